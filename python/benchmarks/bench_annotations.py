@@ -0,0 +1,73 @@
+"""Benchmark of the per-item and bulk annotation constructors.
+
+Run from the `python` directory:
+
+    python -m benchmarks.bench_annotations --annotations 1000000
+"""
+
+import argparse
+import gc
+import time
+from typing import Any, Callable, Dict, List
+
+from invariant_sdk.types.annotations import AnnotationCreate
+
+
+def generate_annotations(
+    num_annotations: int, per_trace: int = 10
+) -> List[List[Dict[str, Any]]]:
+    """Generate annotation dicts grouped into traces of `per_trace` annotations."""
+    return [
+        [
+            {
+                "content": f"annotation {trace}-{i}",
+                "address": f"messages.{i}.content:0-{i + 5}",
+                "extra_metadata": {"source": "bench", "score": i / per_trace},
+            }
+            for i in range(min(per_trace, num_annotations - trace * per_trace))
+        ]
+        for trace in range((num_annotations + per_trace - 1) // per_trace)
+    ]
+
+
+def _time(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+        del result
+    return best
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--annotations", type=int, default=1_000_000)
+    parser.add_argument("--per-trace", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = generate_annotations(args.annotations, args.per_trace)
+    cases = {
+        "from_nested_dicts": lambda: AnnotationCreate.from_nested_dicts(data),
+        "bulk_from_nested_dicts": lambda: AnnotationCreate.bulk_from_nested_dicts(data),
+        "bulk_from_nested_dicts(instantiate=False)": (
+            lambda: AnnotationCreate.bulk_from_nested_dicts(data, instantiate=False)
+        ),
+    }
+    baseline = None
+    print(f"{args.annotations:,} annotations, best of {args.repeat}")
+    for name, fn in cases.items():
+        seconds = _time(fn, args.repeat)
+        baseline = baseline or seconds
+        print(
+            f"{name:<45} {seconds:8.3f} s  "
+            f"{args.annotations / seconds:>12,.0f} annotations/s  "
+            f"x{baseline / seconds:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
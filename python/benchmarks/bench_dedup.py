@@ -0,0 +1,92 @@
+"""Benchmark of trace deduplication: hashing and index lookups.
+
+Run from the `python` directory:
+
+    python -m benchmarks.bench_dedup
+    python -m benchmarks.bench_dedup --traces 10000 --indexed 1000000
+
+Pushes are deduplicated by hashing every trace (`request_hashes`) and looking
+the hashes up in a `DedupIndex`. This reports traces per second for both steps:
+lookups of traces that were never pushed (ruled out by the Bloom filter) and of
+repeats (looked up in SQLite), against an index already holding `--indexed`
+traces. The target is at least 10,000 lookups per second. Hashing encodes every
+trace to canonical JSON, so its cost grows with the size of the traces and is
+reported in MB/s as well.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, List
+
+from invariant_sdk.dedup import DedupIndex, request_hashes
+from invariant_sdk.types.annotations import AnnotationCreate
+from invariant_sdk.types.push_traces import PushTracesRequest
+
+from benchmarks.generators import GENERATORS, generate
+
+TARGET_TRACES_PER_S = 10_000
+
+
+def _per_second(fn: Callable[[], object], items: int, repeat: int) -> float:
+    best = min(_timed(fn) for _ in range(repeat))
+    return items / best
+
+
+def _timed(fn: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main(argv: List[str] = None) -> int:
+    """Print traces per second; exit with 1 if lookups are below the target."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--generator", choices=GENERATORS, default="tool_call_heavy")
+    parser.add_argument("--traces", type=int, default=10_000)
+    parser.add_argument("--indexed", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    batch = generate(args.generator, num_traces=args.traces)
+    request = PushTracesRequest(
+        messages=batch.messages,
+        annotations=AnnotationCreate.bulk_from_nested_dicts(batch.annotations),
+        metadata=batch.metadata,
+        dataset="bench",
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        index = DedupIndex(os.path.join(directory, "dedup.db"))
+        filler = [os.urandom(32) for _ in range(args.indexed)]
+        index.record(filler, [f"id-{i}" for i in range(args.indexed)], "other")
+
+        hashes = request_hashes(request)
+        hashing = _per_second(lambda: request_hashes(request), args.traces, args.repeat)
+        new = _per_second(lambda: index.lookup(hashes), args.traces, args.repeat)
+        index.record(hashes, [f"trace-{i}" for i in range(len(hashes))], "bench")
+        repeated = _per_second(lambda: index.lookup(hashes), args.traces, args.repeat)
+        index.close()
+        reopen = _timed(lambda: DedupIndex(index.path).close())
+
+    print(f"{args.traces:,} {args.generator} traces, {args.indexed:,} traces indexed")
+    trace_mb = sum(len(json.dumps(messages)) for messages in batch.messages) / 1e6
+    print(
+        f"  hash                  {hashing:>12,.0f} traces/s "
+        f"({hashing / args.traces * trace_mb:,.0f} MB/s of messages)"
+    )
+    print(f"  lookup, new traces    {new:>12,.0f} traces/s")
+    print(f"  lookup, repeats       {repeated:>12,.0f} traces/s")
+    print(f"  reopen the index      {reopen * 1000:>12,.0f} ms (saved Bloom filter)")
+    worst = min(new, repeated)
+    print(
+        f"  slowest lookup        {worst:>12,.0f} traces/s "
+        f"(target {TARGET_TRACES_PER_S:,})"
+    )
+    return 0 if worst >= TARGET_TRACES_PER_S else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
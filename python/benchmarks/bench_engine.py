@@ -0,0 +1,58 @@
+"""Benchmark of the sync client's requests engine against its asyncio engine.
+
+Run from the `python` directory:
+
+    python -m benchmarks.bench_engine
+    python -m benchmarks.bench_engine --operation push --threads 1 16 256
+
+For every number of caller threads, `Client` is driven once with each engine
+against a stub server in a subprocess: `engine="requests"` sends one blocking
+request per thread over a requests session, `engine="asyncio"` hands every
+request to an `AsyncClient` on a background event loop, so all threads share one
+httpx connection pool.
+"""
+
+import argparse
+import json
+from typing import List, Optional
+
+from benchmarks.loadgen import OPERATIONS, StubProcess, _Workload, run_sync
+
+ENGINES = ("requests", "asyncio")
+DEFAULT_THREADS = (1, 4, 16, 64, 256)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the matrix of engines and thread counts and print one line per run."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--operation", choices=OPERATIONS, default="metadata")
+    parser.add_argument("--threads", type=int, nargs="+", default=DEFAULT_THREADS)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--json", action="store_true", help="print the reports as JSON")
+    args = parser.parse_args(argv)
+
+    workload = _Workload(args.operation, "tool_call_heavy", 1)
+    if not args.json:
+        print(
+            f"{'engine':<9} {'threads':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+            f"{'CPU us/req':>11} {'errors':>7}"
+        )
+    with StubProcess(args.latency_ms) as stub:
+        for threads in args.threads:
+            for engine in ENGINES:
+                report = run_sync(
+                    stub.url, workload, threads, args.duration, engine=engine
+                )
+                if args.json:
+                    print(json.dumps({"engine": engine, **report.to_json()}))
+                    continue
+                print(
+                    f"{engine:<9} {threads:>7} {report.throughput_rps:>9,.1f} "
+                    f"{report.p50_ms:>8.1f} {report.p99_ms:>8.1f} "
+                    f"{report.cpu_us_per_request:>11,.0f} {report.errors:>7}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Benchmark of reading a dataset back with `iter_dataset_traces`.
+
+Run from the `python` directory:
+
+    python -m benchmarks.bench_export
+    python -m benchmarks.bench_export --traces 1000000 --latency-ms 20
+
+Pushes `--traces` small traces to a stub server in a subprocess and reads them
+back, with the sync client, the async client and the sync client without
+prefetching (one page after the other on the calling thread, for comparison).
+Reports traces per second and the peak memory allocated by the client while
+reading, which should stay the same however many traces the dataset holds.
+`--latency-ms` delays every page, which prefetching overlaps with reading the
+page before.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+from typing import Callable, Iterator, List, Optional
+
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.client import Client
+from invariant_sdk.export import READ_CHUNK_BYTES, line_batches
+
+from benchmarks.loadgen import StubProcess
+
+DATASET = "bench-export"
+
+
+def _fill(url: str, traces: int, batch: int = 10_000) -> None:
+    client = Client(api_url=url, api_key="bench")
+    for start in range(0, traces, batch):
+        count = min(batch, traces - start)
+        client.create_request_and_push_trace(
+            messages=[
+                [
+                    {"role": "user", "content": f"question {start + i}"},
+                    {"role": "assistant", "content": "an answer " * 20},
+                ]
+                for i in range(count)
+            ],
+            metadata=[{"index": start + i} for i in range(count)],
+            dataset=DATASET,
+        )
+
+
+def _sequential(client: Client, page_size: int) -> Iterator[dict]:
+    """Read page after page on the calling thread, without prefetching."""
+    offset = 0
+    while True:
+        pathname = client._export_pathname(  # pylint: disable=protected-access
+            DATASET, None, offset, page_size
+        )
+        response = client.request("GET", pathname, stream=True)
+        count = 0
+        for lines in line_batches(response.iter_content(READ_CHUNK_BYTES)):
+            count += len(lines)
+            for line in lines:
+                yield json.loads(line)
+        response.close()
+        if count < page_size:
+            return
+        offset += count
+
+
+async def _drain_async(url: str, page_size: int) -> int:
+    client = AsyncClient(api_url=url, api_key="bench")
+    count = 0
+    async for _ in client.aiter_dataset_traces(DATASET, page_size=page_size):
+        count += 1
+    await client.session.aclose()
+    return count
+
+
+def _measure(read: Callable[[], int]) -> tuple:
+    start = time.perf_counter()
+    count = read()
+    elapsed = time.perf_counter() - start
+    # Tracing slows reading down, so memory is measured in a second run.
+    tracemalloc.start()
+    read()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return count, count / elapsed, peak / 1e6
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Print throughput and peak client memory for each way of reading."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--traces", type=int, default=200_000)
+    parser.add_argument("--page-size", type=int, default=1_000)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args(argv)
+
+    with StubProcess(args.latency_ms, extra_args=["--store-traces"]) as stub:
+        _fill(stub.url, args.traces)
+        client = Client(api_url=stub.url, api_key="bench")
+        cases = {
+            "sync, prefetching": lambda: sum(
+                1 for _ in client.iter_dataset_traces(DATASET, page_size=args.page_size)
+            ),
+            "async, prefetching": lambda: asyncio.run(
+                _drain_async(stub.url, args.page_size)
+            ),
+            "sync, page by page": lambda: sum(
+                1 for _ in _sequential(client, args.page_size)
+            ),
+        }
+        print(
+            f"{args.traces:,} traces, pages of {args.page_size:,}, "
+            f"{args.latency_ms:g} ms latency"
+        )
+        for name, read in cases.items():
+            count, rate, peak_mb = _measure(read)
+            if count != args.traces:
+                print(f"  {name}: read {count} traces, expected {args.traces}")
+                sys.exit(1)
+            print(f"  {name:<20} {rate:>10,.0f} traces/s  peak {peak_mb:6.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Benchmark of the memory of `BufferedExporter` during a sustained outage.
+
+Run from the `python` directory:
+
+    python -m benchmarks.bench_exporter
+    python -m benchmarks.bench_exporter --duration 60 --max-buffer-mb 16
+
+Exports traces as fast as possible for `--duration` seconds to an API URL
+nothing listens on, so that every push fails and is retried, once per overflow
+policy and once with an unbounded buffer for comparison. Each run is a separate
+process, since memory freed by Python is not always returned to the system.
+Reports the traces exported and dropped and the resident set size of the
+process at each quarter of the run. With a bound, RSS should stop growing once
+the buffer is full; exits with status 1 if it grows by more than 10% (and
+16 MB) over the second half of a bounded run.
+"""
+
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from invariant_sdk.client import Client
+from invariant_sdk.exporter import OVERFLOW_POLICIES, BufferedExporter
+from invariant_sdk.metrics import MetricsRegistry
+from invariant_sdk.types.push_traces import PushTracesRequest
+
+from benchmarks.generators import GENERATORS, generate
+
+UNBOUNDED = "unbounded"
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm", encoding="utf-8") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        # The peak, not the current size, where /proc is not available.
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+
+def _unreachable_url() -> str:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+
+def _run(policy: str, duration: float, max_buffer_mb: float, generator: str) -> Dict:
+    """Export for `duration` seconds with one policy, in this process."""
+    messages, _, metadata = generate(generator, num_traces=100)
+    # Decoded anew for every export, so that each holds its own memory.
+    encoded = [json.dumps([[trace], [meta]]) for trace, meta in zip(messages, metadata)]
+    registry = MetricsRegistry()
+    client = Client(api_url=_unreachable_url(), api_key="bench", metrics=registry)
+    with tempfile.TemporaryDirectory() as directory:
+        exporter = BufferedExporter(
+            client,
+            max_buffer_bytes=(
+                2**62 if policy == UNBOUNDED else int(max_buffer_mb * 1e6)
+            ),
+            overflow="drop_newest" if policy == UNBOUNDED else policy,
+            block_timeout_s=0.001,
+            spill_dir=directory,
+            max_spill_bytes=int(4 * max_buffer_mb * 1e6),
+        )
+        rss = [_rss_mb()]
+        exported = 0
+        start = time.perf_counter()
+        for quarter in range(1, 5):
+            while time.perf_counter() - start < duration * quarter / 4:
+                trace, meta = json.loads(encoded[exported % len(encoded)])
+                exporter.export(
+                    PushTracesRequest(
+                        messages=trace, metadata=meta, dataset="bench-exporter"
+                    )
+                )
+                exported += 1
+            rss.append(_rss_mb())
+        buffered_mb = exporter.buffered_bytes / 1e6
+        spilled_mb = exporter.spilled_bytes / 1e6
+        exporter.shutdown(timeout=0)
+    dropped = sum(
+        registry.dropped_traces.value((reason,))
+        for reason in ("buffer_full", "evicted", "spill_full")
+    )
+    return {
+        "exported": exported,
+        "dropped": dropped,
+        "buffered_mb": buffered_mb,
+        "spilled_mb": spilled_mb,
+        "rss_mb": rss,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Print the RSS of each policy; exit with 1 if a bounded one keeps growing."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--max-buffer-mb", type=float, default=32)
+    parser.add_argument("--generator", choices=GENERATORS, default="tool_call_heavy")
+    parser.add_argument("--policy", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.policy is not None:
+        print(
+            json.dumps(
+                _run(args.policy, args.duration, args.max_buffer_mb, args.generator)
+            )
+        )
+        return 0
+
+    print(
+        f"{args.duration:.0f} s of outage, {args.max_buffer_mb:.0f} MB buffer, "
+        f"{args.generator} traces"
+    )
+    print(
+        f"  {'policy':<12} {'exported':>10} {'dropped':>10} {'buffered':>9} "
+        f"{'spilled':>9}  RSS MB at 0/25/50/75/100%"
+    )
+    growing = []
+    for policy in (*OVERFLOW_POLICIES, UNBOUNDED):
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.bench_exporter",
+                f"--duration={args.duration}",
+                f"--max-buffer-mb={args.max_buffer_mb}",
+                f"--generator={args.generator}",
+                f"--policy={policy}",
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output)
+        rss = result["rss_mb"]
+        print(
+            f"  {policy:<12} {result['exported']:>10,} {result['dropped']:>10,.0f} "
+            f"{result['buffered_mb']:>6.1f} MB {result['spilled_mb']:>6.1f} MB  "
+            + " ".join(f"{value:6.0f}" for value in rss)
+        )
+        if policy != UNBOUNDED and rss[-1] > rss[2] * 1.1 + 16:
+            growing.append(policy)
+    if growing:
+        print(f"RSS kept growing with {', '.join(growing)}")
+    return 1 if growing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""Benchmark of the latency `ChatTracer` adds to each chat completion.
+
+Run from the `python` directory:
+
+    python -m benchmarks.bench_instrumentation
+    python -m benchmarks.bench_instrumentation --messages 10 100 --calls 50000
+
+Calls a fake OpenAI-style client that replies at once with a canned response,
+with and without a `ChatTracer`, and reports the time the tracer adds per call
+for requests of `--messages` messages, plain and streamed (10 chunks). The
+traces are pushed to a stub server by a `BufferedExporter` while calls are made,
+so the cost of converting and pushing them in the background is included as far
+as it takes the GIL from the caller. Exits with status 1 if a plain call takes
+more than 10 us longer with the tracer.
+"""
+
+import argparse
+import sys
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, List, Optional
+
+from invariant_sdk.client import Client
+from invariant_sdk.exporter import BufferedExporter
+from invariant_sdk.instrumentation import ChatTracer
+from invariant_sdk.testing.stub_server import StubServer
+
+TARGET_US = 10.0
+
+RESPONSE = SimpleNamespace(
+    model="fake-model",
+    choices=[
+        SimpleNamespace(
+            index=0, message={"role": "assistant", "content": "The answer is 42."}
+        )
+    ],
+)
+CHUNKS = [
+    {"model": "fake-model", "choices": [{"index": 0, "delta": {"content": "word "}}]}
+] * 10
+
+
+class _Completions:
+    def create(self, *, model: str, messages: List[Any], stream: bool = False) -> Any:
+        return iter(CHUNKS) if stream else RESPONSE
+
+
+def _us_per_call(call: Callable[[], Any], calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        call()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Print the added latency per call; exit with 1 if it exceeds the target."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20_000)
+    parser.add_argument("--messages", type=int, nargs="+", default=[2, 20, 200])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    llm = SimpleNamespace(chat=SimpleNamespace(completions=_Completions()))
+    exceeded = False
+    print(f"{'case':<10} {'messages':>8} {'us/call':>8} {'added us':>9}")
+    with StubServer() as server:
+        client = Client(api_url=server.url, api_key="bench")
+        with BufferedExporter(client, overflow="drop_oldest") as exporter:
+            tracer = ChatTracer(exporter, dataset="bench-instrumentation")
+            traced = tracer.wrap(llm)
+            for count in args.messages:
+                messages = [
+                    {"role": "user" if i % 2 else "assistant", "content": f"turn {i}"}
+                    for i in range(count)
+                ]
+                for case, stream in (("plain", False), ("streamed", True)):
+
+                    def call(target: Any, stream: bool = stream) -> Callable[[], Any]:
+                        create = target.chat.completions.create
+                        if stream:
+                            return lambda: list(
+                                create(model="m", messages=messages, stream=True)
+                            )
+                        return lambda: create(model="m", messages=messages)
+
+                    raw, wrapped = call(llm), call(traced)
+                    base = min(
+                        _us_per_call(raw, args.calls) for _ in range(args.repeat)
+                    )
+                    best = min(
+                        _us_per_call(wrapped, args.calls) for _ in range(args.repeat)
+                    )
+                    added = best - base
+                    exceeded |= case == "plain" and added > TARGET_US
+                    print(f"{case:<10} {count:>8} {best:>8.2f} {added:>9.2f}")
+            tracer.shutdown()
+    return 1 if exceeded else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
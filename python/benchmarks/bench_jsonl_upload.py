@@ -0,0 +1,129 @@
+"""Benchmark of uploading a JSONL file as it is against parsing and pushing it.
+
+Run from the `python` directory:
+
+    python -m benchmarks.bench_jsonl_upload
+    python -m benchmarks.bench_jsonl_upload --size-mb 100 --generator long_content
+
+Writes a JSONL file of `--size-mb` megabytes of annotated event lists (or uses
+`--path`) and sends it to a stub server in a subprocess twice: with
+`Client.upload_jsonl_file`, which memory-maps the file and sends its bytes as
+they are, and the way it is done without it, by parsing each line and pushing
+the traces with `create_request_and_push_trace` in requests of
+`--traces-per-request`. Reports the throughput of each and the speedup, in
+wall-clock time and in CPU time of the client, which is the fairer measure when
+the stub shares the machine's cores. Exits with status 1 if the upload is not
+faster.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, List, Optional, Tuple
+
+from invariant_sdk.client import Client
+
+from benchmarks.generators import GENERATORS, generate
+from benchmarks.loadgen import StubProcess
+
+
+def _write_file(path: str, size_bytes: int, generator: str) -> int:
+    batch = generate(generator, num_traces=100)
+    lines = [
+        json.dumps(
+            {"messages": messages, "annotations": annotations, "metadata": metadata}
+        ).encode()
+        + b"\n"
+        for messages, annotations, metadata in zip(*batch)
+    ]
+    written = traces = 0
+    with open(path, "wb") as f:
+        while written < size_bytes:
+            line = lines[traces % len(lines)]
+            f.write(line)
+            written += len(line)
+            traces += 1
+    return traces
+
+
+def _parse_and_push(client: Client, path: str, traces_per_request: int) -> None:
+    messages: List = []
+    annotations: List = []
+    metadata: List = []
+
+    def push() -> None:
+        client.create_request_and_push_trace(
+            messages=messages,
+            annotations=annotations,
+            metadata=metadata,
+            dataset="bench-parsed",
+        )
+        messages.clear()
+        annotations.clear()
+        metadata.clear()
+
+    with open(path, "rb") as f:
+        for line in f:
+            trace = json.loads(line)
+            messages.append(trace["messages"])
+            annotations.append(trace.get("annotations") or [])
+            metadata.append(trace.get("metadata") or {})
+            if len(messages) == traces_per_request:
+                push()
+    if messages:
+        push()
+
+
+def _measure(run: Callable[[], object]) -> Tuple[float, float]:
+    start, cpu = time.perf_counter(), time.process_time()
+    run()
+    return time.perf_counter() - start, time.process_time() - cpu
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Print the throughput of both ways; exit with 1 if the upload is slower."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=1024)
+    parser.add_argument("--path", default=None)
+    parser.add_argument("--generator", choices=GENERATORS, default="tool_call_heavy")
+    parser.add_argument("--traces-per-request", type=int, default=1_000)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory, StubProcess() as stub:
+        path = args.path
+        if path is None:
+            path = os.path.join(directory, "traces.jsonl")
+            traces = _write_file(path, int(args.size_mb * 1e6), args.generator)
+        else:
+            with open(path, "rb") as f:
+                traces = sum(1 for _ in f)
+        size_mb = os.path.getsize(path) / 1e6
+        client = Client(api_url=stub.url, api_key="bench")
+        results = {
+            "upload as it is": _measure(
+                lambda: client.upload_jsonl_file(path, "bench-raw")
+            ),
+            "parse and push": _measure(
+                lambda: _parse_and_push(client, path, args.traces_per_request)
+            ),
+        }
+
+    print(f"{size_mb:,.0f} MB, {traces:,} traces")
+    for name, (wall, cpu) in results.items():
+        print(
+            f"  {name:<16} {size_mb / wall:8,.0f} MB/s {traces / wall:>10,.0f} traces/s"
+            f"  {wall:7.1f} s wall {cpu:7.1f} s CPU"
+        )
+    (raw_wall, raw_cpu), (parsed_wall, parsed_cpu) = results.values()
+    print(
+        f"  speedup {parsed_wall / raw_wall:.1f}x wall, "
+        f"{parsed_cpu / max(raw_cpu, 1e-9):.1f}x client CPU"
+    )
+    return 0 if raw_wall < parsed_wall else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
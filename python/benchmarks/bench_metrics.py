@@ -0,0 +1,87 @@
+"""Benchmark of the per-request cost of recording metrics.
+
+Run from the `python` directory:
+
+    python -m benchmarks.bench_metrics --threads 1 8
+
+Reports the time `MetricsRegistry` adds to each request: recording a completed
+request (counts, bytes, latency histogram) and recording an error, from one or
+several threads at once. The target is under 1 us per request.
+"""
+
+import argparse
+import sys
+import threading
+import time
+from typing import Callable, List
+
+from invariant_sdk.hooks import RequestRecord
+from invariant_sdk.metrics import MetricsRegistry
+from invariant_sdk.types.exceptions import InvariantAPITimeoutError
+
+TARGET_NS = 1_000
+
+
+def _record(path: str) -> RequestRecord:
+    record = RequestRecord("POST", path)
+    record.status = 200
+    record.body_bytes = 4_096
+    record.response_bytes = 128
+    record.timings.total_ms = 42.0
+    return record
+
+
+def _ns_per_call(fn: Callable[[], None], calls: int, threads: int) -> float:
+    """Wall time per call, with `threads` threads each making `calls` calls."""
+
+    def work() -> None:
+        for _ in range(calls):
+            fn()
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (calls * threads) * 1e9
+
+
+def main(argv: List[str] = None) -> int:
+    """Print the overhead per request; exit with 1 if it exceeds the target."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    registry = MetricsRegistry()
+    push = _record("/api/v1/push/trace")
+    metadata = _record("/api/v1/dataset/metadata/example")
+    error = InvariantAPITimeoutError("timeout")
+    on_end, on_error = registry.hooks.on_request_end, registry.hooks.on_error
+    cases = {
+        "request": lambda: on_end(push),
+        "request (path with id)": lambda: on_end(metadata),
+        "error": lambda: on_error(push, error),
+    }
+    baseline = lambda: None  # pylint: disable=unnecessary-lambda-assignment
+
+    exceeded = False
+    print(f"{'case':<26} {'threads':>7} {'ns/request':>11}")
+    for threads in args.threads:
+        empty = min(
+            _ns_per_call(baseline, args.calls, threads) for _ in range(args.repeat)
+        )
+        for name, fn in cases.items():
+            best = min(
+                _ns_per_call(fn, args.calls, threads) for _ in range(args.repeat)
+            )
+            overhead = best - empty
+            exceeded |= name == "request" and overhead > TARGET_NS
+            print(f"{name:<26} {threads:>7} {overhead:>11,.0f}")
+    return 1 if exceeded else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""Benchmark of the AIMD rate controller against a server with limited capacity.
+
+Run from the `python` directory:
+
+    python -m benchmarks.bench_rate_control
+    python -m benchmarks.bench_rate_control --client async --capacity 8
+
+A fault-injecting stub server (invariant_sdk.testing.fault_server) that answers
+429 to requests over `--capacity` is started in a subprocess, and more workers
+than that are run against it, once without rate control and once with a
+`RateController`. The report shows goodput, how many requests were rejected and
+the limit the controller settled on.
+"""
+
+import argparse
+import json
+from typing import List, Optional
+
+from invariant_sdk.rate_control import RateController
+
+from benchmarks.loadgen import OPERATIONS, StubProcess, _Workload, run_async, run_sync
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the client with and without rate control and print one line per run."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--client", choices=["sync", "async"], default="sync")
+    parser.add_argument("--operation", choices=OPERATIONS, default="push")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--capacity", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument(
+        "--retry-after-s", type=int, default=0, help="Retry-After sent with each 429"
+    )
+    parser.add_argument("--json", action="store_true", help="print the reports as JSON")
+    args = parser.parse_args(argv)
+
+    workload = _Workload(args.operation, "tool_call_heavy", 1)
+    run = run_sync if args.client == "sync" else run_async
+    extra_args = [
+        "--fault-rate",
+        "0",
+        "--max-in-flight",
+        str(args.capacity),
+        "--retry-after-s",
+        str(args.retry_after_s),
+    ]
+    if not args.json:
+        print(
+            f"{'rate control':<12} {'goodput/s':>9} {'rejected':>9} {'p50 ms':>8} "
+            f"{'p99 ms':>8} {'limit':>6}"
+        )
+    for controller in (None, RateController()):
+        with StubProcess(
+            args.latency_ms,
+            module="invariant_sdk.testing.fault_server",
+            extra_args=extra_args,
+        ) as stub:
+            report = run(
+                stub.url,
+                workload,
+                args.concurrency,
+                args.duration,
+                rate_controller=controller,
+            )
+        name = "aimd" if controller is not None else "off"
+        limit = controller.limit if controller is not None else None
+        if args.json:
+            print(
+                json.dumps({"rate_control": name, "limit": limit, **report.to_json()})
+            )
+            continue
+        print(
+            f"{name:<12} {report.throughput_rps:>9,.1f} {report.errors:>9} "
+            f"{report.p50_ms:>8.1f} {report.p99_ms:>8.1f} {limit or '-':>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Benchmark of the local trace store: recording pushes and looking traces up.
+
+Run from the `python` directory:
+
+    python -m benchmarks.bench_trace_store
+    python -m benchmarks.bench_trace_store --traces 100000 --max-mb 100
+
+Records `--traces` traces in a `TraceStore` the way a client does after every
+push, in requests of `--request-size` traces, and reports traces written per
+second. Then looks up random traces by id, the latest traces of a dataset and
+traces by metadata key and value, and reports the latency of each. The target
+is a p99 of at most 10 ms per lookup.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, List
+
+from invariant_sdk.trace_store import TraceStore
+from invariant_sdk.types.annotations import AnnotationCreate
+from invariant_sdk.types.push_traces import PushTracesRequest
+
+from benchmarks.generators import GENERATORS, generate
+
+TARGET_P99_MS = 10.0
+
+
+def _latencies_ms(fn: Callable[[int], object], count: int) -> List[float]:
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def _p99(latencies: List[float]) -> float:
+    return statistics.quantiles(latencies, n=100)[98]
+
+
+def main(argv: List[str] = None) -> int:
+    """Print write throughput and lookup latency; exit with 1 if a p99 is too high."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--generator", choices=GENERATORS, default="tool_call_heavy")
+    parser.add_argument("--traces", type=int, default=50_000)
+    parser.add_argument("--request-size", type=int, default=100)
+    parser.add_argument("--lookups", type=int, default=1_000)
+    parser.add_argument("--max-mb", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    batch = generate(args.generator, num_traces=args.request_size)
+    request = PushTracesRequest(
+        messages=batch.messages,
+        annotations=AnnotationCreate.bulk_from_nested_dicts(batch.annotations),
+        metadata=batch.metadata,
+        dataset="bench",
+    )
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        max_bytes = int(args.max_mb * 1e6) if args.max_mb else None
+        store = TraceStore(os.path.join(directory, "traces.db"), max_bytes=max_bytes)
+        requests = args.traces // args.request_size
+        start = time.perf_counter()
+        for number in range(requests):
+            ids = [f"{number}-{i}" for i in range(args.request_size)]
+            store.record(request, trace_ids=ids, latency_ms=10.0)
+        store.flush()
+        written = requests * args.request_size / (time.perf_counter() - start)
+        stored, stored_mb = len(store), store.stored_bytes / 1e6
+        # The most recent requests are always still stored.
+        recent = range(requests - max(stored // args.request_size, 1), requests)
+
+        def by_id(_):
+            store.get(f"{rng.choice(recent)}-{rng.randrange(args.request_size)}")
+
+        cases = {
+            "by id": by_id,
+            "by dataset, latest 10": lambda _: store.by_dataset("bench", limit=10),
+            "by metadata value": lambda i: store.by_metadata(
+                "trace", i % args.request_size, limit=10
+            ),
+            "by metadata key, latest 10": lambda _: store.by_metadata("kind", limit=10),
+        }
+        results = {name: _latencies_ms(fn, args.lookups) for name, fn in cases.items()}
+        store.close()
+        file_mb = os.path.getsize(os.path.join(directory, "traces.db")) / 1e6
+
+    print(
+        f"{requests * args.request_size:,} {args.generator} traces recorded, "
+        f"{stored:,} stored ({stored_mb:,.0f} MB of JSON, {file_mb:,.0f} MB on disk)"
+    )
+    print(f"  record                      {written:>10,.0f} traces/s")
+    worst = 0.0
+    for name, latencies in results.items():
+        p99 = _p99(latencies)
+        worst = max(worst, p99)
+        print(
+            f"  lookup {name:<26} p50 {statistics.median(latencies):6.2f} ms"
+            f"  p99 {p99:6.2f} ms"
+        )
+    print(f"  slowest p99 {worst:.2f} ms (target {TARGET_P99_MS:.0f} ms)")
+    return 0 if worst <= TARGET_P99_MS else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
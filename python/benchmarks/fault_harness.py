@@ -0,0 +1,182 @@
+"""Resilience harness: Client and AsyncClient against injected network faults.
+
+Run from the `python` directory:
+
+    python -m benchmarks.fault_harness
+    python -m benchmarks.fault_harness --client async --rates 0.05 --duration 20
+
+For every client and fault rate, a fault-injecting stub server
+(invariant_sdk.testing.fault_server) is started in a subprocess and the client is
+driven with the load generator. The report shows:
+
+    goodput     successful requests per second, and relative to the fault-free run
+    errors      how often each exception class was raised
+    detection   how long a call took to raise, per exception class (p50 / max)
+    recovery    time from a worker seeing a failure until its next success (p50 / p95)
+"""
+
+import argparse
+import json
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from invariant_sdk.testing.fault_server import FAULT_KINDS
+
+from benchmarks.loadgen import (
+    OPERATIONS,
+    Outcome,
+    StubProcess,
+    _Workload,
+    percentile,
+    run_async,
+    run_sync,
+)
+
+DEFAULT_RATES = (0.0, 0.01, 0.05, 0.2)
+
+
+class FaultReport(NamedTuple):
+    """The outcome of a load run against a faulty server."""
+
+    client: str
+    fault_rate: float
+    requests: int
+    goodput_rps: float
+    goodput_ratio: float
+    errors: Dict[str, int]
+    detection_ms: Dict[str, Dict[str, float]]
+    recovery_ms: Dict[str, float]
+
+    def to_json(self) -> Dict[str, Any]:
+        """Convert the report to a JSON-serializable dictionary."""
+        return self._asdict()
+
+
+def summarize(
+    client: str,
+    fault_rate: float,
+    outcomes: List[Outcome],
+    duration_s: float,
+    baseline_rps: Optional[float],
+) -> FaultReport:
+    """Compute goodput, error counts, detection and recovery times of a run."""
+    successes = sum(o.error is None for o in outcomes)
+    goodput = successes / duration_s if duration_s else 0.0
+
+    detection: Dict[str, List[float]] = {}
+    for outcome in outcomes:
+        if outcome.error is not None:
+            detection.setdefault(outcome.error, []).append(outcome.end - outcome.start)
+
+    recoveries = []
+    by_worker: Dict[int, List[Outcome]] = {}
+    for outcome in outcomes:
+        by_worker.setdefault(outcome.worker, []).append(outcome)
+    for worker_outcomes in by_worker.values():
+        failed_at = None
+        for outcome in sorted(worker_outcomes, key=lambda o: o.start):
+            if outcome.error is not None:
+                if failed_at is None:
+                    failed_at = outcome.end
+            elif failed_at is not None:
+                recoveries.append(outcome.end - failed_at)
+                failed_at = None
+    recoveries.sort()
+
+    return FaultReport(
+        client=client,
+        fault_rate=fault_rate,
+        requests=len(outcomes),
+        goodput_rps=goodput,
+        goodput_ratio=goodput / baseline_rps if baseline_rps else 1.0,
+        errors={name: len(times) for name, times in sorted(detection.items())},
+        detection_ms={
+            name: {
+                "p50": percentile(sorted(times), 50) * 1000,
+                "max": max(times) * 1000,
+            }
+            for name, times in sorted(detection.items())
+        },
+        recovery_ms={
+            "p50": percentile(recoveries, 50) * 1000,
+            "p95": percentile(recoveries, 95) * 1000,
+        },
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the fault matrix and print one report per client and fault rate."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--client", choices=["sync", "async", "both"], default="both")
+    parser.add_argument("--operation", choices=OPERATIONS, default="push")
+    parser.add_argument("--rates", type=float, nargs="+", default=DEFAULT_RATES)
+    parser.add_argument("--faults", nargs="+", choices=FAULT_KINDS, default=FAULT_KINDS)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--timeout-ms", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=5)
+    parser.add_argument("--slow-ms", type=float, default=2_000)
+    parser.add_argument("--stall-ms", type=float, default=5_000)
+    parser.add_argument("--json", action="store_true", help="print the reports as JSON")
+    args = parser.parse_args(argv)
+
+    workload = _Workload(args.operation, "tool_call_heavy", 1)
+    clients = ["sync", "async"] if args.client == "both" else [args.client]
+    # The fault-free run is the reference for the goodput ratio.
+    rates = sorted(set(args.rates) | {0.0})
+
+    for client in clients:
+        run = run_sync if client == "sync" else run_async
+        baseline_rps = None
+        for rate in rates:
+            extra_args = [
+                "--fault-rate",
+                str(rate),
+                "--faults",
+                *args.faults,
+                "--slow-ms",
+                str(args.slow_ms),
+                "--stall-ms",
+                str(args.stall_ms),
+            ]
+            outcomes: List[Outcome] = []
+            with StubProcess(
+                args.latency_ms,
+                module="invariant_sdk.testing.fault_server",
+                extra_args=extra_args,
+            ) as stub:
+                load = run(
+                    stub.url,
+                    workload,
+                    args.concurrency,
+                    args.duration,
+                    timeout_ms=args.timeout_ms,
+                    outcomes=outcomes,
+                )
+            report = summarize(client, rate, outcomes, load.duration_s, baseline_rps)
+            if rate == 0.0:
+                baseline_rps = report.goodput_rps
+            _print(report, args.json)
+
+
+def _print(report: FaultReport, as_json: bool) -> None:
+    if as_json:
+        print(json.dumps(report.to_json()))
+        return
+    print(
+        f"{report.client} @ {report.fault_rate:.0%} faults: "
+        f"{report.requests} requests\n"
+        f"  goodput      {report.goodput_rps:,.1f} req/s "
+        f"({report.goodput_ratio:.0%} of fault-free)\n"
+        f"  recovery     p50 {report.recovery_ms['p50']:.0f} ms  "
+        f"p95 {report.recovery_ms['p95']:.0f} ms"
+    )
+    for name, count in report.errors.items():
+        detection = report.detection_ms[name]
+        print(
+            f"  {name:<34} {count:>6}x  detected in p50 {detection['p50']:.0f} ms  "
+            f"max {detection['max']:.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
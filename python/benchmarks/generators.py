@@ -0,0 +1,144 @@
+"""Deterministic synthetic trace generators for the benchmarks."""
+
+import json
+import random
+from typing import Any, Dict, List, NamedTuple
+
+_WORDS = (
+    "agent tool call result error file path user assistant search query "
+    "response token context model output input value list read write"
+).split()
+
+
+class TraceBatch(NamedTuple):
+    """The arguments of `create_request_and_push_trace` for a batch of traces."""
+
+    messages: List[List[Dict[str, Any]]]
+    annotations: List[List[Dict[str, Any]]]
+    metadata: List[Dict[str, Any]]
+
+
+def _text(rng: random.Random, num_words: int, words_per_line: int = 12) -> str:
+    words = rng.choices(_WORDS, k=num_words)
+    return "\n".join(
+        " ".join(words[i : i + words_per_line])
+        for i in range(0, num_words, words_per_line)
+    )
+
+
+def _annotations(
+    rng: random.Random, messages: List[Dict[str, Any]], count: int
+) -> List[Dict[str, Any]]:
+    annotations = []
+    for _ in range(count):
+        index = rng.randrange(len(messages))
+        content = messages[index].get("content") or ""
+        start = rng.randrange(max(len(content), 1))
+        end = min(start + 10, len(content))
+        annotations.append(
+            {
+                "content": _text(rng, 8),
+                "address": f"messages.{index}.content:{start}-{end}",
+                "extra_metadata": {"source": "bench", "score": rng.random()},
+            }
+        )
+    return annotations
+
+
+def tool_call_heavy(
+    num_traces: int = 10,
+    tool_calls_per_trace: int = 20,
+    annotations_per_trace: int = 2,
+    seed: int = 0,
+) -> TraceBatch:
+    """Agent traces where most messages are tool calls and their short results."""
+    rng = random.Random(seed)
+    batch = TraceBatch([], [], [])
+    for trace in range(num_traces):
+        messages: List[Dict[str, Any]] = [{"role": "user", "content": _text(rng, 30)}]
+        for call in range(tool_calls_per_trace):
+            call_id = f"call_{trace}_{call}"
+            messages.append(
+                {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [
+                        {
+                            "id": call_id,
+                            "type": "function",
+                            "function": {
+                                "name": rng.choice(["read_file", "search", "run"]),
+                                "arguments": json.dumps(
+                                    {"path": f"/src/{rng.choice(_WORDS)}.py"}
+                                ),
+                            },
+                        }
+                    ],
+                }
+            )
+            messages.append(
+                {"role": "tool", "tool_call_id": call_id, "content": _text(rng, 40)}
+            )
+        messages.append({"role": "assistant", "content": _text(rng, 60)})
+        batch.messages.append(messages)
+        batch.annotations.append(_annotations(rng, messages, annotations_per_trace))
+        batch.metadata.append({"trace": trace, "kind": "tool_call_heavy"})
+    return batch
+
+
+def long_content(
+    num_traces: int = 10,
+    messages_per_trace: int = 4,
+    words_per_message: int = 5_000,
+    seed: int = 0,
+) -> TraceBatch:
+    """Traces with few messages carrying long multi-line content."""
+    rng = random.Random(seed)
+    batch = TraceBatch([], [], [])
+    for trace in range(num_traces):
+        messages = [
+            {
+                "role": "user" if i % 2 == 0 else "assistant",
+                "content": _text(rng, words_per_message),
+            }
+            for i in range(messages_per_trace)
+        ]
+        batch.messages.append(messages)
+        batch.annotations.append(_annotations(rng, messages, 1))
+        batch.metadata.append({"trace": trace, "kind": "long_content"})
+    return batch
+
+
+def many_annotations(
+    num_traces: int = 10,
+    messages_per_trace: int = 10,
+    annotations_per_trace: int = 200,
+    seed: int = 0,
+) -> TraceBatch:
+    """Traces of ordinary size annotated densely, as analyzers produce them."""
+    rng = random.Random(seed)
+    batch = TraceBatch([], [], [])
+    for trace in range(num_traces):
+        messages = [
+            {
+                "role": "user" if i % 2 == 0 else "assistant",
+                "content": _text(rng, 200),
+            }
+            for i in range(messages_per_trace)
+        ]
+        batch.messages.append(messages)
+        batch.annotations.append(_annotations(rng, messages, annotations_per_trace))
+        batch.metadata.append({"trace": trace, "kind": "many_annotations"})
+    return batch
+
+
+GENERATORS = {
+    "tool_call_heavy": tool_call_heavy,
+    "long_content": long_content,
+    "many_annotations": many_annotations,
+}
+
+
+def generate(name: str, seed: int = 0, **kwargs: Any) -> TraceBatch:
+    """Generate a batch with the named generator."""
+    return GENERATORS[name](seed=seed, **kwargs)
@@ -0,0 +1,143 @@
+"""Timing, allocation tracking and baseline comparison for the benchmarks."""
+
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+
+class BenchmarkResult(NamedTuple):
+    """The measurements of one benchmark case."""
+
+    name: str
+    ops_per_sec: float
+    mean_us: float
+    peak_kib: float
+    blocks_per_op: float
+
+    def to_json(self) -> Dict[str, Any]:
+        """Convert the result to a JSON-serializable dictionary."""
+        return self._asdict()
+
+
+class Comparison(NamedTuple):
+    """A result compared against its baseline."""
+
+    name: str
+    baseline_ops_per_sec: float
+    ops_per_sec: float
+    ratio: float
+    regressed: bool
+
+
+def measure(
+    name: str,
+    fn: Callable[[], Any],
+    min_time_s: float = 0.2,
+    repeat: int = 5,
+) -> BenchmarkResult:
+    """
+    Time `fn` and record its allocations.
+
+    The number of calls per round is grown until a round lasts `min_time_s`; the
+    best of `repeat` rounds is kept. Unlike `timeit`, the garbage collector stays
+    enabled while timing since its cost is part of what the SDK pays.
+
+    Allocations are measured in separate calls: the net number of memory blocks
+    still held by the result, and the peak traced by tracemalloc.
+    """
+    fn()  # Warm up caches (TypeAdapters, regexes, ...).
+    number = 1
+    while (elapsed := _run(fn, number)) < min_time_s:
+        number = max(number * 2, int(number * min_time_s / max(elapsed, 1e-9)))
+    best = min([elapsed] + [_run(fn, number) for _ in range(repeat - 1)])
+
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    result = fn()
+    blocks = sys.getallocatedblocks() - blocks_before
+    del result
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        tracemalloc.stop()
+
+    return BenchmarkResult(
+        name=name,
+        ops_per_sec=number / best,
+        mean_us=best / number * 1e6,
+        peak_kib=peak / 1024,
+        blocks_per_op=float(blocks),
+    )
+
+
+def _run(fn: Callable[[], Any], number: int) -> float:
+    gc.collect()
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return time.perf_counter() - start
+
+
+def environment() -> Dict[str, str]:
+    """Describe the machine and library versions the results were taken with."""
+    import pydantic  # pylint: disable=import-outside-toplevel
+
+    return {
+        "python": platform.python_version(),
+        "pydantic": pydantic.VERSION,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
+
+
+def save(path: str, results: List[BenchmarkResult]) -> None:
+    """Write results to a baseline file."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "environment": environment(),
+                "results": {result.name: result.to_json() for result in results},
+            },
+            f,
+            indent=2,
+            sort_keys=True,
+        )
+        f.write("\n")
+
+
+def compare(
+    path: str, results: List[BenchmarkResult], tolerance: float
+) -> List[Comparison]:
+    """
+    Compare results against a baseline file.
+
+    A case regresses when its throughput drops below `1 - tolerance` times the
+    baseline. Cases missing from the baseline are skipped.
+    """
+    with open(path, encoding="utf-8") as f:
+        baseline: Dict[str, Dict[str, float]] = json.load(f)["results"]
+    comparisons = []
+    for result in results:
+        previous: Optional[Dict[str, float]] = baseline.get(result.name)
+        if previous is None:
+            continue
+        ratio = result.ops_per_sec / previous["ops_per_sec"]
+        comparisons.append(
+            Comparison(
+                name=result.name,
+                baseline_ops_per_sec=previous["ops_per_sec"],
+                ops_per_sec=result.ops_per_sec,
+                ratio=ratio,
+                regressed=ratio < 1 - tolerance,
+            )
+        )
+    return comparisons
@@ -0,0 +1,392 @@
+"""Load generator driving Client and AsyncClient against a local stub server.
+
+Run from the `python` directory:
+
+    python -m benchmarks.loadgen --client sync --concurrency 16 --duration 10
+    python -m benchmarks.loadgen --client async --concurrency 64 --latency-ms 50
+    python -m benchmarks.loadgen --url http://127.0.0.1:8000 --operation metadata
+
+Unless `--url` is given, a stub server (invariant_sdk.testing.stub_server) is
+started in a subprocess, so the reported CPU time is the client's alone.
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import httpx
+import requests
+
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.client import Client
+from invariant_sdk.rate_control import RateController
+from invariant_sdk.types.annotations import AnnotationCreate
+from invariant_sdk.types.append_messages import AppendMessagesRequest
+from invariant_sdk.types.push_traces import PushTracesRequest
+from invariant_sdk.types.update_dataset_metadata import (
+    MetadataUpdate,
+    UpdateDatasetMetadataRequest,
+)
+
+from benchmarks.generators import GENERATORS, generate
+
+OPERATIONS = ("push", "metadata", "update", "append")
+
+
+class LoadReport(NamedTuple):
+    """The outcome of a load run."""
+
+    client: str
+    operation: str
+    concurrency: int
+    requests: int
+    errors: int
+    duration_s: float
+    throughput_rps: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    bytes_sent: int
+    cpu_us_per_request: float
+
+    def to_json(self) -> Dict[str, Any]:
+        """Convert the report to a JSON-serializable dictionary."""
+        return self._asdict()
+
+
+class Outcome(NamedTuple):
+    """One call made by a load worker."""
+
+    worker: int
+    start: float
+    end: float
+    error: Optional[str]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Return the q-th percentile (0-100) of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class _Workload:
+    """Prebuilt requests for an operation, and their encoded body size."""
+
+    def __init__(self, operation: str, generator: str, traces_per_request: int):
+        self.operation = operation
+        batch = generate(generator, num_traces=traces_per_request)
+        annotations = AnnotationCreate.bulk_from_nested_dicts(batch.annotations)
+        self.push = PushTracesRequest(
+            messages=batch.messages,
+            annotations=annotations,
+            metadata=batch.metadata,
+            dataset="loadgen",
+        )
+        self.append = AppendMessagesRequest(
+            trace_id="loadgen", messages=batch.messages[0], annotations=annotations[0]
+        )
+        self.update = UpdateDatasetMetadataRequest(
+            dataset_name="loadgen", metadata=MetadataUpdate(accuracy=0.5)
+        )
+        bodies = {
+            "push": self.push.to_json(),
+            "append": {
+                "messages": self.append.dump_messages(),
+                "annotations": self.append.dump_annotations(),
+            },
+            "update": {"metadata": {"accuracy": 0.5}, "replace_all": False},
+            "metadata": None,
+        }
+        body = bodies[operation]
+        self.body_bytes = len(json.dumps(body).encode()) if body is not None else 0
+
+    def sync_call(self, client: Client) -> Callable[[], Any]:
+        """Return the sync call to make."""
+        return {
+            "push": lambda: client.push_trace(self.push),
+            "metadata": lambda: client.get_dataset_metadata(
+                "loadgen", request_kwargs={"headers": {}}
+            ),
+            "update": lambda: client.update_dataset_metadata(self.update),
+            "append": lambda: client.append_messages(self.append),
+        }[self.operation]
+
+    def async_call(self, client: AsyncClient) -> Callable[[], Any]:
+        """Return the async call to make."""
+        return {
+            "push": lambda: client.push_trace(self.push),
+            # Custom request kwargs opt out of single-flight, so every call is sent.
+            "metadata": lambda: client.get_dataset_metadata(
+                "loadgen", request_kwargs={"headers": {}}
+            ),
+            "update": lambda: client.update_dataset_metadata(self.update),
+            "append": lambda: client.append_messages(self.append),
+        }[self.operation]
+
+
+def run_sync(
+    url: str,
+    workload: _Workload,
+    concurrency: int,
+    duration_s: float,
+    timeout_ms: Optional[int] = None,
+    outcomes: Optional[List[Outcome]] = None,
+    engine: str = "requests",
+    rate_controller: Optional[RateController] = None,
+) -> LoadReport:
+    """
+    Drive `Client` from `concurrency` threads sharing one session.
+
+    With `engine="asyncio"` the threads share one httpx connection pool driven by
+    the client's background event loop instead of a requests session. Either way
+    the pool holds up to `concurrency` connections. If `outcomes` is given, every
+    call is also appended to it as an `Outcome`.
+    """
+    if engine == "asyncio":
+        session = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=concurrency, max_keepalive_connections=concurrency
+            )
+        )
+    else:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=concurrency
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+    client = Client(
+        api_url=url,
+        api_key="loadgen",
+        timeout_ms=timeout_ms,
+        session=session,
+        engine=engine,
+        rate_controller=rate_controller,
+    )
+    call = workload.sync_call(client)
+    latencies: List[List[float]] = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    deadline = time.perf_counter() + duration_s
+
+    def worker(index: int) -> None:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                call()
+            except Exception as e:  # pylint: disable=broad-except
+                errors[index] += 1
+                _record(outcomes, index, start, e)
+                continue
+            latencies[index].append(time.perf_counter() - start)
+            _record(outcomes, index, start, None)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+    client_name = "sync"
+    if engine == "asyncio":
+        client_name = "sync-asyncio"
+        client._engine.run(session.aclose())  # pylint: disable=protected-access
+    else:
+        session.close()
+    return _report(client_name, workload, concurrency, latencies, errors, wall, cpu)
+
+
+def run_async(
+    url: str,
+    workload: _Workload,
+    concurrency: int,
+    duration_s: float,
+    timeout_ms: Optional[int] = None,
+    outcomes: Optional[List[Outcome]] = None,
+    rate_controller: Optional[RateController] = None,
+) -> LoadReport:
+    """
+    Drive `AsyncClient` from `concurrency` tasks sharing one connection pool.
+
+    If `outcomes` is given, every call is also appended to it as an `Outcome`.
+    """
+
+    async def main() -> LoadReport:
+        session = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=concurrency, max_keepalive_connections=concurrency
+            )
+        )
+        client = AsyncClient(
+            api_url=url,
+            api_key="loadgen",
+            timeout_ms=timeout_ms,
+            session=session,
+            rate_controller=rate_controller,
+        )
+        call = workload.async_call(client)
+        latencies: List[List[float]] = [[] for _ in range(concurrency)]
+        errors = [0] * concurrency
+        deadline = time.perf_counter() + duration_s
+
+        async def worker(index: int) -> None:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    await call()
+                except Exception as e:  # pylint: disable=broad-except
+                    errors[index] += 1
+                    _record(outcomes, index, start, e)
+                    continue
+                latencies[index].append(time.perf_counter() - start)
+                _record(outcomes, index, start, None)
+
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+        await session.aclose()
+        return _report("async", workload, concurrency, latencies, errors, wall, cpu)
+
+    return asyncio.run(main())
+
+
+def _record(
+    outcomes: Optional[List[Outcome]],
+    worker: int,
+    start: float,
+    error: Optional[Exception],
+) -> None:
+    if outcomes is not None:
+        # list.append is atomic, so threads can share the list.
+        outcomes.append(
+            Outcome(
+                worker,
+                start,
+                time.perf_counter(),
+                type(error).__name__ if error is not None else None,
+            )
+        )
+
+
+def _report(
+    client: str,
+    workload: _Workload,
+    concurrency: int,
+    latencies: List[List[float]],
+    errors: List[int],
+    wall: float,
+    cpu: float,
+) -> LoadReport:
+    merged = sorted(latency for worker in latencies for latency in worker)
+    num_requests = len(merged)
+    return LoadReport(
+        client=client,
+        operation=workload.operation,
+        concurrency=concurrency,
+        requests=num_requests,
+        errors=sum(errors),
+        duration_s=wall,
+        throughput_rps=num_requests / wall if wall else 0.0,
+        p50_ms=percentile(merged, 50) * 1000,
+        p95_ms=percentile(merged, 95) * 1000,
+        p99_ms=percentile(merged, 99) * 1000,
+        bytes_sent=num_requests * workload.body_bytes,
+        cpu_us_per_request=cpu / max(num_requests, 1) * 1e6,
+    )
+
+
+class StubProcess:
+    """A stub server running in a subprocess."""
+
+    def __init__(
+        self,
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        module: str = "invariant_sdk.testing.stub_server",
+        extra_args: Optional[List[str]] = None,
+    ) -> None:
+        self._process = subprocess.Popen(  # pylint: disable=consider-using-with
+            [
+                sys.executable,
+                "-m",
+                module,
+                "--latency-ms",
+                str(latency_ms),
+                *(["--jitter-ms", str(jitter_ms)] if jitter_ms else []),
+                *(extra_args or []),
+            ],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        self.url = self._process.stdout.readline().strip()
+
+    def __enter__(self) -> "StubProcess":
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self._process.terminate()
+        self._process.wait()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run one load test and print the report."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--client", choices=["sync", "async"], default="sync")
+    parser.add_argument(
+        "--engine",
+        choices=["requests", "asyncio"],
+        default="requests",
+        help="how the sync client sends requests",
+    )
+    parser.add_argument("--operation", choices=OPERATIONS, default="push")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument(
+        "--generator", choices=list(GENERATORS), default="tool_call_heavy"
+    )
+    parser.add_argument("--traces-per-request", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--url", help="target an already running server instead")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    workload = _Workload(args.operation, args.generator, args.traces_per_request)
+    if args.client == "sync":
+        run = functools.partial(run_sync, engine=args.engine)
+    else:
+        run = run_async
+
+    if args.url:
+        report = run(args.url, workload, args.concurrency, args.duration)
+    else:
+        with StubProcess(args.latency_ms, args.jitter_ms) as stub:
+            report = run(stub.url, workload, args.concurrency, args.duration)
+
+    if args.json:
+        print(json.dumps(report.to_json()))
+        return
+    print(
+        f"{report.client} {report.operation} x{report.concurrency}: "
+        f"{report.requests} requests ({report.errors} errors) "
+        f"in {report.duration_s:.1f} s\n"
+        f"  throughput   {report.throughput_rps:,.1f} req/s\n"
+        f"  latency      p50 {report.p50_ms:.2f} ms  p95 {report.p95_ms:.2f} ms  "
+        f"p99 {report.p99_ms:.2f} ms\n"
+        f"  sent         {report.bytes_sent / 1e6:,.2f} MB "
+        f"({workload.body_bytes:,} B/request)\n"
+        f"  client CPU   {report.cpu_us_per_request:,.0f} us/request"
+    )
+
+
+if __name__ == "__main__":
+    main()
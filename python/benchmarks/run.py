@@ -0,0 +1,167 @@
+"""Microbenchmarks for request construction, validation and serialization.
+
+Run from the `python` directory:
+
+    python -m benchmarks.run                      # run and compare to baseline.json
+    python -m benchmarks.run -k push --no-compare # run a subset
+    python -m benchmarks.run --save benchmarks/baseline.json
+
+The process exits with status 1 if any case is slower than the baseline by more
+than the tolerance.
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import Any, Callable, Dict, List, Tuple
+
+from invariant_sdk.base_client import BaseClient
+from invariant_sdk.types.annotations import AnnotationCreate
+from invariant_sdk.types.append_messages import AppendMessagesRequest
+from invariant_sdk.types.push_traces import PushTracesRequest
+from invariant_sdk.types.update_dataset_metadata import (
+    InvariantTestResults,
+    MetadataUpdate,
+    UpdateDatasetMetadataRequest,
+)
+
+from benchmarks import harness
+from benchmarks.generators import GENERATORS, generate
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def cases() -> List[Tuple[str, Callable[[], Any]]]:
+    """Build the benchmark cases. Inputs are generated up front, outside the timings."""
+    client = BaseClient(api_url="http://localhost", api_key="bench")
+    result: List[Tuple[str, Callable[[], Any]]] = []
+
+    for name in GENERATORS:
+        batch = generate(name)
+        annotations = AnnotationCreate.bulk_from_nested_dicts(batch.annotations)
+        push_request = PushTracesRequest(
+            messages=batch.messages,
+            annotations=annotations,
+            metadata=batch.metadata,
+            dataset="bench",
+        )
+        append_request = AppendMessagesRequest(
+            trace_id="bench", messages=batch.messages[0], annotations=annotations[0]
+        )
+        prepared = client._prepare_push_trace_request(push_request)
+
+        def make(fn: Callable[..., Any], *args: Any) -> Callable[[], Any]:
+            return lambda: fn(*args)
+
+        result += [
+            (
+                f"annotations_from_nested_dicts[{name}]",
+                make(AnnotationCreate.from_nested_dicts, batch.annotations),
+            ),
+            (
+                f"annotations_bulk_from_nested_dicts[{name}]",
+                make(AnnotationCreate.bulk_from_nested_dicts, batch.annotations),
+            ),
+            (
+                f"push_traces_request[{name}]",
+                make(
+                    lambda: PushTracesRequest(
+                        messages=batch.messages,
+                        annotations=annotations,
+                        metadata=batch.metadata,
+                        dataset="bench",
+                    )
+                ),
+            ),
+            (f"push_traces_to_json[{name}]", push_request.to_json),
+            (
+                f"prepare_push_trace_request[{name}]",
+                make(client._prepare_push_trace_request, push_request),
+            ),
+            (
+                f"push_traces_json_encode[{name}]",
+                make(json.dumps, prepared["json"]),
+            ),
+            (
+                f"append_messages_request[{name}]",
+                make(
+                    lambda: AppendMessagesRequest(
+                        trace_id="bench",
+                        messages=batch.messages[0],
+                        annotations=annotations[0],
+                    )
+                ),
+            ),
+            (
+                f"prepare_append_messages_request[{name}]",
+                make(client._prepare_append_messages_request, append_request),
+            ),
+        ]
+
+    update_fields: Dict[str, Any] = {
+        "benchmark": "bench",
+        "accuracy": 0.5,
+        "name": "bench",
+        "invariant_test_results": InvariantTestResults(num_tests=10, num_passed=7),
+    }
+    update_request = UpdateDatasetMetadataRequest(
+        dataset_name="bench", metadata=MetadataUpdate(**update_fields)
+    )
+    result += [
+        ("metadata_update", lambda: MetadataUpdate(**update_fields)),
+        (
+            "update_dataset_metadata_request",
+            lambda: UpdateDatasetMetadataRequest(
+                dataset_name="bench", metadata=MetadataUpdate(**update_fields)
+            ),
+        ),
+        ("metadata_update_to_json", update_request.metadata.to_json),
+        (
+            "prepare_update_dataset_metadata_request",
+            lambda: client._prepare_update_dataset_metadata_request(update_request),
+        ),
+    ]
+    return result
+
+
+def main() -> int:
+    """Run the suite, print the results and compare them to the baseline."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-k", dest="filter", help="only run cases containing this")
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--no-compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--save", metavar="PATH", help="write the results to PATH")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'case':<55} {'ops/s':>12} {'mean':>12} {'peak':>11} {'blocks':>8}")
+    for name, fn in cases():
+        if args.filter and args.filter not in name:
+            continue
+        result = harness.measure(name, fn, args.min_time, args.repeat)
+        results.append(result)
+        print(
+            f"{name:<55} {result.ops_per_sec:>12,.1f} {result.mean_us:>10,.1f}us "
+            f"{result.peak_kib:>8,.0f}KiB {result.blocks_per_op:>8,.0f}"
+        )
+
+    if args.save:
+        harness.save(args.save, results)
+        print(f"\nSaved {len(results)} results to {args.save}")
+    if args.no_compare or not os.path.exists(args.baseline):
+        return 0
+
+    comparisons = harness.compare(args.baseline, results, args.tolerance)
+    print(f"\nCompared to {args.baseline} (tolerance {args.tolerance:.0%}):")
+    for comparison in comparisons:
+        flag = "REGRESSED" if comparison.regressed else ""
+        print(f"{comparison.name:<55} x{comparison.ratio:>6.2f} {flag}")
+    return 1 if any(comparison.regressed for comparison in comparisons) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
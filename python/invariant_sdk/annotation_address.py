@@ -0,0 +1,196 @@
+"""Parsing and validation of annotation addresses."""
+
+import functools
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from invariant_sdk.types.append_messages import AppendMessagesRequest
+from invariant_sdk.types.push_traces import PushTracesRequest
+
+_PATH_REGEX = re.compile(r"(?:[^.\[\]:]+|\[\d+\])(?:\.[^.\[\]:]+|\[\d+\])*")
+_SEGMENT_REGEX = re.compile(r"\[(\d+)\]|([^.\[\]:]+)")
+_RANGE_REGEX = re.compile(r"(\d+)-(\d+)|L(\d+)")
+
+PathKey = Tuple[str, ...]
+
+
+class AnnotationAddress(NamedTuple):
+    """
+    Structured form of an annotation address.
+
+    `messages.0.content:5-10` parses to path `("messages", 0, "content")` with the
+    character range 5-10, `messages[0].content:L0` to the same path with line 0.
+    An address without a suffix targets the whole object at its path.
+    """
+
+    path: Tuple[Union[str, int], ...]
+    start: Optional[int] = None
+    end: Optional[int] = None
+    line: Optional[int] = None
+
+    @property
+    def key(self) -> PathKey:
+        """The path with every segment as a string, as used by `TracePathIndex`."""
+        return tuple(str(segment) for segment in self.path)
+
+
+class AddressError(NamedTuple):
+    """An annotation whose address does not resolve against its trace."""
+
+    trace_index: int
+    annotation_index: int
+    address: str
+    reason: str
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_address(address: str) -> AnnotationAddress:
+    """
+    Parse an annotation address.
+
+    Args:
+        address (str): The address, e.g. `messages.0.content:5-10`.
+
+    Returns:
+        AnnotationAddress: The structured address.
+
+    Raises:
+        ValueError: If the address is malformed.
+    """
+    path, _, suffix = address.partition(":")
+    if not _PATH_REGEX.fullmatch(path):
+        raise ValueError(f"Invalid annotation address path: {address!r}")
+    segments = tuple(
+        int(index) if index else int(key) if key.isdigit() else key
+        for index, key in _SEGMENT_REGEX.findall(path)
+    )
+    if not suffix:
+        return AnnotationAddress(segments)
+    match = _RANGE_REGEX.fullmatch(suffix)
+    if match is None:
+        raise ValueError(f"Invalid annotation address range: {address!r}")
+    start, end, line = match.groups()
+    if line is not None:
+        return AnnotationAddress(segments, line=int(line))
+    if int(start) > int(end):
+        raise ValueError(f"Annotation address range is reversed: {address!r}")
+    return AnnotationAddress(segments, start=int(start), end=int(end))
+
+
+class TracePathIndex:
+    """
+    Every addressable path of a trace, built in one pass over its messages.
+
+    Newline offsets of string values are computed the first time a line address
+    refers to them and reused afterwards.
+    """
+
+    __slots__ = ["_values", "_line_offsets"]
+
+    def __init__(self, messages: List[Dict], first_message_index: int = 0) -> None:
+        self._values: Dict[PathKey, Any] = {}
+        self._line_offsets: Dict[PathKey, List[int]] = {}
+        root = ("messages",)
+        self._values[root] = messages
+        for i, message in enumerate(messages):
+            self._add((*root, str(first_message_index + i)), message)
+
+    def _add(self, key: PathKey, value: Any) -> None:
+        stack = [(key, value)]
+        values = self._values
+        while stack:
+            key, value = stack.pop()
+            values[key] = value
+            if isinstance(value, dict):
+                stack.extend(((*key, str(k)), v) for k, v in value.items())
+            elif isinstance(value, list):
+                stack.extend(((*key, str(i)), v) for i, v in enumerate(value))
+
+    def line_span(self, key: PathKey, line: int) -> Optional[Tuple[int, int]]:
+        """Return the character range of a line of the string at `key`, if it exists."""
+        offsets = self._line_offsets.get(key)
+        if offsets is None:
+            value = self._values[key]
+            offsets = [0]
+            position = value.find("\n")
+            while position != -1:
+                offsets.append(position + 1)
+                position = value.find("\n", position + 1)
+            offsets.append(len(value) + 1)
+            self._line_offsets[key] = offsets
+        if line + 1 >= len(offsets):
+            return None
+        return offsets[line], offsets[line + 1] - 1
+
+    def check(self, address: str) -> Optional[str]:
+        """
+        Check an address against the trace.
+
+        Returns:
+            Optional[str]: None if the address resolves, otherwise the reason why not.
+        """
+        try:
+            parsed = parse_address(address)
+        except ValueError as e:
+            return str(e)
+        key = parsed.key
+        if key not in self._values:
+            return f"path {'.'.join(key)} does not exist in the trace"
+        if parsed.start is None and parsed.line is None:
+            return None
+        value = self._values[key]
+        if not isinstance(value, str):
+            return f"path {'.'.join(key)} is not a string"
+        if parsed.line is not None:
+            if self.line_span(key, parsed.line) is None:
+                return f"line {parsed.line} is out of range for path {'.'.join(key)}"
+            return None
+        if parsed.end > len(value):
+            return (
+                f"range {parsed.start}-{parsed.end} is out of range for path "
+                f"{'.'.join(key)} of length {len(value)}"
+            )
+        return None
+
+
+def validate_annotations(
+    request: Union[PushTracesRequest, AppendMessagesRequest],
+    first_message_index: int = 0,
+) -> List[AddressError]:
+    """
+    Check the address of every annotation of a request against its trace.
+
+    Each trace is indexed once, so the check runs in time linear in the number of
+    annotations plus the size of the messages.
+
+    Args:
+        request (Union[PushTracesRequest, AppendMessagesRequest]): The request to check.
+        first_message_index (int): For an AppendMessagesRequest, the index the first
+                                   appended message will have in the trace.
+
+    Returns:
+        List[AddressError]: The annotations that do not resolve. Empty if all do.
+    """
+    if isinstance(request, AppendMessagesRequest):
+        traces = [(request.messages, request.annotations or [], first_message_index)]
+    else:
+        traces = [
+            (messages, annotations, 0)
+            for messages, annotations in zip(
+                request.messages, request.annotations or []
+            )
+        ]
+    errors = []
+    for trace_index, (messages, annotations, offset) in enumerate(traces):
+        if not annotations:
+            continue
+        index = TracePathIndex(messages, offset)
+        for annotation_index, annotation in enumerate(annotations):
+            reason = index.check(annotation.address)
+            if reason is not None:
+                errors.append(
+                    AddressError(
+                        trace_index, annotation_index, annotation.address, reason
+                    )
+                )
+    return errors
@@ -1,16 +1,56 @@
 """Async client for interacting with the Invariant APIs."""
 
-from typing import Dict, List, Literal, Mapping, Optional, Tuple, Union
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 import asyncio
-import atexit
+import collections
+import functools
+import time
 import httpx
 
 from invariant_sdk.base_client import (
     DATASET_METADATA_API_PATH,
+    DATASET_UPLOAD_API_PATH,
     PUSH_TRACE_API_PATH,
     TRACE_API_PATH,
     BaseClient,
 )
+from invariant_sdk import fork_safety, profiling
+from invariant_sdk.batching import AdaptiveBatchSizer, trace_sizes
+from invariant_sdk.dedup import DedupIndex, PushPlan, select_traces
+from invariant_sdk.export import (
+    DEFAULT_EXPORT_PAGE_SIZE,
+    PREFETCH_CHUNKS,
+    PREFETCH_PAGES,
+    READ_CHUNK_BYTES,
+    aiter_prefetched,
+    aline_batches,
+    aparse_batches,
+)
+from invariant_sdk.hooks import RequestHooks, RequestRecord
+from invariant_sdk.jsonl_upload import JsonlFile
+from invariant_sdk.metadata_cache import (
+    MetadataCache,
+    MetadataCacheEntry,
+    MetadataCacheKey,
+)
+from invariant_sdk.metrics import MetricsRegistry
+from invariant_sdk.payload_policy import PayloadPolicy
+from invariant_sdk.rate_control import RateController
+from invariant_sdk.sampling import SamplingPolicy
+from invariant_sdk.single_flight import AsyncSingleFlight
+from invariant_sdk.trace_store import TraceStore
 from invariant_sdk.types.annotations import AnnotationCreate
 from invariant_sdk.types.append_messages import AppendMessagesRequest
 from invariant_sdk.types.exceptions import (
@@ -32,10 +72,24 @@ def _close_session(session: httpx.AsyncClient) -> None:
         pass
 
 
+async def _discard_response(upcoming: "asyncio.Future[httpx.Response]") -> None:
+    upcoming.cancel()
+    try:
+        response = await upcoming
+    except (asyncio.CancelledError, Exception):  # pylint: disable=broad-except
+        return
+    await response.aclose()
+
+
 class AsyncClient(BaseClient):
     """Async client for interacting with the Invariant APIs."""
 
-    __slots__ = ["session"]
+    __slots__ = [
+        "session",
+        "_get_flights",
+        "_metadata_flush_tasks",
+        "_owns_session",
+    ]
 
     def __init__(
         self,
@@ -43,16 +97,54 @@ class AsyncClient(BaseClient):
         api_key: Optional[str] = None,
         timeout_ms: Optional[Union[int, Tuple[int, int]]] = None,
         session: Optional[httpx.AsyncClient] = None,
+        metadata_coalesce_window_ms: Optional[int] = None,
+        metadata_cache: Optional[MetadataCache] = None,
+        hooks: Optional[RequestHooks] = None,
+        metrics: Optional[MetricsRegistry] = None,
+        rate_controller: Optional[RateController] = None,
+        batch_sizer: Optional[AdaptiveBatchSizer] = None,
+        dedup_index: Optional[DedupIndex] = None,
+        trace_store: Optional[TraceStore] = None,
+        payload_policy: Optional[PayloadPolicy] = None,
+        sampling_policy: Optional[SamplingPolicy] = None,
     ) -> None:
-        super().__init__(api_url, api_key, timeout_ms)
+        super().__init__(
+            api_url,
+            api_key,
+            timeout_ms,
+            metadata_coalesce_window_ms,
+            metadata_cache,
+            hooks,
+            metrics,
+            rate_controller,
+            batch_sizer,
+            dedup_index,
+            trace_store,
+            payload_policy,
+            sampling_policy,
+        )
+        self._owns_session = session is None
         self.session = session if session else httpx.AsyncClient()
-        atexit.register(_close_session, self.session)
+        self._get_flights = AsyncSingleFlight()
+        self._metadata_flush_tasks: Set[asyncio.Task] = set()
+        fork_safety.at_exit(_close_session, self.session)
+
+    def _after_fork_in_child(self) -> None:
+        super()._after_fork_in_child()
+        self._get_flights = AsyncSingleFlight()
+        self._metadata_flush_tasks = set()
+        # A session passed in is left as it is: its configuration cannot be
+        # copied, so it should be created after the fork.
+        if self._owns_session:
+            self.session = httpx.AsyncClient()
+            fork_safety.at_exit(_close_session, self.session)
 
     async def request(
         self,
         method: Literal["GET", "POST", "PUT", "DELETE"],
         pathname: str,
         request_kwargs: Optional[Mapping] = None,
+        stream: bool = False,
     ) -> httpx.Response:
         """
         Makes a request to the Invariant API.
@@ -61,18 +153,66 @@ class AsyncClient(BaseClient):
             method (Literal["GET", "POST", "PUT", "DELETE"]): The HTTP method to use.
             pathname (str): The path to make the request to.
             request_kwargs (Optional[Mapping]): Additional keyword arguments for the request.
+            stream (bool): Return once the headers are received and read the body only
+                           as it is consumed. The response must then be closed.
 
         Returns:
             httpx.Response: The response from the API.
         """
         request_kwargs = self._prepare_request_kwargs(request_kwargs)
+        if profiling.get_profiler() is not None:
+            # Encode here rather than in the HTTP library to time it separately.
+            request_kwargs = self._encode_json_body(
+                request_kwargs, "content", ensure_ascii=False, separators=(",", ":")
+            )
+        async with self._admit_async():
+            if self.hooks is None:
+                return await self._send_request(
+                    method, pathname, request_kwargs, stream=stream
+                )
+            record = self.hooks.start(method, pathname)
+            request_kwargs["extensions"] = {
+                **request_kwargs.get("extensions", {}),
+                "trace": record.trace,
+            }
+            try:
+                response = await self._send_request(
+                    method, pathname, request_kwargs, record, stream
+                )
+            except InvariantError as e:
+                self.hooks.error(record, e)
+                raise
+            self.hooks.end(record)
+            return response
+
+    async def _send_request(
+        self,
+        method: str,
+        pathname: str,
+        request_kwargs: Dict,
+        record: Optional[RequestRecord] = None,
+        stream: bool = False,
+    ) -> httpx.Response:
         try:
             path = self.api_url + pathname
-            response = await self.session.request(
-                method=method,
-                url=path,
-                **request_kwargs,
-            )
+            with profiling.phase("network"):
+                if stream:
+                    response = await self.session.send(
+                        self.session.build_request(
+                            method=method, url=path, **request_kwargs
+                        ),
+                        stream=True,
+                    )
+                else:
+                    response = await self.session.request(
+                        method=method,
+                        url=path,
+                        **request_kwargs,
+                    )
+            if record is not None:
+                record.received(response, streamed=stream)
+            if stream and response.is_error:
+                await response.aclose()
             response.raise_for_status()
             return response
         except httpx.ReadTimeout as e:
@@ -83,7 +223,11 @@ class AsyncClient(BaseClient):
             raise InvariantAPITimeoutError(
                 f"Timeout when connecting to server for method: {method} on path: {pathname}."
             ) from e
-        except httpx.ConnectError as e:
+        except httpx.TimeoutException as e:
+            raise InvariantAPITimeoutError(
+                f"Timeout when calling method: {method} for path: {pathname}."
+            ) from e
+        except (httpx.NetworkError, httpx.RemoteProtocolError) as e:
             raise InvariantError(
                 f"Connection error when calling method: {method} for path: {pathname}."
             ) from e
@@ -96,6 +240,7 @@ class AsyncClient(BaseClient):
                 f"Unexpected error ({type(e).__name__}): {e} when calling method: {method} for path: {pathname}."
             ) from e
 
+    @profiling.profiled
     async def push_trace(
         self,
         request: PushTracesRequest,
@@ -104,6 +249,13 @@ class AsyncClient(BaseClient):
         """
         Push trace data to the Invariant API.
 
+        With a `dedup_index`, traces pushed before are not sent again; the ids they
+        got then are returned for them. With a `trace_store`, the traces are
+        recorded there with their ids, or with the error if the push fails. With a
+        `payload_policy`, oversized strings and base64 images in the messages are
+        trimmed first. With a `sampling_policy`, the traces it drops are not sent
+        and get None in place of an id.
+
         Args:
             request (PushTracesRequest): The request object containing trace data.
             request_kwargs (Optional[Mapping]): Additional keyword arguments to pass to
@@ -112,14 +264,134 @@ class AsyncClient(BaseClient):
         Returns:
             PushTracesResponse: The response object.
         """
-        request_kwargs = self._prepare_push_trace_request(request, request_kwargs)
-        http_response = await self.request(
-            method="POST",
-            pathname=PUSH_TRACE_API_PATH,
-            request_kwargs=request_kwargs,
+        kept = self._sample(
+            request.messages, request.annotations, request.metadata, request.dataset
+        )
+        if kept is None:
+            return await self._push_trace(request, request_kwargs)
+        response = (
+            await self._push_trace(select_traces(request, kept), request_kwargs)
+            if kept
+            else None
+        )
+        return self._sampled_response(
+            kept, len(request.messages), response, request.dataset
         )
-        return PushTracesResponse.from_json(http_response.json())
 
+    async def _push_trace(
+        self,
+        request: PushTracesRequest,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> PushTracesResponse:
+        # The traces count in the backlog, e.g. of tasks waiting for the rate
+        # controller or the connection pool, until they are pushed.
+        traces = len(request.messages)
+        self._track_backlog(traces)
+        try:
+            return await self._send_trace(request, request_kwargs)
+        finally:
+            self._track_backlog(-traces)
+
+    async def _send_trace(
+        self,
+        request: PushTracesRequest,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> PushTracesResponse:
+        request = self._apply_payload_policy(request)
+        plan = None
+        if self.dedup_index is not None:
+            # Its SQLite lookups would block the event loop.
+            plan = await asyncio.to_thread(self._plan_push, request)
+        if plan is not None and plan.request is None:
+            return await self._store_push_async(request, plan, plan.complete(None))
+        request_kwargs = self._prepare_push_trace_request(
+            request if plan is None else plan.request, request_kwargs
+        )
+        sent = time.perf_counter()
+        try:
+            http_response = await self.request(
+                method="POST",
+                pathname=PUSH_TRACE_API_PATH,
+                request_kwargs=request_kwargs,
+            )
+        except InvariantError as e:
+            self._observe_push_latency(sent)
+            await self._store_push_async(request, plan, None, sent, e)
+            raise
+        self._observe_push_latency(sent)
+        with profiling.phase("deserialization"):
+            response = PushTracesResponse.from_json(http_response.json())
+        if plan is not None:
+            # Recording the pushed hashes inserts into SQLite.
+            response = await asyncio.to_thread(plan.complete, response)
+        return await self._store_push_async(request, plan, response, sent)
+
+    async def _store_push_async(
+        self,
+        request: PushTracesRequest,
+        plan: Optional[PushPlan],
+        response: Optional[PushTracesResponse],
+        sent: Optional[float] = None,
+        error: Optional[BaseException] = None,
+    ) -> Optional[PushTracesResponse]:
+        if self.trace_store is None:
+            return response
+        # Its SQLite writes and commits would block the event loop.
+        return await asyncio.to_thread(
+            self._store_push, request, plan, response, sent, error
+        )
+
+    @profiling.profiled
+    async def push_trace_batched(
+        self,
+        request: PushTracesRequest,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> PushTracesResponse:
+        """
+        Push trace data in batches sized to the client's `batch_sizer`.
+
+        The traces are split into batches of about `batch_sizer.batch_bytes` each,
+        which are pushed one after the other. The size adapts to the latency of
+        every request, see `AdaptiveBatchSizer`. If a batch fails, its error is
+        raised and the batches before it stay pushed.
+
+        Args:
+            request (PushTracesRequest): The request object containing trace data.
+            request_kwargs (Optional[Mapping]): Additional keyword arguments to pass to
+                                      the requests method.
+
+        Returns:
+            PushTracesResponse: The response object, with the ids of all traces in
+                                order.
+        """
+        kept = self._sample(
+            request.messages, request.annotations, request.metadata, request.dataset
+        )
+        total = len(request.messages)
+        if kept is not None:
+            if not kept:
+                return self._sampled_response(kept, total, None, request.dataset)
+            request = select_traces(request, kept)
+        with profiling.phase("serialization"):
+            sizes = trace_sizes(request)
+        ids: List[Optional[str]] = []
+        response = None
+        start = 0
+        while start < len(sizes):
+            batch, count, batch_bytes = self._next_batch(request, sizes, start)
+            sent = time.perf_counter()
+            response = await self._push_trace(batch, request_kwargs)
+            self._observe_batch(batch_bytes, count, (time.perf_counter() - sent) * 1000)
+            ids.extend(response.id)
+            start += count
+        response = PushTracesResponse(
+            id=ids, dataset=response.dataset, username=response.username
+        )
+        if kept is None:
+            return response
+        return self._sampled_response(kept, total, response, request.dataset)
+
+    @profiling.profiled
     async def create_request_and_push_trace(
         self,
         messages: List[List[Dict]],
@@ -141,16 +413,39 @@ class AsyncClient(BaseClient):
         Returns:
             PushTracesResponse: The response object.
         """
-        request = PushTracesRequest(
-            messages=messages,
-            annotations=(
-                AnnotationCreate.from_nested_dicts(annotations) if annotations else None
-            ),
-            metadata=metadata,
-            dataset=dataset,
-        )
-        return await self.push_trace(request, request_kwargs)
+        if self.sampling_policy is not None:
+            # Sampled before the annotations are validated, so that dropped traces
+            # cost next to nothing, but invalid input still raises ValueError.
+            PushTracesRequest.validate_fields(
+                messages, annotations or None, metadata, dataset, annotation_type=dict
+            )
+        kept = self._sample(messages, annotations, metadata, dataset)
+        if kept is not None:
+            total = len(messages)
+            if not kept:
+                return self._sampled_response(kept, total, None, dataset)
+            messages = [messages[position] for position in kept]
+            if annotations:
+                annotations = [annotations[position] for position in kept]
+            if metadata:
+                metadata = [metadata[position] for position in kept]
+        with profiling.phase("validation"):
+            request = PushTracesRequest(
+                messages=messages,
+                annotations=(
+                    AnnotationCreate.from_nested_dicts(annotations)
+                    if annotations
+                    else None
+                ),
+                metadata=metadata,
+                dataset=dataset,
+            )
+        response = await self._push_trace(request, request_kwargs)
+        if kept is None:
+            return response
+        return self._sampled_response(kept, total, response, request.dataset)
 
+    @profiling.profiled
     async def get_dataset_metadata(
         self,
         dataset_name: str,
@@ -160,6 +455,10 @@ class AsyncClient(BaseClient):
         """
         Get the metadata for a dataset.
 
+        If the client has a `metadata_cache`, fresh entries are served locally and
+        stale ones are revalidated with their ETag. Concurrent calls for the same
+        dataset without custom `request_kwargs` share a single request.
+
         Args:
             dataset_name (str): The name of the dataset to get metadata for.
             owner_username (str): The username of the owner of the dataset. If the caller
@@ -173,24 +472,195 @@ class AsyncClient(BaseClient):
         Returns:
             Dict: The response from the API.
         """
+        key = (dataset_name, owner_username)
+        cached, stale_entry = self._lookup_dataset_metadata(key)
+        if cached is not None:
+            return cached
         pathname = f"{DATASET_METADATA_API_PATH}/{dataset_name}"
         if owner_username:
             pathname += f"?owner={owner_username}"
+        if request_kwargs:
+            # Custom request kwargs may change the answer, so only share plain calls.
+            return await self._fetch_dataset_metadata(
+                key, pathname, stale_entry, request_kwargs
+            )
+        return await self._get_flights.do(
+            pathname,
+            lambda: self._fetch_dataset_metadata(key, pathname, stale_entry),
+        )
+
+    async def _fetch_dataset_metadata(
+        self,
+        key: MetadataCacheKey,
+        pathname: str,
+        stale_entry: Optional[MetadataCacheEntry],
+        request_kwargs: Optional[Mapping] = None,
+    ) -> Dict:
+        generation = self._metadata_generation(key)
         http_response = await self.request(
             method="GET",
             pathname=pathname,
-            request_kwargs=self._prepare_get_dataset_metadata_request(request_kwargs),
+            request_kwargs=self._add_revalidation_header(
+                self._prepare_get_dataset_metadata_request(request_kwargs), stale_entry
+            ),
+        )
+        return self._cache_dataset_metadata(key, stale_entry, http_response, generation)
+
+    def aiter_dataset_traces(
+        self,
+        dataset_name: str,
+        owner_username: Optional[str] = None,
+        page_size: int = DEFAULT_EXPORT_PAGE_SIZE,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> AsyncIterator[Dict]:
+        """
+        Iterate over the traces of a dataset, in order, for offline analysis.
+
+        The traces are fetched in pages of `page_size` and each page is parsed as
+        it streams in. The next four pages are requested while the current one is
+        read, and a background task reads ahead of the caller by up to 2 MiB of
+        the responses, so that waiting for pages overlaps with processing them.
+        Memory stays constant however large the dataset is. An error is raised
+        after the traces before it.
+
+        Args:
+            dataset_name (str): The name of the dataset.
+            owner_username (Optional[str]): The username of the owner of the dataset,
+                                            if it is not the caller.
+            page_size (int): The number of traces to request at a time.
+            request_kwargs (Optional[Mapping]): Additional keyword arguments to pass to
+                                      the httpx method.
+
+        Returns:
+            AsyncIterator[Dict]: The traces, each with its `id`, `index`, `messages`,
+                                 `annotations` and `metadata`.
+        """
+        if page_size <= 0:
+            raise ValueError("page_size must be positive")
+        batches = aiter_prefetched(
+            functools.partial(
+                self._read_dataset_pages,
+                dataset_name,
+                owner_username,
+                page_size,
+                request_kwargs,
+            ),
+            PREFETCH_CHUNKS,
         )
-        return http_response.json()
+        return aparse_batches(batches)
 
+    async def _read_dataset_pages(
+        self,
+        dataset_name: str,
+        owner_username: Optional[str],
+        page_size: int,
+        request_kwargs: Optional[Mapping],
+        put: Callable[[List[bytes]], Awaitable[None]],
+    ) -> None:
+        async for lines in self._dataset_line_batches(
+            dataset_name, owner_username, page_size, request_kwargs
+        ):
+            await put(lines)
+
+    async def _dataset_line_batches(
+        self,
+        dataset_name: str,
+        owner_username: Optional[str],
+        page_size: int,
+        request_kwargs: Optional[Mapping],
+    ) -> AsyncIterator[List[bytes]]:
+        """Yield the lines of every page as they stream in."""
+
+        async def open_page(offset: int) -> httpx.Response:
+            pathname = self._export_pathname(
+                dataset_name, owner_username, offset, page_size
+            )
+            return await self.request("GET", pathname, request_kwargs, stream=True)
+
+        upcoming = collections.deque(
+            asyncio.ensure_future(open_page(page * page_size))
+            for page in range(PREFETCH_PAGES)
+        )
+        requested = PREFETCH_PAGES
+        try:
+            while True:
+                response = await upcoming.popleft()
+                upcoming.append(asyncio.ensure_future(open_page(requested * page_size)))
+                requested += 1
+                count = 0
+                try:
+                    async for lines in aline_batches(
+                        response.aiter_bytes(READ_CHUNK_BYTES)
+                    ):
+                        count += len(lines)
+                        yield lines
+                except httpx.HTTPError as e:
+                    raise InvariantError(
+                        f"Connection error when reading the traces of {dataset_name}."
+                    ) from e
+                finally:
+                    await response.aclose()
+                if count < page_size:
+                    return
+        finally:
+            for future in upcoming:
+                await _discard_response(future)
+
+    @profiling.profiled
+    async def upload_jsonl_file(
+        self,
+        path: str,
+        dataset_name: str,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> Dict:
+        """
+        Upload a JSONL file of traces as a new dataset, without parsing it.
+
+        The file must be in the format of Explorer's file uploads (see
+        `JsonlFile`). It is memory-mapped, each line's structure is checked, and
+        its bytes are sent as they are, as with an upload in the browser: no
+        Python objects are created for the traces. The trace store, dedup index
+        and payload policy apply to `push_trace` only.
+
+        Args:
+            path (str): The path of the JSONL file.
+            dataset_name (str): The name of the dataset to create.
+            request_kwargs (Optional[Mapping]): Additional keyword arguments to pass to
+                                      the httpx method.
+
+        Returns:
+            Dict: The created dataset, as returned by the API.
+
+        Raises:
+            ValueError: If the dataset name is invalid or a line of the file is not
+                        a trace.
+        """
+        with JsonlFile(path) as file:
+            http_response = await self.request(
+                method="POST",
+                pathname=DATASET_UPLOAD_API_PATH,
+                request_kwargs=self._prepare_upload_request(
+                    dataset_name, file, "content", request_kwargs
+                ),
+            )
+        with profiling.phase("deserialization"):
+            return http_response.json()
+
+    @profiling.profiled
     async def update_dataset_metadata(
         self,
         request: UpdateDatasetMetadataRequest,
         request_kwargs: Optional[Mapping] = None,
-    ) -> Dict:
+    ) -> Optional[Dict]:
         """
         Update the metadata for a dataset.
 
+        If the client was created with `metadata_coalesce_window_ms`, the update is
+        buffered and merged with the other updates for the same dataset. One PUT
+        is sent per dataset at the end of the window, or on `flush_dataset_metadata`.
+        Buffered updates are not sent at interpreter exit, so await
+        `flush_dataset_metadata` before the event loop stops.
+
         Args:
             request (UpdateDatasetMetadataRequest): The request object containing the dataset name,
                                                     and metadata to update.
@@ -198,8 +668,80 @@ class AsyncClient(BaseClient):
                                                 the httpx method.
 
         Returns:
-            Dict: The response from the API.
+            Optional[Dict]: The response from the API, or None if the update was
+                            buffered.
+        """
+        if self._metadata_coalescer is not None:
+            if self._metadata_coalescer.add(request, request_kwargs):
+                self._track_queue_depth("metadata_updates", 1)
+                self._schedule_metadata_flush(request.dataset_name)
+            return None
+        return await self._send_dataset_metadata_update(request, request_kwargs)
+
+    @profiling.profiled
+    async def flush_dataset_metadata(
+        self, dataset_name: Optional[str] = None
+    ) -> Dict[str, Dict]:
+        """
+        Send the buffered metadata updates right away.
+
+        Args:
+            dataset_name (Optional[str]): The dataset to flush. If None, all datasets
+                                          with buffered updates are flushed.
+
+        Returns:
+            Dict[str, Dict]: The API response for each flushed dataset.
+
+        Raises:
+            InvariantError: If an update fails to send. After a transient error,
+                            e.g. a timeout, the update is put back to be sent at
+                            the end of a new window; otherwise it is dropped.
+                            The updates not sent yet are put back.
         """
+        if self._metadata_coalescer is None:
+            return {}
+        # Taken under the coalescer's lock and sent outside of it, so that a slow
+        # update does not hold up the other flushes.
+        updates = self._take_metadata_updates(dataset_name)
+        responses = {}
+        for position, (request, request_kwargs) in enumerate(updates):
+            try:
+                response = await self._send_dataset_metadata_update(
+                    request, request_kwargs
+                )
+            except InvariantError as e:
+                for name in self._requeue_metadata_updates(updates[position:], e):
+                    self._schedule_metadata_flush(name)
+                raise
+            responses[request.dataset_name] = response
+        return responses
+
+    def _schedule_metadata_flush(self, dataset_name: str) -> None:
+        handle = asyncio.get_running_loop().call_later(
+            self._metadata_coalescer.window_s,
+            self._start_metadata_flush,
+            dataset_name,
+        )
+        self._metadata_coalescer.set_handle(dataset_name, handle)
+
+    def _start_metadata_flush(self, dataset_name: str) -> None:
+        task = asyncio.ensure_future(self._flush_metadata_in_background(dataset_name))
+        # Keep a reference so that the task is not garbage collected mid-flight.
+        self._metadata_flush_tasks.add(task)
+        task.add_done_callback(self._metadata_flush_tasks.discard)
+
+    async def _flush_metadata_in_background(self, dataset_name: str) -> None:
+        try:
+            await self.flush_dataset_metadata(dataset_name)
+        except InvariantError:
+            # Counted in the metrics, and requeued if sending again may help.
+            pass
+
+    async def _send_dataset_metadata_update(
+        self,
+        request: UpdateDatasetMetadataRequest,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> Dict:
         request_kwargs = self._prepare_update_dataset_metadata_request(
             request, request_kwargs
         )
@@ -208,15 +750,18 @@ class AsyncClient(BaseClient):
             pathname=f"{DATASET_METADATA_API_PATH}/{request.dataset_name}",
             request_kwargs=request_kwargs,
         )
-        return http_response.json()
+        self._invalidate_dataset_metadata(request.dataset_name)
+        with profiling.phase("deserialization"):
+            return http_response.json()
 
+    @profiling.profiled
     async def create_request_and_update_dataset_metadata(
         self,
         dataset_name: str,
         replace_all: bool = False,
         metadata: Optional[Dict] = None,
         request_kwargs: Optional[Mapping] = None,
-    ) -> Dict:
+    ) -> Optional[Dict]:
         """
         Update the metadata for a dataset.
 
@@ -228,15 +773,18 @@ class AsyncClient(BaseClient):
                                                 the httpx method.
 
         Returns:
-            Dict: The response from the API.
+            Optional[Dict]: The response from the API, or None if the update was
+                            buffered.
         """
-        request = UpdateDatasetMetadataRequest(
-            dataset_name=dataset_name,
-            metadata=MetadataUpdate(**metadata),
-            replace_all=replace_all,
-        )
+        with profiling.phase("validation"):
+            request = UpdateDatasetMetadataRequest(
+                dataset_name=dataset_name,
+                metadata=MetadataUpdate(**metadata),
+                replace_all=replace_all,
+            )
         return await self.update_dataset_metadata(request, request_kwargs)
 
+    @profiling.profiled
     async def append_messages(
         self,
         request: AppendMessagesRequest,
@@ -254,14 +802,17 @@ class AsyncClient(BaseClient):
         Returns:
             Dict: The response from the API.
         """
+        request = self._apply_payload_policy(request)
         request_kwargs = self._prepare_append_messages_request(request, request_kwargs)
         http_response = await self.request(
             method="POST",
             pathname=f"{TRACE_API_PATH}/{request.trace_id}/messages",
             request_kwargs=request_kwargs,
         )
-        return http_response.json()
+        with profiling.phase("deserialization"):
+            return http_response.json()
 
+    @profiling.profiled
     async def create_request_and_append_messages(
         self,
         messages: List[Dict],
@@ -282,11 +833,12 @@ class AsyncClient(BaseClient):
         Returns:
             Dict: The response from the API.
         """
-        request = AppendMessagesRequest(
-            trace_id=trace_id,
-            annotations=(
-                AnnotationCreate.from_dicts(annotations) if annotations else None
-            ),
-            messages=messages,
-        )
+        with profiling.phase("validation"):
+            request = AppendMessagesRequest(
+                trace_id=trace_id,
+                annotations=(
+                    AnnotationCreate.from_dicts(annotations) if annotations else None
+                ),
+                messages=messages,
+            )
         return await self.append_messages(request, request_kwargs)
@@ -1,36 +1,110 @@
 """Base client for interacting with the Invariant APIs."""
 
-from typing import Dict, Mapping, Optional, Tuple, Union
+import contextlib
+import json
+import os
+import time
+import urllib.parse
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING, Dict, List, Mapping, Optional, Tuple, Union
+import httpx
+import requests
 from invariant_sdk.types.exceptions import (
     InvariantError,
+    InvariantAPIBusyError,
     InvariantAPIError,
+    InvariantAPITimeoutError,
     InvariantAuthError,
     InvariantNotFoundError,
+    InvariantRateLimitError,
+    InvariantServiceUnavailableError,
+)
+from invariant_sdk.types.push_traces import (
+    DATASET_NAME_REGEX,
+    PushTracesRequest,
+    PushTracesResponse,
 )
-from invariant_sdk.types.push_traces import PushTracesRequest
 from invariant_sdk.types.update_dataset_metadata import (
     UpdateDatasetMetadataRequest,
 )
 from invariant_sdk.types.append_messages import AppendMessagesRequest
+from invariant_sdk.metadata_cache import (
+    MetadataCache,
+    MetadataCacheEntry,
+    MetadataCacheKey,
+)
+from invariant_sdk.metadata_coalescing import MetadataUpdateCoalescer
+from invariant_sdk.batching import AdaptiveBatchSizer, slice_request
+from invariant_sdk.dedup import DedupIndex, PushPlan, select_traces
+from invariant_sdk.hooks import RequestHooks
+from invariant_sdk.jsonl_upload import JsonlFile, MultipartBody
+from invariant_sdk.payload_policy import PayloadPolicy
+from invariant_sdk.rate_control import RateController
+from invariant_sdk.sampling import SamplingPolicy
+from invariant_sdk.trace_store import DEDUPLICATED, PUSHED, TraceStore
+from invariant_sdk import fork_safety, profiling
 import invariant_sdk.utils as invariant_utils
 
+if TYPE_CHECKING:
+    from invariant_sdk.metrics import MetricsRegistry
+
 DEFAULT_CONNECTION_TIMEOUT_MS = 5_000
 DEFAULT_READ_TIMEOUT_MS = 20_000
 PUSH_TRACE_API_PATH = "/api/v1/push/trace"
 DATASET_METADATA_API_PATH = "/api/v1/dataset/metadata"
 TRACE_API_PATH = "/api/v1/trace"
+DATASET_EXPORT_API_PATH = "/api/v1/dataset/export"
+DATASET_UPLOAD_API_PATH = "/api/v1/dataset/upload"
+
+_NO_RATE_CONTROL = contextlib.nullcontext()
+
+# Errors that sending again can fix. Connection errors are raised as a plain
+# `InvariantError`, from the error of the HTTP library.
+_TRANSIENT_ERRORS = (InvariantAPIError, InvariantAPITimeoutError, InvariantAPIBusyError)
+_CONNECTION_ERRORS = (
+    requests.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    httpx.NetworkError,
+    httpx.RemoteProtocolError,
+)
 
 
 class BaseClient:
     """Base client for interacting with the Invariant APIs."""
 
-    __slots__ = ["api_url", "api_key", "timeout_ms"]
+    __slots__ = [
+        "api_url",
+        "api_key",
+        "timeout_ms",
+        "metadata_cache",
+        "hooks",
+        "metrics",
+        "rate_controller",
+        "batch_sizer",
+        "dedup_index",
+        "trace_store",
+        "payload_policy",
+        "sampling_policy",
+        "_metadata_coalescer",
+        "__weakref__",
+    ]
 
     def __init__(
         self,
         api_url: Optional[str] = None,
         api_key: Optional[str] = None,
         timeout_ms: Optional[Union[int, Tuple[int, int]]] = None,
+        metadata_coalesce_window_ms: Optional[int] = None,
+        metadata_cache: Optional[MetadataCache] = None,
+        hooks: Optional[RequestHooks] = None,
+        metrics: Optional["MetricsRegistry"] = None,
+        rate_controller: Optional[RateController] = None,
+        batch_sizer: Optional[AdaptiveBatchSizer] = None,
+        dedup_index: Optional[DedupIndex] = None,
+        trace_store: Optional[TraceStore] = None,
+        payload_policy: Optional[PayloadPolicy] = None,
+        sampling_policy: Optional[SamplingPolicy] = None,
     ) -> None:
         self.api_url = invariant_utils.get_api_url(api_url)
         self.api_key = invariant_utils.get_api_key(api_key)
@@ -41,6 +115,46 @@ class BaseClient:
                 timeout_ms or (DEFAULT_CONNECTION_TIMEOUT_MS, DEFAULT_READ_TIMEOUT_MS)
             )
         )
+        self.metadata_cache = metadata_cache
+        if metrics is not None:
+            hooks = (
+                metrics.hooks
+                if hooks is None
+                else RequestHooks.combine(hooks, metrics.hooks)
+            )
+        self.hooks = hooks
+        self.metrics = metrics
+        self.rate_controller = rate_controller
+        self.batch_sizer = batch_sizer or AdaptiveBatchSizer()
+        self.dedup_index = dedup_index
+        self.trace_store = trace_store
+        self.payload_policy = payload_policy
+        self.sampling_policy = sampling_policy
+        if metrics is not None:
+            self.batch_sizer.report_to(
+                metrics.gauge(
+                    "invariant_sdk_batch_bytes",
+                    "Target size of the batches of push_trace_batched, summed over"
+                    " batch sizers.",
+                )
+            )
+        self._metadata_coalescer = (
+            MetadataUpdateCoalescer(metadata_coalesce_window_ms)
+            if metadata_coalesce_window_ms
+            else None
+        )
+        fork_safety.register(self)
+
+    def _after_fork_in_child(self) -> None:
+        """Reset the state inherited from the parent process, see `fork_safety`."""
+        if self._metadata_coalescer is not None:
+            # The parent sends the updates it buffered; the child starts afresh.
+            self._track_queue_depth(
+                "metadata_updates", -len(self._metadata_coalescer.pending_datasets())
+            )
+            self._metadata_coalescer = MetadataUpdateCoalescer(
+                self._metadata_coalescer.window_ms
+            )
 
     @property
     def _headers(self) -> Dict[str, str]:
@@ -65,10 +179,31 @@ class BaseClient:
             raise InvariantNotFoundError(
                 f"Resource not found (404) when calling method: {method} for path: {pathname}."
             )
+        if response.status_code in (429, 503):
+            error_cls = (
+                InvariantRateLimitError
+                if response.status_code == 429
+                else InvariantServiceUnavailableError
+            )
+            raise error_cls(
+                f"HTTP error when calling method: {method} for path: {pathname}. "
+                f"Server asked to back off ({response.status_code}).",
+                retry_after_s=_parse_retry_after(response.headers.get("Retry-After")),
+            )
         raise InvariantError(
             f"HTTP error when calling method: {method} for path: {pathname}."
         )
 
+    def _admit(self) -> contextlib.AbstractContextManager:
+        if self.rate_controller is None:
+            return _NO_RATE_CONTROL
+        return self.rate_controller.admit()
+
+    def _admit_async(self) -> contextlib.AbstractAsyncContextManager:
+        if self.rate_controller is None:
+            return _NO_RATE_CONTROL
+        return self.rate_controller.admit_async()
+
     def _prepare_request_kwargs(self, request_kwargs: Optional[Mapping]) -> Dict:
         request_kwargs = request_kwargs or {}
         return {
@@ -80,17 +215,37 @@ class BaseClient:
             },
         }
 
+    def _encode_json_body(
+        self, request_kwargs: Dict, body_kwarg: str, **dumps_kwargs
+    ) -> Dict:
+        """Encode the `json` body to bytes the way the HTTP library would."""
+        if "json" not in request_kwargs:
+            return request_kwargs
+        with profiling.phase("encode"):
+            body = json.dumps(
+                request_kwargs.pop("json"), allow_nan=False, **dumps_kwargs
+            )
+            request_kwargs[body_kwarg] = body.encode()
+        # The HTTP library only sets the content type of a `json` body.
+        headers = dict(request_kwargs.get("headers") or {})
+        if not any(name.lower() == "content-type" for name in headers):
+            headers["Content-Type"] = "application/json"
+        request_kwargs["headers"] = headers
+        return request_kwargs
+
     def _prepare_push_trace_request(
         self, request: PushTracesRequest, request_kwargs: Optional[Mapping] = None
     ) -> Dict:
         request_kwargs = request_kwargs or {}
+        with profiling.phase("serialization"):
+            body = request.to_json()
         return {
             **request_kwargs,
             "headers": {
                 "Content-Type": "application/json",
                 **request_kwargs.get("headers", {}),
             },
-            "json": request.to_json(),
+            "json": body,
         }
 
     def _prepare_get_dataset_metadata_request(
@@ -105,12 +260,335 @@ class BaseClient:
             },
         }
 
+    def _export_pathname(
+        self,
+        dataset_name: str,
+        owner_username: Optional[str],
+        offset: int,
+        limit: int,
+    ) -> str:
+        query = {"offset": offset, "limit": limit}
+        if owner_username:
+            query["owner_username"] = owner_username
+        return (
+            f"{DATASET_EXPORT_API_PATH}/{dataset_name}?{urllib.parse.urlencode(query)}"
+        )
+
+    def _prepare_upload_request(
+        self,
+        dataset_name: str,
+        file: JsonlFile,
+        body_kwarg: str,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> Dict:
+        if not DATASET_NAME_REGEX.match(dataset_name):
+            raise ValueError("dataset name can only contain A-Z, a-z, 0-9, - and _")
+        request_kwargs = request_kwargs or {}
+        with profiling.phase("serialization"):
+            file.check()
+            body = MultipartBody(
+                {"name": dataset_name}, "file", os.path.basename(file.path), file.data
+            )
+        return {
+            **request_kwargs,
+            "headers": {
+                "Content-Type": body.content_type,
+                "Content-Length": str(len(body)),
+                **request_kwargs.get("headers", {}),
+            },
+            body_kwarg: body,
+        }
+
+    def _lookup_dataset_metadata(
+        self, key: MetadataCacheKey
+    ) -> Tuple[Optional[Dict], Optional[MetadataCacheEntry]]:
+        if self.metadata_cache is None:
+            return None, None
+        return self.metadata_cache.lookup(key)
+
+    def _metadata_generation(self, key: MetadataCacheKey) -> Optional[int]:
+        if self.metadata_cache is None:
+            return None
+        return self.metadata_cache.generation(key)
+
+    def _add_revalidation_header(
+        self, request_kwargs: Dict, stale_entry: Optional[MetadataCacheEntry]
+    ) -> Dict:
+        if stale_entry is not None:
+            request_kwargs["headers"] = {
+                "If-None-Match": stale_entry.etag,
+                **request_kwargs["headers"],
+            }
+        return request_kwargs
+
+    def _cache_dataset_metadata(
+        self,
+        key: MetadataCacheKey,
+        stale_entry: Optional[MetadataCacheEntry],
+        response,
+        generation: Optional[int],
+    ) -> Dict:
+        # Not cached if an update invalidated the key while it was fetched.
+        if self.metadata_cache is None:
+            return response.json()
+        if response.status_code == 304 and stale_entry is not None:
+            return self.metadata_cache.revalidated(key, stale_entry, generation)
+        metadata = response.json()
+        self.metadata_cache.store(
+            key, metadata, response.headers.get("ETag"), generation
+        )
+        return metadata
+
+    def _track_queue_depth(self, queue: str, delta: int) -> None:
+        if self.metrics is not None:
+            self.metrics.queue_depth.inc(delta, (queue,))
+
+    def _next_batch(
+        self, request: PushTracesRequest, sizes: List[int], start: int
+    ) -> Tuple[PushTracesRequest, int, int]:
+        """Return the next batch of a batched push, its number of traces and size."""
+        count = self.batch_sizer.take(sizes, start)
+        batch = slice_request(request, start, start + count)
+        return batch, count, sum(sizes[start : start + count])
+
+    def _observe_batch(self, batch_bytes: int, traces: int, latency_ms: float) -> None:
+        # The sizer keeps the batch bytes gauge up to date.
+        self.batch_sizer.observe(batch_bytes, traces, latency_ms)
+
+    def _apply_payload_policy(
+        self, request: Union[PushTracesRequest, AppendMessagesRequest]
+    ) -> Union[PushTracesRequest, AppendMessagesRequest]:
+        if self.payload_policy is None:
+            return request
+        with profiling.phase("serialization"):
+            request, report = self.payload_policy.apply(request)
+        if report and self.metrics is not None:
+            counter = self.metrics.counter(
+                "invariant_sdk_trimmed_payload_bytes_total",
+                "Bytes of message content cut or extracted by the payload policy.",
+                ("action",),
+            )
+            for item in report.trimmed:
+                counter.inc(item.original_bytes - item.kept_bytes, (item.action,))
+        return request
+
+    def _sample(
+        self,
+        messages: List[List[Dict]],
+        annotations: Optional[List[List]],
+        metadata: Optional[List[Dict]],
+        dataset: Optional[str],
+    ) -> Optional[List[int]]:
+        """Return the positions of the traces to push, or None to push them all."""
+        if self.sampling_policy is None or not isinstance(messages, list):
+            return None
+        if (annotations and len(annotations) != len(messages)) or (
+            metadata and len(metadata) != len(messages)
+        ):
+            # Left to the validation of the request to report.
+            return None
+        with profiling.phase("sampling"):
+            reasons = self.sampling_policy.sample(
+                messages, annotations, metadata, dataset
+            )
+        kept = [position for position, reason in enumerate(reasons) if reason is None]
+        if len(kept) == len(reasons):
+            return None
+        if self.metrics is not None:
+            for reason in reasons:
+                if reason is not None:
+                    self.metrics.dropped_traces.inc(1, (reason,))
+        return kept
+
+    # The interface of queues that push traces for a client later, such as
+    # `BufferedExporter`: `sample_request` when traces are queued, `track_queued`
+    # while they wait and `Client.push_queued_trace` to push them.
+
+    def sample_request(self, request: PushTracesRequest) -> Optional[PushTracesRequest]:
+        """
+        Apply the `sampling_policy` to a request to push later.
+
+        Args:
+            request (PushTracesRequest): The traces to push.
+
+        Returns:
+            Optional[PushTracesRequest]: The request with the traces kept, or None
+                                         if all of them were dropped.
+        """
+        kept = self._sample(
+            request.messages, request.annotations, request.metadata, request.dataset
+        )
+        if kept is None:
+            return request
+        return select_traces(request, kept) if kept else None
+
+    def track_queued(
+        self, traces: int = 0, queue: Optional[str] = None, queue_bytes: int = 0
+    ) -> None:
+        """
+        Count traces and bytes joining (positive) or leaving (negative) a queue.
+
+        The traces count in the backlog that the load shedder of the
+        `sampling_policy` observes, until `Client.push_queued_trace` pushes
+        them. The bytes count in `invariant_sdk_queue_depth{queue=queue}`.
+        """
+        if traces:
+            self._track_backlog(traces)
+        if queue is not None and queue_bytes:
+            self._track_queue_depth(queue, queue_bytes)
+
+    def _track_backlog(self, traces: int) -> None:
+        """Count traces joining (positive) or leaving the ones not pushed yet."""
+        self._track_queue_depth("traces", traces)
+        if self.sampling_policy is not None and self.sampling_policy.load_shedder:
+            change = self.sampling_policy.load_shedder.observe_backlog(traces)
+            self._count_shedding_adjustment(change)
+
+    def _observe_push_latency(self, sent: float) -> None:
+        if self.sampling_policy is not None and self.sampling_policy.load_shedder:
+            change = self.sampling_policy.load_shedder.observe_latency(
+                (time.perf_counter() - sent) * 1000
+            )
+            self._count_shedding_adjustment(change)
+
+    def _count_shedding_adjustment(self, change: float) -> None:
+        if change and self.metrics is not None:
+            self.metrics.counter(
+                "invariant_sdk_load_shedding_adjustments_total",
+                "Changes of the keep rate of the load shedder.",
+                ("direction",),
+            ).inc(1, ("decrease" if change < 0 else "increase",))
+
+    @staticmethod
+    def _sampled_response(
+        kept: List[int],
+        count: int,
+        response: Optional[PushTracesResponse],
+        dataset: Optional[str],
+    ) -> PushTracesResponse:
+        """Return a response for all traces, with None for the ones dropped."""
+        ids: List[Optional[str]] = [None] * count
+        if response is not None:
+            for position, trace_id in zip(kept, response.id):
+                ids[position] = trace_id
+        return PushTracesResponse(
+            id=ids,
+            dataset=response.dataset if response is not None else dataset,
+            username=response.username if response is not None else None,
+        )
+
+    def _plan_push(self, request: PushTracesRequest) -> Optional[PushPlan]:
+        if self.dedup_index is None:
+            return None
+        plan = self.dedup_index.plan(request)
+        if plan.skipped and self.metrics is not None:
+            self.metrics.counter(
+                "invariant_sdk_deduplicated_traces_total",
+                "Traces not pushed because an identical trace was pushed before.",
+            ).inc(plan.skipped)
+        return plan
+
+    def _store_push(
+        self,
+        request: PushTracesRequest,
+        plan: Optional[PushPlan],
+        response: Optional[PushTracesResponse],
+        sent: Optional[float] = None,
+        error: Optional[BaseException] = None,
+    ) -> Optional[PushTracesResponse]:
+        """Record a push in the trace store, if any, and return its response."""
+        if self.trace_store is None:
+            return response
+        statuses = None
+        if plan is not None and plan.skipped and response is not None:
+            statuses = [DEDUPLICATED] * len(plan.hashes)
+            for position in plan.sent:
+                statuses[position] = PUSHED
+        self.trace_store.record(
+            request,
+            response.id if response is not None else None,
+            statuses,
+            (time.perf_counter() - sent) * 1000 if sent is not None else None,
+            error,
+        )
+        return response
+
+    def _take_metadata_updates(
+        self, dataset_name: Optional[str]
+    ) -> List[Tuple[UpdateDatasetMetadataRequest, Optional[Mapping]]]:
+        """Take the buffered metadata updates of a dataset, or of all, to send."""
+        if dataset_name is None:
+            updates = self._metadata_coalescer.pop_all()
+        else:
+            update = self._metadata_coalescer.pop(dataset_name)
+            updates = [] if update is None else [update]
+        if updates:
+            self._track_queue_depth("metadata_updates", -len(updates))
+        return updates
+
+    def _requeue_metadata_updates(
+        self,
+        updates: List[Tuple[UpdateDatasetMetadataRequest, Optional[Mapping]]],
+        error: InvariantError,
+    ) -> List[str]:
+        """
+        Put back the updates of a flush that failed to send the first of them.
+
+        The first is put back if sending again may help, the others were not sent
+        and always are.
+
+        Returns:
+            List[str]: The datasets whose flush must be scheduled.
+        """
+        (request, request_kwargs), unsent = updates[0], updates[1:]
+        scheduled = []
+        if self._requeue_metadata_update(request, request_kwargs, error):
+            scheduled.append(request.dataset_name)
+        for request, request_kwargs in unsent:
+            if self._metadata_coalescer.requeue(request, request_kwargs):
+                self._track_queue_depth("metadata_updates", 1)
+                scheduled.append(request.dataset_name)
+        return scheduled
+
+    def _requeue_metadata_update(
+        self,
+        request: UpdateDatasetMetadataRequest,
+        request_kwargs: Optional[Mapping],
+        error: InvariantError,
+    ) -> bool:
+        """
+        Put back a coalesced update that failed to send, if sending again may help.
+
+        Returns:
+            bool: True if it was requeued and a flush of its dataset must be
+                  scheduled.
+        """
+        requeued = is_transient_error(error)
+        if self.metrics is not None:
+            self.metrics.counter(
+                "invariant_sdk_metadata_update_failures_total",
+                "Coalesced metadata updates that failed to send, by what followed.",
+                ("outcome",),
+            ).inc(1, ("requeued" if requeued else "dropped",))
+        if not requeued:
+            return False
+        if not self._metadata_coalescer.requeue(request, request_kwargs):
+            return False
+        self._track_queue_depth("metadata_updates", 1)
+        return True
+
+    def _invalidate_dataset_metadata(self, dataset_name: str) -> None:
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate(dataset_name)
+
     def _prepare_update_dataset_metadata_request(
         self,
         request: UpdateDatasetMetadataRequest,
         request_kwargs: Optional[Mapping] = None,
     ) -> Dict:
         request_kwargs = request_kwargs or {}
+        with profiling.phase("serialization"):
+            metadata = request.metadata.to_json()
         return {
             **request_kwargs,
             "headers": {
@@ -118,7 +596,7 @@ class BaseClient:
                 **request_kwargs.get("headers", {}),
             },
             "json": {
-                "metadata": request.metadata.to_json(),
+                "metadata": metadata,
                 "replace_all": request.replace_all,
             },
         }
@@ -127,14 +605,43 @@ class BaseClient:
         self, request: AppendMessagesRequest, request_kwargs: Optional[Mapping] = None
     ) -> Dict:
         request_kwargs = request_kwargs or {}
+        with profiling.phase("serialization"):
+            body = {
+                "messages": request.dump_messages(),
+                "annotations": request.dump_annotations(),
+            }
         return {
             **request_kwargs,
             "headers": {
                 "Content-Type": "application/json",
                 **request_kwargs.get("headers", {}),
             },
-            "json": {
-                "messages": request.dump_messages(),
-                "annotations": request.dump_annotations(),
-            },
+            "json": body,
         }
+
+
+def is_transient_error(error: InvariantError) -> bool:
+    """
+    Return whether sending a request again may succeed after `error`.
+
+    Server errors (500), timeouts, requests to back off (429, 503) and connection
+    errors are transient; the server rejecting a request (4xx) is not.
+    """
+    return isinstance(error, _TRANSIENT_ERRORS) or isinstance(
+        error.__cause__, _CONNECTION_ERRORS
+    )
+
+
+def _parse_retry_after(value) -> Optional[float]:
+    """Parse a Retry-After header given either in seconds or as an HTTP date."""
+    if not isinstance(value, str):
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
@@ -0,0 +1,201 @@
+"""Adaptive sizing of trace batches from measured request latency."""
+
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from invariant_sdk.types.push_traces import PushTracesRequest
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from invariant_sdk.metrics import Gauge
+
+
+class AdaptiveBatchSizer:
+    """
+    Picks how many bytes of traces to send per request to meet a latency budget.
+
+    After every batch, the target size is scaled by `latency_budget_ms` divided
+    by the measured latency (by at most 2x either way) and smoothed with the
+    previous target. Latency is roughly a fixed cost plus a cost per byte, so
+    this converges on the size whose requests take the budget. Batches smaller
+    than the target that finish within the budget, such as the last batch of a
+    push, do not shrink it.
+
+    Sizes are the estimated JSON size of each trace's messages, annotations and
+    metadata, which is close to its share of the request body.
+
+    Args:
+        latency_budget_ms: the latency to aim for per request.
+        min_batch_bytes: the smallest target. A batch always holds at least one
+                         trace, however large.
+        max_batch_bytes: the largest target.
+        initial_batch_bytes: the target before the first measurement.
+        smoothing: the weight of a new measurement, between 0 and 1.
+    """
+
+    __slots__ = [
+        "latency_budget_ms",
+        "min_batch_bytes",
+        "max_batch_bytes",
+        "smoothing",
+        "_batch_bytes",
+        "_traces_per_batch",
+        "_gauges",
+        "_lock",
+    ]
+
+    def __init__(
+        self,
+        latency_budget_ms: float = 1_000,
+        min_batch_bytes: int = 16 * 1024,
+        max_batch_bytes: int = 4 * 1024 * 1024,
+        initial_batch_bytes: int = 256 * 1024,
+        smoothing: float = 0.5,
+    ) -> None:
+        if latency_budget_ms <= 0:
+            raise ValueError("latency_budget_ms must be positive")
+        if not 0 < min_batch_bytes <= max_batch_bytes:
+            raise ValueError("Expected 0 < min_batch_bytes <= max_batch_bytes")
+        if not 0 < smoothing <= 1:
+            raise ValueError("smoothing must be in (0, 1]")
+        self.latency_budget_ms = latency_budget_ms
+        self.min_batch_bytes = min_batch_bytes
+        self.max_batch_bytes = max_batch_bytes
+        self.smoothing = smoothing
+        self._batch_bytes = float(
+            min(max(initial_batch_bytes, min_batch_bytes), max_batch_bytes)
+        )
+        self._traces_per_batch: Optional[float] = None
+        self._gauges: List["Gauge"] = []
+        self._lock = threading.Lock()
+
+    @property
+    def batch_bytes(self) -> int:
+        """The current target size of a batch in bytes."""
+        return int(self._batch_bytes)
+
+    @property
+    def traces_per_batch(self) -> Optional[float]:
+        """The average number of traces in recent full batches, if any were sent."""
+        return self._traces_per_batch
+
+    def report_to(self, gauge: "Gauge") -> None:
+        """
+        Add the target size to `gauge` and keep it up to date.
+
+        A sizer shared by several clients of a registry is counted in its gauge
+        once, however many clients report it.
+        """
+        with self._lock:
+            if any(known is gauge for known in self._gauges):
+                return
+            self._gauges.append(gauge)
+            gauge.inc(int(self._batch_bytes))
+
+    def take(self, sizes: List[int], start: int = 0) -> int:
+        """Return how many traces from `start` on, of these sizes, fit in a batch."""
+        budget = self._batch_bytes
+        total = 0
+        for index in range(start, len(sizes)):
+            total += sizes[index]
+            if total > budget:
+                return max(index - start, 1)
+        return len(sizes) - start
+
+    def observe(self, batch_bytes: int, traces: int, latency_ms: float) -> int:
+        """
+        Learn from a batch that was sent.
+
+        Args:
+            batch_bytes (int): The size of the batch.
+            traces (int): The number of traces in it.
+            latency_ms (float): How long the request took.
+
+        Returns:
+            int: How much the target size changed, in bytes.
+        """
+        if batch_bytes <= 0 or latency_ms <= 0:
+            return 0
+        ratio = min(max(self.latency_budget_ms / latency_ms, 0.5), 2.0)
+        with self._lock:
+            before = self._batch_bytes
+            if ratio >= 1 and batch_bytes < before / 2:
+                # An underfull batch says little about how large one could be.
+                return 0
+            weight = self.smoothing
+            target = (1 - weight) * before + weight * batch_bytes * ratio
+            self._batch_bytes = min(
+                max(target, self.min_batch_bytes), self.max_batch_bytes
+            )
+            self._traces_per_batch = (
+                traces
+                if self._traces_per_batch is None
+                else (1 - weight) * self._traces_per_batch + weight * traces
+            )
+            change = int(self._batch_bytes) - int(before)
+            if change:
+                for gauge in self._gauges:
+                    gauge.inc(change)
+            return change
+
+
+def trace_sizes(request: PushTracesRequest) -> List[int]:
+    """
+    Return the approximate JSON size of every trace of a push request.
+
+    The size of a trace's messages, annotations and metadata is estimated from
+    their structure and the lengths of their strings, without encoding them,
+    so that sizing a request costs far less than sending it. Escaped characters
+    are counted once.
+    """
+    annotations, metadata = request.annotations, request.metadata
+    sizes = []
+    for index, messages in enumerate(request.messages):
+        size = _json_size(messages)
+        if annotations is not None:
+            size += _json_size(annotations[index])
+        if metadata is not None:
+            size += _json_size(metadata[index])
+        sizes.append(size)
+    return sizes
+
+
+def _json_size(value: Any) -> int:
+    if isinstance(value, str):
+        return len(value) + 2
+    if isinstance(value, dict):
+        # The braces, and per item the quotes of its key, ": " and ", ".
+        size = 2 + 6 * len(value)
+        for key, item in value.items():
+            size += len(str(key)) + _json_size(item)
+        return size
+    if isinstance(value, (list, tuple)):
+        size = 2 + 2 * len(value)
+        for item in value:
+            size += _json_size(item)
+        return size
+    if value is None or value is True:
+        return 4
+    if value is False:
+        return 5
+    if isinstance(value, BaseModel):
+        return _json_size(value.__dict__)
+    # Numbers, and what is encoded as a string with `default=str`.
+    return len(str(value)) + (0 if isinstance(value, (int, float)) else 2)
+
+
+def slice_request(
+    request: PushTracesRequest, start: int, stop: int
+) -> PushTracesRequest:
+    """Return the traces `start:stop` of a push request, without validating them."""
+    fields: Dict[str, Any] = {
+        "messages": request.messages[start:stop],
+        "annotations": (
+            request.annotations[start:stop] if request.annotations is not None else None
+        ),
+        "dataset": request.dataset,
+        "metadata": (
+            request.metadata[start:stop] if request.metadata is not None else None
+        ),
+    }
+    return PushTracesRequest.model_construct(**fields)
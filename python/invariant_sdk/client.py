@@ -1,11 +1,57 @@
 """Client for interacting with the Invariant APIs."""
 
-import atexit
-from typing import Dict, List, Literal, Mapping, Optional, Tuple, Union
+import collections
+import functools
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_for_futures
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
+from invariant_sdk import fork_safety, profiling
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.batching import AdaptiveBatchSizer, trace_sizes
+from invariant_sdk.dedup import DedupIndex, select_traces
+from invariant_sdk.export import (
+    DEFAULT_EXPORT_PAGE_SIZE,
+    PREFETCH_CHUNKS,
+    PREFETCH_PAGES,
+    READ_CHUNK_BYTES,
+    iter_prefetched,
+    line_batches,
+    parse_batches,
+)
+from invariant_sdk.hooks import RequestHooks, RequestRecord
+from invariant_sdk.jsonl_upload import JsonlFile
+from invariant_sdk.loop_engine import LoopEngine
+from invariant_sdk.metadata_cache import (
+    MetadataCache,
+    MetadataCacheEntry,
+    MetadataCacheKey,
+)
+from invariant_sdk.metrics import MetricsRegistry
+from invariant_sdk.payload_policy import PayloadPolicy
+from invariant_sdk.rate_control import RateController
+from invariant_sdk.sampling import SamplingPolicy
+from invariant_sdk.single_flight import SingleFlight
+from invariant_sdk.trace_store import TraceStore
 from invariant_sdk.types.annotations import AnnotationCreate
 from invariant_sdk.types.exceptions import (
     InvariantError,
     InvariantAPITimeoutError,
+    InvariantUserError,
 )
 from invariant_sdk.types.push_traces import PushTracesRequest, PushTracesResponse
 from invariant_sdk.types.update_dataset_metadata import (
@@ -17,38 +63,160 @@ from invariant_sdk.base_client import (
     BaseClient,
     PUSH_TRACE_API_PATH,
     DATASET_METADATA_API_PATH,
+    DATASET_UPLOAD_API_PATH,
     TRACE_API_PATH,
 )
 
+import httpx
 import requests
 import urllib3
 
+T = TypeVar("T")
+
 
 def _close_session(session: requests.Session) -> None:
     session.close()
 
 
+def _close_response(future: "Future[requests.Response]") -> None:
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def _close_engine(engine: LoopEngine, async_client: AsyncClient) -> None:
+    try:
+        engine.run(async_client.session.aclose(), timeout=5)
+    finally:
+        engine.close()
+
+
 class Client(BaseClient):
-    """Client for interacting with the Invariant APIs."""
+    """
+    Client for interacting with the Invariant APIs.
+
+    By default requests are sent with `requests`, one blocking request per calling
+    thread. With `engine="asyncio"` they are instead sent by an `AsyncClient` running
+    on a background event loop thread, so that many calling threads share one
+    httpx connection pool. `session` must then be an `httpx.AsyncClient` (or None),
+    `request` returns `httpx.Response` objects, and custom `request_kwargs` must be
+    understood by httpx.
+    """
 
-    __slots__ = ["session"]
+    __slots__ = [
+        "session",
+        "max_workers",
+        "_get_flights",
+        "_executor",
+        "_executor_lock",
+        "_pending_futures",
+        "_shut_down",
+        "_metadata_exit_hook",
+        "_engine",
+        "_async_client",
+    ]
 
     def __init__(
         self,
         api_url: Optional[str] = None,
         api_key: Optional[str] = None,
         timeout_ms: Optional[Union[int, Tuple[int, int]]] = None,
-        session: Optional[requests.Session] = None,
+        session: Optional[Union[requests.Session, httpx.AsyncClient]] = None,
+        metadata_coalesce_window_ms: Optional[int] = None,
+        metadata_cache: Optional[MetadataCache] = None,
+        hooks: Optional[RequestHooks] = None,
+        metrics: Optional[MetricsRegistry] = None,
+        max_workers: int = requests.adapters.DEFAULT_POOLSIZE,
+        engine: Literal["requests", "asyncio"] = "requests",
+        rate_controller: Optional[RateController] = None,
+        batch_sizer: Optional[AdaptiveBatchSizer] = None,
+        dedup_index: Optional[DedupIndex] = None,
+        trace_store: Optional[TraceStore] = None,
+        payload_policy: Optional[PayloadPolicy] = None,
+        sampling_policy: Optional[SamplingPolicy] = None,
     ) -> None:
-        super().__init__(api_url, api_key, timeout_ms)
-        self.session = session if session else requests.Session()
-        atexit.register(_close_session, self.session)
+        super().__init__(
+            api_url,
+            api_key,
+            timeout_ms,
+            metadata_coalesce_window_ms,
+            metadata_cache,
+            hooks,
+            metrics,
+            rate_controller,
+            batch_sizer,
+            dedup_index,
+            trace_store,
+            payload_policy,
+            sampling_policy,
+        )
+        if engine not in ("requests", "asyncio"):
+            raise ValueError(f"Unknown engine: {engine}")
+        self._engine: Optional[LoopEngine] = None
+        self._async_client: Optional[AsyncClient] = None
+        if engine == "asyncio":
+            if session is not None and not isinstance(session, httpx.AsyncClient):
+                raise ValueError('engine="asyncio" needs an httpx.AsyncClient session')
+            self.session = None
+            self._engine = LoopEngine()
+            # The metrics are already part of `self.hooks`.
+            self._async_client = AsyncClient(
+                api_url=self.api_url,
+                api_key=self.api_key,
+                timeout_ms=self.timeout_ms,
+                session=session,
+                hooks=self.hooks,
+                rate_controller=rate_controller,
+            )
+            fork_safety.at_exit(_close_engine, self._engine, self._async_client)
+        else:
+            self.session = session if session else requests.Session()
+        self._get_flights = SingleFlight()
+        # The pool for `submit` is only started on first use. Its default size
+        # matches the connection pool of a default requests session.
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._pending_futures: Set[Future] = set()
+        self._shut_down = False
+        self._register_at_exit()
+
+    def _register_at_exit(self) -> None:
+        if self.session is not None:
+            fork_safety.at_exit(_close_session, self.session)
+        self._metadata_exit_hook: Optional[fork_safety.ExitHook] = None
+        if self._metadata_coalescer is not None:
+            # Registered after the session so that it runs first at exit. Weak, so
+            # that the hook does not keep the client alive.
+            self._metadata_exit_hook = fork_safety.at_exit(
+                self.flush_dataset_metadata, weak=True
+            )
+
+    def _after_fork_in_child(self) -> None:
+        super()._after_fork_in_child()
+        # The pool's threads are not running in the child, and the futures they
+        # would have completed are the parent's.
+        self._track_queue_depth("submitted", -len(self._pending_futures))
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._pending_futures = set()
+        self._get_flights = SingleFlight()
+        if isinstance(self.session, requests.Session):
+            # Pickling an adapter round trip builds new connection pools and
+            # keeps its configuration, as well as the session's own.
+            for adapter in self.session.adapters.values():
+                if isinstance(adapter, requests.adapters.HTTPAdapter):
+                    adapter.__setstate__(adapter.__getstate__())
+        if self._engine is not None:
+            # The engine and its async client reset themselves.
+            fork_safety.at_exit(_close_engine, self._engine, self._async_client)
+        self._register_at_exit()
 
     def request(
         self,
         method: Literal["GET", "POST", "PUT", "DELETE"],
         pathname: str,
         request_kwargs: Optional[Mapping] = None,
+        stream: bool = False,
     ) -> requests.Response:
         """
         Makes a request to the Invariant API.
@@ -57,19 +225,64 @@ class Client(BaseClient):
             method (Literal["GET", "POST", "PUT", "DELETE"]): The HTTP method to use.
             pathname (str): The path to make the request to.
             request_kwargs (Optional[Mapping]): Additional keyword arguments for the request.
+            stream (bool): Return once the headers are received and read the body only
+                           as it is consumed. The response must then be closed. Not
+                           supported with `engine="asyncio"`.
 
         Returns:
-            requests.Response: The response from the API.
+            requests.Response: The response from the API (`httpx.Response` with
+                               `engine="asyncio"`).
         """
+        if self._async_client is not None:
+            if stream:
+                raise InvariantUserError('stream=True needs engine="requests"')
+            return self._engine.run(
+                self._async_client.request(method, pathname, request_kwargs)
+            )
         request_kwargs = self._prepare_request_kwargs(request_kwargs)
+        if profiling.get_profiler() is not None:
+            # Encode here rather than in the HTTP library to time it separately.
+            request_kwargs = self._encode_json_body(request_kwargs, "data")
+        with self._admit():
+            if self.hooks is None:
+                return self._send_request(
+                    method, pathname, request_kwargs, stream=stream
+                )
+            record = self.hooks.start(method, pathname)
+            try:
+                response = self._send_request(
+                    method, pathname, request_kwargs, record, stream
+                )
+            except InvariantError as e:
+                self.hooks.error(record, e)
+                raise
+            self.hooks.end(record)
+            return response
+
+    def _send_request(
+        self,
+        method: str,
+        pathname: str,
+        request_kwargs: Dict,
+        record: Optional[RequestRecord] = None,
+        stream: bool = False,
+    ) -> requests.Response:
         try:
             path = self.api_url + pathname
-            response = self.session.request(
-                method=method,
-                url=path,
-                stream=False,
-                **request_kwargs,
-            )
+            with profiling.phase("network"):
+                response = self.session.request(
+                    method=method,
+                    url=path,
+                    stream=stream,
+                    **request_kwargs,
+                )
+            if record is not None:
+                record.received(
+                    response, response.elapsed.total_seconds() * 1000, stream
+                )
+            if stream and not response.ok:
+                # Its status and headers are all that is needed of it.
+                response.close()
             response.raise_for_status()
             return response
         except requests.ReadTimeout as e:
@@ -81,6 +294,12 @@ class Client(BaseClient):
                 f"Timeout when connecting to server for method: {method} on path: {pathname}."
             ) from e
         except requests.ConnectionError as e:
+            if e.args and isinstance(e.args[0], urllib3.exceptions.ReadTimeoutError):
+                # Raised by requests when the body, not the headers, times out.
+                raise InvariantAPITimeoutError(
+                    f"Timeout when calling method: {method} for path: {pathname}. "
+                    "Server took too long."
+                ) from e
             cause = getattr(e, "__cause__", None)
             if isinstance(cause, TimeoutError):
                 raise InvariantAPITimeoutError(
@@ -95,6 +314,10 @@ class Client(BaseClient):
             raise InvariantError(
                 f"Connection error when calling method: {method} for path: {pathname}."
             ) from e
+        except requests.exceptions.ChunkedEncodingError as e:
+            raise InvariantError(
+                f"Connection error when calling method: {method} for path: {pathname}."
+            ) from e
         except requests.HTTPError as e:
             response = e.response
             if response is not None:
@@ -104,6 +327,7 @@ class Client(BaseClient):
                 f"Unexpected error ({type(e).__name__}): {e} when calling method: {method} for path: {pathname}."
             ) from e
 
+    @profiling.profiled
     def push_trace(
         self,
         request: PushTracesRequest,
@@ -112,6 +336,13 @@ class Client(BaseClient):
         """
         Push trace data to the Invariant API.
 
+        With a `dedup_index`, traces pushed before are not sent again; the ids they
+        got then are returned for them. With a `trace_store`, the traces are
+        recorded there with their ids, or with the error if the push fails. With a
+        `payload_policy`, oversized strings and base64 images in the messages are
+        trimmed first. With a `sampling_policy`, the traces it drops are not sent
+        and get None in place of an id.
+
         Args:
             request (PushTracesRequest): The request object containing trace data.
             request_kwargs (Optional[Mapping]): Additional keyword arguments to pass to
@@ -120,14 +351,138 @@ class Client(BaseClient):
         Returns:
             PushTracesResponse: The response object.
         """
-        request_kwargs = self._prepare_push_trace_request(request, request_kwargs)
-        http_response = self.request(
-            method="POST",
-            pathname=PUSH_TRACE_API_PATH,
-            request_kwargs=request_kwargs,
+        kept = self._sample(
+            request.messages, request.annotations, request.metadata, request.dataset
+        )
+        if kept is None:
+            return self._push_trace(request, request_kwargs)
+        response = (
+            self._push_trace(select_traces(request, kept), request_kwargs)
+            if kept
+            else None
+        )
+        return self._sampled_response(
+            kept, len(request.messages), response, request.dataset
         )
-        return PushTracesResponse.from_json(http_response.json())
 
+    def push_queued_trace(
+        self,
+        request: PushTracesRequest,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> PushTracesResponse:
+        """
+        Push traces counted in the backlog with `track_queued`.
+
+        Unlike `push_trace`, the request is not sampled again. Its traces leave
+        the backlog once the push is done, whether it succeeded or not.
+
+        Args:
+            request (PushTracesRequest): The traces to push.
+            request_kwargs (Optional[Mapping]): Additional keyword arguments to pass to
+                                      the requests method.
+
+        Returns:
+            PushTracesResponse: The response object.
+        """
+        return self._push_trace(request, request_kwargs, queued=True)
+
+    def _push_trace(
+        self,
+        request: PushTracesRequest,
+        request_kwargs: Optional[Mapping] = None,
+        queued: bool = False,
+    ) -> PushTracesResponse:
+        # The traces count in the backlog until pushed, from when they were queued
+        # if they were.
+        traces = len(request.messages)
+        if not queued:
+            self._track_backlog(traces)
+        try:
+            return self._send_trace(request, request_kwargs)
+        finally:
+            self._track_backlog(-traces)
+
+    def _send_trace(
+        self,
+        request: PushTracesRequest,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> PushTracesResponse:
+        request = self._apply_payload_policy(request)
+        plan = self._plan_push(request)
+        if plan is not None and plan.request is None:
+            return self._store_push(request, plan, plan.complete(None))
+        request_kwargs = self._prepare_push_trace_request(
+            request if plan is None else plan.request, request_kwargs
+        )
+        sent = time.perf_counter()
+        try:
+            http_response = self.request(
+                method="POST",
+                pathname=PUSH_TRACE_API_PATH,
+                request_kwargs=request_kwargs,
+            )
+        except InvariantError as e:
+            self._observe_push_latency(sent)
+            self._store_push(request, plan, None, sent, e)
+            raise
+        self._observe_push_latency(sent)
+        with profiling.phase("deserialization"):
+            response = PushTracesResponse.from_json(http_response.json())
+        if plan is not None:
+            response = plan.complete(response)
+        return self._store_push(request, plan, response, sent)
+
+    @profiling.profiled
+    def push_trace_batched(
+        self,
+        request: PushTracesRequest,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> PushTracesResponse:
+        """
+        Push trace data in batches sized to the client's `batch_sizer`.
+
+        The traces are split into batches of about `batch_sizer.batch_bytes` each,
+        which are pushed one after the other. The size adapts to the latency of
+        every request, see `AdaptiveBatchSizer`. If a batch fails, its error is
+        raised and the batches before it stay pushed.
+
+        Args:
+            request (PushTracesRequest): The request object containing trace data.
+            request_kwargs (Optional[Mapping]): Additional keyword arguments to pass to
+                                      the requests method.
+
+        Returns:
+            PushTracesResponse: The response object, with the ids of all traces in
+                                order.
+        """
+        kept = self._sample(
+            request.messages, request.annotations, request.metadata, request.dataset
+        )
+        total = len(request.messages)
+        if kept is not None:
+            if not kept:
+                return self._sampled_response(kept, total, None, request.dataset)
+            request = select_traces(request, kept)
+        with profiling.phase("serialization"):
+            sizes = trace_sizes(request)
+        ids: List[Optional[str]] = []
+        response = None
+        start = 0
+        while start < len(sizes):
+            batch, count, batch_bytes = self._next_batch(request, sizes, start)
+            sent = time.perf_counter()
+            response = self._push_trace(batch, request_kwargs)
+            self._observe_batch(batch_bytes, count, (time.perf_counter() - sent) * 1000)
+            ids.extend(response.id)
+            start += count
+        response = PushTracesResponse(
+            id=ids, dataset=response.dataset, username=response.username
+        )
+        if kept is None:
+            return response
+        return self._sampled_response(kept, total, response, request.dataset)
+
+    @profiling.profiled
     def create_request_and_push_trace(
         self,
         messages: List[List[Dict]],
@@ -149,16 +504,39 @@ class Client(BaseClient):
         Returns:
             PushTracesResponse: The response object.
         """
-        request = PushTracesRequest(
-            messages=messages,
-            annotations=(
-                AnnotationCreate.from_nested_dicts(annotations) if annotations else None
-            ),
-            metadata=metadata,
-            dataset=dataset,
-        )
-        return self.push_trace(request, request_kwargs)
+        if self.sampling_policy is not None:
+            # Sampled before the annotations are validated, so that dropped traces
+            # cost next to nothing, but invalid input still raises ValueError.
+            PushTracesRequest.validate_fields(
+                messages, annotations or None, metadata, dataset, annotation_type=dict
+            )
+        kept = self._sample(messages, annotations, metadata, dataset)
+        if kept is not None:
+            total = len(messages)
+            if not kept:
+                return self._sampled_response(kept, total, None, dataset)
+            messages = [messages[position] for position in kept]
+            if annotations:
+                annotations = [annotations[position] for position in kept]
+            if metadata:
+                metadata = [metadata[position] for position in kept]
+        with profiling.phase("validation"):
+            request = PushTracesRequest(
+                messages=messages,
+                annotations=(
+                    AnnotationCreate.from_nested_dicts(annotations)
+                    if annotations
+                    else None
+                ),
+                metadata=metadata,
+                dataset=dataset,
+            )
+        response = self._push_trace(request, request_kwargs)
+        if kept is None:
+            return response
+        return self._sampled_response(kept, total, response, request.dataset)
 
+    @profiling.profiled
     def get_dataset_metadata(
         self,
         dataset_name: str,
@@ -168,6 +546,10 @@ class Client(BaseClient):
         """
         Get the metadata for a dataset.
 
+        If the client has a `metadata_cache`, fresh entries are served locally and
+        stale ones are revalidated with their ETag. Concurrent calls for the same
+        dataset without custom `request_kwargs` share a single request.
+
         Args:
             dataset_name (str): The name of the dataset to get metadata for.
             owner_username (str): The username of the owner of the dataset. If the caller
@@ -181,24 +563,211 @@ class Client(BaseClient):
         Returns:
             Dict: The response from the API.
         """
+        key = (dataset_name, owner_username)
+        cached, stale_entry = self._lookup_dataset_metadata(key)
+        if cached is not None:
+            return cached
         pathname = f"{DATASET_METADATA_API_PATH}/{dataset_name}"
         if owner_username:
             pathname += f"?owner_username={owner_username}"
+        if request_kwargs:
+            # Custom request kwargs may change the answer, so only share plain calls.
+            return self._fetch_dataset_metadata(
+                key, pathname, stale_entry, request_kwargs
+            )
+        return self._get_flights.do(
+            pathname,
+            lambda: self._fetch_dataset_metadata(key, pathname, stale_entry),
+        )
+
+    def _fetch_dataset_metadata(
+        self,
+        key: MetadataCacheKey,
+        pathname: str,
+        stale_entry: Optional[MetadataCacheEntry],
+        request_kwargs: Optional[Mapping] = None,
+    ) -> Dict:
+        generation = self._metadata_generation(key)
         http_response = self.request(
             method="GET",
             pathname=pathname,
-            request_kwargs=self._prepare_get_dataset_metadata_request(request_kwargs),
+            request_kwargs=self._add_revalidation_header(
+                self._prepare_get_dataset_metadata_request(request_kwargs), stale_entry
+            ),
+        )
+        return self._cache_dataset_metadata(key, stale_entry, http_response, generation)
+
+    def iter_dataset_traces(
+        self,
+        dataset_name: str,
+        owner_username: Optional[str] = None,
+        page_size: int = DEFAULT_EXPORT_PAGE_SIZE,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> Iterator[Dict]:
+        """
+        Iterate over the traces of a dataset, in order, for offline analysis.
+
+        The traces are fetched in pages of `page_size` and each page is parsed as
+        it streams in. The next four pages are requested while the current one is
+        read, and a background thread reads ahead of the caller by up to 2 MiB of
+        the responses, so that waiting for pages overlaps with processing them.
+        Memory stays constant however large the dataset is. An error is raised
+        after the traces before it. Stop iterating early with `break` or by
+        closing the iterator.
+
+        Args:
+            dataset_name (str): The name of the dataset.
+            owner_username (Optional[str]): The username of the owner of the dataset,
+                                            if it is not the caller.
+            page_size (int): The number of traces to request at a time.
+            request_kwargs (Optional[Mapping]): Additional keyword arguments to pass to
+                                      the requests method.
+
+        Returns:
+            Iterator[Dict]: The traces, each with its `id`, `index`, `messages`,
+                            `annotations` and `metadata`.
+        """
+        if page_size <= 0:
+            raise ValueError("page_size must be positive")
+        produce = (
+            self._read_dataset_pages
+            if self._async_client is None
+            else self._read_dataset_pages_on_engine
+        )
+        batches = iter_prefetched(
+            functools.partial(
+                produce, dataset_name, owner_username, page_size, request_kwargs
+            ),
+            PREFETCH_CHUNKS,
         )
-        return http_response.json()
+        return parse_batches(batches)
 
+    def _read_dataset_pages(
+        self,
+        dataset_name: str,
+        owner_username: Optional[str],
+        page_size: int,
+        request_kwargs: Optional[Mapping],
+        put: Callable[[List[bytes]], bool],
+    ) -> None:
+        def open_page(offset: int) -> requests.Response:
+            pathname = self._export_pathname(
+                dataset_name, owner_username, offset, page_size
+            )
+            return self.request("GET", pathname, request_kwargs, stream=True)
+
+        with ThreadPoolExecutor(PREFETCH_PAGES, "invariant-export-fetch") as fetcher:
+            upcoming = collections.deque(
+                fetcher.submit(open_page, page * page_size)
+                for page in range(PREFETCH_PAGES)
+            )
+            requested = PREFETCH_PAGES
+            try:
+                while True:
+                    response = upcoming.popleft().result()
+                    upcoming.append(fetcher.submit(open_page, requested * page_size))
+                    requested += 1
+                    count = 0
+                    try:
+                        for lines in line_batches(
+                            response.iter_content(READ_CHUNK_BYTES)
+                        ):
+                            count += len(lines)
+                            if not put(lines):
+                                return
+                    except requests.RequestException as e:
+                        raise InvariantError(
+                            "Connection error when reading the traces of "
+                            f"{dataset_name}."
+                        ) from e
+                    finally:
+                        response.close()
+                    if count < page_size:
+                        return
+            finally:
+                for future in upcoming:
+                    future.add_done_callback(_close_response)
+
+    def _read_dataset_pages_on_engine(
+        self,
+        dataset_name: str,
+        owner_username: Optional[str],
+        page_size: int,
+        request_kwargs: Optional[Mapping],
+        put: Callable[[List[bytes]], bool],
+    ) -> None:
+        # pylint: disable-next=protected-access
+        batches = self._async_client._dataset_line_batches(
+            dataset_name, owner_username, page_size, request_kwargs
+        )
+        try:
+            while True:
+                try:
+                    lines = self._engine.run(anext(batches))
+                except StopAsyncIteration:
+                    return
+                if not put(lines):
+                    return
+        finally:
+            self._engine.run(batches.aclose())
+
+    @profiling.profiled
+    def upload_jsonl_file(
+        self,
+        path: str,
+        dataset_name: str,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> Dict:
+        """
+        Upload a JSONL file of traces as a new dataset, without parsing it.
+
+        The file must be in the format of Explorer's file uploads (see
+        `JsonlFile`). It is memory-mapped, each line's structure is checked, and
+        its bytes are sent as they are, as with an upload in the browser: no
+        Python objects are created for the traces. The trace store, dedup index
+        and payload policy apply to `push_trace` only.
+
+        Args:
+            path (str): The path of the JSONL file.
+            dataset_name (str): The name of the dataset to create.
+            request_kwargs (Optional[Mapping]): Additional keyword arguments to pass to
+                                      the requests method.
+
+        Returns:
+            Dict: The created dataset, as returned by the API.
+
+        Raises:
+            ValueError: If the dataset name is invalid or a line of the file is not
+                        a trace.
+        """
+        if self._async_client is not None:
+            return self._engine.run(
+                self._async_client.upload_jsonl_file(path, dataset_name, request_kwargs)
+            )
+        with JsonlFile(path) as file:
+            http_response = self.request(
+                method="POST",
+                pathname=DATASET_UPLOAD_API_PATH,
+                request_kwargs=self._prepare_upload_request(
+                    dataset_name, file, "data", request_kwargs
+                ),
+            )
+        with profiling.phase("deserialization"):
+            return http_response.json()
+
+    @profiling.profiled
     def update_dataset_metadata(
         self,
         request: UpdateDatasetMetadataRequest,
         request_kwargs: Optional[Mapping] = None,
-    ) -> Dict:
+    ) -> Optional[Dict]:
         """
         Update the metadata for a dataset.
 
+        If the client was created with `metadata_coalesce_window_ms`, the update is
+        buffered and merged with the other updates for the same dataset. One PUT
+        is sent per dataset at the end of the window, or on `flush_dataset_metadata`.
+
         Args:
             request (UpdateDatasetMetadataRequest): The request object containing the dataset name,
                                                     and metadata to update.
@@ -206,8 +775,74 @@ class Client(BaseClient):
                                                 the requests method.
 
         Returns:
-            Dict: The response from the API.
+            Optional[Dict]: The response from the API, or None if the update was
+                            buffered.
+        """
+        if self._metadata_coalescer is not None:
+            if self._metadata_coalescer.add(request, request_kwargs):
+                self._track_queue_depth("metadata_updates", 1)
+                self._schedule_metadata_flush(request.dataset_name)
+            return None
+        return self._send_dataset_metadata_update(request, request_kwargs)
+
+    @profiling.profiled
+    def flush_dataset_metadata(
+        self, dataset_name: Optional[str] = None
+    ) -> Dict[str, Dict]:
         """
+        Send the buffered metadata updates right away.
+
+        Args:
+            dataset_name (Optional[str]): The dataset to flush. If None, all datasets
+                                          with buffered updates are flushed.
+
+        Returns:
+            Dict[str, Dict]: The API response for each flushed dataset.
+
+        Raises:
+            InvariantError: If an update fails to send. After a transient error,
+                            e.g. a timeout, the update is put back to be sent at
+                            the end of a new window; otherwise it is dropped.
+                            The updates not sent yet are put back.
+        """
+        if self._metadata_coalescer is None:
+            return {}
+        # Taken under the coalescer's lock and sent outside of it, so that a slow
+        # update does not hold up the other flushes.
+        updates = self._take_metadata_updates(dataset_name)
+        responses = {}
+        for position, (request, request_kwargs) in enumerate(updates):
+            try:
+                response = self._send_dataset_metadata_update(request, request_kwargs)
+            except InvariantError as e:
+                for name in self._requeue_metadata_updates(updates[position:], e):
+                    self._schedule_metadata_flush(name)
+                raise
+            responses[request.dataset_name] = response
+        return responses
+
+    def _schedule_metadata_flush(self, dataset_name: str) -> None:
+        timer = threading.Timer(
+            self._metadata_coalescer.window_s,
+            self._flush_metadata_in_background,
+            args=(dataset_name,),
+        )
+        timer.daemon = True
+        self._metadata_coalescer.set_handle(dataset_name, timer)
+        timer.start()
+
+    def _flush_metadata_in_background(self, dataset_name: str) -> None:
+        try:
+            self.flush_dataset_metadata(dataset_name)
+        except InvariantError:
+            # Counted in the metrics, and requeued if sending again may help.
+            pass
+
+    def _send_dataset_metadata_update(
+        self,
+        request: UpdateDatasetMetadataRequest,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> Dict:
         request_kwargs = self._prepare_update_dataset_metadata_request(
             request, request_kwargs
         )
@@ -216,15 +851,18 @@ class Client(BaseClient):
             pathname=f"{DATASET_METADATA_API_PATH}/{request.dataset_name}",
             request_kwargs=request_kwargs,
         )
-        return http_response.json()
+        self._invalidate_dataset_metadata(request.dataset_name)
+        with profiling.phase("deserialization"):
+            return http_response.json()
 
+    @profiling.profiled
     def create_request_and_update_dataset_metadata(
         self,
         dataset_name: str,
         replace_all: bool = False,
         metadata: Optional[Dict] = None,
         request_kwargs: Optional[Mapping] = None,
-    ) -> Dict:
+    ) -> Optional[Dict]:
         """
         Update the metadata for a dataset.
 
@@ -236,16 +874,19 @@ class Client(BaseClient):
                                                 the requests method.
 
         Returns:
-            Dict: The response from the API.
+            Optional[Dict]: The response from the API, or None if the update was
+                            buffered.
         """
         metadata = metadata or {}
-        request = UpdateDatasetMetadataRequest(
-            dataset_name=dataset_name,
-            replace_all=replace_all,
-            metadata=MetadataUpdate(**metadata),
-        )
+        with profiling.phase("validation"):
+            request = UpdateDatasetMetadataRequest(
+                dataset_name=dataset_name,
+                replace_all=replace_all,
+                metadata=MetadataUpdate(**metadata),
+            )
         return self.update_dataset_metadata(request, request_kwargs)
 
+    @profiling.profiled
     def append_messages(
         self,
         request: AppendMessagesRequest,
@@ -263,14 +904,17 @@ class Client(BaseClient):
         Returns:
             Dict: The response from the API.
         """
+        request = self._apply_payload_policy(request)
         request_kwargs = self._prepare_append_messages_request(request, request_kwargs)
         http_response = self.request(
             method="POST",
             pathname=f"{TRACE_API_PATH}/{request.trace_id}/messages",
             request_kwargs=request_kwargs,
         )
-        return http_response.json()
+        with profiling.phase("deserialization"):
+            return http_response.json()
 
+    @profiling.profiled
     def create_request_and_append_messages(
         self,
         messages: List[Dict],
@@ -291,11 +935,163 @@ class Client(BaseClient):
         Returns:
             Dict: The response from the API.
         """
-        request = AppendMessagesRequest(
-            trace_id=trace_id,
-            messages=messages,
-            annotations=(
-                AnnotationCreate.from_dicts(annotations) if annotations else None
-            ),
-        )
+        with profiling.phase("validation"):
+            request = AppendMessagesRequest(
+                trace_id=trace_id,
+                messages=messages,
+                annotations=(
+                    AnnotationCreate.from_dicts(annotations) if annotations else None
+                ),
+            )
         return self.append_messages(request, request_kwargs)
+
+    def submit(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> "Future[T]":
+        """
+        Run `fn(*args, **kwargs)` on the client's thread pool.
+
+        The pool has `max_workers` threads sharing the client's session and is
+        started on first use.
+
+        Args:
+            fn (Callable[..., T]): The function to run, usually a method of this client.
+            *args: Positional arguments for `fn`.
+            **kwargs: Keyword arguments for `fn`.
+
+        Returns:
+            Future[T]: A future for the result. Errors raised by `fn` are raised by
+                       `Future.result()`.
+
+        Raises:
+            InvariantUserError: If the client has been shut down.
+        """
+        with self._executor_lock:
+            if self._shut_down:
+                raise InvariantUserError("Cannot submit requests after shutdown.")
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="invariant-sdk"
+                )
+            future = self._executor.submit(fn, *args, **kwargs)
+            self._pending_futures.add(future)
+        self._track_queue_depth("submitted", 1)
+        future.add_done_callback(self._forget_future)
+        return future
+
+    def _forget_future(self, future: Future) -> None:
+        with self._executor_lock:
+            self._pending_futures.discard(future)
+        self._track_queue_depth("submitted", -1)
+
+    def push_trace_async(
+        self,
+        request: PushTracesRequest,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> "Future[PushTracesResponse]":
+        """
+        Push trace data without blocking. See `push_trace` and `submit`.
+
+        The traces are sampled before they are queued, so that the traces dropped,
+        e.g. by a `LoadShedder` while the queue grows, are never held in it.
+
+        Returns:
+            Future[PushTracesResponse]: A future for the response object.
+        """
+        kept = self._sample(
+            request.messages, request.annotations, request.metadata, request.dataset
+        )
+        total = len(request.messages)
+        if kept is not None:
+            if not kept:
+                future: "Future[PushTracesResponse]" = Future()
+                future.set_result(
+                    self._sampled_response(kept, total, None, request.dataset)
+                )
+                return future
+            request = select_traces(request, kept)
+        traces = len(request.messages)
+        self._track_backlog(traces)
+        try:
+            return self.submit(
+                self._push_queued_trace, request, request_kwargs, kept, total
+            )
+        except BaseException:
+            self._track_backlog(-traces)
+            raise
+
+    @profiling.profiled
+    def _push_queued_trace(
+        self,
+        request: PushTracesRequest,
+        request_kwargs: Optional[Mapping],
+        kept: Optional[List[int]],
+        total: int,
+    ) -> PushTracesResponse:
+        response = self._push_trace(request, request_kwargs, queued=True)
+        if kept is None:
+            return response
+        return self._sampled_response(kept, total, response, request.dataset)
+
+    def append_messages_async(
+        self,
+        request: AppendMessagesRequest,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> "Future[Dict]":
+        """
+        Append messages to an existing trace without blocking. See `append_messages`
+        and `submit`.
+
+        Returns:
+            Future[Dict]: A future for the response from the API.
+        """
+        return self.submit(self.append_messages, request, request_kwargs)
+
+    def update_dataset_metadata_async(
+        self,
+        request: UpdateDatasetMetadataRequest,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> "Future[Optional[Dict]]":
+        """
+        Update the metadata for a dataset without blocking. See
+        `update_dataset_metadata` and `submit`.
+
+        Returns:
+            Future[Optional[Dict]]: A future for the response from the API.
+        """
+        return self.submit(self.update_dataset_metadata, request, request_kwargs)
+
+    def shutdown(self, timeout: Optional[float] = None) -> bool:
+        """
+        Stop accepting new work and wait for the submitted work to finish.
+
+        The buffered metadata updates are then sent and the session is closed.
+
+        Args:
+            timeout (Optional[float]): The maximum number of seconds to wait. Work that
+                                       has not started by then is cancelled; requests
+                                       already being sent are bounded by `timeout_ms`.
+                                       None waits for everything.
+
+        Returns:
+            bool: True if all submitted work finished within the timeout and the
+                  buffered metadata updates were sent.
+        """
+        with self._executor_lock:
+            self._shut_down = True
+            executor, pending = self._executor, set(self._pending_futures)
+        finished = True
+        if executor is not None:
+            _, not_done = wait_for_futures(pending, timeout=timeout)
+            for future in not_done:
+                future.cancel()
+            executor.shutdown(wait=True)
+            finished = not not_done
+        if self._metadata_exit_hook is not None:
+            self._metadata_exit_hook.cancel()
+            self._metadata_exit_hook = None
+        try:
+            self.flush_dataset_metadata()
+        except InvariantError:
+            finished = False
+        if self.session is not None:
+            self.session.close()
+        return finished
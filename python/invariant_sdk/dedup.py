@@ -0,0 +1,321 @@
+"""Deduplication of repeated trace uploads by content hash."""
+
+import hashlib
+import json
+import math
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from invariant_sdk import fork_safety
+from invariant_sdk.types.annotations import AnnotationCreate
+from invariant_sdk.types.push_traces import PushTracesRequest, PushTracesResponse
+
+_LOOKUP_CHUNK = 500
+
+
+def trace_hash(
+    messages: List[Dict],
+    annotations: Optional[List[Dict]] = None,
+    metadata: Optional[Dict] = None,
+    dataset: Optional[str] = None,
+) -> bytes:
+    """
+    Hash a trace by the canonical JSON of its content.
+
+    Keys are sorted and whitespace dropped, so traces that are equal as JSON hash
+    the same. The dataset is part of the hash: pushing a trace to another
+    dataset is not a repeat.
+
+    Returns:
+        bytes: The SHA-256 digest.
+    """
+    canonical = json.dumps(
+        [dataset, messages, annotations or [], metadata or {}],
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode()).digest()
+
+
+def request_hashes(request: PushTracesRequest) -> List[bytes]:
+    """Return the hash of every trace of a push request."""
+    annotations = (
+        AnnotationCreate.bulk_to_nested_dicts(request.annotations)
+        if request.annotations is not None
+        else None
+    )
+    return [
+        trace_hash(
+            messages,
+            annotations[index] if annotations is not None else None,
+            request.metadata[index] if request.metadata is not None else None,
+            request.dataset,
+        )
+        for index, messages in enumerate(request.messages)
+    ]
+
+
+class BloomFilter:
+    """
+    A Bloom filter over SHA-256 digests.
+
+    The bit positions are derived from the digest itself by double hashing, so
+    adding and testing a key hashes nothing again.
+
+    Args:
+        capacity: the number of keys the filter is sized for.
+        error_rate: the false positive rate at `capacity` keys.
+    """
+
+    __slots__ = ["num_bits", "num_hashes", "_bits"]
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.001) -> None:
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError("Expected capacity > 0 and 0 < error_rate < 1")
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def add(self, digest: bytes) -> None:
+        """Add a key."""
+        bits, num_bits = self._bits, self.num_bits
+        position = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:16], "little") | 1
+        for _ in range(self.num_hashes):
+            position %= num_bits
+            bits[position >> 3] |= 1 << (position & 7)
+            position += step
+
+    def __contains__(self, digest: bytes) -> bool:
+        bits, num_bits = self._bits, self.num_bits
+        position = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:16], "little") | 1
+        for _ in range(self.num_hashes):
+            position %= num_bits
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+            position += step
+        return True
+
+    def to_bytes(self) -> bytes:
+        """The bit array, to restore the filter with `load`."""
+        return bytes(self._bits)
+
+    def load(self, data: bytes) -> None:
+        """Restore the bits of a filter of the same size."""
+        if len(data) != len(self._bits):
+            raise ValueError("The data is not from a filter of this size")
+        self._bits[:] = data
+
+
+class DedupIndex:
+    """
+    A persistent index from trace hashes to the ids the server returned for them.
+
+    The index is a SQLite table in `path` (":memory:" for a throwaway one) in WAL
+    mode, fronted by an in-memory Bloom filter. Most traces that were never
+    pushed are ruled out by the filter alone; only the rest are looked up in
+    SQLite. The filter is saved to the database by `close` and restored on open
+    if it still covers the whole table, and rebuilt from the table otherwise.
+
+    Pass it to a client with `Client(dedup_index=DedupIndex("pushed.db"))`: traces
+    already in the index are then not pushed again and their earlier ids are
+    returned instead. The index can be shared between clients and threads, but
+    not between processes writing at the same time.
+
+    Args:
+        path: the SQLite database file.
+        capacity: the number of traces the Bloom filter is sized for. Beyond it,
+                  more lookups reach SQLite, but the results stay correct.
+        error_rate: the Bloom filter's false positive rate at `capacity`.
+    """
+
+    __slots__ = ["path", "_connection", "_filter", "_lock", "__weakref__"]
+
+    def __init__(
+        self, path: str, capacity: int = 1_000_000, error_rate: float = 0.001
+    ) -> None:
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS pushed_traces ("
+            " hash BLOB PRIMARY KEY,"
+            " trace_id TEXT NOT NULL,"
+            " dataset TEXT,"
+            " pushed_at REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS bloom_filter ("
+            " id INTEGER PRIMARY KEY CHECK (id = 0),"
+            " num_bits INTEGER NOT NULL,"
+            " num_hashes INTEGER NOT NULL,"
+            " entries INTEGER NOT NULL,"
+            " bits BLOB NOT NULL"
+            ")"
+        )
+        self._connection.commit()
+        self._filter = BloomFilter(capacity, error_rate)
+        self._lock = threading.Lock()
+        self._load_filter()
+        fork_safety.register(self)
+
+    def _after_fork_in_child(self) -> None:
+        # A SQLite connection must not be used across a fork, unless the database
+        # is in memory, and so copied.
+        self._lock = threading.Lock()
+        if self.path not in ("", ":memory:"):
+            fork_safety.abandon(self._connection)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+
+    def _load_filter(self) -> None:
+        saved = self._connection.execute(
+            "SELECT num_bits, num_hashes, entries, bits FROM bloom_filter"
+        ).fetchone()
+        if saved is not None and saved[:3] == (
+            self._filter.num_bits,
+            self._filter.num_hashes,
+            self._count(),
+        ):
+            self._filter.load(saved[3])
+            return
+        for (digest,) in self._connection.execute("SELECT hash FROM pushed_traces"):
+            self._filter.add(digest)
+
+    def lookup(self, hashes: Sequence[bytes]) -> Dict[bytes, str]:
+        """Return the trace ids of those hashes that are in the index."""
+        candidates = [digest for digest in hashes if digest in self._filter]
+        found: Dict[bytes, str] = {}
+        if not candidates:
+            return found
+        with self._lock:
+            for start in range(0, len(candidates), _LOOKUP_CHUNK):
+                chunk = candidates[start : start + _LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(
+                    self._connection.execute(
+                        "SELECT hash, trace_id FROM pushed_traces"
+                        f" WHERE hash IN ({placeholders})",
+                        chunk,
+                    )
+                )
+        return found
+
+    def record(
+        self, hashes: Sequence[bytes], trace_ids: Sequence[str], dataset: Optional[str]
+    ) -> None:
+        """Add pushed traces and the ids the server returned for them."""
+        now = time.time()
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO pushed_traces VALUES (?, ?, ?, ?)",
+                    [
+                        (digest, trace_id, dataset, now)
+                        for digest, trace_id in zip(hashes, trace_ids)
+                    ],
+                )
+            for digest in hashes:
+                self._filter.add(digest)
+
+    def plan(self, request: PushTracesRequest) -> "PushPlan":
+        """Work out which traces of a push request still need to be sent."""
+        return PushPlan(self, request)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._count()
+
+    def _count(self) -> int:
+        return self._connection.execute(
+            "SELECT COUNT(*) FROM pushed_traces"
+        ).fetchone()[0]
+
+    def close(self) -> None:
+        """Save the Bloom filter and close the database."""
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO bloom_filter VALUES (0, ?, ?, ?, ?)",
+                    (
+                        self._filter.num_bits,
+                        self._filter.num_hashes,
+                        self._count(),
+                        self._filter.to_bytes(),
+                    ),
+                )
+            self._connection.close()
+
+
+class PushPlan:
+    """
+    The part of a push request that is not in a `DedupIndex` yet.
+
+    `request` holds the traces to send: those not in the index, each distinct
+    trace once. It is None if there is nothing to send. `complete` records what
+    was sent and returns the response for the whole original request.
+    """
+
+    __slots__ = ["index", "original", "request", "hashes", "known", "sent"]
+
+    def __init__(self, index: DedupIndex, request: PushTracesRequest) -> None:
+        self.index = index
+        self.original = request
+        self.hashes = request_hashes(request)
+        self.known = index.lookup(self.hashes)
+        first: Dict[bytes, int] = {}
+        for position, digest in enumerate(self.hashes):
+            if digest not in self.known and digest not in first:
+                first[digest] = position
+        self.sent = list(first.values())
+        if not self.sent:
+            self.request: Optional[PushTracesRequest] = None
+        elif len(self.sent) == len(self.hashes):
+            self.request = request
+        else:
+            self.request = select_traces(request, self.sent)
+
+    @property
+    def skipped(self) -> int:
+        """The number of traces of the original request that are not sent."""
+        return len(self.hashes) - len(self.sent)
+
+    def complete(self, response: Optional[PushTracesResponse]) -> PushTracesResponse:
+        """Record the response to `request` and return one for the original request."""
+        ids = dict(self.known)
+        if response is not None:
+            sent_hashes = [self.hashes[position] for position in self.sent]
+            self.index.record(sent_hashes, response.id, self.original.dataset)
+            ids.update(zip(sent_hashes, response.id))
+        return PushTracesResponse(
+            id=[ids[digest] for digest in self.hashes],
+            dataset=response.dataset if response is not None else self.original.dataset,
+            username=response.username if response is not None else None,
+        )
+
+
+def select_traces(
+    request: PushTracesRequest, indices: Sequence[int]
+) -> PushTracesRequest:
+    """Return the given traces of a push request, without validating them again."""
+    fields: Dict[str, Any] = {
+        "messages": [request.messages[index] for index in indices],
+        "annotations": (
+            [request.annotations[index] for index in indices]
+            if request.annotations is not None
+            else None
+        ),
+        "dataset": request.dataset,
+        "metadata": (
+            [request.metadata[index] for index in indices]
+            if request.metadata is not None
+            else None
+        ),
+    }
+    return PushTracesRequest.model_construct(**fields)
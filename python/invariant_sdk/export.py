@@ -0,0 +1,185 @@
+"""Prefetching iterators for reading traces back from Explorer, page by page."""
+
+import asyncio
+import json
+import queue
+import threading
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+)
+
+DEFAULT_EXPORT_PAGE_SIZE = 1_000
+# Pages are requested this many at a time: the pages after the current one are
+# already on their way while it is read. Reading stops at the first short page,
+# so up to this many requests past the end of the dataset come back empty.
+PREFETCH_PAGES = 4
+# Responses are read in chunks of this size, and at most this many chunks are
+# buffered ahead of the caller.
+READ_CHUNK_BYTES = 64 * 1024
+PREFETCH_CHUNKS = 32
+
+# Producers hand items to the consumer through a bounded queue and stop once the
+# consumer is gone. These mark the end of the items, or an error to raise.
+_DONE = object()
+
+
+class _Failure:
+    __slots__ = ["error"]
+
+    def __init__(self, error: BaseException) -> None:
+        self.error = error
+
+
+def iter_prefetched(
+    produce: Callable[[Callable[[Any], bool]], None],
+    capacity: int,
+    name: str = "invariant-export",
+) -> Iterator[Any]:
+    """
+    Iterate over the items a producer thread puts, while it keeps producing.
+
+    `produce(put)` runs on a new thread and calls `put(item)` for every item. The
+    queue between them holds at most `capacity` items, so the producer runs ahead
+    of the consumer by at most that many. `put` returns False once the consumer
+    has stopped iterating, and the producer should then return. An exception of
+    the producer is raised to the consumer after the items before it.
+    """
+    items: "queue.Queue[Any]" = queue.Queue(maxsize=capacity)
+    stopped = threading.Event()
+
+    def put(item: Any) -> bool:
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run() -> None:
+        try:
+            produce(put)
+        except BaseException as e:  # pylint: disable=broad-except
+            put(_Failure(e))
+        else:
+            put(_DONE)
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+
+
+async def aiter_prefetched(
+    produce: Callable[[Callable[[Any], Awaitable[None]]], Awaitable[None]],
+    capacity: int,
+) -> AsyncIterator[Any]:
+    """
+    Iterate over the items a producer task puts, while it keeps producing.
+
+    The async counterpart of `iter_prefetched`: `produce(put)` runs as a task and
+    awaits `put(item)`, which waits while `capacity` items are queued. The task
+    is cancelled when the consumer stops iterating.
+    """
+    items: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=capacity)
+
+    async def run() -> None:
+        try:
+            await produce(items.put)
+        except Exception as e:  # pylint: disable=broad-except
+            await items.put(_Failure(e))
+        else:
+            await items.put(_DONE)
+
+    task = asyncio.ensure_future(run())
+    try:
+        while True:
+            item = await items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+def line_batches(chunks: Iterable[bytes]) -> Iterator[List[bytes]]:
+    """Split a stream of chunks into the non-empty lines each chunk completes."""
+    partial: List[bytes] = []
+    for chunk in chunks:
+        lines = _complete_lines(partial, chunk)
+        if lines:
+            yield lines
+    last = b"".join(partial)
+    if last.strip():
+        yield [last]
+
+
+async def aline_batches(chunks: AsyncIterable[bytes]) -> AsyncIterator[List[bytes]]:
+    """The async counterpart of `line_batches`."""
+    partial: List[bytes] = []
+    async for chunk in chunks:
+        lines = _complete_lines(partial, chunk)
+        if lines:
+            yield lines
+    last = b"".join(partial)
+    if last.strip():
+        yield [last]
+
+
+def _complete_lines(partial: List[bytes], chunk: bytes) -> List[bytes]:
+    # A line longer than a chunk is collected in `partial` until its end arrives,
+    # so that it is joined once.
+    end = chunk.rfind(b"\n")
+    if end == -1:
+        partial.append(chunk)
+        return []
+    lines = chunk[:end].split(b"\n")
+    if partial:
+        partial.append(lines[0])
+        lines[0] = b"".join(partial)
+        partial.clear()
+    if end + 1 < len(chunk):
+        partial.append(chunk[end + 1 :])
+    return [line for line in lines if line.strip()]
+
+
+def parse_batches(batches: Iterator[List[bytes]]) -> Iterator[Dict]:
+    """Parse batches of JSON lines, closing the batches when stopped early."""
+    try:
+        for batch in batches:
+            for line in batch:
+                yield json.loads(line)
+    finally:
+        batches.close()
+
+
+async def aparse_batches(batches: AsyncIterator[List[bytes]]) -> AsyncIterator[Dict]:
+    """The async counterpart of `parse_batches`."""
+    try:
+        async for batch in batches:
+            for line in batch:
+                yield json.loads(line)
+    finally:
+        await batches.aclose()
@@ -0,0 +1,509 @@
+"""Background export of traces from a buffer bounded in bytes."""
+
+import collections
+import json
+import tempfile
+import threading
+import time
+from typing import IO, Any, Deque, Dict, List, Optional, Tuple
+
+from invariant_sdk import fork_safety
+from invariant_sdk.base_client import is_transient_error
+from invariant_sdk.batching import trace_sizes
+from invariant_sdk.client import Client
+from invariant_sdk.types.annotations import AnnotationCreate
+from invariant_sdk.types.exceptions import (
+    InvariantAPIBusyError,
+    InvariantError,
+    InvariantUserError,
+)
+from invariant_sdk.types.push_traces import PushTracesRequest
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+SPILL = "spill"
+
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, SPILL)
+
+# Reasons of the traces dropped, in `invariant_sdk_dropped_traces_total`.
+BUFFER_FULL = "buffer_full"
+EVICTED = "evicted"
+SPILL_FULL = "spill_full"
+REJECTED = "rejected"
+SHUTDOWN = "shutdown"
+
+# A buffered push request and its approximate encoded size in bytes.
+_Entry = Tuple[PushTracesRequest, int]
+
+
+class BufferedExporter:
+    """
+    Pushes traces from a background thread, buffering at most `max_buffer_bytes`.
+
+    `export` returns as soon as the traces are buffered; a worker thread pushes
+    them in order with the client, merging consecutive requests to the same
+    dataset into pushes of up to `max_batch_bytes`. Pushes that fail with a
+    server error (500), a timeout, a connection error or a request to back off
+    (429, 503) are retried with exponential backoff (or after the server's
+    Retry-After) until they succeed, so the buffer fills up while Explorer is
+    unreachable. Pushes that fail otherwise, e.g. the server rejects them (4xx),
+    are dropped.
+
+    The buffer is accounted in the approximate encoded size of the traces, the
+    JSON size of their messages, annotations and metadata, since trace sizes vary
+    by orders of magnitude. When a request does not fit, the `overflow` policy
+    applies:
+
+    - "block": `export` waits up to `block_timeout_s` for room, then drops it;
+    - "drop_oldest": the oldest buffered requests, a push waiting to be retried
+      first, are dropped to make room, or the request if a push being sent
+      leaves none;
+    - "drop_newest": the request is dropped;
+    - "spill": the request is appended to a temporary file in `spill_dir`, as
+      are all requests after it until the file has been read back, which
+      happens as the buffer empties. Beyond `max_spill_bytes` on disk, requests
+      are dropped.
+
+    A request larger than the buffer is still taken when the buffer is empty.
+    Dropped traces are counted in `invariant_sdk_dropped_traces_total`, and the
+    bytes buffered in memory and on disk in `invariant_sdk_queue_depth`, with
+    the queues "exporter_bytes" and "exporter_spilled_bytes", if the client has
+    `metrics`. The client's `sampling_policy` applies when the traces are
+    exported, before they are buffered, and the buffered traces count towards
+    the backlog of its `LoadShedder`.
+
+    Usage:
+        with BufferedExporter(client, overflow="spill") as exporter:
+            exporter.export(PushTracesRequest(messages=[messages], dataset="agent"))
+
+    Args:
+        client: the client to push with.
+        max_buffer_bytes: the high-water mark of the buffer in memory.
+        overflow: what to do with a request that does not fit, see above.
+        block_timeout_s: how long `export` waits for room with "block".
+        spill_dir: the directory of the spill file, or None for the system's
+                   temporary directory.
+        max_spill_bytes: the most bytes to spill to disk.
+        max_batch_bytes: the most bytes of traces to merge into one push.
+        max_retry_backoff_s: the longest wait between two attempts of a push.
+        shutdown_timeout_s: how long to keep pushing at exit.
+    """
+
+    __slots__ = [
+        "client",
+        "max_buffer_bytes",
+        "overflow",
+        "block_timeout_s",
+        "spill_dir",
+        "max_spill_bytes",
+        "max_batch_bytes",
+        "max_retry_backoff_s",
+        "shutdown_timeout_s",
+        "_queue",
+        "_buffered_bytes",
+        "_spill",
+        "_spill_read_offset",
+        "_spill_write_offset",
+        "_spilled_traces",
+        "_in_flight",
+        "_in_flight_bytes",
+        "_retrying",
+        "_condition",
+        "_stopping",
+        "_closed",
+        "_thread",
+        "__weakref__",
+    ]
+
+    def __init__(
+        self,
+        client: Client,
+        max_buffer_bytes: int = 64 * 1024 * 1024,
+        overflow: str = BLOCK,
+        block_timeout_s: float = 1.0,
+        spill_dir: Optional[str] = None,
+        max_spill_bytes: int = 1024 * 1024 * 1024,
+        max_batch_bytes: int = 1024 * 1024,
+        max_retry_backoff_s: float = 30.0,
+        shutdown_timeout_s: float = 5.0,
+    ) -> None:
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unknown overflow policy {overflow!r}, expected one of "
+                f"{', '.join(OVERFLOW_POLICIES)}"
+            )
+        if max_buffer_bytes <= 0 or max_batch_bytes <= 0:
+            raise ValueError("max_buffer_bytes and max_batch_bytes must be positive")
+        self.client = client
+        self.max_buffer_bytes = max_buffer_bytes
+        self.overflow = overflow
+        self.block_timeout_s = block_timeout_s
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.max_batch_bytes = max_batch_bytes
+        self.max_retry_backoff_s = max_retry_backoff_s
+        self.shutdown_timeout_s = shutdown_timeout_s
+        self._queue: Deque[_Entry] = collections.deque()
+        # The bytes of the queued requests and of the push in flight.
+        self._buffered_bytes = 0
+        self._spill: Optional[IO[bytes]] = None
+        self._spill_read_offset = 0
+        self._spill_write_offset = 0
+        self._spilled_traces = 0
+        self._in_flight = 0
+        self._in_flight_bytes = 0
+        # Whether the push in flight failed and waits to be retried.
+        self._retrying = False
+        self._condition = threading.Condition()
+        self._stopping = threading.Event()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        fork_safety.register(self)
+
+    @property
+    def buffered_bytes(self) -> int:
+        """The approximate encoded size of the traces buffered in memory."""
+        return self._buffered_bytes
+
+    @property
+    def spilled_bytes(self) -> int:
+        """The size of the traces spilled to disk and not read back yet."""
+        return self._spill_write_offset - self._spill_read_offset
+
+    def export(self, request: PushTracesRequest) -> bool:
+        """
+        Buffer traces to push in the background.
+
+        Args:
+            request (PushTracesRequest): The traces to push.
+
+        Returns:
+            bool: Whether the traces were buffered, False if they were all
+                  dropped by the sampling policy or the overflow policy.
+
+        Raises:
+            InvariantUserError: If the exporter has been shut down.
+        """
+        sampled = self.client.sample_request(request)
+        if sampled is None:
+            return False
+        request = sampled
+        size = sum(trace_sizes(request))
+        traces = len(request.messages)
+        with self._condition:
+            if self._closed:
+                raise InvariantUserError("Cannot export traces after shutdown.")
+            self._start()
+            if self._spill is not None and self.spilled_bytes:
+                # Spilled requests are older than this one, which must follow them.
+                return self._spill_entry(request, size)
+            if not self._make_room(size):
+                if self.overflow == SPILL:
+                    return self._spill_entry(request, size)
+                self._count_dropped(traces, BUFFER_FULL)
+                return False
+            self._queue.append((request, size))
+            self._add_buffered(size, traces)
+            self._condition.notify_all()
+        return True
+
+    def start(self) -> None:
+        """
+        Start the background thread, if it is not running or shut down.
+
+        The first `export` starts it too. Starting it earlier registers its exit
+        hook earlier, and hooks run in reverse order: the exporter then pushes
+        what is left at exit after the hooks registered later, such as those of
+        a `ChatTracer` exporting its last traces.
+        """
+        with self._condition:
+            if not self._closed:
+                self._start()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every buffered trace has been pushed or dropped.
+
+        Args:
+            timeout (Optional[float]): The most seconds to wait, or None to wait
+                                       as long as it takes.
+
+        Returns:
+            bool: True if the buffer was emptied, False on timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(self._is_empty, timeout)
+
+    def shutdown(self, timeout: Optional[float] = None) -> bool:
+        """
+        Push the buffered traces for up to `timeout` seconds, then stop.
+
+        The traces still buffered after `timeout` are dropped and counted with
+        the reason "shutdown", as is a push still being sent, which is left to
+        finish on the background thread. Traces cannot be exported afterwards.
+
+        Args:
+            timeout (Optional[float]): The most seconds to keep pushing, or None
+                                       to wait as long as it takes.
+
+        Returns:
+            bool: True if every trace was pushed or dropped before stopping.
+        """
+        with self._condition:
+            if self._closed:
+                return self._is_empty()
+            self._closed = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        flushed = self.flush(timeout)
+        self._stopping.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(
+                None if deadline is None else max(deadline - time.monotonic(), 0)
+            )
+        with self._condition:
+            traces = sum(len(request.messages) for request, _ in self._queue)
+            # A push still being sent is abandoned to the daemon thread.
+            in_flight = self._in_flight
+            self._count_dropped(in_flight + traces + self._spilled_traces, SHUTDOWN)
+            backlog = traces + (in_flight if self._retrying else 0)
+            self._add_buffered(-self._buffered_bytes, -backlog)
+            self._in_flight = self._in_flight_bytes = 0
+            self._queue.clear()
+            self._close_spill()
+        return flushed
+
+    def __enter__(self) -> "BufferedExporter":
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.shutdown(self.shutdown_timeout_s)
+
+    def _start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="invariant-sdk-exporter", daemon=True
+        )
+        self._thread.start()
+        fork_safety.at_exit(self.shutdown, self.shutdown_timeout_s)
+
+    def _after_fork_in_child(self) -> None:
+        """Start empty in a forked child: the parent pushes what it buffered."""
+        traces = self._in_flight + sum(
+            len(request.messages) for request, _ in self._queue
+        )
+        self._track(-traces, buffered_bytes=-self._buffered_bytes)
+        self._queue = collections.deque()
+        self._buffered_bytes = 0
+        self._in_flight = self._in_flight_bytes = 0
+        self._retrying = False
+        # Closing the inherited descriptor leaves the parent's spill file as it is.
+        self._close_spill()
+        self._condition = threading.Condition()
+        self._stopping = threading.Event()
+        # The worker is started again by the first export.
+        self._thread = None
+
+    def _is_empty(self) -> bool:
+        return not self._queue and not self.spilled_bytes and not self._in_flight
+
+    def _make_room(self, size: int) -> bool:
+        """Apply the overflow policy until `size` bytes fit, under the lock."""
+
+        def fits() -> bool:
+            return (
+                not self._buffered_bytes
+                or self._buffered_bytes + size <= self.max_buffer_bytes
+            )
+
+        if fits():
+            return True
+        if self.overflow == BLOCK:
+            return self._condition.wait_for(fits, self.block_timeout_s)
+        if self.overflow == DROP_OLDEST:
+            if self._retrying and self._in_flight:
+                # The push waiting to be retried holds the oldest requests.
+                traces = self._in_flight
+                self._add_buffered(-self._in_flight_bytes, -traces)
+                self._count_dropped(traces, EVICTED)
+                self._in_flight = self._in_flight_bytes = 0
+            while self._queue and not fits():
+                request, evicted = self._queue.popleft()
+                traces = len(request.messages)
+                self._add_buffered(-evicted, -traces)
+                self._count_dropped(traces, EVICTED)
+            # A push being sent cannot be evicted, and may leave no room.
+            return fits()
+        return False
+
+    def _spill_entry(self, request: PushTracesRequest, size: int) -> bool:
+        traces = len(request.messages)
+        line = json.dumps(request.to_json(), default=str).encode() + b"\n"
+        if self.spilled_bytes + len(line) > self.max_spill_bytes:
+            self._count_dropped(traces, SPILL_FULL)
+            return False
+        if self._spill is None:
+            # pylint: disable-next=consider-using-with
+            self._spill = tempfile.TemporaryFile(
+                prefix="invariant-sdk-spill-", dir=self.spill_dir
+            )
+        self._spill.seek(self._spill_write_offset)
+        self._spill.write(line)
+        self._spill_write_offset += len(line)
+        self._spilled_traces += traces
+        self._track(traces, spilled_bytes=len(line))
+        self._condition.notify_all()
+        return True
+
+    def _unspill(self) -> None:
+        """Read spilled requests back into the buffer while they fit, under the lock."""
+        spill = self._spill
+        assert spill is not None
+        spill.seek(self._spill_read_offset)
+        while self._spill_read_offset < self._spill_write_offset:
+            line = spill.readline()
+            fields = json.loads(line)
+            if fields.get("annotations") is not None:
+                fields["annotations"] = AnnotationCreate.from_nested_dicts(
+                    fields["annotations"]
+                )
+            request = PushTracesRequest.model_construct(**fields)
+            size = sum(trace_sizes(request))
+            traces = len(request.messages)
+            self._spill_read_offset += len(line)
+            self._spilled_traces -= traces
+            self._track(-traces, spilled_bytes=-len(line))
+            self._queue.append((request, size))
+            self._add_buffered(size, traces)
+            if self._buffered_bytes >= self.max_buffer_bytes:
+                break
+        if self._spill_read_offset == self._spill_write_offset:
+            spill.seek(0)
+            spill.truncate()
+            self._spill_read_offset = self._spill_write_offset = 0
+
+    def _take_batch(self) -> Tuple[PushTracesRequest, int]:
+        """Merge the oldest requests to one dataset into one, under the lock."""
+        requests: List[PushTracesRequest] = []
+        batch_bytes = 0
+        while self._queue:
+            request, size = self._queue[0]
+            if requests and (
+                request.dataset != requests[0].dataset
+                or batch_bytes + size > self.max_batch_bytes
+            ):
+                break
+            self._queue.popleft()
+            requests.append(request)
+            batch_bytes += size
+        return _merge_requests(requests), batch_bytes
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queue and not self.spilled_bytes:
+                    if self._stopping.is_set():
+                        return
+                    self._condition.wait()
+                if self._stopping.is_set():
+                    return
+                if not self._queue:
+                    self._unspill()
+                request, self._in_flight_bytes = self._take_batch()
+                self._in_flight = len(request.messages)
+            try:
+                self._push(request)
+            finally:
+                with self._condition:
+                    # Nothing is left to release if drop_oldest evicted the push.
+                    self._add_buffered(-self._in_flight_bytes, 0)
+                    self._in_flight = self._in_flight_bytes = 0
+                    self._condition.notify_all()
+
+    def _push(self, request: PushTracesRequest) -> None:
+        """Push until it succeeds, is rejected or the exporter stops."""
+        backoff_s = 0.1
+        traces = len(request.messages)
+        while True:
+            try:
+                self.client.push_queued_trace(request)
+                return
+            except InvariantError as e:
+                with self._condition:
+                    if not self._in_flight:
+                        # Abandoned by a shutdown that timed out, and counted.
+                        return
+                if not is_transient_error(e):
+                    self._count_dropped(traces, REJECTED)
+                    return
+                wait_s = backoff_s
+                if isinstance(e, InvariantAPIBusyError) and e.retry_after_s:
+                    wait_s = e.retry_after_s
+                backoff_s = min(backoff_s * 2, self.max_retry_backoff_s)
+            # Until it is pushed, the request is back in the backlog.
+            with self._condition:
+                self._track(traces)
+                self._retrying = True
+            stopping = self._stopping.wait(min(wait_s, self.max_retry_backoff_s))
+            with self._condition:
+                self._retrying = False
+                if not self._in_flight:
+                    # Evicted by drop_oldest, which took it out of the backlog.
+                    return
+                if stopping:
+                    self._track(-traces)
+                    self._count_dropped(traces, SHUTDOWN)
+                    return
+
+    def _add_buffered(self, size: int, traces: int) -> None:
+        self._buffered_bytes += size
+        self._track(traces, buffered_bytes=size)
+
+    def _track(
+        self, traces: int, buffered_bytes: int = 0, spilled_bytes: int = 0
+    ) -> None:
+        """Update the backlog of the client and the queue depth metrics."""
+        client = self.client
+        client.track_queued(traces, "exporter_bytes", buffered_bytes)
+        if spilled_bytes:
+            client.track_queued(
+                queue="exporter_spilled_bytes", queue_bytes=spilled_bytes
+            )
+
+    def _count_dropped(self, traces: int, reason: str) -> None:
+        if traces and self.client.metrics is not None:
+            self.client.metrics.dropped_traces.inc(traces, (reason,))
+
+    def _close_spill(self) -> None:
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+        if self._spilled_traces:
+            self._track(-self._spilled_traces, spilled_bytes=-self.spilled_bytes)
+        self._spill_read_offset = self._spill_write_offset = 0
+        self._spilled_traces = 0
+
+
+def _merge_requests(requests: List[PushTracesRequest]) -> PushTracesRequest:
+    """Return one request with the traces of requests to the same dataset."""
+    if len(requests) == 1:
+        return requests[0]
+    has_annotations = any(request.annotations is not None for request in requests)
+    has_metadata = any(request.metadata is not None for request in requests)
+    fields: Dict[str, Any] = {
+        "messages": [],
+        "annotations": [] if has_annotations else None,
+        "dataset": requests[0].dataset,
+        "metadata": [] if has_metadata else None,
+    }
+    for request in requests:
+        count = len(request.messages)
+        fields["messages"].extend(request.messages)
+        if has_annotations:
+            fields["annotations"].extend(request.annotations or [[]] * count)
+        if has_metadata:
+            fields["metadata"].extend(request.metadata or [{}] * count)
+    return PushTracesRequest.model_construct(**fields)
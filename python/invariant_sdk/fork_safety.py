@@ -0,0 +1,88 @@
+"""Reinitialization of the SDK's objects in processes forked after they were created.
+
+A child process starts with a copy of its parent's memory, including the
+sockets of connection pools, the state of background threads that do not run in
+it, locks those threads may have held, and buffers the parent will still flush.
+Objects that hold such state register here and reset it in every child of a
+fork, e.g. of a prefork server such as gunicorn or of `multiprocessing`.
+"""
+
+import atexit
+import os
+import traceback
+import weakref
+from typing import Any, Callable, List, Optional
+
+_OBJECTS: "weakref.WeakSet[Any]" = weakref.WeakSet()
+_ABANDONED: List[Any] = []
+
+
+def register(obj: Any) -> None:
+    """
+    Call `obj._after_fork_in_child()` in the child of every later fork.
+
+    The object is held weakly, so it is not kept alive by this registration.
+    """
+    _OBJECTS.add(obj)
+
+
+def at_exit(fn: Callable[..., Any], *args: Any, weak: bool = False) -> "ExitHook":
+    """
+    Like `atexit.register`, but only in this process, not in forked children.
+
+    Exit hooks are inherited by forked children along with the objects they
+    close or flush. Running them there would close the parent's connections or
+    flush its buffers a second time, so a child skips them and registers its own.
+
+    With `weak`, `fn` must be a bound method, and its object is held weakly: the
+    hook does nothing once the object is gone, rather than keep it alive until
+    exit. Call `cancel` on the returned hook to unregister it.
+    """
+    hook = ExitHook(fn, args, weak)
+    atexit.register(hook)
+    return hook
+
+
+class ExitHook:
+    """A function registered by `at_exit`."""
+
+    __slots__ = ["_pid", "_fn", "_method", "_args"]
+
+    def __init__(self, fn: Callable[..., Any], args: tuple, weak: bool) -> None:
+        self._pid = os.getpid()
+        self._fn: Optional[Callable[..., Any]] = None if weak else fn
+        self._method = weakref.WeakMethod(fn) if weak else None  # type: ignore
+        self._args = args
+
+    def __call__(self) -> None:
+        fn = self._fn if self._method is None else self._method()
+        if fn is not None and os.getpid() == self._pid:
+            fn(*self._args)
+
+    def cancel(self) -> None:
+        """Unregister the hook."""
+        atexit.unregister(self)
+
+
+def abandon(obj: Any) -> None:
+    """
+    Keep an object inherited from the parent alive, unused, in a forked child.
+
+    Finalizing some objects in the child acts on what they share with the
+    parent: closing a SQLite connection releases the locks of the process on
+    its database file, including those of the child's own new connection.
+    """
+    _ABANDONED.append(obj)
+
+
+def _after_fork_in_child() -> None:
+    for obj in list(_OBJECTS):
+        try:
+            obj._after_fork_in_child()  # pylint: disable=protected-access
+        except Exception:  # pylint: disable=broad-except
+            # One object failing to reset must not leave the others unreset.
+            traceback.print_exc()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,252 @@
+"""Callbacks observing every request the clients send to the Invariant API."""
+
+import time
+from typing import Any, Callable, Dict, Optional
+
+# The connection pool phases reported by httpcore's `trace` extension, with the
+# protocol prefix ("connection.", "http11.", "http2.") removed.
+_CONNECT_STARTED = "connect_tcp.started"
+_CONNECT_COMPLETE = "connect_tcp.complete"
+_TLS_STARTED = "start_tls.started"
+_TLS_COMPLETE = "start_tls.complete"
+_SEND_STARTED = "send_request_headers.started"
+_HEADERS_RECEIVED = "receive_response_headers.complete"
+
+
+class RequestTimings:
+    """
+    Where the time of one request went, in milliseconds.
+
+    Attributes:
+        queue_ms: waiting for a connection from the pool, up to the start of
+                  connecting or of sending the request.
+        connect_ms: DNS resolution and the TCP handshake, if a new connection was
+                    opened.
+        tls_ms: the TLS handshake, if a new connection was opened over HTTPS.
+        ttfb_ms: from sending the request until the response headers arrived.
+        total_ms: the whole request, including reading the response body.
+
+    Phases the HTTP library does not expose are None. The sync client (requests)
+    only reports `ttfb_ms` and `total_ms`, and its `ttfb_ms` includes connecting.
+    """
+
+    __slots__ = ["queue_ms", "connect_ms", "tls_ms", "ttfb_ms", "total_ms"]
+
+    def __init__(
+        self,
+        queue_ms: Optional[float] = None,
+        connect_ms: Optional[float] = None,
+        tls_ms: Optional[float] = None,
+        ttfb_ms: Optional[float] = None,
+        total_ms: Optional[float] = None,
+    ) -> None:
+        self.queue_ms = queue_ms
+        self.connect_ms = connect_ms
+        self.tls_ms = tls_ms
+        self.ttfb_ms = ttfb_ms
+        self.total_ms = total_ms
+
+    def to_json(self) -> Dict[str, Optional[float]]:
+        """Convert the timings to a JSON-serializable dictionary."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self) -> str:
+        phases = ", ".join(
+            f"{name}={value:.2f}"
+            for name, value in self.to_json().items()
+            if value is not None
+        )
+        return f"RequestTimings({phases})"
+
+
+class RequestRecord:
+    """
+    One attempt at an API request, passed to every hook.
+
+    `status`, `body_bytes`, `response_bytes` and `timings` are filled in once the
+    request has completed, so `on_request_start` sees them as None. `body_bytes` is
+    the size of the encoded request body as sent, `response_bytes` the size of the
+    response body. The clients do not retry, so `attempt` is always 1.
+    """
+
+    __slots__ = [
+        "method",
+        "path",
+        "attempt",
+        "status",
+        "body_bytes",
+        "response_bytes",
+        "timings",
+        "_started",
+        "_ttfb_ms",
+        "_marks",
+    ]
+
+    def __init__(self, method: str, path: str, attempt: int = 1) -> None:
+        self.method = method
+        self.path = path
+        self.attempt = attempt
+        self.status: Optional[int] = None
+        self.body_bytes: Optional[int] = None
+        self.response_bytes: Optional[int] = None
+        self.timings = RequestTimings()
+        self._started = time.perf_counter()
+        self._ttfb_ms: Optional[float] = None
+        self._marks: Dict[str, float] = {}
+
+    def received(
+        self, response: Any, ttfb_ms: Optional[float] = None, streamed: bool = False
+    ) -> None:
+        """
+        Record the status and sizes of a response from requests or httpx.
+
+        The size of a `streamed` response is not known yet and is left as None.
+        """
+        self.status = response.status_code
+        self.body_bytes = _body_size(response.request)
+        content = None if streamed else response.content
+        self.response_bytes = len(content) if isinstance(content, bytes) else None
+        self._ttfb_ms = ttfb_ms
+
+    async def trace(self, event_name: str, _: Dict) -> None:
+        """Timestamp connection phases; usable as httpx's `trace` extension."""
+        self._marks.setdefault(event_name.split(".", 1)[-1], time.perf_counter())
+
+    def _finish(self) -> None:
+        marks = self._marks
+        first_mark = marks.get(_CONNECT_STARTED, marks.get(_SEND_STARTED))
+        self.timings = RequestTimings(
+            queue_ms=_span_ms(self._started, first_mark),
+            connect_ms=_span_ms(
+                marks.get(_CONNECT_STARTED), marks.get(_CONNECT_COMPLETE)
+            ),
+            tls_ms=_span_ms(marks.get(_TLS_STARTED), marks.get(_TLS_COMPLETE)),
+            ttfb_ms=(
+                self._ttfb_ms
+                if self._ttfb_ms is not None
+                else _span_ms(marks.get(_SEND_STARTED), marks.get(_HEADERS_RECEIVED))
+            ),
+            total_ms=_span_ms(self._started, time.perf_counter()),
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"RequestRecord({self.method} {self.path}, attempt={self.attempt}, "
+            f"status={self.status}, body_bytes={self.body_bytes}, {self.timings!r})"
+        )
+
+
+RequestStartHook = Callable[[RequestRecord], None]
+RequestEndHook = Callable[[RequestRecord], None]
+RequestErrorHook = Callable[[RequestRecord, Exception], None]
+
+
+class RequestHooks:
+    """
+    Callbacks invoked around every request a client sends.
+
+    Args:
+        on_request_start: called with the `RequestRecord` before the request is sent.
+        on_request_end: called with the completed `RequestRecord` after a successful
+                        response.
+        on_error: called with the `RequestRecord` and the `InvariantError` about to
+                  be raised. HTTP errors carry their `status`.
+
+    Hooks run on the thread (or event loop) making the request, so they should be
+    quick. Exceptions raised by a hook propagate to the caller.
+
+    Usage:
+        client = Client(hooks=RequestHooks(on_request_end=print))
+    """
+
+    __slots__ = ["on_request_start", "on_request_end", "on_error"]
+
+    def __init__(
+        self,
+        on_request_start: Optional[RequestStartHook] = None,
+        on_request_end: Optional[RequestEndHook] = None,
+        on_error: Optional[RequestErrorHook] = None,
+    ) -> None:
+        self.on_request_start = on_request_start
+        self.on_request_end = on_request_end
+        self.on_error = on_error
+
+    @classmethod
+    def combine(cls, *hooks: "RequestHooks") -> "RequestHooks":
+        """Return hooks that call each of `hooks` in order."""
+
+        def chain(name: str) -> Optional[Callable]:
+            callbacks = [getattr(h, name) for h in hooks if getattr(h, name)]
+            if not callbacks:
+                return None
+
+            def call(*args: Any) -> None:
+                for callback in callbacks:
+                    callback(*args)
+
+            return call
+
+        return cls(
+            chain("on_request_start"), chain("on_request_end"), chain("on_error")
+        )
+
+    def start(self, method: str, path: str) -> RequestRecord:
+        """Begin recording a request and call `on_request_start`."""
+        record = RequestRecord(method, path)
+        if self.on_request_start is not None:
+            self.on_request_start(record)
+        return record
+
+    def end(self, record: RequestRecord) -> None:
+        """Complete the timings of a successful request and call `on_request_end`."""
+        record._finish()  # pylint: disable=protected-access
+        if self.on_request_end is not None:
+            self.on_request_end(record)
+
+    def error(self, record: RequestRecord, error: Exception) -> None:
+        """Complete the timings of a failed request and call `on_error`."""
+        if record.body_bytes is None:
+            # Network errors carry the request they failed to send.
+            record.body_bytes = _body_size(_failed_request(error))
+        record._finish()  # pylint: disable=protected-access
+        if self.on_error is not None:
+            self.on_error(record, error)
+
+
+def _span_ms(start: Optional[float], end: Optional[float]) -> Optional[float]:
+    if start is None or end is None:
+        return None
+    return (end - start) * 1000
+
+
+def _body_size(request: Any) -> Optional[int]:
+    """The body size of a `requests.PreparedRequest` or an `httpx.Request`."""
+    body = getattr(request, "body", None)
+    if body is None:
+        try:
+            body = getattr(request, "content", None)
+        except Exception:  # pylint: disable=broad-except
+            # httpx raises for streamed bodies that have not been read.
+            return _content_length(request)
+    if isinstance(body, str):
+        return len(body.encode())
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    if body is not None:
+        # A file-like body, sent as it is read.
+        return _content_length(request)
+    return 0 if request is not None else None
+
+
+def _content_length(request: Any) -> Optional[int]:
+    length = request.headers.get("Content-Length")
+    return int(length) if length is not None else None
+
+
+def _failed_request(error: Exception) -> Any:
+    cause = error.__cause__
+    try:
+        return getattr(cause, "request", None)
+    except RuntimeError:
+        # httpx raises if the error was created without a request.
+        return None
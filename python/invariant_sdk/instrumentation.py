@@ -0,0 +1,420 @@
+"""Recording of the chat completions of OpenAI-compatible clients as traces."""
+
+import collections
+import inspect
+import threading
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from invariant_sdk import fork_safety
+from invariant_sdk.exporter import SHUTDOWN, BufferedExporter
+from invariant_sdk.types.exceptions import InvariantUserError
+from invariant_sdk.types.push_traces import PushTracesRequest
+
+# Reasons of the completions dropped, in `invariant_sdk_dropped_traces_total`.
+TRACER_FULL = "tracer_full"
+INVALID = "invalid"
+
+# The messages of a request, its response or streamed chunks, and whether it
+# was streamed.
+_Completion = Tuple[List[Any], Any, bool]
+
+
+class ChatTracer:
+    """
+    Records the chat completions of OpenAI-compatible clients as traces.
+
+    `wrap` returns a proxy of a client, such as `openai.OpenAI` or
+    `openai.AsyncOpenAI`, whose `chat.completions.create` records every
+    completion as a trace: the messages of the request followed by the message
+    of the first choice of the response, with its tool calls. Streamed
+    completions are recorded once the stream is exhausted or closed, with the
+    deltas of their chunks merged into one message. Calls that raise are not
+    recorded. Other attributes of the client are those of the client itself.
+
+    Recording adds microseconds to each call: `create` only copies the list of
+    messages, which the caller may append to later, and queues it with the
+    response. A background thread converts the queued completions into traces
+    every `flush_interval_s` and exports them with `exporter`, which pushes them
+    from its own thread. At most `max_pending` completions wait to be converted;
+    more are dropped and counted with the reason "tracer_full", as are the ones
+    that cannot be converted, with the reason "invalid", and the ones recorded
+    after `shutdown`, with the reason "shutdown".
+
+    Usage:
+        with BufferedExporter(Client()) as exporter:
+            tracer = ChatTracer(exporter, dataset="agent")
+            openai_client = tracer.wrap(OpenAI())
+            openai_client.chat.completions.create(model="gpt-4o", messages=messages)
+
+    Args:
+        exporter: the exporter to hand the traces to.
+        dataset: the dataset to push the traces to, or None for a snapshot.
+        metadata: metadata to add to every trace, along with the model.
+        max_pending: the most completions waiting to be converted.
+        flush_interval_s: how often the background thread converts completions.
+    """
+
+    __slots__ = [
+        "exporter",
+        "dataset",
+        "metadata",
+        "max_pending",
+        "flush_interval_s",
+        "_pending",
+        "_lock",
+        "_drain_lock",
+        "_stopping",
+        "_closed",
+        "_thread",
+        "__weakref__",
+    ]
+
+    def __init__(
+        self,
+        exporter: BufferedExporter,
+        dataset: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        max_pending: int = 10_000,
+        flush_interval_s: float = 0.1,
+    ) -> None:
+        if max_pending <= 0 or flush_interval_s <= 0:
+            raise ValueError("max_pending and flush_interval_s must be positive")
+        self.exporter = exporter
+        self.dataset = dataset
+        self.metadata = dict(metadata or {})
+        self.max_pending = max_pending
+        self.flush_interval_s = flush_interval_s
+        self._pending: Deque[_Completion] = collections.deque()
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        fork_safety.register(self)
+
+    def wrap(self, client: Any) -> Any:
+        """
+        Return a proxy of `client` that records its chat completions.
+
+        Args:
+            client (Any): A client with a `chat.completions.create` method that
+                          takes the `messages` of the request as keyword.
+
+        Returns:
+            Any: The proxy, used in place of the client.
+        """
+        return _InstrumentedClient(client, self)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Export the completions recorded so far and wait until they are pushed.
+
+        Args:
+            timeout (Optional[float]): The most seconds to wait for the exporter,
+                                       or None to wait as long as it takes.
+
+        Returns:
+            bool: True if the exporter pushed everything, False on timeout.
+        """
+        self._drain()
+        return self.exporter.flush(timeout)
+
+    def shutdown(self) -> None:
+        """
+        Export the completions recorded so far and stop the background thread.
+
+        The exporter is not shut down. Completions recorded afterwards are
+        dropped and counted with the reason "shutdown".
+        """
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        self._stopping.set()
+        if thread is not None:
+            thread.join()
+        self._drain()
+
+    def _record(self, messages: List[Any], response: Any, streamed: bool) -> None:
+        """Queue a completion, on the caller's thread: keep this cheap."""
+        pending = self._pending
+        if self._closed or len(pending) >= self.max_pending:
+            self._count_dropped(SHUTDOWN if self._closed else TRACER_FULL)
+            return
+        pending.append((messages, response, streamed))
+        if self._thread is None:
+            self._start()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is not None or self._closed:
+                return
+            # Started first, the exporter registers its exit hook first, which
+            # makes it run after ours, once the last completions are exported.
+            self.exporter.start()
+            self._thread = threading.Thread(
+                target=self._run, name="invariant-sdk-chat-tracer", daemon=True
+            )
+            self._thread.start()
+            fork_safety.at_exit(self.shutdown)
+
+    def _after_fork_in_child(self) -> None:
+        """Start empty in a forked child: the parent exports what it recorded."""
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._stopping = threading.Event()
+        # The thread is started again by the first completion.
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.flush_interval_s):
+            self._drain()
+
+    def _drain(self) -> None:
+        """Convert the queued completions into traces and export them in order."""
+        with self._drain_lock:
+            pending = self._pending
+            while pending:
+                messages, response, streamed = pending.popleft()
+                try:
+                    request = self._request(messages, response, streamed)
+                except Exception:  # pylint: disable=broad-except
+                    # Duck-typed responses can be anything; one must not stop
+                    # the others from being exported.
+                    self._count_dropped(INVALID)
+                    continue
+                try:
+                    self.exporter.export(request)
+                except InvariantUserError:
+                    self._count_dropped(SHUTDOWN)
+
+    def _request(
+        self, messages: List[Any], response: Any, streamed: bool
+    ) -> PushTracesRequest:
+        if streamed:
+            message, model = _merge_chunks(response)
+        else:
+            choices = _get(response, "choices")
+            message = _to_dict(_get(choices[0], "message")) if choices else None
+            model = _get(response, "model")
+        trace = [_to_dict(m) for m in messages]
+        if message is not None:
+            trace.append(message)
+        metadata = dict(self.metadata)
+        if model is not None:
+            metadata["model"] = model
+        return PushTracesRequest(
+            messages=[trace], metadata=[metadata], dataset=self.dataset
+        )
+
+    def _count_dropped(self, reason: str) -> None:
+        metrics = self.exporter.client.metrics
+        if metrics is not None:
+            metrics.dropped_traces.inc(1, (reason,))
+
+
+class _InstrumentedClient:
+    __slots__ = ["_client", "chat"]
+
+    def __init__(self, client: Any, tracer: ChatTracer) -> None:
+        self._client = client
+        self.chat = _Chat(client.chat, tracer)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+
+class _Chat:
+    __slots__ = ["_chat", "completions"]
+
+    def __init__(self, chat: Any, tracer: ChatTracer) -> None:
+        self._chat = chat
+        self.completions = _Completions(chat.completions, tracer)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._chat, name)
+
+
+class _Completions:
+    __slots__ = ["_completions", "_tracer"]
+
+    def __init__(self, completions: Any, tracer: ChatTracer) -> None:
+        self._completions = completions
+        self._tracer = tracer
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._completions, name)
+
+    def create(self, *args: Any, **kwargs: Any) -> Any:
+        """Create a chat completion with the client and record it."""
+        result = self._completions.create(*args, **kwargs)
+        messages = kwargs.get("messages")
+        if messages is None:
+            return result
+        messages = list(messages)
+        if inspect.isawaitable(result):
+            return self._create_async(result, messages, kwargs.get("stream"))
+        if kwargs.get("stream"):
+            return _RecordedStream(result, messages, self._tracer)
+        # pylint: disable-next=protected-access
+        self._tracer._record(messages, result, False)
+        return result
+
+    async def _create_async(self, result: Any, messages: List[Any], stream: Any) -> Any:
+        response = await result
+        if stream:
+            return _RecordedAsyncStream(response, messages, self._tracer)
+        # pylint: disable-next=protected-access
+        self._tracer._record(messages, response, False)
+        return response
+
+
+class _StreamRecorder:
+    """Records the chunks of a streamed completion as they are iterated over."""
+
+    __slots__ = ["_stream", "_iterator", "_messages", "_tracer", "_chunks"]
+
+    def __init__(
+        self, stream: Any, iterator: Any, messages: List[Any], tracer: ChatTracer
+    ) -> None:
+        self._stream = stream
+        self._iterator = iterator
+        self._messages = messages
+        self._tracer = tracer
+        self._chunks: Optional[List[Any]] = []
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+    def _add(self, chunk: Any) -> None:
+        if self._chunks is not None:
+            self._chunks.append(chunk)
+
+    def _finish(self) -> None:
+        """Record the chunks received so far, once."""
+        if self._chunks is not None:
+            chunks, self._chunks = self._chunks, None
+            self._tracer._record(  # pylint: disable=protected-access
+                self._messages, chunks, True
+            )
+
+
+class _RecordedStream(_StreamRecorder):
+    __slots__: List[str] = []
+
+    def __init__(self, stream: Any, messages: List[Any], tracer: ChatTracer) -> None:
+        super().__init__(stream, iter(stream), messages, tracer)
+
+    def __iter__(self) -> "_RecordedStream":
+        return self
+
+    def __next__(self) -> Any:
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            self._finish()
+            raise
+        self._add(chunk)
+        return chunk
+
+    def __enter__(self) -> "_RecordedStream":
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the stream, recording the chunks received so far."""
+        self._finish()
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+
+
+class _RecordedAsyncStream(_StreamRecorder):
+    __slots__: List[str] = []
+
+    def __init__(self, stream: Any, messages: List[Any], tracer: ChatTracer) -> None:
+        super().__init__(stream, stream.__aiter__(), messages, tracer)
+
+    def __aiter__(self) -> "_RecordedAsyncStream":
+        return self
+
+    async def __anext__(self) -> Any:
+        try:
+            chunk = await self._iterator.__anext__()
+        except StopAsyncIteration:
+            self._finish()
+            raise
+        self._add(chunk)
+        return chunk
+
+    async def __aenter__(self) -> "_RecordedAsyncStream":
+        return self
+
+    async def __aexit__(self, *_: Any) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """Close the stream, recording the chunks received so far."""
+        self._finish()
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+
+
+def _get(obj: Any, name: str) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def _to_dict(obj: Any) -> Dict[str, Any]:
+    """Return a message, or a model of the client's, as a dictionary."""
+    if isinstance(obj, dict):
+        return obj
+    if hasattr(obj, "model_dump"):
+        data = obj.model_dump()
+    elif hasattr(obj, "to_dict"):
+        data = obj.to_dict()
+    else:
+        data = dict(vars(obj))
+    # Models have every field of the API, most of them unset in a message.
+    return {key: value for key, value in data.items() if value is not None}
+
+
+def _merge_chunks(chunks: List[Any]) -> Tuple[Optional[Dict[str, Any]], Any]:
+    """Return the message of the first choice of streamed chunks, and the model."""
+    model = None
+    role = None
+    content: List[str] = []
+    tool_calls: Dict[int, Dict[str, Any]] = {}
+    for chunk in chunks:
+        model = _get(chunk, "model") or model
+        for choice in _get(chunk, "choices") or []:
+            delta = _get(choice, "delta")
+            if (_get(choice, "index") or 0) != 0 or delta is None:
+                continue
+            role = _get(delta, "role") or role
+            if _get(delta, "content"):
+                content.append(_get(delta, "content"))
+            for call in _get(delta, "tool_calls") or []:
+                merged = tool_calls.setdefault(
+                    _get(call, "index") or 0,
+                    {"type": "function", "function": {"name": "", "arguments": ""}},
+                )
+                if _get(call, "id"):
+                    merged["id"] = _get(call, "id")
+                function = _get(call, "function")
+                for key in ("name", "arguments"):
+                    merged["function"][key] += _get(function, key) or ""
+    if role is None and not content and not tool_calls:
+        return None, model
+    message: Dict[str, Any] = {"role": role or "assistant"}
+    if content:
+        message["content"] = "".join(content)
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+    return message, model
@@ -0,0 +1,173 @@
+"""Uploads of JSONL files as they are, without parsing the traces in them."""
+
+import mmap
+import os
+import uuid
+from typing import Any, AsyncIterator, Dict, Optional, Union
+
+# The body is read in chunks of at most this size.
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+_WHITESPACE = frozenset(b" \t\r")
+_OPEN_OBJECT, _CLOSE_OBJECT, _OPEN_ARRAY, _CLOSE_ARRAY = b"{}[]"
+
+
+class JsonlFile:
+    """
+    A JSONL file of traces, memory-mapped and checked without parsing it.
+
+    The file is in the format of Explorer's file uploads: every non-empty line is
+    an annotated event list (a JSON object with a "messages" field, and
+    optionally "annotations" and "metadata") or a raw event list (a JSON array of
+    events). The first line may instead hold the dataset metadata, as an object
+    without "messages".
+
+    Usage:
+        with JsonlFile("traces.jsonl") as file:
+            traces = file.check()
+    """
+
+    __slots__ = ["path", "size", "data", "_file"]
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # pylint: disable-next=consider-using-with
+        self._file = open(path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        # An empty file cannot be mapped.
+        self.data: Union[mmap.mmap, bytes] = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.size
+            else b""
+        )
+
+    def check(self) -> int:
+        """
+        Check the structure of every line and count the traces.
+
+        Only the first and last character of each line and the presence of the
+        "messages" key are checked, not the JSON in between, so that no line is
+        parsed or copied. The server still validates the traces.
+
+        Returns:
+            int: The number of traces in the file.
+
+        Raises:
+            ValueError: If a line is not a JSON object or array, or an object other
+                        than the first has no "messages" field.
+        """
+        data, size = self.data, self.size
+        traces = 0
+        start = 0
+        number = 0
+        first_line = True
+        while start < size:
+            number += 1
+            end = data.find(b"\n", start)
+            if end == -1:
+                end = size
+            first, last = start, end
+            while first < last and data[first] in _WHITESPACE:
+                first += 1
+            while last > first and data[last - 1] in _WHITESPACE:
+                last -= 1
+            start = end + 1
+            if first == last:
+                continue
+            is_first, first_line = first_line, False
+            opening, closing = data[first], data[last - 1]
+            if opening == _OPEN_ARRAY and closing == _CLOSE_ARRAY:
+                traces += 1
+            elif opening == _OPEN_OBJECT and closing == _CLOSE_OBJECT:
+                if data.find(b'"messages"', first, last) != -1:
+                    traces += 1
+                elif not is_first:
+                    raise ValueError(
+                        f"{self.path}, line {number}: the trace has no messages"
+                    )
+            else:
+                raise ValueError(
+                    f"{self.path}, line {number}: not a JSON object or array"
+                )
+        return traces
+
+    def close(self) -> None:
+        """Unmap and close the file."""
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self._file.close()
+
+    def __enter__(self) -> "JsonlFile":
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+
+class MultipartBody:
+    """
+    A multipart/form-data body with the bytes of a file spliced in as they are.
+
+    The form fields and the part headers are encoded once and the file is read in
+    slices while the body is sent, so the body is never held in memory as a
+    whole. It reads like a file, for requests, and iterates asynchronously, for
+    httpx.
+
+    Args:
+        fields: the form fields before the file.
+        file_field: the name of the form field of the file.
+        filename: the name of the file to send.
+        data: the contents of the file, e.g. `JsonlFile.data`.
+    """
+
+    __slots__ = ["content_type", "_parts", "_length", "_part", "_offset"]
+
+    def __init__(
+        self,
+        fields: Dict[str, str],
+        file_field: str,
+        filename: str,
+        data: Union[mmap.mmap, bytes],
+    ) -> None:
+        boundary = uuid.uuid4().hex
+        while data.find(boundary.encode()) != -1:
+            boundary = uuid.uuid4().hex
+        head = "".join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{value}\r\n"
+            for name, value in fields.items()
+        )
+        head += (
+            f"--{boundary}\r\nContent-Disposition: form-data; "
+            f'name="{file_field}"; filename="{filename}"\r\n'
+            "Content-Type: application/jsonl\r\n\r\n"
+        )
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._parts = [head.encode(), data, f"\r\n--{boundary}--\r\n".encode()]
+        self._length = sum(len(part) for part in self._parts)
+        self._part = 0
+        self._offset = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        """Read up to `size` bytes of the body, or the rest of it."""
+        if size is None or size < 0:
+            size = self._length
+        while self._part < len(self._parts):
+            part = self._parts[self._part]
+            if self._offset < len(part):
+                chunk = part[self._offset : self._offset + size]
+                self._offset += len(chunk)
+                return chunk
+            self._part += 1
+            self._offset = 0
+        return b""
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        while True:
+            chunk = self.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
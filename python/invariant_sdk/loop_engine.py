@@ -0,0 +1,110 @@
+"""An event loop on a background thread, for running coroutines from sync code."""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+from typing import Any, Coroutine, Optional, TypeVar
+
+from invariant_sdk import fork_safety
+
+T = TypeVar("T")
+
+
+class LoopEngine:
+    """
+    Runs an asyncio event loop on a dedicated daemon thread.
+
+    Any number of threads may call `run` at the same time; their coroutines are
+    multiplexed onto the one loop. The caller's context variables are copied into
+    the task, as `asyncio.to_thread` does in the other direction.
+
+    Usage:
+        engine = LoopEngine()
+        response = engine.run(async_client.push_trace(request))
+    """
+
+    __slots__ = ["_name", "_loop", "_thread", "_closed", "__weakref__"]
+
+    def __init__(self, name: str = "invariant-sdk-loop") -> None:
+        self._name = name
+        self._closed = False
+        self._start()
+        fork_safety.register(self)
+
+    def _start(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run_forever, args=(started,), name=self._name, daemon=True
+        )
+        self._thread.start()
+        started.wait()
+
+    def _after_fork_in_child(self) -> None:
+        # The parent's loop shares its selector with the parent and has no thread
+        # running it here, so it is left alone for a new one.
+        if not self._closed:
+            fork_safety.abandon(self._loop)
+            self._start()
+
+    def _run_forever(self, started: threading.Event) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(started.set)
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The event loop."""
+        return self._loop
+
+    def submit(
+        self, coroutine: Coroutine[Any, Any, T]
+    ) -> "concurrent.futures.Future[T]":
+        """Schedule a coroutine on the loop and return a future for its result."""
+        if self._closed:
+            coroutine.close()
+            raise RuntimeError("The event loop engine is closed.")
+        future: "concurrent.futures.Future[T]" = concurrent.futures.Future()
+        context = contextvars.copy_context()
+
+        def start() -> None:
+            if not future.set_running_or_notify_cancel():
+                coroutine.close()
+                return
+            # Created inside `context`, the task runs with a copy of it.
+            task = context.run(self._loop.create_task, coroutine)
+            task.add_done_callback(lambda done: _copy_outcome(done, future))
+
+        self._loop.call_soon_threadsafe(start)
+        return future
+
+    def run(
+        self, coroutine: Coroutine[Any, Any, T], timeout: Optional[float] = None
+    ) -> T:
+        """Run a coroutine on the loop and block until it returns or raises."""
+        if threading.current_thread() is self._thread:
+            coroutine.close()
+            raise RuntimeError("LoopEngine.run would deadlock on its own loop thread.")
+        return self.submit(coroutine).result(timeout)
+
+    def close(self, timeout: Optional[float] = 5.0) -> None:
+        """Let scheduled callbacks run, then stop the loop and join its thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+
+
+def _copy_outcome(task: asyncio.Task, future: concurrent.futures.Future) -> None:
+    if task.cancelled():
+        # The future is already running, so it can no longer be cancelled itself.
+        future.set_exception(concurrent.futures.CancelledError())
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
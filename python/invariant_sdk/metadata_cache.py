@@ -0,0 +1,167 @@
+"""TTL/LRU cache for dataset metadata."""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+MetadataCacheKey = Tuple[str, Optional[str]]
+
+
+class MetadataCacheEntry:
+    """A cached metadata response together with its validator."""
+
+    __slots__ = ["value", "etag", "expires_at"]
+
+    def __init__(self, value: Dict, etag: Optional[str], expires_at: float) -> None:
+        self.value = value
+        self.etag = etag
+        self.expires_at = expires_at
+
+
+class MetadataCache:
+    """
+    Cache for `get_dataset_metadata` keyed by `(dataset_name, owner_username)`.
+
+    Entries are fresh for `ttl_s` seconds. Once stale, an entry that carries an
+    ETag is revalidated with `If-None-Match` instead of being refetched; a 304
+    answer renews it without transferring the metadata again. The least recently
+    used entry is evicted once `max_entries` is exceeded.
+
+    Cached values are copied on the way in and out, so callers may mutate what
+    they get back. A single cache may be shared between several clients.
+
+    A response fetched before an invalidation would bring back what it dropped,
+    so callers pass the `generation` of the key from before the request to
+    `store` and `revalidated`, which do not cache the response if it changed.
+    """
+
+    __slots__ = [
+        "ttl_s",
+        "max_entries",
+        "hits",
+        "misses",
+        "revalidations",
+        "_entries",
+        "_generations",
+        "_clears",
+        "_lock",
+    ]
+
+    def __init__(self, ttl_s: float = 30.0, max_entries: int = 128) -> None:
+        if ttl_s <= 0:
+            raise ValueError("ttl_s must be positive")
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._entries: "OrderedDict[MetadataCacheKey, MetadataCacheEntry]" = (
+            OrderedDict()
+        )
+        # Invalidations per dataset name, and of all of them.
+        self._generations: Dict[str, int] = {}
+        self._clears = 0
+        self._lock = threading.Lock()
+
+    def lookup(
+        self, key: MetadataCacheKey
+    ) -> Tuple[Optional[Dict], Optional[MetadataCacheEntry]]:
+        """
+        Look up an entry.
+
+        Returns:
+            Tuple[Optional[Dict], Optional[MetadataCacheEntry]]: A copy of the value if
+            the entry is fresh (a hit). Otherwise None and the stale entry, if any, so
+            that the caller can revalidate it with its ETag.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry.value), None
+            self.misses += 1
+        return None, entry if entry is not None and entry.etag else None
+
+    def generation(self, key: MetadataCacheKey) -> int:
+        """Return a number that grows whenever the key is invalidated."""
+        with self._lock:
+            return self._clears + self._generations.get(key[0], 0)
+
+    def store(
+        self,
+        key: MetadataCacheKey,
+        value: Dict,
+        etag: Optional[str],
+        generation: Optional[int] = None,
+    ) -> None:
+        """Store a freshly fetched value, unless the key changed `generation`."""
+        entry = MetadataCacheEntry(
+            copy.deepcopy(value), etag, time.monotonic() + self.ttl_s
+        )
+        self._insert(key, entry, generation)
+
+    def revalidated(
+        self,
+        key: MetadataCacheKey,
+        entry: MetadataCacheEntry,
+        generation: Optional[int] = None,
+    ) -> Dict:
+        """
+        Renew an entry after the server answered 304 and return a copy of its value.
+
+        The entry is not renewed if the key changed `generation`.
+        """
+        renewed = MetadataCacheEntry(
+            entry.value, entry.etag, time.monotonic() + self.ttl_s
+        )
+        self._insert(key, renewed, generation)
+        with self._lock:
+            self.revalidations += 1
+        return copy.deepcopy(entry.value)
+
+    def invalidate(self, dataset_name: str) -> None:
+        """Drop every entry for a dataset, whatever its owner."""
+        with self._lock:
+            self._generations[dataset_name] = self._generations.get(dataset_name, 0) + 1
+            for key in [key for key in self._entries if key[0] == dataset_name]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        """Drop all entries."""
+        with self._lock:
+            self._clears += 1
+            self._entries.clear()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """The hit, miss and revalidation counters and the current size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "size": len(self._entries),
+            }
+
+    def _insert(
+        self,
+        key: MetadataCacheKey,
+        entry: MetadataCacheEntry,
+        generation: Optional[int],
+    ) -> None:
+        with self._lock:
+            if (
+                generation is not None
+                and self._clears + self._generations.get(key[0], 0) != generation
+            ):
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,174 @@
+"""Coalescing of dataset metadata updates within a time window."""
+
+import threading
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from invariant_sdk.types.update_dataset_metadata import (
+    MetadataUpdate,
+    UpdateDatasetMetadataRequest,
+)
+
+
+class _PendingUpdate:
+    """Merged state of the updates buffered for a single dataset."""
+
+    __slots__ = ["replace_all", "fields", "request_kwargs", "handle"]
+
+    def __init__(self) -> None:
+        self.replace_all = False
+        self.fields: Dict[str, Any] = {}
+        self.request_kwargs: Optional[Mapping] = None
+        self.handle: Any = None
+
+
+class MetadataUpdateCoalescer:
+    """
+    Merges pending metadata updates per dataset.
+
+    Within a window the last write wins per field. An update with
+    `replace_all=True` acts as a barrier: everything buffered before it is
+    discarded (the server would overwrite it anyway) and the merged update is
+    sent with `replace_all=True`, so no field from before the barrier can leak
+    past it.
+
+    The coalescer only holds state. Scheduling the flush at the end of the
+    window is left to the client, which attaches its timer as the `handle` of
+    the dataset so that an explicit flush can cancel it.
+    """
+
+    __slots__ = ["window_ms", "_pending", "_lock"]
+
+    def __init__(self, window_ms: int) -> None:
+        if window_ms <= 0:
+            raise ValueError("window_ms must be a positive integer")
+        self.window_ms = window_ms
+        self._pending: Dict[str, _PendingUpdate] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def window_s(self) -> float:
+        """The coalescing window in seconds."""
+        return self.window_ms / 1000
+
+    def add(
+        self,
+        request: UpdateDatasetMetadataRequest,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> bool:
+        """
+        Merge an update into the pending state of its dataset.
+
+        Args:
+            request (UpdateDatasetMetadataRequest): The update to buffer.
+            request_kwargs (Optional[Mapping]): The request kwargs of the update. The
+                                                kwargs of the latest update are used
+                                                for the merged request.
+
+        Returns:
+            bool: True if this update opened a new window for the dataset, in which
+                  case the caller should schedule a flush.
+        """
+        fields = {name: value for name, value in request.metadata if value is not None}
+        with self._lock:
+            pending = self._pending.get(request.dataset_name)
+            opened = pending is None
+            if opened:
+                pending = self._pending[request.dataset_name] = _PendingUpdate()
+            if request.replace_all:
+                pending.replace_all = True
+                pending.fields = fields
+            else:
+                pending.fields.update(fields)
+            pending.request_kwargs = request_kwargs
+            return opened
+
+    def set_handle(self, dataset_name: str, handle: Any) -> None:
+        """Attach the scheduled flush handle (anything with `cancel()`) to a dataset."""
+        with self._lock:
+            pending = self._pending.get(dataset_name)
+            if pending is not None:
+                pending.handle = handle
+
+    def pop(
+        self, dataset_name: str
+    ) -> Optional[Tuple[UpdateDatasetMetadataRequest, Optional[Mapping]]]:
+        """
+        Remove the pending state of a dataset and build the merged request.
+
+        Returns:
+            Optional[Tuple[UpdateDatasetMetadataRequest, Optional[Mapping]]]: The merged
+            request and its request kwargs, or None if nothing is pending.
+        """
+        with self._lock:
+            pending = self._pending.pop(dataset_name, None)
+        if pending is None:
+            return None
+        return self._merged(dataset_name, pending)
+
+    def pop_all(
+        self,
+    ) -> List[Tuple[UpdateDatasetMetadataRequest, Optional[Mapping]]]:
+        """
+        Remove the pending state of every dataset and build the merged requests.
+
+        The pending map is swapped for an empty one under the lock, so that updates
+        added meanwhile open new windows.
+
+        Returns:
+            List[Tuple[UpdateDatasetMetadataRequest, Optional[Mapping]]]: The merged
+            request and its request kwargs for each dataset.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return [self._merged(name, update) for name, update in pending.items()]
+
+    @staticmethod
+    def _merged(
+        dataset_name: str, pending: _PendingUpdate
+    ) -> Tuple[UpdateDatasetMetadataRequest, Optional[Mapping]]:
+        if pending.handle is not None:
+            pending.handle.cancel()
+        request = UpdateDatasetMetadataRequest(
+            dataset_name=dataset_name,
+            replace_all=pending.replace_all,
+            metadata=MetadataUpdate(**pending.fields),
+        )
+        return request, pending.request_kwargs
+
+    def requeue(
+        self,
+        request: UpdateDatasetMetadataRequest,
+        request_kwargs: Optional[Mapping] = None,
+    ) -> bool:
+        """
+        Put back a merged update that failed to send, under any newer update.
+
+        The fields of the updates added since it was popped win over its own, and
+        one of them with `replace_all=True` discards it.
+
+        Args:
+            request (UpdateDatasetMetadataRequest): The merged update, from `pop`.
+            request_kwargs (Optional[Mapping]): Its request kwargs, from `pop`.
+
+        Returns:
+            bool: True if nothing newer was pending for the dataset, in which case
+                  the caller should schedule a flush.
+        """
+        fields = {name: value for name, value in request.metadata if value is not None}
+        with self._lock:
+            pending = self._pending.get(request.dataset_name)
+            if pending is None:
+                pending = self._pending[request.dataset_name] = _PendingUpdate()
+                pending.replace_all = request.replace_all
+                pending.fields = fields
+                pending.request_kwargs = request_kwargs
+                return True
+            if not pending.replace_all:
+                pending.replace_all = request.replace_all
+                pending.fields = {**fields, **pending.fields}
+            return False
+
+    def pending_datasets(self) -> List[str]:
+        """Return the names of the datasets with buffered updates."""
+        with self._lock:
+            return list(self._pending)
@@ -0,0 +1,524 @@
+"""In-process metrics for the clients, exposed in the Prometheus text format."""
+
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from invariant_sdk.base_client import (
+    DATASET_EXPORT_API_PATH,
+    DATASET_METADATA_API_PATH,
+    TRACE_API_PATH,
+)
+from invariant_sdk.hooks import RequestHooks, RequestRecord
+
+DEFAULT_LATENCY_BUCKETS_S = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+# Layout of the per-(method, endpoint, status) request cells: the counters
+# below, then one slot per latency bucket plus +Inf, then the latency sum.
+_COUNT, _SENT, _RECEIVED, _FIRST_BUCKET = 0, 1, 2, 3
+
+
+class _ThreadCells:
+    """
+    Values split into one dictionary per thread.
+
+    A thread only ever writes its own dictionary, so recording needs no lock;
+    under the GIL a read-modify-write of a thread's own slot cannot be interleaved
+    with another writer. Readers merge all dictionaries. The dictionaries of
+    threads that have exited are folded into one, so their counts are kept.
+    """
+
+    __slots__ = ["_local", "_live", "_retired", "_lock"]
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._live: List[Tuple[threading.Thread, Dict]] = []
+        self._retired: Dict = {}
+        self._lock = threading.Lock()
+
+    def get(self) -> Dict:
+        """Return the calling thread's dictionary."""
+        try:
+            return self._local.values
+        except AttributeError:
+            values: Dict = {}
+            self._local.values = values
+            with self._lock:
+                self._retire_dead_threads()
+                self._live.append((threading.current_thread(), values))
+            return values
+
+    def merged(self) -> Dict:
+        """Return the sum over all threads."""
+        with self._lock:
+            self._retire_dead_threads()
+            merged: Dict = {}
+            _merge_into(merged, self._retired)
+            for _, values in self._live:
+                # dict.copy is atomic under the GIL, iterating the live dict is not.
+                _merge_into(merged, values.copy())
+        return merged
+
+    def _retire_dead_threads(self) -> None:
+        alive = []
+        for thread, values in self._live:
+            if thread.is_alive():
+                alive.append((thread, values))
+            else:
+                _merge_into(self._retired, values)
+        self._live = alive
+
+
+def _merge_into(target: Dict, source: Dict) -> None:
+    for key, value in source.items():
+        if isinstance(value, list):
+            existing = target.get(key)
+            if existing is None:
+                target[key] = list(value)
+            else:
+                for i, item in enumerate(value):
+                    existing[i] += item
+        else:
+            target[key] = target.get(key, 0) + value
+
+
+class _Metric:
+    """A named family of time series, one per combination of label values."""
+
+    kind = ""
+    __slots__ = ["name", "help", "labelnames", "_cells"]
+
+    def __init__(
+        self,
+        name: str,
+        help: str,  # pylint: disable=redefined-builtin
+        labelnames: Sequence[str] = (),
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._cells = _ThreadCells()
+
+    def _check(self, labels: LabelValues) -> None:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {labels}"
+            )
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        """Yield (sample name, labels, value) for the exposition."""
+        for labels, value in sorted(self._cells.merged().items()):
+            yield self.name, dict(zip(self.labelnames, labels)), value
+
+
+class Counter(_Metric):
+    """A monotonically increasing count."""
+
+    kind = "counter"
+    __slots__: List[str] = []
+
+    def inc(self, amount: float = 1, labels: LabelValues = ()) -> None:
+        """Add `amount` to the series with the given label values."""
+        values = self._cells.get()
+        if labels not in values:
+            self._check(labels)
+        values[labels] = values.get(labels, 0) + amount
+
+    def value(self, labels: LabelValues = ()) -> float:
+        """The current value of a series."""
+        return self._cells.merged().get(labels, 0)
+
+
+class Gauge(Counter):
+    """A value that goes up and down, such as the depth of a queue."""
+
+    kind = "gauge"
+    __slots__: List[str] = []
+
+    def dec(self, amount: float = 1, labels: LabelValues = ()) -> None:
+        """Subtract `amount` from the series with the given label values."""
+        self.inc(-amount, labels)
+
+
+class Histogram(_Metric):
+    """Counts of observations in fixed buckets, plus their sum."""
+
+    kind = "histogram"
+    __slots__ = ["buckets"]
+
+    def __init__(
+        self,
+        name: str,
+        help: str,  # pylint: disable=redefined-builtin
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS_S,
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, labels: LabelValues = ()) -> None:
+        """Record one observation."""
+        values = self._cells.get()
+        counts = values.get(labels)
+        if counts is None:
+            self._check(labels)
+            counts = values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        for labels, counts in sorted(self._cells.merged().items()):
+            yield from _histogram_samples(
+                self.name, dict(zip(self.labelnames, labels)), self.buckets, counts
+            )
+
+
+def _histogram_samples(
+    name: str, labels: Dict[str, str], buckets: Sequence[float], counts: List[float]
+) -> Iterator[Tuple[str, Dict[str, str], float]]:
+    cumulative = 0
+    for bound, count in zip((*buckets, float("inf")), counts):
+        cumulative += count
+        yield f"{name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+    yield f"{name}_sum", labels, counts[-1]
+    yield f"{name}_count", labels, cumulative
+
+
+class _RequestMetrics(_Metric):
+    """
+    Request counts, bytes and latencies, fed by the request hooks.
+
+    All of them are kept in one cell per (method, endpoint, status), so that
+    recording a request costs a single dictionary lookup.
+    """
+
+    __slots__ = ["buckets"]
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        super().__init__("invariant_sdk_requests", "", ("method", "endpoint", "status"))
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, record: RequestRecord, _: Optional[Exception] = None) -> None:
+        """Record a completed request; usable as `on_request_end` and `on_error`."""
+        try:
+            values = self._cells._local.values  # pylint: disable=protected-access
+        except AttributeError:
+            values = self._cells.get()
+        path = record.path
+        key = (record.method, _ENDPOINTS.get(path) or endpoint(path), record.status)
+        cell = values.get(key)
+        if cell is None:
+            cell = values[key] = [0] * (_FIRST_BUCKET + len(self.buckets) + 2)
+        seconds = (record.timings.total_ms or 0.0) / 1000
+        cell[_COUNT] += 1
+        cell[_SENT] += record.body_bytes or 0
+        cell[_RECEIVED] += record.response_bytes or 0
+        cell[_FIRST_BUCKET + bisect_left(self.buckets, seconds)] += 1
+        cell[-1] += seconds
+
+    def families(self) -> Iterator[Tuple[str, str, str, List]]:
+        """Yield (name, kind, help, samples) for each exposed family."""
+        merged = sorted(
+            ((method, path, "none" if status is None else str(status)), cell)
+            for (method, path, status), cell in self._cells.merged().items()
+        )
+        by_endpoint: Dict[Tuple[str, str], List] = {}
+        for (method, path, _), cell in merged:
+            _merge_into(by_endpoint, {(method, path): cell})
+
+        def per_status(name: str, index: int) -> List:
+            return [
+                (name, {"method": m, "endpoint": e, "status": s}, cell[index])
+                for (m, e, s), cell in merged
+            ]
+
+        yield (
+            "invariant_sdk_requests_total",
+            "counter",
+            "Requests sent to the Invariant API.",
+            per_status("invariant_sdk_requests_total", _COUNT),
+        )
+        yield (
+            "invariant_sdk_sent_bytes_total",
+            "counter",
+            "Bytes of request bodies sent to the Invariant API.",
+            per_status("invariant_sdk_sent_bytes_total", _SENT),
+        )
+        yield (
+            "invariant_sdk_received_bytes_total",
+            "counter",
+            "Bytes of response bodies received from the Invariant API.",
+            per_status("invariant_sdk_received_bytes_total", _RECEIVED),
+        )
+        yield (
+            "invariant_sdk_request_duration_seconds",
+            "histogram",
+            "Latency of requests to the Invariant API.",
+            [
+                sample
+                for (method, path), cell in by_endpoint.items()
+                for sample in _histogram_samples(
+                    "invariant_sdk_request_duration_seconds",
+                    {"method": method, "endpoint": path},
+                    self.buckets,
+                    cell[_FIRST_BUCKET:],
+                )
+            ],
+        )
+
+
+def endpoint(path: str) -> str:
+    """Replace the dataset names and trace ids in an API path with placeholders."""
+    bare_path = path.split("?", 1)[0]
+    if bare_path.startswith(DATASET_METADATA_API_PATH + "/"):
+        result = DATASET_METADATA_API_PATH + "/{dataset}"
+    elif bare_path.startswith(DATASET_EXPORT_API_PATH + "/"):
+        result = DATASET_EXPORT_API_PATH + "/{dataset}"
+    elif bare_path.startswith(TRACE_API_PATH + "/"):
+        result = (
+            TRACE_API_PATH
+            + "/{trace_id}"
+            + ("/messages" if bare_path.endswith("/messages") else "")
+        )
+    else:
+        result = bare_path
+    if len(_ENDPOINTS) < _MAX_CACHED_ENDPOINTS:
+        _ENDPOINTS[path] = result
+    return result
+
+
+# Paths seen so far; bounded because trace ids make most paths unique.
+_ENDPOINTS: Dict[str, str] = {}
+_MAX_CACHED_ENDPOINTS = 1_024
+
+
+class MetricsRegistry:
+    """
+    Metrics of one or more clients.
+
+    Pass the registry to a client with `Client(metrics=registry)` to record, for
+    every request, its count, latency histogram, bytes sent and received, and
+    errors by exception class. Other components add their own counters, gauges
+    and histograms with `counter`, `gauge` and `histogram`.
+
+    Recording is lock free: every thread counts into its own cells, which are
+    only merged when the metrics are read.
+
+    Usage:
+        registry = MetricsRegistry()
+        client = Client(metrics=registry)
+        ...
+        print(registry.metrics_text())
+        registry.serve(port=9464)  # or scrape http://127.0.0.1:9464/metrics
+    """
+
+    __slots__ = [
+        "hooks",
+        "errors",
+        "queue_depth",
+        "dropped_traces",
+        "_requests",
+        "_metrics",
+        "_lock",
+    ]
+
+    def __init__(self, latency_buckets_s: Sequence[float] = DEFAULT_LATENCY_BUCKETS_S):
+        self._requests = _RequestMetrics(latency_buckets_s)
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self.errors = self.counter(
+            "invariant_sdk_errors_total",
+            "Errors raised by the clients, by exception class.",
+            ("method", "endpoint", "exception"),
+        )
+        self.queue_depth = self.gauge(
+            "invariant_sdk_queue_depth",
+            "Work buffered in the clients and not yet sent.",
+            ("queue",),
+        )
+        self.dropped_traces = self.counter(
+            "invariant_sdk_dropped_traces_total",
+            "Traces dropped without being sent.",
+            ("reason",),
+        )
+        self.hooks = RequestHooks(
+            on_request_end=self._requests.observe, on_error=self._on_error
+        )
+
+    def _on_error(self, record: RequestRecord, error: Exception) -> None:
+        self._requests.observe(record)
+        self.errors.inc(1, (record.method, endpoint(record.path), type(error).__name__))
+
+    def counter(
+        self,
+        name: str,
+        help: str,  # pylint: disable=redefined-builtin
+        labelnames: Sequence[str] = (),
+    ) -> Counter:
+        """Get or create a counter."""
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(
+        self,
+        name: str,
+        help: str,  # pylint: disable=redefined-builtin
+        labelnames: Sequence[str] = (),
+    ) -> Gauge:
+        """Get or create a gauge."""
+        return self._register(Gauge, name, help, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        help: str,  # pylint: disable=redefined-builtin
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS_S,
+    ) -> Histogram:
+        """Get or create a histogram."""
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def _register(
+        self,
+        cls: type,
+        name: str,
+        help: str,  # pylint: disable=redefined-builtin
+        labelnames: Sequence[str],
+        **kwargs: Any,
+    ) -> Any:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered differently")
+            return metric
+
+    def metrics_text(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        for name, kind, help_text, samples in self._requests.families():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [_format_sample(*sample) for sample in samples]
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            lines += [
+                f"# HELP {metric.name} {metric.help}",
+                f"# TYPE {metric.name} {metric.kind}",
+            ]
+            lines += [_format_sample(*sample) for sample in metric.samples()]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host: str = "127.0.0.1", port: int = 0) -> "MetricsServer":
+        """Expose `metrics_text` over HTTP on a background thread."""
+        return MetricsServer(self, host, port).start()
+
+
+def _format_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        rendered = ",".join(
+            f'{key}="{_escape(str(label))}"' for key, label in labels.items()
+        )
+        return f"{name}{{{rendered}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    server: Any
+
+    def log_message(
+        self,
+        format: str,  # pylint: disable=redefined-builtin
+        *args: Any,
+    ) -> None:
+        """Do not log scrapes."""
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Serve the metrics on /metrics."""
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = self.server.registry.metrics_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MetricsServer:
+    """A minimal HTTP endpoint serving a registry on /metrics."""
+
+    __slots__ = ["_httpd", "_thread"]
+
+    def __init__(
+        self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 0
+    ):
+        self._httpd = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.registry = registry  # type: ignore[attr-defined]
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """The URL to scrape."""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self) -> "MetricsServer":
+        """Serve on a background daemon thread, unless already serving."""
+        if self._thread is not None:
+            return self
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever,
+            kwargs={"poll_interval": 0.05},
+            name="invariant-metrics-server",
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        if self._thread is None:
+            # Never started: `shutdown` would wait for a loop that never runs.
+            self._httpd.server_close()
+            return
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self) -> "MetricsServer":
+        return self.start()
+
+    def __exit__(self, *_: Any) -> None:
+        self.stop()
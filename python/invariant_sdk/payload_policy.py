@@ -0,0 +1,352 @@
+"""Size limits for trace content: truncation and extraction of base64 images."""
+
+import base64
+import binascii
+import copy
+import hashlib
+import os
+import re
+from typing import Any, Callable, List, Optional, Tuple, Union
+
+from invariant_sdk.types.append_messages import AppendMessagesRequest
+from invariant_sdk.types.push_traces import PushTracesRequest
+
+TRUNCATED = "truncated"
+EXTRACTED = "extracted"
+REMOVED = "removed"
+
+# Strings shorter than this (roles, names, ids) are counted but never cut.
+_MIN_TRUNCATED_BYTES = 64
+# The start of the base64 encoding of each image format's magic number.
+_BASE64_IMAGE_PREFIXES = (
+    ("iVBORw0KGg", "image/png"),
+    ("/9j/", "image/jpeg"),
+    ("R0lGOD", "image/gif"),
+    ("UklGR", "image/webp"),
+)
+_BASE64_START = re.compile(r"[A-Za-z0-9+/]{64}")
+
+
+class DirectoryBlobStore:
+    """
+    Stores extracted images as files named by their SHA-256, in `path`.
+
+    A blob store is any object with a `put(data, media_type)` method that saves
+    the data and returns a reference to it, which replaces the data in the trace.
+    """
+
+    __slots__ = ["path"]
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def put(self, data: bytes, media_type: str) -> str:
+        """Save a blob and return the path of its file."""
+        extension = media_type.rpartition("/")[2] or "bin"
+        name = f"{hashlib.sha256(data).hexdigest()}.{extension}"
+        path = os.path.join(self.path, name)
+        if not os.path.exists(path):
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        return path
+
+
+class TrimmedPayload:
+    """
+    A string that a `PayloadPolicy` cut or replaced.
+
+    Attributes:
+        trace: the index of the trace in the request.
+        path: where the string is in the trace's messages, e.g.
+              "2.content.0.image_url.url".
+        action: "truncated", "extracted" to the blob store, or "removed" (an image
+                without a blob store).
+        original_bytes: the size of the string before.
+        kept_bytes: the size of what is left of it, without the marker.
+        reference: where an extracted image was stored.
+    """
+
+    __slots__ = ["trace", "path", "action", "original_bytes", "kept_bytes", "reference"]
+
+    def __init__(
+        self,
+        trace: int,
+        path: str,
+        action: str,
+        original_bytes: int,
+        kept_bytes: int,
+        reference: Optional[str] = None,
+    ) -> None:
+        self.trace = trace
+        self.path = path
+        self.action = action
+        self.original_bytes = original_bytes
+        self.kept_bytes = kept_bytes
+        self.reference = reference
+
+    def __repr__(self) -> str:
+        return (
+            f"TrimmedPayload(trace={self.trace}, path={self.path!r}, "
+            f"action={self.action!r}, original_bytes={self.original_bytes}, "
+            f"kept_bytes={self.kept_bytes})"
+        )
+
+
+class PayloadReport:
+    """What a `PayloadPolicy` trimmed from a request."""
+
+    __slots__ = ["trimmed"]
+
+    def __init__(self) -> None:
+        self.trimmed: List[TrimmedPayload] = []
+
+    @property
+    def trimmed_bytes(self) -> int:
+        """The number of bytes cut or replaced."""
+        return sum(item.original_bytes - item.kept_bytes for item in self.trimmed)
+
+    def __bool__(self) -> bool:
+        return bool(self.trimmed)
+
+    def __repr__(self) -> str:
+        return (
+            f"PayloadReport({len(self.trimmed)} strings, "
+            f"{self.trimmed_bytes} bytes trimmed)"
+        )
+
+
+class PayloadPolicy:
+    """
+    Keeps huge strings in messages from making a push too large to send.
+
+    Applied by `push_trace` and `append_messages` before the request is
+    serialized, with `Client(payload_policy=PayloadPolicy(...))`. Every string in
+    the messages is visited once:
+
+    - Base64 images of at least `min_image_bytes`, as data URLs or as bare base64
+      of a PNG, JPEG, GIF or WebP, are decoded and saved to `blob_store` and
+      replaced by a marker with the reference it returned. Without a blob store
+      they are replaced by a marker only.
+    - The other strings count against `max_message_bytes` per message and
+      `max_trace_bytes` per trace, in order. A string that does not fit in what
+      is left of either budget is cut there and ends with a marker giving the
+      number of bytes cut. Strings under 64 bytes are never cut.
+
+    Sizes are those of the UTF-8 strings; keys and JSON syntax are not counted.
+    Only messages and dicts or lists that contain a changed string are copied:
+    the caller's request is not modified. Annotations and metadata are kept as
+    they are. For `append_messages`, `max_trace_bytes` counts the appended
+    messages only, not those the trace already has.
+
+    Args:
+        max_message_bytes: the most string bytes to keep per message.
+        max_trace_bytes: the most string bytes to keep per trace.
+        blob_store: where to save extracted images, e.g. a `DirectoryBlobStore`.
+        min_image_bytes: the smallest base64 string to treat as an image.
+        on_trim: called with the report of every request something was trimmed
+                 from.
+    """
+
+    __slots__ = [
+        "max_message_bytes",
+        "max_trace_bytes",
+        "blob_store",
+        "min_image_bytes",
+        "on_trim",
+    ]
+
+    def __init__(
+        self,
+        max_message_bytes: Optional[int] = None,
+        max_trace_bytes: Optional[int] = None,
+        blob_store: Optional[Any] = None,
+        min_image_bytes: int = 1024,
+        on_trim: Optional[Callable[[PayloadReport], None]] = None,
+    ) -> None:
+        if max_message_bytes is not None and max_message_bytes < 0:
+            raise ValueError("max_message_bytes must not be negative")
+        if max_trace_bytes is not None and max_trace_bytes < 0:
+            raise ValueError("max_trace_bytes must not be negative")
+        self.max_message_bytes = max_message_bytes
+        self.max_trace_bytes = max_trace_bytes
+        self.blob_store = blob_store
+        self.min_image_bytes = min_image_bytes
+        self.on_trim = on_trim
+
+    def apply(
+        self, request: Union[PushTracesRequest, AppendMessagesRequest]
+    ) -> Tuple[Union[PushTracesRequest, AppendMessagesRequest], PayloadReport]:
+        """
+        Apply the policy to a push or append messages request.
+
+        Args:
+            request (Union[PushTracesRequest, AppendMessagesRequest]): The request.
+
+        Returns:
+            Tuple[Union[PushTracesRequest, AppendMessagesRequest], PayloadReport]:
+            The request with the trimmed messages (the same object if nothing was
+            trimmed) and the report.
+        """
+        report = PayloadReport()
+        if isinstance(request, AppendMessagesRequest):
+            # The appended messages are reported as trace 0.
+            messages = self._trim_trace(0, request.messages, report)
+            if not report:
+                return request, report
+            if self.on_trim is not None:
+                self.on_trim(report)
+            appended = AppendMessagesRequest.model_construct(
+                messages=messages,
+                annotations=request.annotations,
+                trace_id=request.trace_id,
+            )
+            return appended, report
+        messages = [
+            self._trim_trace(trace, messages, report)
+            for trace, messages in enumerate(request.messages)
+        ]
+        if not report:
+            return request, report
+        if self.on_trim is not None:
+            self.on_trim(report)
+        trimmed = PushTracesRequest.model_construct(
+            messages=messages,
+            annotations=request.annotations,
+            dataset=request.dataset,
+            metadata=request.metadata,
+        )
+        return trimmed, report
+
+    def _trim_trace(
+        self, trace: int, messages: List[dict], report: PayloadReport
+    ) -> List[dict]:
+        walk = _Walk(self, trace, report, self.max_trace_bytes)
+        trimmed = []
+        for index, message in enumerate(messages):
+            walk.message_left = self.max_message_bytes
+            walk.path.append(index)
+            trimmed.append(walk.visit(message))
+            walk.path.pop()
+        return trimmed if len(report.trimmed) > walk.trimmed_before else messages
+
+
+class _Walk:
+    """The state of one pass over the messages of a trace."""
+
+    __slots__ = [
+        "policy",
+        "trace",
+        "report",
+        "trace_left",
+        "message_left",
+        "path",
+        "trimmed_before",
+    ]
+
+    def __init__(
+        self,
+        policy: PayloadPolicy,
+        trace: int,
+        report: PayloadReport,
+        trace_left: Optional[int],
+    ) -> None:
+        self.policy = policy
+        self.trace = trace
+        self.report = report
+        self.trace_left = trace_left
+        self.message_left: Optional[int] = None
+        self.path: List[Any] = []
+        self.trimmed_before = len(report.trimmed)
+
+    def visit(self, value: Any) -> Any:
+        """Return a dict or list with its strings trimmed, or the value itself."""
+        changed = None
+        path = self.path
+        for key, item in value.items() if type(value) is dict else enumerate(value):
+            kind = type(item)
+            if kind is str:
+                new = self._visit_string(item, key)
+            elif kind is dict or kind is list:
+                path.append(key)
+                new = self.visit(item)
+                path.pop()
+            else:
+                continue
+            if new is not item:
+                if changed is None:
+                    changed = copy.copy(value)
+                changed[key] = new
+        return value if changed is None else changed
+
+    def _trimmed(self, key: Any, *args: Any) -> None:
+        path = ".".join(str(part) for part in (*self.path, key))
+        self.report.trimmed.append(TrimmedPayload(self.trace, path, *args))
+
+    def _visit_string(self, value: str, key: Any) -> str:
+        ascii_only = value.isascii()
+        size = len(value) if ascii_only else len(value.encode())
+        if ascii_only and size >= self.policy.min_image_bytes:
+            image = _base64_image(value)
+            replaced = self._replace_image(value, key, *image) if image else None
+            if replaced is not None:
+                return replaced
+        left = _smallest(self.message_left, self.trace_left)
+        if left is None or size <= left or size < _MIN_TRUNCATED_BYTES:
+            self._spend(size)
+            return value
+        keep = max(left, 0)
+        if ascii_only:
+            head = value[:keep]
+        else:
+            # Cut on a character boundary: a partial character is dropped.
+            head = value.encode()[:keep].decode(errors="ignore")
+            keep = len(head.encode())
+        self._spend(keep)
+        self._trimmed(key, TRUNCATED, size, keep)
+        return f"{head}...[truncated {size - keep} bytes]"
+
+    def _replace_image(
+        self, value: str, key: Any, media_type: str, start: int
+    ) -> Optional[str]:
+        """Return what replaces an image, or None if its base64 data is invalid."""
+        store = self.policy.blob_store
+        if store is None:
+            self._trimmed(key, REMOVED, len(value), 0)
+            return f"[{media_type} image of {len(value)} base64 bytes removed]"
+        try:
+            data = base64.b64decode(value[start:])
+        except (binascii.Error, ValueError):
+            # Trimmed and counted as any other string.
+            return None
+        reference = store.put(data, media_type)
+        self._trimmed(key, EXTRACTED, len(value), 0, reference)
+        return f"[{media_type} image extracted to {reference}]"
+
+    def _spend(self, size: int) -> None:
+        if self.message_left is not None:
+            self.message_left -= size
+        if self.trace_left is not None:
+            self.trace_left -= size
+
+
+def _smallest(first: Optional[int], second: Optional[int]) -> Optional[int]:
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return min(first, second)
+
+
+def _base64_image(value: str) -> Optional[Tuple[str, int]]:
+    """Return the media type and the start of the base64 data of an image."""
+    if value.startswith("data:image/"):
+        marker = value.find(";base64,", 0, 100)
+        if marker == -1:
+            return None
+        return value[5:marker], marker + len(";base64,")
+    for prefix, media_type in _BASE64_IMAGE_PREFIXES:
+        if value.startswith(prefix):
+            return (media_type, 0) if _BASE64_START.match(value) else None
+    return None
@@ -0,0 +1,280 @@
+"""Profiling mode splitting the time of client calls into phases.
+
+Set `INVARIANT_SDK_PROFILE=1` (or call `enable()`) and every client call records
+the wall time, CPU time and peak traced memory of its phases:
+
+    validation       building and validating the request models
+    serialization    dumping the models to JSON-compatible dictionaries
+    encode           encoding the body to JSON bytes
+    network          sending the request and receiving the response
+    deserialization  parsing the response
+
+A rolling summary over the last `window` calls of each method is available from
+`summary()` and `dump()`. With the environment variable set, the summary is
+written at exit to the path in `INVARIANT_SDK_PROFILE_PATH`, or to stderr.
+"""
+
+import atexit
+import contextlib
+import functools
+import inspect
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, TypeVar
+
+from invariant_sdk.utils import fetch_env_var
+
+PROFILE_ENV_VAR = "INVARIANT_SDK_PROFILE"
+PROFILE_PATH_ENV_VAR = "INVARIANT_SDK_PROFILE_PATH"
+TOTAL = "total"
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class _CallRecord:
+    """The phases of one client call: name -> [wall_s, cpu_s, peak_bytes]."""
+
+    __slots__ = ["phases", "memory_start"]
+
+    def __init__(self, memory_start: int) -> None:
+        self.phases: Dict[str, List[float]] = {}
+        self.memory_start = memory_start
+
+    def add(self, phase: str, wall_s: float, cpu_s: float, peak: int) -> None:
+        totals = self.phases.get(phase)
+        if totals is None:
+            self.phases[phase] = [wall_s, cpu_s, peak]
+        else:
+            totals[0] += wall_s
+            totals[1] += cpu_s
+            totals[2] = max(totals[2], peak)
+
+
+_current_call: ContextVar[Optional[_CallRecord]] = ContextVar(
+    "invariant_sdk_profiled_call", default=None
+)
+
+
+class Profiler:
+    """
+    Collects per-phase timings of client calls.
+
+    Wall time is measured with `time.perf_counter`, CPU time with
+    `time.thread_time`; for the async client the CPU time of the network phase
+    includes other tasks run by the event loop meanwhile. Peak memory is the
+    highest traced allocation above the level at the start of the call, taken
+    from `tracemalloc`, which slows allocations down noticeably. It is only
+    approximate when several calls run at the same time.
+
+    Args:
+        window: how many recent calls of each method the summary covers.
+        trace_memory: whether to start `tracemalloc` and record peak memory.
+    """
+
+    __slots__ = ["window", "trace_memory", "_calls", "_lock", "_started_tracing"]
+
+    def __init__(self, window: int = 1_000, trace_memory: bool = True) -> None:
+        if window <= 0:
+            raise ValueError("window must be positive")
+        self.window = window
+        self.trace_memory = trace_memory
+        self._calls: Dict[str, Deque[Dict[str, List[float]]]] = {}
+        self._lock = threading.Lock()
+        self._started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+    def _memory(self) -> int:
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            return current
+        return 0
+
+    def _peak(self) -> int:
+        if self.trace_memory and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[1]
+        return 0
+
+    @contextlib.contextmanager
+    def call(self, name: str) -> Iterator[None]:
+        """Profile a client call. Calls made from inside another call are part of it."""
+        if _current_call.get() is not None:
+            yield
+            return
+        record = _CallRecord(self._memory())
+        token = _current_call.set(record)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            peak = max(
+                [self._peak()] + [totals[2] for totals in record.phases.values()]
+            )
+            _current_call.reset(token)
+            phases = {
+                phase: [totals[0], totals[1], max(totals[2] - record.memory_start, 0)]
+                for phase, totals in record.phases.items()
+            }
+            phases[TOTAL] = [wall, cpu, max(peak - record.memory_start, 0)]
+            with self._lock:
+                calls = self._calls.get(name)
+                if calls is None:
+                    calls = self._calls[name] = deque(maxlen=self.window)
+                calls.append(phases)
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time a phase of the current call. Outside of a call this does nothing."""
+        record = _current_call.get()
+        if record is None:
+            yield
+            return
+        self._memory()
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            record.add(
+                name,
+                time.perf_counter() - wall,
+                time.thread_time() - cpu,
+                self._peak(),
+            )
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Summarize the recorded calls.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: For each method, the number of calls covered and,
+            for each phase and the total, the mean, p50, p95 and max wall time in
+            milliseconds, the mean CPU time in milliseconds and the max peak memory
+            in KiB.
+        """
+        with self._lock:
+            calls = {name: list(records) for name, records in self._calls.items()}
+        summary: Dict[str, Dict[str, Any]] = {}
+        for name, records in sorted(calls.items()):
+            phases: Dict[str, List[List[float]]] = {}
+            for record in records:
+                for phase, totals in record.items():
+                    phases.setdefault(phase, []).append(totals)
+            summary[name] = {
+                "calls": len(records),
+                "phases": {
+                    phase: _summarize(samples) for phase, samples in phases.items()
+                },
+            }
+        return summary
+
+    def dump(self, path: Optional[str] = None) -> str:
+        """Return the summary as JSON, and write it to `path` if given."""
+        text = json.dumps(self.summary(), indent=2, sort_keys=True)
+        if path is not None:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+        return text
+
+    def reset(self) -> None:
+        """Forget all recorded calls."""
+        with self._lock:
+            self._calls.clear()
+
+    def close(self) -> None:
+        """Stop `tracemalloc` if this profiler started it."""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+
+def _summarize(samples: List[List[float]]) -> Dict[str, float]:
+    walls = sorted(sample[0] * 1000 for sample in samples)
+    return {
+        "wall_ms_mean": sum(walls) / len(walls),
+        "wall_ms_p50": walls[int(round(0.5 * (len(walls) - 1)))],
+        "wall_ms_p95": walls[int(round(0.95 * (len(walls) - 1)))],
+        "wall_ms_max": walls[-1],
+        "cpu_ms_mean": sum(sample[1] for sample in samples) * 1000 / len(samples),
+        "peak_kib_max": max(sample[2] for sample in samples) / 1024,
+    }
+
+
+_profiler: Optional[Profiler] = None
+
+
+def enable(window: int = 1_000, trace_memory: bool = True) -> Profiler:
+    """Start profiling client calls and return the profiler."""
+    global _profiler  # pylint: disable=global-statement
+    disable()
+    _profiler = Profiler(window, trace_memory)
+    return _profiler
+
+
+def disable() -> None:
+    """Stop profiling client calls."""
+    global _profiler  # pylint: disable=global-statement
+    if _profiler is not None:
+        _profiler.close()
+    _profiler = None
+
+
+def get_profiler() -> Optional[Profiler]:
+    """The active profiler, or None if profiling is off."""
+    return _profiler
+
+
+_NO_PHASE = contextlib.nullcontext()
+
+
+def phase(name: str) -> contextlib.AbstractContextManager:
+    """Time a phase of the current client call if profiling is on."""
+    profiler = _profiler
+    return _NO_PHASE if profiler is None else profiler.phase(name)
+
+
+def profiled(fn: F) -> F:
+    """Profile calls of a client method, sync or async, under its name."""
+    name = fn.__name__
+    if inspect.iscoroutinefunction(fn):
+
+        @functools.wraps(fn)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            profiler = _profiler
+            if profiler is None:
+                return await fn(*args, **kwargs)
+            with profiler.call(name):
+                return await fn(*args, **kwargs)
+
+        return async_wrapper  # type: ignore[return-value]
+
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        profiler = _profiler
+        if profiler is None:
+            return fn(*args, **kwargs)
+        with profiler.call(name):
+            return fn(*args, **kwargs)
+
+    return wrapper  # type: ignore[return-value]
+
+
+def _dump_at_exit() -> None:
+    if _profiler is None:
+        return
+    path = fetch_env_var(PROFILE_PATH_ENV_VAR)
+    text = _profiler.dump(path)
+    if path is None:
+        print(text, file=sys.stderr)
+
+
+_profile_env = (fetch_env_var(PROFILE_ENV_VAR) or "").strip().lower()
+if _profile_env not in ("", "0", "false", "no"):
+    enable()
+    atexit.register(_dump_at_exit)
@@ -0,0 +1,297 @@
+"""Client-side rate control: a token bucket and an AIMD limit on requests in flight."""
+
+import asyncio
+import contextlib
+import math
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Iterator, Optional
+
+from invariant_sdk.types.exceptions import (
+    InvariantAPIBusyError,
+    InvariantAPITimeoutError,
+)
+
+
+class RateController:
+    """
+    Adapts how fast requests are sent to what the server sustains.
+
+    Every request must pass two limits before it is sent:
+
+    - a token bucket of `max_rps` requests per second with bursts of up to
+      `burst` requests (no limit when `max_rps` is None), and
+    - a limit on the number of requests in flight, adapted by AIMD. It grows by
+      one for every limit's worth of successful requests, i.e. by about one per
+      round trip, and is multiplied by `backoff` on congestion: a 429 or 503
+      response, a timeout, or a response slower than `latency_tolerance` times
+      the baseline latency. Like TCP, congestion seen by requests sent before
+      the last decrease does not decrease the limit again, so a burst of
+      errors backs off once.
+
+    The baseline latency is the lowest one seen over the last one to two
+    `baseline_window_s` (a sliding minimum, as in BBR), or `latency_target_ms`
+    if given. A `Retry-After` from the server holds back all requests for that
+    long, at most `max_pause_s`.
+
+    Waiting callers are admitted in the order they arrived. One controller can
+    be shared by several clients, sync and async, to limit them together.
+
+    Usage:
+        rate_controller = RateController(max_rps=100)
+        client = Client(rate_controller=rate_controller)
+    """
+
+    __slots__ = [
+        "max_rps",
+        "burst",
+        "min_limit",
+        "max_limit",
+        "backoff",
+        "latency_tolerance",
+        "latency_target_ms",
+        "baseline_window_s",
+        "max_pause_s",
+        "_limit",
+        "_in_flight",
+        "_tokens",
+        "_refilled_at",
+        "_paused_until",
+        "_decreased_at",
+        "_min_latency",
+        "_window_started",
+        "_lock",
+        "_waiters",
+    ]
+
+    def __init__(
+        self,
+        max_rps: Optional[float] = None,
+        burst: Optional[int] = None,
+        initial_limit: int = 16,
+        min_limit: int = 1,
+        max_limit: int = 256,
+        backoff: float = 0.5,
+        latency_tolerance: float = 2.0,
+        latency_target_ms: Optional[float] = None,
+        baseline_window_s: float = 10.0,
+        max_pause_s: float = 60.0,
+    ) -> None:
+        if max_rps is not None and max_rps <= 0:
+            raise ValueError("max_rps must be positive")
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError("Expected 1 <= min_limit <= initial_limit <= max_limit")
+        if not 0 < backoff < 1:
+            raise ValueError("backoff must be between 0 and 1")
+        if latency_tolerance <= 1:
+            raise ValueError("latency_tolerance must be greater than 1")
+        self.max_rps = max_rps
+        self.burst = burst if burst is not None else max(1, math.ceil(max_rps or 1))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.latency_target_ms = latency_target_ms
+        self.baseline_window_s = baseline_window_s
+        self.max_pause_s = max_pause_s
+        now = time.monotonic()
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._tokens = float(self.burst)
+        self._refilled_at = now
+        self._paused_until = now
+        self._decreased_at = -math.inf
+        # Minimum latency of the current and of the previous window.
+        self._min_latency = [math.inf, math.inf]
+        self._window_started = now
+        self._lock = threading.Lock()
+        # Callers waiting for admission, served in order.
+        self._waiters: Deque["_Waiter"] = deque()
+
+    @property
+    def limit(self) -> int:
+        """The current limit on requests in flight."""
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        """The number of requests admitted and not yet finished."""
+        return self._in_flight
+
+    @property
+    def baseline_ms(self) -> Optional[float]:
+        """The baseline latency in milliseconds, or None before the first response."""
+        if self.latency_target_ms is not None:
+            return self.latency_target_ms
+        baseline = min(self._min_latency)
+        return None if baseline == math.inf else baseline * 1000
+
+    @contextlib.contextmanager
+    def admit(self) -> Iterator[None]:
+        """Wait until a request may be sent, and learn from how it went."""
+        started = self._enter()
+        error: Optional[BaseException] = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._release(started, error)
+
+    @contextlib.asynccontextmanager
+    async def admit_async(self) -> AsyncIterator[None]:
+        """Like `admit`, waiting without blocking the event loop."""
+        started = await self._enter_async()
+        error: Optional[BaseException] = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._release(started, error)
+
+    def _enter(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            if not self._waiters and self._try_admit(now) is None:
+                return now
+            waiter = _Waiter()
+            self._waiters.append(waiter)
+        try:
+            while True:
+                with self._lock:
+                    delay = math.inf
+                    if self._waiters[0] is waiter:
+                        now = time.monotonic()
+                        delay = self._try_admit(now)
+                        if delay is None:
+                            return now
+                    waiter.reset()
+                waiter.event.wait(None if delay == math.inf else delay)
+        finally:
+            self._leave(waiter)
+
+    async def _enter_async(self) -> float:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            now = time.monotonic()
+            if not self._waiters and self._try_admit(now) is None:
+                return now
+            waiter = _Waiter(loop)
+            self._waiters.append(waiter)
+        try:
+            while True:
+                with self._lock:
+                    delay = math.inf
+                    if self._waiters[0] is waiter:
+                        now = time.monotonic()
+                        delay = self._try_admit(now)
+                        if delay is None:
+                            return now
+                    waiter.reset()
+                    future = waiter.future
+                try:
+                    await asyncio.wait_for(future, None if delay == math.inf else delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._leave(waiter)
+
+    def _leave(self, waiter: "_Waiter") -> None:
+        with self._lock:
+            self._waiters.remove(waiter)
+            self._wake()
+
+    def _try_admit(self, now: float) -> Optional[float]:
+        """Admit a request, or return how long to wait (inf: until one finishes)."""
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._in_flight >= int(self._limit):
+            return math.inf
+        if self.max_rps is not None:
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._refilled_at) * self.max_rps
+            )
+            self._refilled_at = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.max_rps
+            self._tokens -= 1
+        self._in_flight += 1
+        return None
+
+    def _release(self, started: float, error: Optional[BaseException]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            saturated = self._in_flight >= self._limit / 2
+            self._in_flight -= 1
+            if isinstance(error, InvariantAPIBusyError):
+                if error.retry_after_s:
+                    self._paused_until = max(
+                        self._paused_until,
+                        now + min(error.retry_after_s, self.max_pause_s),
+                    )
+                self._decrease(started, now)
+            elif isinstance(error, InvariantAPITimeoutError):
+                self._decrease(started, now)
+            elif error is None:
+                if self._is_slow(now - started, now):
+                    self._decrease(started, now)
+                elif saturated:
+                    # Idle capacity says nothing about what the server sustains.
+                    self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._wake()
+
+    def _is_slow(self, latency: float, now: float) -> bool:
+        if now - self._window_started >= self.baseline_window_s:
+            self._min_latency = [math.inf, self._min_latency[0]]
+            self._window_started = now
+        self._min_latency[0] = min(self._min_latency[0], latency)
+        baseline_ms = self.baseline_ms
+        return (
+            baseline_ms is not None
+            and latency * 1000 > baseline_ms * self.latency_tolerance
+        )
+
+    def _decrease(self, started: float, now: float) -> None:
+        if started < self._decreased_at:
+            return
+        self._limit = max(self.min_limit, self._limit * self.backoff)
+        self._decreased_at = now
+
+    def _wake(self) -> None:
+        """Wake the first waiter if a request could be sent, with the lock held."""
+        if self._waiters and self._in_flight < int(self._limit):
+            self._waiters[0].wake()
+
+
+class _Waiter:
+    """A caller waiting for admission, in a thread or in an event loop."""
+
+    __slots__ = ["loop", "event", "future"]
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def reset(self) -> None:
+        """Prepare to wait again. Called with the controller's lock held."""
+        if self.loop is None:
+            self.event.clear()
+        elif self.future.done():
+            self.future = self.loop.create_future()
+
+    def wake(self) -> None:
+        """Wake the waiter. Called with the controller's lock held."""
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_set_waiter, self.future)
+
+
+def _set_waiter(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
@@ -0,0 +1,428 @@
+"""Client-side sampling of traces, decided before they are validated or encoded."""
+
+import hashlib
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Pattern, Sequence, Tuple, Union
+
+SAMPLED = "sampled"
+RATE_CAPPED = "rate_capped"
+SHED = "shed"
+
+DEFAULT_ERROR_PATTERN = re.compile(
+    r"\b(?:error|exception|traceback|failed|failure)\b", re.IGNORECASE
+)
+
+
+class ProbabilisticSampler:
+    """
+    Keeps every trace with probability `rate`, independently.
+
+    Args:
+        rate: the fraction of traces to keep, from 0 to 1.
+        seed: the seed of the random numbers, for reproducible sampling.
+    """
+
+    __slots__ = ["rate", "reason", "_random"]
+
+    def __init__(self, rate: float, seed: Optional[int] = None) -> None:
+        _check_rate(rate)
+        self.rate = rate
+        self.reason = SAMPLED
+        self._random = random.Random(seed)
+
+    def keep(
+        self,
+        messages: List[Dict],
+        annotations: Optional[List[Any]],
+        metadata: Optional[Dict],
+        dataset: Optional[str],
+    ) -> bool:
+        """Return whether to keep the trace."""
+        return self._random.random() < self.rate
+
+
+class HashSampler:
+    """
+    Keeps the traces whose value of a metadata key hashes below `rate`.
+
+    The decision depends on the value only, so all the traces of a session or a
+    user (with `key="session_id"` or `key="user_id"`) are kept or dropped
+    together, in every process. Values are compared by their string form.
+
+    Args:
+        key: the metadata key to hash the value of.
+        rate: the fraction of values to keep, from 0 to 1.
+        keep_missing: whether to keep traces without the key.
+    """
+
+    __slots__ = ["key", "rate", "keep_missing", "reason", "_threshold"]
+
+    def __init__(self, key: str, rate: float, keep_missing: bool = True) -> None:
+        _check_rate(rate)
+        self.key = key
+        self.rate = rate
+        self.keep_missing = keep_missing
+        self.reason = SAMPLED
+        self._threshold = int(rate * 2**64)
+
+    def keep(
+        self,
+        messages: List[Dict],
+        annotations: Optional[List[Any]],
+        metadata: Optional[Dict],
+        dataset: Optional[str],
+    ) -> bool:
+        """Return whether to keep the trace."""
+        value = metadata.get(self.key) if metadata else None
+        if value is None:
+            return self.keep_missing
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big") < self._threshold
+
+
+class RateCapSampler:
+    """
+    Keeps at most `max_tps` traces per second per dataset, in a token bucket.
+
+    Every dataset has its own bucket, which holds up to `burst` traces (by
+    default one second's worth). Traces pushed without a dataset share one.
+
+    Args:
+        max_tps: the traces per second to keep of each dataset, or None to not
+                 cap the datasets missing from `per_dataset`.
+        per_dataset: caps for given datasets, in traces per second, instead of
+                     `max_tps`.
+        burst: the most traces to keep at once after a pause, or None for one
+               second's worth.
+    """
+
+    __slots__ = ["max_tps", "per_dataset", "burst", "reason", "_buckets", "_lock"]
+
+    def __init__(
+        self,
+        max_tps: Optional[float] = None,
+        per_dataset: Optional[Dict[str, float]] = None,
+        burst: Optional[float] = None,
+    ) -> None:
+        for rate in [max_tps, *(per_dataset or {}).values()]:
+            if rate is not None and rate <= 0:
+                raise ValueError("Trace rate caps must be positive")
+        self.max_tps = max_tps
+        self.per_dataset = dict(per_dataset or {})
+        self.burst = burst
+        self.reason = RATE_CAPPED
+        self._buckets: Dict[Optional[str], Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def keep(
+        self,
+        messages: List[Dict],
+        annotations: Optional[List[Any]],
+        metadata: Optional[Dict],
+        dataset: Optional[str],
+    ) -> bool:
+        """Return whether to keep the trace, taking a token if so."""
+        rate = self.per_dataset.get(dataset, self.max_tps)
+        if rate is None:
+            return True
+        burst = self.burst if self.burst is not None else max(rate, 1.0)
+        with self._lock:
+            now = time.monotonic()
+            tokens, refilled_at = self._buckets.get(dataset, (burst, now))
+            tokens = min(burst, tokens + (now - refilled_at) * rate)
+            kept = tokens >= 1
+            self._buckets[dataset] = (tokens - 1 if kept else tokens, now)
+        return kept
+
+
+class KeepAnnotated:
+    """Always keeps traces that have annotations."""
+
+    __slots__ = []
+
+    def keep(
+        self,
+        messages: List[Dict],
+        annotations: Optional[List[Any]],
+        metadata: Optional[Dict],
+        dataset: Optional[str],
+    ) -> bool:
+        """Return whether the trace has annotations."""
+        return bool(annotations)
+
+
+class KeepErrors:
+    """
+    Always keeps traces with a message that looks like an error.
+
+    A message looks like an error if it has a truthy "error" field, or if its
+    content, when a string, matches `pattern` (by default the words error,
+    exception, traceback, failed or failure, in any case).
+
+    Args:
+        pattern: the regular expression to search message contents for.
+        roles: only look at the messages of these roles, e.g. ["tool"], or at
+               all messages if None.
+    """
+
+    __slots__ = ["pattern", "roles"]
+
+    def __init__(
+        self,
+        pattern: Union[str, Pattern[str]] = DEFAULT_ERROR_PATTERN,
+        roles: Optional[Sequence[str]] = None,
+    ) -> None:
+        self.pattern = re.compile(pattern) if isinstance(pattern, str) else pattern
+        self.roles = frozenset(roles) if roles is not None else None
+
+    def keep(
+        self,
+        messages: List[Dict],
+        annotations: Optional[List[Any]],
+        metadata: Optional[Dict],
+        dataset: Optional[str],
+    ) -> bool:
+        """Return whether a message of the trace looks like an error."""
+        for message in messages:
+            if self.roles is not None and message.get("role") not in self.roles:
+                continue
+            if message.get("error"):
+                return True
+            content = message.get("content")
+            if isinstance(content, str) and self.pattern.search(content):
+                return True
+        return False
+
+
+class LoadShedder:
+    """
+    Sheds a growing share of traces while the client falls behind.
+
+    The clients report the backlog, i.e. the traces accepted by `push_trace` or
+    queued by `push_trace_async` and not pushed yet, and the latency of every
+    push. At most every `interval_s`, the keep rate is adjusted:
+
+    - it is multiplied by `decrease`, down to `min_rate`, while the backlog is
+      above `max_backlog` traces or the moving average of the push latency is
+      above `max_latency_ms`;
+    - it grows by `increase`, up to 1, once the backlog is down to half of
+      `max_backlog` and the latency is under its limit again. In between, it
+      stays as it is.
+
+    In a `SamplingPolicy`, the traces matched by an `always_keep` rule are the
+    high-priority ones and are never shed. The others are kept with the current
+    rate; the ones shed are counted in `invariant_sdk_dropped_traces_total`
+    with the reason "shed", and every change of the rate in
+    `invariant_sdk_load_shedding_adjustments_total`.
+
+    Args:
+        max_backlog: the most traces to have waiting before shedding.
+        max_latency_ms: the push latency to shed above, or None to only look
+                        at the backlog.
+        min_rate: the lowest keep rate.
+        decrease: the factor the rate is multiplied by when overloaded.
+        increase: how much the rate grows by when not.
+        interval_s: the least time between two adjustments.
+        seed: the seed of the random numbers, for reproducible shedding.
+    """
+
+    __slots__ = [
+        "max_backlog",
+        "max_latency_ms",
+        "min_rate",
+        "decrease",
+        "increase",
+        "interval_s",
+        "reason",
+        "_rate",
+        "_backlog",
+        "_latency_ms",
+        "_adjusted_at",
+        "_random",
+        "_lock",
+    ]
+
+    # The weight of the latest push in the moving average of the latency.
+    _LATENCY_WEIGHT = 0.2
+
+    def __init__(
+        self,
+        max_backlog: int = 10_000,
+        max_latency_ms: Optional[float] = None,
+        min_rate: float = 0.01,
+        decrease: float = 0.8,
+        increase: float = 0.05,
+        interval_s: float = 1.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        _check_rate(min_rate)
+        if max_backlog <= 0 or not 0 < decrease < 1 or increase <= 0:
+            raise ValueError("Expected max_backlog > 0, 0 < decrease < 1, increase > 0")
+        self.max_backlog = max_backlog
+        self.max_latency_ms = max_latency_ms
+        self.min_rate = min_rate
+        self.decrease = decrease
+        self.increase = increase
+        self.interval_s = interval_s
+        self.reason = SHED
+        self._rate = 1.0
+        self._backlog = 0
+        self._latency_ms: Optional[float] = None
+        self._adjusted_at = time.monotonic()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        """The fraction of low-priority traces currently kept."""
+        return self._rate
+
+    @property
+    def backlog(self) -> int:
+        """The number of traces waiting to be pushed."""
+        return self._backlog
+
+    def keep(
+        self,
+        messages: List[Dict],
+        annotations: Optional[List[Any]],
+        metadata: Optional[Dict],
+        dataset: Optional[str],
+    ) -> bool:
+        """Return whether to keep the trace."""
+        return self._rate >= 1 or self._random.random() < self._rate
+
+    def observe_backlog(self, delta: int) -> float:
+        """
+        Count traces joining (positive) or leaving (negative) the backlog.
+
+        Returns:
+            float: The change of the keep rate this caused, usually 0.
+        """
+        with self._lock:
+            self._backlog += delta
+            return self._adjust()
+
+    def observe_latency(self, latency_ms: float) -> float:
+        """
+        Record the latency of a push.
+
+        Returns:
+            float: The change of the keep rate this caused, usually 0.
+        """
+        with self._lock:
+            if self._latency_ms is None:
+                self._latency_ms = latency_ms
+            else:
+                self._latency_ms += self._LATENCY_WEIGHT * (
+                    latency_ms - self._latency_ms
+                )
+            return self._adjust()
+
+    def _adjust(self) -> float:
+        now = time.monotonic()
+        if now - self._adjusted_at < self.interval_s:
+            return 0.0
+        self._adjusted_at = now
+        slow = (
+            self.max_latency_ms is not None
+            and self._latency_ms is not None
+            and self._latency_ms > self.max_latency_ms
+        )
+        rate = self._rate
+        if slow or self._backlog > self.max_backlog:
+            self._rate = max(self.min_rate, rate * self.decrease)
+        elif self._backlog <= self.max_backlog / 2:
+            self._rate = min(1.0, rate + self.increase)
+        return self._rate - rate
+
+
+class SamplingPolicy:
+    """
+    Decides which traces a client pushes and which it drops.
+
+    A trace is kept if any of the `always_keep` rules keeps it. Otherwise it goes
+    through the `samplers` in order and is dropped by the first one that does not
+    keep it, so a rate cap placed last only counts the traces the others kept.
+    Samplers and rules are objects with a `keep(messages, annotations, metadata,
+    dataset)` method; samplers also have a `reason`, the label of the traces they
+    drop in the `invariant_sdk_dropped_traces_total` metric. A `load_shedder`
+    comes after the samplers, and is fed the client's backlog and latency.
+
+    The client decides before the traces are validated or encoded: dropped
+    traces are only looked at by the policy. `push_trace` returns None in place
+    of the id of every dropped trace.
+
+    Usage:
+        client = Client(
+            sampling_policy=SamplingPolicy(
+                samplers=[HashSampler("session_id", 0.1)],
+                always_keep=[KeepAnnotated(), KeepErrors()],
+            )
+        )
+
+    Args:
+        samplers: the samplers every trace must pass.
+        always_keep: the rules for traces to keep regardless of the samplers.
+        load_shedder: sheds the traces that are not always kept while the client
+                      falls behind.
+    """
+
+    __slots__ = ["samplers", "always_keep", "load_shedder"]
+
+    def __init__(
+        self,
+        samplers: Sequence[Any] = (),
+        always_keep: Sequence[Any] = (),
+        load_shedder: Optional[LoadShedder] = None,
+    ) -> None:
+        self.samplers = list(samplers)
+        self.always_keep = list(always_keep)
+        self.load_shedder = load_shedder
+
+    def drop_reason(
+        self,
+        messages: List[Dict],
+        annotations: Optional[List[Any]] = None,
+        metadata: Optional[Dict] = None,
+        dataset: Optional[str] = None,
+    ) -> Optional[str]:
+        """Return why to drop a trace, or None to keep it."""
+        for rule in self.always_keep:
+            if rule.keep(messages, annotations, metadata, dataset):
+                return None
+        for sampler in self.samplers:
+            if not sampler.keep(messages, annotations, metadata, dataset):
+                return sampler.reason
+        shedder = self.load_shedder
+        if shedder is not None and not shedder.keep(
+            messages, annotations, metadata, dataset
+        ):
+            return shedder.reason
+        return None
+
+    def sample(
+        self,
+        messages: List[List[Dict]],
+        annotations: Optional[List[List[Any]]] = None,
+        metadata: Optional[List[Dict]] = None,
+        dataset: Optional[str] = None,
+    ) -> List[Optional[str]]:
+        """Return the drop reason of every trace, None for the traces to keep."""
+        return [
+            self.drop_reason(
+                trace,
+                annotations[index] if annotations else None,
+                metadata[index] if metadata else None,
+                dataset,
+            )
+            for index, trace in enumerate(messages)
+        ]
+
+
+def _check_rate(rate: float) -> None:
+    if not 0 <= rate <= 1:
+        raise ValueError("Sampling rates must be between 0 and 1")
@@ -0,0 +1,113 @@
+"""Single-flight deduplication of concurrent identical calls."""
+
+import asyncio
+import copy
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _Call:
+    """A call in flight and, once done, its outcome."""
+
+    __slots__ = ["done", "result", "error"]
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time across threads.
+
+    The first caller for a key (the leader) runs the call. Callers arriving
+    while it is in flight wait for it and receive a deep copy of its result, or
+    the same exception. Results are not kept once the call finishes, so this is
+    no cache: a caller arriving afterwards starts a new call.
+    """
+
+    __slots__ = ["_calls", "_lock"]
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Run `fn`, or join the call already in flight for `key`.
+
+        Args:
+            key (Hashable): Identifies calls which are interchangeable.
+            fn (Callable[[], Any]): The call to run if none is in flight.
+
+        Returns:
+            Any: The result of the call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self) -> int:
+        """Return the number of calls in flight."""
+        with self._lock:
+            return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """
+    Runs at most one call per key at a time within an event loop.
+
+    Same contract as `SingleFlight`. The call runs in its own task, so a
+    cancelled caller (even the first one) does not cancel it for the others.
+    """
+
+    __slots__ = ["_calls"]
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await `fn()`, or join the call already in flight for `key`.
+
+        Args:
+            key (Hashable): Identifies calls which are interchangeable.
+            fn (Callable[[], Awaitable[Any]]): Creates the call to run if none is in
+                                               flight.
+
+        Returns:
+            Any: The result of the call.
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            return copy.deepcopy(await asyncio.shield(task))
+        task = asyncio.ensure_future(fn())
+        self._calls[key] = task
+        task.add_done_callback(lambda _: self._forget(key, task))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def in_flight(self) -> int:
+        """Return the number of calls in flight."""
+        return len(self._calls)
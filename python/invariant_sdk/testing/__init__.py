@@ -0,0 +1 @@
+"""Helpers for testing and load testing code that uses the Invariant SDK."""
@@ -0,0 +1,257 @@
+"""Stub server that injects network and HTTP faults on a schedule."""
+
+import argparse
+import json
+import random
+import socket
+import struct
+import threading
+import time
+from typing import Any, Dict, Optional, Sequence
+
+from invariant_sdk.testing.stub_server import StubRequestHandler, StubServer
+
+NO_FAULT = "none"
+SLOW_HEADERS = "slow_headers"
+SLOW_BODY = "slow_body"
+RESET_MID_BODY = "reset_mid_body"
+RATE_LIMITED = "rate_limited"
+UNAVAILABLE = "unavailable"
+STALL = "stall"
+
+FAULT_KINDS = (
+    SLOW_HEADERS,
+    SLOW_BODY,
+    RESET_MID_BODY,
+    RATE_LIMITED,
+    UNAVAILABLE,
+    STALL,
+)
+
+
+class FaultSchedule:
+    """
+    Decides which fault, if any, each request gets.
+
+    Either a fixed `sequence` of fault kinds that is cycled through, or a random
+    schedule where each request is faulted with probability `rate` and the kind
+    is drawn uniformly from `kinds`.
+    """
+
+    __slots__ = ["rate", "kinds", "sequence", "counts", "_rng", "_position", "_lock"]
+
+    def __init__(
+        self,
+        rate: float = 0.0,
+        kinds: Sequence[str] = FAULT_KINDS,
+        sequence: Optional[Sequence[str]] = None,
+        seed: int = 0,
+    ) -> None:
+        unknown = set(sequence or kinds) - set(FAULT_KINDS) - {NO_FAULT}
+        if unknown:
+            raise ValueError(f"Unknown fault kinds: {sorted(unknown)}")
+        self.rate = rate
+        self.kinds = tuple(kinds)
+        self.sequence = tuple(sequence) if sequence else None
+        self.counts: Dict[str, int] = {}
+        self._rng = random.Random(seed)
+        self._position = 0
+        self._lock = threading.Lock()
+
+    def next(self) -> str:
+        """Return the fault kind for the next request."""
+        with self._lock:
+            if self.sequence is not None:
+                kind = self.sequence[self._position % len(self.sequence)]
+                self._position += 1
+            elif self.kinds and self._rng.random() < self.rate:
+                kind = self._rng.choice(self.kinds)
+            else:
+                kind = NO_FAULT
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            return kind
+
+
+class FaultInjectingRequestHandler(StubRequestHandler):
+    """Serves like the stub handler, except faulted requests and those over capacity."""
+
+    server: Any
+
+    def _handle(self, handler) -> None:
+        fault_server: FaultInjectingServer = self.server.stub
+        if not fault_server.enter():
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            fault_server.stats.record(len(body), 0)
+            self._fault_rate_limited(fault_server)
+            return
+        try:
+            self._handle_scheduled(handler, fault_server)
+        finally:
+            fault_server.leave()
+
+    def _handle_scheduled(self, handler, fault_server: "FaultInjectingServer") -> None:
+        kind = fault_server.schedule.next()
+        if kind == NO_FAULT:
+            super()._handle(handler)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        fault_server.stats.record(len(body), 0)
+        getattr(self, f"_fault_{kind}")(fault_server)
+
+    def _fault_slow_headers(self, fault_server: "FaultInjectingServer") -> None:
+        time.sleep(fault_server.slow_ms / 1000)
+        self._respond(200, _fake_payload(self.path), {})
+
+    def _fault_slow_body(self, fault_server: "FaultInjectingServer") -> None:
+        data = json.dumps(_fake_payload(self.path)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data[:1])
+        self.wfile.flush()
+        time.sleep(fault_server.slow_ms / 1000)
+        self.wfile.write(data[1:])
+
+    def _fault_reset_mid_body(self, _: "FaultInjectingServer") -> None:
+        data = json.dumps(_fake_payload(self.path)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data) * 2))
+        self.end_headers()
+        self.wfile.write(data[: len(data) // 2])
+        self.wfile.flush()
+        # A zero linger time makes close() send a RST instead of a FIN.
+        self.connection.setsockopt(
+            socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0)
+        )
+        self.close_connection = True
+
+    def _fault_rate_limited(self, fault_server: "FaultInjectingServer") -> None:
+        self._respond(
+            429,
+            {"detail": "rate limited"},
+            {"Retry-After": str(fault_server.retry_after_s)},
+        )
+
+    def _fault_unavailable(self, fault_server: "FaultInjectingServer") -> None:
+        self._respond(
+            503,
+            {"detail": "unavailable"},
+            {"Retry-After": str(fault_server.retry_after_s)},
+        )
+
+    def _fault_stall(self, fault_server: "FaultInjectingServer") -> None:
+        # Hold the keep-alive connection open without ever answering.
+        time.sleep(fault_server.stall_ms / 1000)
+        self.close_connection = True
+
+
+def _fake_payload(path: str) -> Dict[str, Any]:
+    if path.endswith("/messages"):
+        return {"success": True}
+    if "/push/" in path:
+        return {"id": ["faulted"], "dataset": None, "username": "stub"}
+    return {}
+
+
+class FaultInjectingServer(StubServer):
+    """
+    Stub server that injects faults according to a `FaultSchedule`.
+
+    Faults:
+        slow_headers: the response starts after `slow_ms`.
+        slow_body: the status line and headers are sent at once, the rest of the
+                   body after `slow_ms`.
+        reset_mid_body: half of the body is sent, then the connection is reset.
+        rate_limited / unavailable: 429 / 503 with `Retry-After: retry_after_s`.
+        stall: the request is read but never answered; the connection is closed
+               after `stall_ms`.
+
+    With `max_in_flight`, the server also has a capacity: requests arriving while
+    that many are being served are answered with 429 (counted in `overloaded`).
+    """
+
+    __slots__ = [
+        "schedule",
+        "slow_ms",
+        "stall_ms",
+        "retry_after_s",
+        "max_in_flight",
+        "overloaded",
+        "_in_flight",
+        "_in_flight_lock",
+    ]
+
+    def __init__(
+        self,
+        schedule: Optional[FaultSchedule] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency_ms: float = 0,
+        slow_ms: float = 1_000,
+        stall_ms: float = 5_000,
+        retry_after_s: int = 1,
+        max_in_flight: Optional[int] = None,
+    ) -> None:
+        super().__init__(
+            host, port, latency_ms, handler_class=FaultInjectingRequestHandler
+        )
+        self.schedule = schedule or FaultSchedule()
+        self.slow_ms = slow_ms
+        self.stall_ms = stall_ms
+        self.retry_after_s = retry_after_s
+        self.max_in_flight = max_in_flight
+        self.overloaded = 0
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    def enter(self) -> bool:
+        """Start serving a request, or return False if the server is at capacity."""
+        with self._in_flight_lock:
+            if self.max_in_flight is not None and self._in_flight >= self.max_in_flight:
+                self.overloaded += 1
+                return False
+            self._in_flight += 1
+            return True
+
+    def leave(self) -> None:
+        """Finish serving a request."""
+        with self._in_flight_lock:
+            self._in_flight -= 1
+
+
+def main() -> None:
+    """Run the fault-injecting server until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--fault-rate", type=float, default=0.05)
+    parser.add_argument("--faults", nargs="+", choices=FAULT_KINDS, default=FAULT_KINDS)
+    parser.add_argument("--slow-ms", type=float, default=1_000)
+    parser.add_argument("--stall-ms", type=float, default=5_000)
+    parser.add_argument("--retry-after-s", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-in-flight", type=int, default=None)
+    args = parser.parse_args()
+
+    server = FaultInjectingServer(
+        FaultSchedule(args.fault_rate, args.faults, seed=args.seed),
+        args.host,
+        args.port,
+        args.latency_ms,
+        args.slow_ms,
+        args.stall_ms,
+        args.retry_after_s,
+        args.max_in_flight,
+    )
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+"""Local stand-in for the Explorer API, for load tests and benchmarks."""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from invariant_sdk.base_client import (
+    DATASET_EXPORT_API_PATH,
+    DATASET_METADATA_API_PATH,
+    DATASET_UPLOAD_API_PATH,
+    PUSH_TRACE_API_PATH,
+    TRACE_API_PATH,
+)
+
+_METADATA_PATH_REGEX = re.compile(rf"^{DATASET_METADATA_API_PATH}/([^/?]+)")
+_MESSAGES_PATH_REGEX = re.compile(rf"^{TRACE_API_PATH}/([^/?]+)/messages$")
+_EXPORT_PATH_REGEX = re.compile(rf"^{DATASET_EXPORT_API_PATH}/([^/?]+)(?:\?(.*))?$")
+_UPLOAD_NAME_REGEX = re.compile(rb'name="name"\r\n\r\n([^\r]*)\r\n')
+_UPLOAD_READ_BYTES = 1024 * 1024
+
+
+class StubStats:
+    """Counters of what the stub server has received."""
+
+    __slots__ = ["requests", "bytes_received", "bytes_sent", "traces", "_lock"]
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.traces = 0
+        self._lock = threading.Lock()
+
+    def record(self, received: int, sent: int, traces: int = 0) -> None:
+        """Count one request."""
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += received
+            self.bytes_sent += sent
+            self.traces += traces
+
+    def to_json(self) -> Dict[str, int]:
+        """Convert the counters to a JSON-serializable dictionary."""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "bytes_received": self.bytes_received,
+                "bytes_sent": self.bytes_sent,
+                "traces": self.traces,
+            }
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """Implements the push, upload, export, metadata and append messages endpoints."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, Nagle's algorithm and
+    # delayed ACKs add ~40 ms to every response.
+    disable_nagle_algorithm = True
+    server: "_StubHTTPServer"
+
+    def log_message(
+        self,
+        format: str,  # pylint: disable=redefined-builtin
+        *args: Any,
+    ) -> None:
+        """Keep the load generator output clean."""
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Export traces, or get the metadata of a dataset honouring If-None-Match."""
+        if _EXPORT_PATH_REGEX.match(self.path):
+            self._handle(self._export)
+        else:
+            self._handle(self._get_metadata)
+
+    def do_PUT(self) -> None:  # pylint: disable=invalid-name
+        """Update the metadata of a dataset."""
+        self._handle(self._update_metadata)
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        """Push traces, upload a dataset file or append messages to a trace."""
+        if self.path == DATASET_UPLOAD_API_PATH:
+            self._upload()
+        else:
+            self._handle(self._post)
+
+    def _handle(self, handler) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.stub.delay()
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            status, payload, headers, traces = 401, {"detail": "unauthorized"}, {}, 0
+        else:
+            try:
+                status, payload, headers, traces = handler(
+                    json.loads(body) if body else None
+                )
+            except (ValueError, KeyError, TypeError):
+                status, payload, headers, traces = 400, {"detail": "bad request"}, {}, 0
+        self._respond(status, payload, headers, received=len(body), traces=traces)
+
+    def _upload(self) -> None:
+        # Uploads can be larger than memory, so the multipart body is read in
+        # chunks: the form fields come first, then the file up to the boundary.
+        stub = self.server.stub
+        length = int(self.headers.get("Content-Length") or 0)
+        tail = len(f"\r\n--{self.headers.get_param('boundary')}--\r\n")
+        name, start, lines, last = None, None, 0, b"\n"
+        kept = bytearray() if stub.store_traces else None
+        position = 0
+        while position < length:
+            chunk = self.rfile.read(min(length - position, _UPLOAD_READ_BYTES))
+            if not chunk:
+                break
+            if start is None:
+                match = _UPLOAD_NAME_REGEX.search(chunk)
+                name = match.group(1).decode() if match else None
+                headers_end = chunk.find(b"\r\n\r\n", chunk.find(b'name="file"'))
+                start = headers_end + 4 if headers_end != -1 else length
+            data = chunk[max(start - position, 0) : length - tail - position]
+            position += len(chunk)
+            if data:
+                lines += data.count(b"\n")
+                last = data[-1:]
+                if kept is not None:
+                    kept += data
+        stub.delay()
+        traces = 0
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            status, payload = 401, {"detail": "unauthorized"}
+        elif name is None or position < length:
+            status, payload = 400, {"detail": "bad request"}
+        else:
+            try:
+                if kept is not None:
+                    traces = stub.add_jsonl(name, bytes(kept))
+                else:
+                    traces = lines + (last != b"\n")
+                status, payload = 200, {"id": str(uuid.uuid4()), "name": name}
+            except (ValueError, KeyError, TypeError):
+                status, payload = 400, {"detail": "bad request"}
+        self._respond(status, payload, {}, received=position, traces=traces)
+
+    def _respond(
+        self,
+        status: int,
+        payload: Union[None, Dict, bytes],
+        headers: Dict[str, str],
+        received: Optional[int] = None,
+        traces: int = 0,
+    ) -> None:
+        if isinstance(payload, bytes):
+            data = payload
+        else:
+            data = json.dumps(payload).encode() if payload is not None else b""
+        if received is not None:
+            # Counted before it is sent, so a client that has the response sees it.
+            self.server.stub.stats.record(received, len(data), traces)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if payload is not None and "Content-Type" not in headers:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _post(self, body: Any) -> Tuple[int, Optional[Dict], Dict[str, str], int]:
+        if self.path == PUSH_TRACE_API_PATH:
+            ids = [str(uuid.uuid4()) for _ in body["messages"]]
+            if self.server.stub.store_traces and body.get("dataset"):
+                self.server.stub.add_traces(
+                    body["dataset"],
+                    ids,
+                    body["messages"],
+                    body.get("annotations"),
+                    body.get("metadata"),
+                )
+            payload = {"id": ids, "dataset": body.get("dataset"), "username": "stub"}
+            return 200, payload, {}, len(ids)
+        if _MESSAGES_PATH_REGEX.match(self.path):
+            if not body["messages"]:
+                raise ValueError("messages cannot be empty")
+            return 200, {"success": True}, {}, 0
+        return 404, {"detail": "not found"}, {}, 0
+
+    def _export(self, _: Any) -> Tuple[int, Optional[bytes], Dict[str, str], int]:
+        match = _EXPORT_PATH_REGEX.match(self.path)
+        query = urllib.parse.parse_qs(match.group(2) or "")
+        page = self.server.stub.export(
+            match.group(1),
+            int(query.get("offset", ["0"])[0]),
+            int(query.get("limit", ["1000"])[0]),
+        )
+        if page is None:
+            return 404, {"detail": "not found"}, {}, 0
+        return 200, page, {"Content-Type": "application/x-ndjson"}, 0
+
+    def _get_metadata(self, _: Any) -> Tuple[int, Optional[Dict], Dict[str, str], int]:
+        match = _METADATA_PATH_REGEX.match(self.path)
+        if match is None:
+            return 404, {"detail": "not found"}, {}, 0
+        metadata, etag = self.server.stub.get_metadata(match.group(1))
+        if self.headers.get("If-None-Match") == etag:
+            return 304, None, {"ETag": etag}, 0
+        return 200, metadata, {"ETag": etag}, 0
+
+    def _update_metadata(
+        self, body: Any
+    ) -> Tuple[int, Optional[Dict], Dict[str, str], int]:
+        match = _METADATA_PATH_REGEX.match(self.path)
+        if match is None:
+            return 404, {"detail": "not found"}, {}, 0
+        metadata = self.server.stub.update_metadata(
+            match.group(1), body["metadata"], bool(body.get("replace_all"))
+        )
+        return 200, metadata, {}, 0
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+    stub: "StubServer"
+
+    def handle_error(self, request, client_address) -> None:
+        # Clients giving up on a slow response are expected under load.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubServer:
+    """
+    In-process HTTP server implementing the Explorer endpoints used by the SDK.
+
+    Every response is delayed by `latency_ms` plus a uniform random jitter of up to
+    `jitter_ms`. Requests are served concurrently, one thread per connection.
+
+    With `store_traces`, traces pushed or uploaded to a dataset are kept, encoded,
+    and can be read back from the export endpoint as JSON lines. Traces can also
+    be added directly with `add_traces`.
+
+    Usage:
+        with StubServer(latency_ms=20) as server:
+            client = Client(api_url=server.url, api_key="any")
+    """
+
+    __slots__ = [
+        "latency_ms",
+        "jitter_ms",
+        "stats",
+        "_httpd",
+        "_thread",
+        "store_traces",
+        "_metadata",
+        "_metadata_lock",
+        "_traces",
+        "_traces_lock",
+    ]
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        handler_class: type = StubRequestHandler,
+        store_traces: bool = False,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.stats = StubStats()
+        self._httpd = _StubHTTPServer((host, port), handler_class)
+        self._httpd.stub = self
+        self._thread: Optional[threading.Thread] = None
+        self._metadata: Dict[str, Dict] = {}
+        self._metadata_lock = threading.Lock()
+        self.store_traces = store_traces
+        self._traces: Dict[str, List[bytes]] = {}
+        self._traces_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """The base URL to pass as `api_url`."""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        """Serve requests on a background thread."""
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever,
+            kwargs={"poll_interval": 0.05},
+            name="invariant-stub-server",
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the listening socket."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def serve_forever(self) -> None:
+        """Serve requests on the calling thread."""
+        self._httpd.serve_forever()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *_: Any) -> None:
+        self.stop()
+
+    def delay(self) -> None:
+        """Sleep for the configured latency."""
+        latency = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+    def get_metadata(self, dataset_name: str) -> Tuple[Dict, str]:
+        """Return the metadata of a dataset and its ETag."""
+        with self._metadata_lock:
+            metadata = dict(self._metadata.get(dataset_name, {}))
+        etag = hashlib.sha1(json.dumps(metadata, sort_keys=True).encode()).hexdigest()
+        return metadata, f'"{etag}"'
+
+    def update_metadata(
+        self, dataset_name: str, metadata: Dict, replace_all: bool
+    ) -> Dict:
+        """Apply a metadata update and return the resulting metadata."""
+        with self._metadata_lock:
+            current = {} if replace_all else self._metadata.get(dataset_name, {})
+            self._metadata[dataset_name] = {**current, **metadata}
+            return dict(self._metadata[dataset_name])
+
+    def add_traces(
+        self,
+        dataset_name: str,
+        ids: List[str],
+        messages: List[List[Dict]],
+        annotations: Optional[List[List[Dict]]] = None,
+        metadata: Optional[List[Dict]] = None,
+    ) -> None:
+        """Add traces to a dataset, to be read back from the export endpoint."""
+        with self._traces_lock:
+            traces = self._traces.setdefault(dataset_name, [])
+            for position, trace_id in enumerate(ids):
+                line = {
+                    "id": trace_id,
+                    "index": len(traces),
+                    "messages": messages[position],
+                    "annotations": annotations[position] if annotations else [],
+                    "metadata": metadata[position] if metadata else {},
+                }
+                traces.append(json.dumps(line).encode() + b"\n")
+
+    def add_jsonl(self, dataset_name: str, data: bytes) -> int:
+        """Add the traces of an uploaded JSONL file to a dataset and count them."""
+        messages: List[List[Dict]] = []
+        annotations: List[List[Dict]] = []
+        metadata: List[Dict] = []
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            trace = json.loads(line)
+            if isinstance(trace, list):
+                has_metadata = bool(trace) and set(trace[0]) == {"metadata"}
+                metadata.append(trace[0]["metadata"] if has_metadata else {})
+                messages.append(trace[1:] if has_metadata else trace)
+                annotations.append([])
+            elif "messages" in trace:
+                messages.append(trace["messages"])
+                annotations.append(trace.get("annotations") or [])
+                metadata.append(trace.get("metadata") or {})
+            elif not messages:
+                # The dataset metadata, on the first line.
+                self.update_metadata(dataset_name, trace["metadata"], True)
+            else:
+                raise ValueError("a trace has no messages")
+        ids = [str(uuid.uuid4()) for _ in messages]
+        self.add_traces(dataset_name, ids, messages, annotations, metadata)
+        return len(ids)
+
+    def export(self, dataset_name: str, offset: int, limit: int) -> Optional[bytes]:
+        """Return the JSON lines of traces `offset` to `offset + limit` of a dataset."""
+        with self._traces_lock:
+            traces = self._traces.get(dataset_name)
+            if traces is None:
+                return None
+            return b"".join(traces[offset : offset + limit])
+
+
+def main() -> None:
+    """Run the stub server until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--store-traces", action="store_true")
+    args = parser.parse_args()
+
+    server = StubServer(
+        args.host,
+        args.port,
+        args.latency_ms,
+        args.jitter_ms,
+        store_traces=args.store_traces,
+    )
+    # The first line tells a parent process where to connect.
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
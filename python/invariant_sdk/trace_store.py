@@ -0,0 +1,402 @@
+"""Local store of pushed traces, for debugging without querying the server."""
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from invariant_sdk import fork_safety
+from invariant_sdk.types.annotations import AnnotationCreate
+from invariant_sdk.types.push_traces import PushTracesRequest
+
+PUSHED = "pushed"
+DEDUPLICATED = "deduplicated"
+FAILED = "failed"
+
+_ANY = object()
+
+
+class StoredTrace:
+    """A trace as it was pushed, with what came of it."""
+
+    __slots__ = [
+        "trace_id",
+        "dataset",
+        "status",
+        "error",
+        "pushed_at",
+        "latency_ms",
+        "messages",
+        "annotations",
+        "metadata",
+    ]
+
+    def __init__(
+        self,
+        trace_id: Optional[str],
+        dataset: Optional[str],
+        status: str,
+        error: Optional[str],
+        pushed_at: float,
+        latency_ms: Optional[float],
+        messages: List[Dict],
+        annotations: Optional[List[Dict]],
+        metadata: Optional[Dict],
+    ) -> None:
+        self.trace_id = trace_id
+        self.dataset = dataset
+        self.status = status
+        self.error = error
+        self.pushed_at = pushed_at
+        self.latency_ms = latency_ms
+        self.messages = messages
+        self.annotations = annotations
+        self.metadata = metadata
+
+    def __repr__(self) -> str:
+        return (
+            f"StoredTrace(trace_id={self.trace_id!r}, dataset={self.dataset!r}, "
+            f"status={self.status!r})"
+        )
+
+
+class TraceStore:
+    """
+    A SQLite database of the traces a client pushed and the ids it got for them.
+
+    Pass it to a client with `Client(trace_store=TraceStore("traces.db"))`. Every
+    trace of `push_trace` is then recorded with its server id, dataset, the time
+    and latency of the push and its status: "pushed", "deduplicated" (not sent
+    because of a `dedup_index`) or "failed" (with the error, and no id).
+
+    Writes are buffered and committed in batches of `batch_size` traces, or
+    when the oldest buffered trace is `flush_interval_s` old, in WAL mode. Lookups
+    flush first, so they see every recorded trace. Call `close` to commit the
+    rest; a store that is not closed commits it when it is garbage collected or
+    at exit. Traces are indexed by id, by dataset and by each top-level metadata
+    key, so lookups do not scan the table.
+
+    Once the stored traces are larger than `max_bytes`, the oldest are deleted.
+    Sizes are those of the traces' JSON, not of the database file, which also
+    holds the indexes and is not shrunk on disk.
+
+    Args:
+        path: the SQLite database file (":memory:" for a throwaway one).
+        max_bytes: the size to keep the stored traces under. None keeps all.
+        batch_size: the number of traces to buffer before writing them.
+        flush_interval_s: the longest a trace is buffered, checked on every write.
+    """
+
+    __slots__ = [
+        "path",
+        "max_bytes",
+        "batch_size",
+        "flush_interval_s",
+        "_connection",
+        "_pending",
+        "_pending_since",
+        "_pending_traces",
+        "_stored_bytes",
+        "_lock",
+        "_closed",
+        "_exit_hook",
+        "__weakref__",
+    ]
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: Optional[int] = None,
+        batch_size: int = 256,
+        flush_interval_s: float = 1.0,
+    ) -> None:
+        if max_bytes is not None and max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        if batch_size <= 0:
+            raise ValueError("batch_size must be positive")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS traces ("
+                " seq INTEGER PRIMARY KEY,"
+                " trace_id TEXT,"
+                " dataset TEXT,"
+                " status TEXT NOT NULL,"
+                " error TEXT,"
+                " pushed_at REAL NOT NULL,"
+                " latency_ms REAL,"
+                " messages TEXT NOT NULL,"
+                " annotations TEXT,"
+                " metadata TEXT,"
+                " size INTEGER NOT NULL"
+                ")"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS traces_trace_id ON traces (trace_id)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS traces_dataset ON traces (dataset, seq)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS trace_metadata ("
+                " key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " seq INTEGER NOT NULL,"
+                " PRIMARY KEY (key, value, seq)"
+                ") WITHOUT ROWID"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS trace_metadata_key"
+                " ON trace_metadata (key, seq)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS trace_metadata_seq ON trace_metadata (seq)"
+            )
+        self._stored_bytes = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM traces"
+        ).fetchone()[0]
+        self._pending: List[tuple] = []
+        self._pending_since = 0.0
+        self._pending_traces = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        fork_safety.register(self)
+        self._exit_hook = fork_safety.at_exit(self.close, weak=True)
+
+    def _after_fork_in_child(self) -> None:
+        # The parent writes the traces it buffered. A SQLite connection must not
+        # be used across a fork, unless the database is in memory, and so copied.
+        self._pending = []
+        self._pending_traces = 0
+        self._lock = threading.Lock()
+        # The inherited exit hook only runs in the parent.
+        self._exit_hook = fork_safety.at_exit(self.close, weak=True)
+        if self.path not in ("", ":memory:"):
+            fork_safety.abandon(self._connection)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._stored_bytes = self._connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM traces"
+            ).fetchone()[0]
+
+    def record(
+        self,
+        request: PushTracesRequest,
+        trace_ids: Optional[Sequence[str]] = None,
+        statuses: Optional[Sequence[str]] = None,
+        latency_ms: Optional[float] = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """
+        Record the traces of a push request.
+
+        Args:
+            request (PushTracesRequest): The request that was pushed.
+            trace_ids (Optional[Sequence[str]]): The id of every trace, None if the
+                                                 push failed.
+            statuses (Optional[Sequence[str]]): The status of every trace. Defaults to
+                                                "pushed", or "failed" with an error.
+            latency_ms (Optional[float]): How long the push took.
+            error (Optional[BaseException]): The error the push failed with.
+        """
+        now = time.time()
+        count = len(request.messages)
+        if statuses is None:
+            statuses = [FAILED if error is not None else PUSHED] * count
+        if trace_ids is None:
+            trace_ids = [None] * count
+        error_text = f"{type(error).__name__}: {error}" if error is not None else None
+        with self._lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending.append(
+                (request, trace_ids, statuses, now, latency_ms, error_text)
+            )
+            self._pending_traces += count
+            if (
+                self._pending_traces >= self.batch_size
+                or time.monotonic() - self._pending_since >= self.flush_interval_s
+            ):
+                self._flush()
+
+    def flush(self) -> None:
+        """Write the buffered traces."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        self._pending_traces = 0
+        rows = []
+        for request, trace_ids, statuses, pushed_at, latency_ms, error in pending:
+            annotations = (
+                AnnotationCreate.bulk_to_nested_dicts(request.annotations)
+                if request.annotations is not None
+                else None
+            )
+            for index, messages in enumerate(request.messages):
+                messages_json = json.dumps(messages, default=str)
+                annotations_json = (
+                    json.dumps(annotations[index], default=str)
+                    if annotations is not None
+                    else None
+                )
+                metadata = (
+                    request.metadata[index] if request.metadata is not None else None
+                )
+                metadata_json = (
+                    json.dumps(metadata, default=str) if metadata is not None else None
+                )
+                size = (
+                    len(messages_json)
+                    + len(annotations_json or "")
+                    + len(metadata_json or "")
+                )
+                rows.append(
+                    (
+                        trace_ids[index],
+                        request.dataset,
+                        statuses[index],
+                        error,
+                        pushed_at,
+                        latency_ms,
+                        messages_json,
+                        annotations_json,
+                        metadata_json,
+                        size,
+                        metadata,
+                    )
+                )
+        with self._connection:
+            cursor = self._connection.cursor()
+            metadata_rows = []
+            for row in rows:
+                cursor.execute(
+                    "INSERT INTO traces (trace_id, dataset, status, error, pushed_at,"
+                    " latency_ms, messages, annotations, metadata, size)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    row[:10],
+                )
+                if row[10]:
+                    metadata_rows.extend(
+                        (key, json.dumps(value, default=str), cursor.lastrowid)
+                        for key, value in row[10].items()
+                    )
+            cursor.executemany(
+                "INSERT OR IGNORE INTO trace_metadata VALUES (?, ?, ?)", metadata_rows
+            )
+            self._stored_bytes += sum(row[9] for row in rows)
+            self._enforce_retention(cursor)
+
+    def _enforce_retention(self, cursor: sqlite3.Cursor) -> None:
+        if self.max_bytes is None or self._stored_bytes <= self.max_bytes:
+            return
+        excess = self._stored_bytes - self.max_bytes
+        freed = 0
+        last = None
+        for seq, size in cursor.execute("SELECT seq, size FROM traces ORDER BY seq"):
+            freed += size
+            last = seq
+            if freed >= excess:
+                break
+        cursor.execute("DELETE FROM trace_metadata WHERE seq <= ?", (last,))
+        cursor.execute("DELETE FROM traces WHERE seq <= ?", (last,))
+        self._stored_bytes -= freed
+
+    def get(self, trace_id: str) -> Optional[StoredTrace]:
+        """Return the most recent record of the trace with the given id, if any."""
+        traces = self._query(
+            "WHERE trace_id = ? ORDER BY seq DESC LIMIT 1", (trace_id,)
+        )
+        return traces[0] if traces else None
+
+    def by_dataset(
+        self, dataset: Optional[str], limit: Optional[int] = None
+    ) -> List[StoredTrace]:
+        """Return the traces pushed to a dataset, most recent first."""
+        # `IS` also matches traces pushed without a dataset when given None.
+        return self._query(
+            "WHERE dataset IS ? ORDER BY seq DESC LIMIT ?", (dataset, limit or -1)
+        )
+
+    def by_metadata(
+        self, key: str, value: Any = _ANY, limit: Optional[int] = None
+    ) -> List[StoredTrace]:
+        """
+        Return the traces with a top-level metadata key, most recent first.
+
+        Args:
+            key (str): The metadata key.
+            value (Any): If given, only traces where the key has this value.
+            limit (Optional[int]): The most traces to return.
+
+        Returns:
+            List[StoredTrace]: The traces.
+        """
+        if value is _ANY:
+            condition, params = "m.key = ?", (key,)
+        else:
+            condition = "m.key = ? AND m.value = ?"
+            params = (key, json.dumps(value, default=str))
+        return self._query(
+            f"JOIN trace_metadata AS m ON m.seq = t.seq WHERE {condition}"
+            " ORDER BY m.seq DESC LIMIT ?",
+            (*params, limit or -1),
+        )
+
+    def _query(self, clause: str, params: tuple) -> List[StoredTrace]:
+        with self._lock:
+            self._flush()
+            rows = self._connection.execute(
+                "SELECT t.trace_id, t.dataset, t.status, t.error, t.pushed_at,"
+                " t.latency_ms, t.messages, t.annotations, t.metadata"
+                f" FROM traces AS t {clause}",
+                params,
+            ).fetchall()
+        return [
+            StoredTrace(
+                *row[:6],
+                json.loads(row[6]),
+                json.loads(row[7]) if row[7] is not None else None,
+                json.loads(row[8]) if row[8] is not None else None,
+            )
+            for row in rows
+        ]
+
+    @property
+    def stored_bytes(self) -> int:
+        """The size of the stored traces, as counted for `max_bytes`."""
+        with self._lock:
+            self._flush()
+            return self._stored_bytes
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._flush()
+            return self._connection.execute("SELECT COUNT(*) FROM traces").fetchone()[0]
+
+    def close(self) -> None:
+        """Write the buffered traces and close the database."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._exit_hook.cancel()
+            try:
+                self._flush()
+            finally:
+                self._connection.close()
+
+    def __del__(self) -> None:
+        # Not set if __init__ failed, e.g. to open the database.
+        if not getattr(self, "_closed", True):
+            self.close()
@@ -1,7 +1,17 @@
 """Contains the model class for the annotation data."""
 
-from typing import Any, Dict, List, Optional
-from pydantic import BaseModel
+import functools
+from typing import Any, Dict, List, Optional, Union
+from typing_extensions import NotRequired, TypedDict
+from pydantic import BaseModel, TypeAdapter
+
+
+class AnnotationDict(TypedDict):
+    """Validated annotation data kept as a plain dict."""
+
+    content: str
+    address: str
+    extra_metadata: NotRequired[Optional[Dict[Any, Any]]]
 
 
 class AnnotationCreate(BaseModel):
@@ -26,3 +36,59 @@ class AnnotationCreate(BaseModel):
         if not isinstance(data, list) or not all(isinstance(i, dict) for i in data):
             raise ValueError("Input must be a List of Dict.")
         return [cls(**item) for item in data]
+
+    @classmethod
+    def bulk_from_nested_dicts(
+        cls, data: List[List[Dict[Any, Any]]], instantiate: bool = True
+    ) -> Union[List[List["AnnotationCreate"]], List[List[AnnotationDict]]]:
+        """
+        Validate a List of List of Dict in a single call.
+
+        Same result as `from_nested_dicts`, but the whole input is validated by one
+        cached TypeAdapter instead of a Python loop. Building the models costs as
+        much either way, so this is only faster with `instantiate=False`.
+
+        Args:
+            data (List[List[Dict[Any, Any]]]): The annotations of each trace.
+            instantiate (bool): If False, skip creating the models and return the
+                                validated dicts.
+
+        Returns:
+            Union[List[List[AnnotationCreate]], List[List[AnnotationDict]]]: The
+            validated annotations.
+
+        Raises:
+            ValueError: If the input is not a List of List of valid annotations.
+        """
+        adapter = _bulk_adapter(cls, nested=True, instantiate=instantiate)
+        return adapter.validate_python(data)
+
+    @classmethod
+    def bulk_from_dicts(
+        cls, data: List[Dict[Any, Any]], instantiate: bool = True
+    ) -> Union[List["AnnotationCreate"], List[AnnotationDict]]:
+        """
+        Validate a List of Dict in a single call.
+
+        Same as `bulk_from_nested_dicts`, for the annotations of a single trace.
+        """
+        adapter = _bulk_adapter(cls, nested=False, instantiate=instantiate)
+        return adapter.validate_python(data)
+
+    @classmethod
+    def bulk_to_nested_dicts(
+        cls, annotations: List[List["AnnotationCreate"]]
+    ) -> List[List[Dict[Any, Any]]]:
+        """
+        Convert a List of List of AnnotationCreate to dicts in a single call.
+
+        The inverse of `bulk_from_nested_dicts`, by the same cached TypeAdapter.
+        """
+        adapter = _bulk_adapter(cls, nested=True, instantiate=True)
+        return adapter.dump_python(annotations)
+
+
+@functools.lru_cache(maxsize=None)
+def _bulk_adapter(model: type, nested: bool, instantiate: bool) -> TypeAdapter:
+    item = model if instantiate else AnnotationDict
+    return TypeAdapter(List[List[item]] if nested else List[item])
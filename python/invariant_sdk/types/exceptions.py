@@ -1,5 +1,7 @@
 """Describes the exceptions that can be raised by the Invariant SDK."""
 
+from typing import Optional
+
 
 class InvariantError(Exception):
     """An error occurred while communicating with the Invariant API."""
@@ -20,5 +22,22 @@ class InvariantAuthError(InvariantError):
 class InvariantNotFoundError(InvariantError):
     """Couldn't find the requested resource."""
 
+
 class InvariantAPITimeoutError(InvariantError):
     """Request to the Invariant API timed out."""
+
+
+class InvariantAPIBusyError(InvariantError):
+    """The Invariant API asked the client to back off."""
+
+    def __init__(self, message: str, retry_after_s: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.retry_after_s = retry_after_s
+
+
+class InvariantRateLimitError(InvariantAPIBusyError):
+    """The Invariant API is rate limiting the client (429)."""
+
+
+class InvariantServiceUnavailableError(InvariantAPIBusyError):
+    """The Invariant API is temporarily unavailable (503)."""
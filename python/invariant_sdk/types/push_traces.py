@@ -8,6 +8,7 @@ from pydantic import BaseModel
 
 DATASET_NAME_REGEX = re.compile(r"^[a-zA-Z0-9-_]+$")
 
+
 class PushTracesRequest(BaseModel):
     """Model class which holds the PushTraces API request."""
 
@@ -41,6 +42,7 @@ class PushTracesRequest(BaseModel):
         annotations: Optional[List[List[AnnotationCreate]]],
         metadata: Optional[List[Dict]],
         dataset: Optional[str],
+        annotation_type: Any = AnnotationCreate,
     ):
         """
         Validate the fields of the PushTracesRequest object.
@@ -50,6 +52,8 @@ class PushTracesRequest(BaseModel):
             annotations (Optional[List[AnnotationCreate]]): The annotations to validate.
             metadata (Optional[List[Metadata]]): The metadata to validate.
             dataset (Optional[str]): The dataset name to validate.
+            annotation_type (Any): The type, or tuple of types, of the annotations,
+                                   e.g. dict to check annotations not yet converted.
 
         Raises:
             ValueError: If any validation fails.
@@ -66,7 +70,7 @@ class PushTracesRequest(BaseModel):
         if annotations is not None and not all(
             isinstance(trace_annotation, list)
             and all(
-                isinstance(annotation, AnnotationCreate)
+                isinstance(annotation, annotation_type)
                 for annotation in trace_annotation
             )
             for trace_annotation in annotations
@@ -89,7 +93,8 @@ class PushTracesRequest(BaseModel):
 class PushTracesResponse(BaseModel):
     """Model class which holds the PushTraces API response."""
 
-    id: List[str]
+    # None for the traces dropped by the client's sampling policy.
+    id: List[Optional[str]]
     dataset: Optional[str] = None
     username: Optional[str] = None
 
@@ -0,0 +1,13 @@
+"""Fixtures shared by the unit tests."""
+
+import pytest
+
+
+@pytest.fixture(name="call")
+def fixture_call(is_async):
+    """Return a function that awaits what a client returned if it is async."""
+
+    async def call(coroutine_or_value):
+        return await coroutine_or_value if is_async else coroutine_or_value
+
+    return call
@@ -0,0 +1,146 @@
+"""Unit tests for parsing and validating annotation addresses."""
+
+import pytest
+from invariant_sdk.annotation_address import (
+    AddressError,
+    AnnotationAddress,
+    TracePathIndex,
+    parse_address,
+    validate_annotations,
+)
+from invariant_sdk.types.annotations import AnnotationCreate
+from invariant_sdk.types.append_messages import AppendMessagesRequest
+from invariant_sdk.types.push_traces import PushTracesRequest
+
+
+@pytest.mark.parametrize(
+    "address, expected",
+    [
+        ("messages", AnnotationAddress(("messages",))),
+        (
+            "messages.0.content:5-10",
+            AnnotationAddress(("messages", 0, "content"), start=5, end=10),
+        ),
+        (
+            "messages[0].content:L0",
+            AnnotationAddress(("messages", 0, "content"), line=0),
+        ),
+        (
+            "messages[2].tool_calls[0].function.arguments.path",
+            AnnotationAddress(
+                ("messages", 2, "tool_calls", 0, "function", "arguments", "path")
+            ),
+        ),
+    ],
+)
+def test_parse_address(address, expected):
+    """Test parsing well-formed addresses."""
+    assert parse_address(address) == expected
+
+
+@pytest.mark.parametrize(
+    "address, message",
+    [
+        ("", "Invalid annotation address path"),
+        ("messages..0", "Invalid annotation address path"),
+        ("messages[x].content", "Invalid annotation address path"),
+        ("messages.0.content:5", "Invalid annotation address range"),
+        ("messages.0.content:Lx", "Invalid annotation address range"),
+        ("messages.0.content:10-5", "Annotation address range is reversed"),
+    ],
+)
+def test_parse_address_invalid(address, message):
+    """Test that malformed addresses are rejected."""
+    with pytest.raises(ValueError, match=message):
+        parse_address(address)
+
+
+def test_trace_path_index_line_span():
+    """Test resolving line addresses through the newline offset table."""
+    index = TracePathIndex([{"role": "assistant", "content": "one\ntwo\n\nfour"}])
+    key = ("messages", "0", "content")
+    assert index.line_span(key, 0) == (0, 3)
+    assert index.line_span(key, 1) == (4, 7)
+    assert index.line_span(key, 2) == (8, 8)
+    assert index.line_span(key, 3) == (9, 13)
+    assert index.line_span(key, 4) is None
+
+
+def test_validate_push_traces_request():
+    """Test that every annotation is checked against its own trace."""
+    request = PushTracesRequest(
+        messages=[
+            [
+                {"role": "user", "content": "hello world"},
+                {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [
+                        {"function": {"name": "ls", "arguments": {"path": "/tmp"}}}
+                    ],
+                },
+            ],
+            [{"role": "user", "content": "short"}],
+        ],
+        annotations=[
+            AnnotationCreate.from_dicts(
+                [
+                    {"content": "ok", "address": "messages.0.content:6-11"},
+                    {"content": "ok", "address": "messages[0].content:L0"},
+                    {
+                        "content": "ok",
+                        "address": "messages.1.tool_calls.0.function.arguments.path",
+                    },
+                    {"content": "bad", "address": "messages.0.content:6-12"},
+                    {"content": "bad", "address": "messages.0.content:L1"},
+                ]
+            ),
+            AnnotationCreate.from_dicts(
+                [
+                    {"content": "bad", "address": "messages.1.content"},
+                    {"content": "bad", "address": "messages.0.role.x"},
+                    {"content": "bad", "address": "messages.0:0-1"},
+                    {"content": "bad", "address": "messages.0.content:oops"},
+                ]
+            ),
+        ],
+    )
+    errors = validate_annotations(request)
+    assert [(e.trace_index, e.annotation_index) for e in errors] == [
+        (0, 3),
+        (0, 4),
+        (1, 0),
+        (1, 1),
+        (1, 2),
+        (1, 3),
+    ]
+    assert errors[0] == AddressError(
+        0,
+        3,
+        "messages.0.content:6-12",
+        "range 6-12 is out of range for path messages.0.content of length 11",
+    )
+    assert errors[2].reason == "path messages.1.content does not exist in the trace"
+    assert errors[4].reason == "path messages.0 is not a string"
+
+
+def test_validate_push_traces_request_without_annotations():
+    """Test that requests without annotations are valid."""
+    request = PushTracesRequest(messages=[[{"role": "user", "content": "hi"}]])
+    assert not validate_annotations(request)
+
+
+def test_validate_append_messages_request_with_offset():
+    """Test that appended messages are addressed from the given index."""
+    request = AppendMessagesRequest(
+        trace_id="123",
+        messages=[{"role": "user", "content": "appended"}],
+        annotations=AnnotationCreate.from_dicts(
+            [
+                {"content": "ok", "address": "messages.3.content:0-8"},
+                {"content": "bad", "address": "messages.0.content"},
+            ]
+        ),
+    )
+    errors = validate_annotations(request, first_message_index=3)
+    assert [e.annotation_index for e in errors] == [1]
@@ -0,0 +1,143 @@
+"""Tests of adaptive batch sizing and batched pushes."""
+
+import json
+
+import pytest
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.batching import AdaptiveBatchSizer, slice_request, trace_sizes
+from invariant_sdk.client import Client
+from invariant_sdk.metrics import MetricsRegistry
+from invariant_sdk.testing.stub_server import StubServer
+from invariant_sdk.types.annotations import AnnotationCreate
+from invariant_sdk.types.push_traces import PushTracesRequest
+
+
+def _request(num_traces, content_size=100):
+    return PushTracesRequest(
+        messages=[
+            [{"role": "user", "content": f"{i}" + "x" * content_size}]
+            for i in range(num_traces)
+        ],
+        annotations=[
+            [AnnotationCreate(content="good", address="messages[0]")]
+            for _ in range(num_traces)
+        ],
+        metadata=[{"index": i} for i in range(num_traces)],
+        dataset="example",
+    )
+
+
+def test_converges_on_the_latency_budget():
+    """Test that the target settles where a full batch takes the budget."""
+    sizer = AdaptiveBatchSizer(latency_budget_ms=200, initial_batch_bytes=20_000)
+    # 20 ms fixed cost plus 1 ms per kB: 180 kB take 200 ms.
+    for _ in range(30):
+        size = sizer.batch_bytes
+        sizer.observe(size, size // 1000, 20 + size / 1000)
+    assert sizer.batch_bytes == pytest.approx(180_000, rel=0.02)
+    assert sizer.traces_per_batch == pytest.approx(180, rel=0.02)
+
+    # The server slows down: the batches shrink.
+    for _ in range(30):
+        size = sizer.batch_bytes
+        sizer.observe(size, size // 1000, 20 + size / 250)
+    assert sizer.batch_bytes == pytest.approx(45_000, rel=0.02)
+
+
+def test_bounds_and_underfull_batches():
+    """Test the size limits, and that small fast batches do not shrink the target."""
+    sizer = AdaptiveBatchSizer(
+        latency_budget_ms=100,
+        min_batch_bytes=1_000,
+        max_batch_bytes=10_000,
+        initial_batch_bytes=5_000,
+    )
+    assert sizer.observe(100, 1, 10) == 0
+    assert sizer.batch_bytes == 5_000
+    for _ in range(10):
+        sizer.observe(sizer.batch_bytes, 1, 1)
+    assert sizer.batch_bytes == 10_000
+    for _ in range(10):
+        sizer.observe(sizer.batch_bytes, 1, 10_000)
+    assert sizer.batch_bytes == 1_000
+    with pytest.raises(ValueError):
+        AdaptiveBatchSizer(min_batch_bytes=10, max_batch_bytes=1)
+
+
+def test_take_and_slice():
+    """Test splitting a request: at least one trace per batch, others by size."""
+    sizer = AdaptiveBatchSizer(min_batch_bytes=100, initial_batch_bytes=100)
+    assert sizer.take([40, 40, 40, 40]) == 2
+    assert sizer.take([40, 40, 40, 40], start=3) == 1
+    assert sizer.take([500, 40]) == 1
+
+    request = _request(5)
+    sizes = trace_sizes(request)
+    assert len(sizes) == 5 and all(size > 100 for size in sizes)
+    batch = slice_request(request, 1, 3)
+    assert batch.messages == request.messages[1:3]
+    assert batch.annotations == request.annotations[1:3]
+    assert batch.metadata == [{"index": 1}, {"index": 2}]
+    assert batch.dataset == "example"
+
+
+def test_trace_sizes_are_close_to_the_encoded_size():
+    """Test the estimate against the JSON encoding of varied traces."""
+    request = PushTracesRequest(
+        messages=[
+            [{"role": "user", "content": "Hi " * 300}],
+            [
+                {"role": "assistant", "content": None, "tool_calls": [{"id": 1}]},
+                {"role": "tool", "content": "[1.5, true, false]", "tool_call_id": 1},
+            ],
+        ],
+        annotations=[
+            [AnnotationCreate(content="good", address="messages.0")],
+            [AnnotationCreate(content="bad", address="messages.1", extra_metadata={})],
+        ],
+        metadata=[{"score": 0.25, "tags": ("a", "b")}, {}],
+        dataset="example",
+    )
+    for index, size in enumerate(trace_sizes(request)):
+        parts = [
+            request.messages[index],
+            [annotation.model_dump() for annotation in request.annotations[index]],
+            request.metadata[index],
+        ]
+        encoded = len(json.dumps(parts))
+        assert abs(size - encoded) <= encoded * 0.1
+
+
+def test_client_pushes_in_batches():
+    """Test that a batched push sends several requests and returns every id."""
+    registry = MetricsRegistry()
+    sizer = AdaptiveBatchSizer(min_batch_bytes=1_000, initial_batch_bytes=2_000)
+    with StubServer() as server:
+        client = Client(
+            api_url=server.url, api_key="test-key", batch_sizer=sizer, metrics=registry
+        )
+        response = client.push_trace_batched(_request(60))
+        stats = server.stats.to_json()
+
+    assert len(response.id) == len(set(response.id)) == 60
+    assert response.dataset == "example"
+    assert stats["traces"] == 60
+    assert stats["requests"] > 1
+    # A local server is far within the budget, so the batches grew.
+    assert sizer.batch_bytes > 2_000
+    assert f"invariant_sdk_batch_bytes {sizer.batch_bytes}\n" in registry.metrics_text()
+    # A sizer shared by another client is not counted twice.
+    Client(api_url=server.url, api_key="test-key", batch_sizer=sizer, metrics=registry)
+    assert f"invariant_sdk_batch_bytes {sizer.batch_bytes}\n" in registry.metrics_text()
+
+
+async def test_async_client_pushes_in_batches():
+    """Test the batched push of the async client."""
+    sizer = AdaptiveBatchSizer(min_batch_bytes=1_000, initial_batch_bytes=1_000)
+    with StubServer() as server:
+        client = AsyncClient(api_url=server.url, api_key="test-key", batch_sizer=sizer)
+        response = await client.push_trace_batched(_request(20))
+        stats = server.stats.to_json()
+    assert len(response.id) == 20
+    assert stats["traces"] == 20
+    assert stats["requests"] > 1
@@ -0,0 +1,129 @@
+"""Tests of trace deduplication by content hash."""
+
+import os
+import threading
+
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.client import Client
+from invariant_sdk.dedup import BloomFilter, DedupIndex, trace_hash
+from invariant_sdk.metrics import MetricsRegistry
+from invariant_sdk.testing.stub_server import StubServer
+
+MESSAGES = [
+    [{"role": "user", "content": "one"}],
+    [{"role": "user", "content": "two"}],
+    [{"role": "user", "content": "three"}],
+]
+
+
+class ThreadRecordingIndex(DedupIndex):
+    """Records the threads its lookups and inserts run on."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.threads = set()
+
+    def lookup(self, hashes):
+        self.threads.add(threading.get_ident())
+        return super().lookup(hashes)
+
+    def record(self, *args, **kwargs):
+        self.threads.add(threading.get_ident())
+        return super().record(*args, **kwargs)
+
+
+def test_trace_hash_is_canonical():
+    """Test that key order does not matter, but content and dataset do."""
+    messages = [{"role": "user", "content": "hi", "extra": {"a": 1, "b": 2}}]
+    reordered = [{"extra": {"b": 2, "a": 1}, "content": "hi", "role": "user"}]
+    assert trace_hash(messages) == trace_hash(reordered)
+    assert trace_hash(messages, metadata={"run": 1}) == trace_hash(
+        reordered, metadata={"run": 1}
+    )
+    assert trace_hash(messages) != trace_hash(messages, metadata={"run": 1})
+    assert trace_hash(messages) != trace_hash(messages, dataset="other")
+    assert trace_hash(messages) != trace_hash(
+        messages, annotations=[{"content": "good", "address": "messages[0]"}]
+    )
+
+
+def test_bloom_filter():
+    """Test that the filter has no false negatives and few false positives."""
+    bloom = BloomFilter(capacity=1_000, error_rate=0.01)
+    added = [os.urandom(32) for _ in range(1_000)]
+    for digest in added:
+        bloom.add(digest)
+    assert all(digest in bloom for digest in added)
+    false_positives = sum(os.urandom(32) in bloom for _ in range(10_000))
+    assert false_positives < 300
+
+    restored = BloomFilter(capacity=1_000, error_rate=0.01)
+    restored.load(bloom.to_bytes())
+    assert all(digest in restored for digest in added)
+
+
+def test_index_persists(tmp_path):
+    """Test that entries survive reopening, with and without a saved filter."""
+    path = str(tmp_path / "dedup.db")
+    first, second = os.urandom(32), os.urandom(32)
+    index = DedupIndex(path)
+    assert index.lookup([first]) == {}
+    index.record([first], ["id-1"], "example")
+    index.close()
+
+    index = DedupIndex(path)
+    assert index.lookup([first, second]) == {first: "id-1"}
+    index.record([second], ["id-2"], "example")
+    # Not closed: the saved filter misses `second` and is rebuilt on open.
+    index = DedupIndex(path)
+    assert index.lookup([first, second]) == {first: "id-1", second: "id-2"}
+    assert len(index) == 2
+    index.close()
+
+
+def test_client_skips_traces_pushed_before(tmp_path):
+    """Test that only new traces are sent and that earlier ids are reused."""
+    registry = MetricsRegistry()
+    index = DedupIndex(str(tmp_path / "dedup.db"))
+    with StubServer() as server:
+        client = Client(
+            api_url=server.url, api_key="test-key", dedup_index=index, metrics=registry
+        )
+        first = client.create_request_and_push_trace(
+            messages=MESSAGES[:2], dataset="example"
+        )
+        # A repeat, a new trace, the same new trace again and another repeat.
+        second = client.create_request_and_push_trace(
+            messages=[MESSAGES[1], MESSAGES[2], MESSAGES[2], MESSAGES[0]],
+            dataset="example",
+        )
+        assert server.stats.to_json()["traces"] == 3
+        # Everything is known now, so nothing is sent.
+        third = client.create_request_and_push_trace(
+            messages=MESSAGES, dataset="example"
+        )
+        # Another dataset is not a repeat.
+        other = client.create_request_and_push_trace(messages=MESSAGES[:1])
+        stats = server.stats.to_json()
+
+    assert second.id == [first.id[1], second.id[1], second.id[1], first.id[0]]
+    assert third.id == [first.id[0], first.id[1], second.id[1]]
+    assert third.dataset == "example"
+    assert other.id[0] not in first.id
+    assert stats["requests"] == 3
+    assert stats["traces"] == 4
+    assert "invariant_sdk_deduplicated_traces_total 6\n" in registry.metrics_text()
+    index.close()
+
+
+async def test_async_client_skips_traces_pushed_before():
+    """Test deduplication in the async client, off the event loop's thread."""
+    index = ThreadRecordingIndex(":memory:")
+    with StubServer() as server:
+        client = AsyncClient(api_url=server.url, api_key="test-key", dedup_index=index)
+        first = await client.create_request_and_push_trace(messages=MESSAGES)
+        second = await client.create_request_and_push_trace(messages=MESSAGES)
+        stats = server.stats.to_json()
+    assert second.id == first.id
+    assert stats["requests"] == 1
+    assert index.threads and threading.get_ident() not in index.threads
@@ -0,0 +1,120 @@
+"""Tests of reading the traces of a dataset back."""
+
+import threading
+
+import pytest
+import requests
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.client import Client
+from invariant_sdk.export import iter_prefetched
+from invariant_sdk.testing.stub_server import StubServer
+from invariant_sdk.types.exceptions import InvariantNotFoundError
+
+
+class RecordingSession(requests.Session):
+    """Keeps the responses it returns."""
+
+    def __init__(self):
+        super().__init__()
+        self.responses = []
+
+    def request(self, *args, **kwargs):  # pylint: disable=arguments-differ
+        response = super().request(*args, **kwargs)
+        self.responses.append(response)
+        return response
+
+
+def _fill(server, count, dataset="example"):
+    server.add_traces(
+        dataset,
+        [f"id-{i}" for i in range(count)],
+        [[{"role": "user", "content": f"trace {i}"}] for i in range(count)],
+        metadata=[{"index": i} for i in range(count)],
+    )
+
+
+def test_pushed_traces_are_read_back_in_pages():
+    """Test that every page is requested and the traces come back in order."""
+    with StubServer(store_traces=True) as server:
+        client = Client(api_url=server.url, api_key="test-key")
+        pushed = client.create_request_and_push_trace(
+            messages=[[{"role": "user", "content": f"trace {i}"}] for i in range(25)],
+            annotations=[[{"content": "good", "address": "messages.0"}]] * 25,
+            dataset="example",
+        )
+        traces = list(client.iter_dataset_traces("example", page_size=10))
+        stats = server.stats.to_json()
+
+    assert [trace["id"] for trace in traces] == pushed.id
+    assert [trace["index"] for trace in traces] == list(range(25))
+    assert traces[3]["messages"] == [{"role": "user", "content": "trace 3"}]
+    assert traces[3]["annotations"][0]["content"] == "good"
+    # One push, three pages (the last one short) and the four pages after them,
+    # requested before the last one was known to be short.
+    assert stats["requests"] == 8
+
+
+def test_stopping_early_stops_the_prefetching():
+    """Test that the producer stops once the caller stops iterating."""
+    with StubServer() as server:
+        _fill(server, 5_000)
+        client = Client(api_url=server.url, api_key="test-key")
+        traces = client.iter_dataset_traces("example", page_size=50)
+        first = [next(traces) for _ in range(5)]
+        traces.close()
+        for thread in threading.enumerate():
+            if thread.name == "invariant-export":
+                thread.join(timeout=1)
+                assert not thread.is_alive()
+        # The producer ran ahead by a bounded number of pages, not all 100.
+        assert server.stats.to_json()["requests"] < 40
+    assert [trace["id"] for trace in first] == [f"id-{i}" for i in range(5)]
+
+
+def test_errors_are_raised_after_the_traces_before_them():
+    """Test that a failing producer raises in the consumer."""
+
+    def produce(put):
+        put(1)
+        put(2)
+        raise ValueError("broken")
+
+    traces = iter_prefetched(produce, capacity=1)
+    assert next(traces) == 1
+    assert next(traces) == 2
+    with pytest.raises(ValueError, match="broken"):
+        next(traces)
+
+    session = RecordingSession()
+    with StubServer() as server:
+        client = Client(api_url=server.url, api_key="test-key", session=session)
+        with pytest.raises(InvariantNotFoundError):
+            list(client.iter_dataset_traces("missing"))
+    # The streamed error responses give their connections back to the pool.
+    assert session.responses
+    assert all(response.raw.closed for response in session.responses)
+
+
+def test_engine_client_reads_traces():
+    """Test reading traces with the sync client on its event loop engine."""
+    with StubServer() as server:
+        _fill(server, 600)
+        client = Client(api_url=server.url, api_key="test-key", engine="asyncio")
+        traces = list(client.iter_dataset_traces("example", page_size=100))
+    assert [trace["id"] for trace in traces] == [f"id-{i}" for i in range(600)]
+
+
+async def test_async_client_reads_traces():
+    """Test reading traces with the async client, including stopping early."""
+    with StubServer() as server:
+        _fill(server, 250)
+        client = AsyncClient(api_url=server.url, api_key="test-key")
+        iterator = client.aiter_dataset_traces("example", page_size=100)
+        traces = [trace async for trace in iterator]
+        assert [trace["metadata"]["index"] for trace in traces] == list(range(250))
+
+        iterator = client.aiter_dataset_traces("example", page_size=100)
+        async for trace in iterator:
+            break
+        await iterator.aclose()
+        assert trace["id"] == "id-0"
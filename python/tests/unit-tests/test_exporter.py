@@ -0,0 +1,212 @@
+"""Tests of the buffered exporter and its overflow policies."""
+
+import socket
+import threading
+import time
+
+import pytest
+from invariant_sdk.client import Client
+from invariant_sdk.exporter import BufferedExporter
+from invariant_sdk.metrics import MetricsRegistry
+from invariant_sdk.testing.stub_server import StubRequestHandler, StubServer
+from invariant_sdk.types.annotations import AnnotationCreate
+from invariant_sdk.types.exceptions import InvariantUserError
+from invariant_sdk.types.push_traces import PushTracesRequest
+
+
+def _request(i, dataset="example", size=100):
+    return PushTracesRequest(
+        messages=[[{"role": "user", "content": f"{i:04} " + "x" * size}]],
+        metadata=[{"i": i}],
+        dataset=dataset,
+    )
+
+
+def _unreachable_url():
+    """Return the URL of a port nothing listens on, so that pushes fail."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+
+class RejectingHandler(StubRequestHandler):
+    """Answers pushes to the dataset "rejected" with the status in its name."""
+
+    status = 400
+
+    def _post(self, body):
+        if body and body.get("dataset") == "rejected":
+            return self.status, {"detail": "rejected"}, {}, 0
+        return super()._post(body)
+
+
+def _dropped(registry, reason):
+    return registry.dropped_traces.value((reason,))
+
+
+def test_exports_are_merged_and_pushed_in_order():
+    """Test merging requests per dataset, with and without annotations."""
+    with StubServer(store_traces=True) as server:
+        client = Client(api_url=server.url, api_key="test-key")
+        with BufferedExporter(client) as exporter:
+            for i in range(20):
+                exporter.export(_request(i))
+            exporter.export(
+                PushTracesRequest(
+                    messages=[[{"role": "user", "content": "annotated"}]],
+                    annotations=[
+                        AnnotationCreate.from_dicts(
+                            [{"content": "note", "address": "messages.0"}]
+                        )
+                    ],
+                    dataset="example",
+                )
+            )
+            exporter.export(_request(99, dataset="other"))
+            assert exporter.flush(timeout=5)
+            assert exporter.buffered_bytes == 0
+        traces = list(client.iter_dataset_traces("example"))
+        stats = server.stats.to_json()
+
+    assert [trace["metadata"].get("i") for trace in traces] == list(range(20)) + [None]
+    assert traces[-1]["annotations"][0]["content"] == "note"
+    assert stats["traces"] == 22
+    # 22 exports in far fewer pushes, plus the export of the dataset.
+    assert stats["requests"] < 12
+
+
+@pytest.mark.parametrize("overflow", ["drop_newest", "drop_oldest"])
+def test_drop_policies_bound_the_buffer_during_an_outage(overflow):
+    """Test the byte accounting and which traces are dropped."""
+    registry = MetricsRegistry()
+    client = Client(api_url=_unreachable_url(), api_key="test-key", metrics=registry)
+    exporter = BufferedExporter(client, max_buffer_bytes=2_000, overflow=overflow)
+    results = [exporter.export(_request(i)) for i in range(50)]
+    assert exporter.buffered_bytes <= 2_000
+
+    dropped = _dropped(registry, "buffer_full") + _dropped(registry, "evicted")
+    assert 30 < dropped < 50
+    # With drop_oldest too, when a push being sent leaves no room.
+    assert results.count(False) == _dropped(registry, "buffer_full")
+    if overflow == "drop_oldest":
+        assert _dropped(registry, "evicted")
+    assert (
+        f'invariant_sdk_queue_depth{{queue="exporter_bytes"}} '
+        f"{exporter.buffered_bytes}" in registry.metrics_text()
+    )
+
+    assert not exporter.shutdown(timeout=0)
+    reasons = ("buffer_full", "evicted", "shutdown")
+    assert sum(_dropped(registry, reason) for reason in reasons) == 50
+    assert exporter.buffered_bytes == 0
+
+
+def test_shutdown_does_not_wait_for_a_slow_push():
+    """Test that a push still being sent at the timeout is counted as dropped."""
+    registry = MetricsRegistry()
+    with StubServer(latency_ms=2_000) as server:
+        client = Client(api_url=server.url, api_key="test-key", metrics=registry)
+        exporter = BufferedExporter(client)
+        exporter.export(_request(0))
+        exporter.export(_request(1, dataset="other"))
+        time.sleep(0.2)
+        started = time.monotonic()
+        assert not exporter.shutdown(timeout=0.3)
+        assert time.monotonic() - started < 1
+    assert _dropped(registry, "shutdown") == 2
+    assert exporter.buffered_bytes == 0
+
+
+def test_block_waits_for_room_then_drops():
+    """Test that the producer is held for block_timeout_s at most."""
+    registry = MetricsRegistry()
+    client = Client(api_url=_unreachable_url(), api_key="test-key", metrics=registry)
+    exporter = BufferedExporter(
+        client, max_buffer_bytes=500, overflow="block", block_timeout_s=0.1
+    )
+    assert exporter.export(_request(0, size=400))
+    start = time.perf_counter()
+    assert not exporter.export(_request(1, size=400))
+    assert time.perf_counter() - start >= 0.1
+    assert _dropped(registry, "buffer_full") == 1
+    exporter.shutdown(timeout=0)
+
+
+def test_spilled_traces_are_pushed_in_order_after_an_outage(tmp_path):
+    """Test spilling to disk while Explorer is down, and reading back after."""
+    registry = MetricsRegistry()
+    client = Client(api_url=_unreachable_url(), api_key="test-key", metrics=registry)
+    exporter = BufferedExporter(
+        client,
+        max_buffer_bytes=1_000,
+        overflow="spill",
+        spill_dir=str(tmp_path),
+        max_spill_bytes=20_000,
+        max_retry_backoff_s=0.05,
+    )
+    results = [exporter.export(_request(i)) for i in range(200)]
+    assert exporter.buffered_bytes <= 1_000 and exporter.spilled_bytes <= 20_000
+    assert exporter.spilled_bytes > 10_000
+    assert results.count(False) == _dropped(registry, "spill_full") > 0
+
+    with StubServer(store_traces=True) as server:
+        client.api_url = server.url
+        assert exporter.flush(timeout=10)
+        assert exporter.spilled_bytes == 0
+        exporter.shutdown()
+        traces = list(client.iter_dataset_traces("example"))
+
+    assert [trace["metadata"]["i"] for trace in traces] == [
+        i for i, exported in enumerate(results) if exported
+    ]
+    assert 'invariant_sdk_queue_depth{queue="exporter_spilled_bytes"} 0' in (
+        registry.metrics_text()
+    )
+
+
+@pytest.mark.parametrize("status", [400, 413, 422])
+def test_rejected_pushes_do_not_block_later_ones(status):
+    """Test that pushes failing with a client error are dropped, not retried."""
+    registry = MetricsRegistry()
+    handler = type("Handler", (RejectingHandler,), {"status": status})
+    with StubServer(store_traces=True, handler_class=handler) as server:
+        client = Client(api_url=server.url, api_key="test-key", metrics=registry)
+        with BufferedExporter(client, max_retry_backoff_s=60) as exporter:
+            exporter.export(_request(0, dataset="rejected"))
+            for i in range(1, 4):
+                exporter.export(_request(i))
+            assert exporter.flush(timeout=5)
+        traces = list(client.iter_dataset_traces("example"))
+
+    assert [trace["metadata"]["i"] for trace in traces] == [1, 2, 3]
+    assert _dropped(registry, "rejected") == 1
+
+
+def test_invalid_configuration_and_export_after_shutdown():
+    """Test the errors of misuse."""
+    client = Client(api_url=_unreachable_url(), api_key="test-key")
+    with pytest.raises(ValueError, match="overflow"):
+        BufferedExporter(client, overflow="drop_all")
+    exporter = BufferedExporter(client)
+    exporter.shutdown()
+    with pytest.raises(InvariantUserError, match="after shutdown"):
+        exporter.export(_request(0))
+
+
+def test_start_is_idempotent_and_ends_with_shutdown():
+    """Test that the background thread starts once, and not after shutdown."""
+
+    def workers():
+        return sum(
+            thread.name == "invariant-sdk-exporter" for thread in threading.enumerate()
+        )
+
+    client = Client(api_url=_unreachable_url(), api_key="test-key")
+    before = workers()
+    exporter = BufferedExporter(client)
+    exporter.start()
+    exporter.start()
+    assert workers() == before + 1
+    exporter.shutdown()
+    exporter.start()
+    assert workers() == before
@@ -0,0 +1,68 @@
+"""Tests of the client exception mapping against injected network faults."""
+
+import pytest
+from invariant_sdk.client import Client
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.testing.fault_server import (
+    FAULT_KINDS,
+    NO_FAULT,
+    FaultInjectingServer,
+    FaultSchedule,
+)
+from invariant_sdk.types.exceptions import (
+    InvariantAPITimeoutError,
+    InvariantError,
+    InvariantRateLimitError,
+    InvariantServiceUnavailableError,
+)
+
+MESSAGES = [[{"role": "user", "content": "one"}]]
+
+
+@pytest.mark.parametrize("is_async", [True, False])
+@pytest.mark.parametrize(
+    "kind, exception_cls, exception_message",
+    [
+        ("slow_headers", InvariantAPITimeoutError, "Server took too long."),
+        ("slow_body", InvariantAPITimeoutError, "Server took too long."),
+        ("reset_mid_body", InvariantError, "Connection error when calling method"),
+        ("rate_limited", InvariantRateLimitError, "Server asked to back off (429)"),
+        ("unavailable", InvariantServiceUnavailableError, "back off (503)"),
+        ("stall", InvariantAPITimeoutError, "Server took too long."),
+    ],
+)
+async def test_fault_is_mapped_and_client_recovers(
+    is_async, call, kind, exception_cls, exception_message
+):
+    """Test that each fault raises its documented exception and the client recovers."""
+    schedule = FaultSchedule(sequence=[kind, NO_FAULT])
+    with FaultInjectingServer(
+        schedule, slow_ms=1_000, stall_ms=1_000, retry_after_s=3
+    ) as server:
+        client_cls = AsyncClient if is_async else Client
+        client = client_cls(api_url=server.url, api_key="test-key", timeout_ms=200)
+
+        with pytest.raises(exception_cls) as exc_info:
+            await call(client.create_request_and_push_trace(messages=MESSAGES))
+        assert exception_message in str(exc_info.value)
+        if kind in ("rate_limited", "unavailable"):
+            assert exc_info.value.retry_after_s == 3
+
+        response = await call(client.create_request_and_push_trace(messages=MESSAGES))
+        assert len(response.id) == 1
+    assert schedule.counts == {kind: 1, NO_FAULT: 1}
+
+
+def test_fault_schedule_rate():
+    """Test that a random schedule faults roughly the configured share of requests."""
+    schedule = FaultSchedule(rate=0.2, seed=1)
+    kinds = [schedule.next() for _ in range(5_000)]
+    faulted = sum(kind != NO_FAULT for kind in kinds)
+    assert 800 < faulted < 1_200
+    assert set(kinds) == set(FAULT_KINDS) | {NO_FAULT}
+
+
+def test_fault_schedule_unknown_kind():
+    """Test that unknown fault kinds are rejected."""
+    with pytest.raises(ValueError, match="Unknown fault kinds"):
+        FaultSchedule(sequence=["explode"])
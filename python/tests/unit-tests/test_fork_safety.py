@@ -0,0 +1,143 @@
+"""Tests of using the clients in processes forked after they were created."""
+
+import os
+import signal
+import threading
+import time
+import traceback
+
+import pytest
+from invariant_sdk.client import Client
+from invariant_sdk.exporter import BufferedExporter
+from invariant_sdk.testing.stub_server import StubServer
+from invariant_sdk.trace_store import TraceStore
+from invariant_sdk.types.push_traces import PushTracesRequest
+from invariant_sdk.types.update_dataset_metadata import (
+    MetadataUpdate,
+    UpdateDatasetMetadataRequest,
+)
+
+pytestmark = [
+    pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork"),
+    # Forking with the stub server's threads running is what is tested here.
+    pytest.mark.filterwarnings("ignore:This process .* is multi-threaded"),
+]
+
+WORKERS = 4
+
+
+def _request(i, dataset="example"):
+    return PushTracesRequest(
+        messages=[[{"role": "user", "content": f"trace {i}"}]],
+        metadata=[{"pid": os.getpid()}],
+        dataset=dataset,
+    )
+
+
+def _fork(work):
+    """Run `work` in a child process, which exits with 0 if it returns True."""
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            code = 0 if work() else 1
+        except BaseException:  # pylint: disable=broad-except
+            traceback.print_exc()
+        finally:
+            os._exit(code)
+    return pid
+
+
+def _wait(pids, timeout=30):
+    """Return the exit codes of the children, killing them after `timeout`."""
+    codes = {}
+    deadline = time.monotonic() + timeout
+    while len(codes) < len(pids):
+        for pid in pids:
+            if pid not in codes:
+                done, status = os.waitpid(pid, os.WNOHANG)
+                if done:
+                    codes[pid] = os.waitstatus_to_exitcode(status)
+        if time.monotonic() > deadline:
+            for pid in set(pids) - set(codes):
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            pytest.fail("A forked worker hung")
+        time.sleep(0.01)
+    return [codes[pid] for pid in pids]
+
+
+def _push_concurrently(client, count):
+    """Push `count` traces from several threads; return whether all got ids."""
+    futures = [client.push_trace_async(_request(i)) for i in range(count // 2)]
+    responses = []
+    threads = [
+        threading.Thread(
+            target=lambda i=i: responses.append(client.push_trace(_request(i)))
+        )
+        for i in range(count - count // 2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    responses.extend(future.result(timeout=10) for future in futures)
+    return len(responses) == count and all(r.id[0] is not None for r in responses)
+
+
+@pytest.mark.parametrize("engine", ["requests", "asyncio"])
+def test_forked_workers_push_concurrently(engine):
+    """Test that children push on their own connections while the parent does."""
+    with StubServer(latency_ms=5) as server:
+        client = Client(api_url=server.url, api_key="test-key", engine=engine)
+        # Open pooled connections and start the thread pool before forking.
+        assert _push_concurrently(client, 10)
+
+        pids = [_fork(lambda: _push_concurrently(client, 20)) for _ in range(WORKERS)]
+        assert _push_concurrently(client, 20)
+        codes = _wait(pids)
+        client.shutdown()
+        stats = server.stats.to_json()
+
+    assert codes == [0] * WORKERS
+    assert stats["traces"] == 10 + 20 + WORKERS * 20
+
+
+def test_children_discard_inherited_buffers(tmp_path):
+    """Test that what the parent buffered is sent once, by the parent."""
+    store_path = str(tmp_path / "traces.db")
+    with StubServer(latency_ms=100) as server:
+        client = Client(
+            api_url=server.url,
+            api_key="test-key",
+            metadata_coalesce_window_ms=60_000,
+            trace_store=TraceStore(store_path, batch_size=1_000),
+        )
+        exporter = BufferedExporter(client)
+        for i in range(10):
+            exporter.export(_request(i))
+        client.update_dataset_metadata(
+            UpdateDatasetMetadataRequest(
+                dataset_name="example", metadata=MetadataUpdate(benchmark="parent")
+            )
+        )
+
+        def child():
+            if exporter.buffered_bytes or client.flush_dataset_metadata():
+                return False
+            for i in range(3):
+                exporter.export(_request(i, dataset="child"))
+            pushed = exporter.shutdown(timeout=5)
+            client.trace_store.flush()
+            return pushed
+
+        pid = _fork(child)
+        assert _wait([pid]) == [0]
+        assert exporter.shutdown(timeout=5)
+        assert set(client.flush_dataset_metadata()) == {"example"}
+        client.trace_store.flush()
+        stats = server.stats.to_json()
+
+    assert stats["traces"] == 13
+    assert len(client.trace_store.by_dataset("example")) == 10
+    assert len(client.trace_store.by_dataset("child")) == 3
@@ -0,0 +1,98 @@
+"""Tests of the fire-and-forget variants of the sync client."""
+
+import threading
+import time
+
+import pytest
+from invariant_sdk.client import Client
+from invariant_sdk.metrics import MetricsRegistry
+from invariant_sdk.testing.stub_server import StubServer
+from invariant_sdk.types.append_messages import AppendMessagesRequest
+from invariant_sdk.types.exceptions import InvariantNotFoundError, InvariantUserError
+from invariant_sdk.types.push_traces import PushTracesRequest, PushTracesResponse
+from invariant_sdk.types.update_dataset_metadata import (
+    MetadataUpdate,
+    UpdateDatasetMetadataRequest,
+)
+
+PUSH_REQUEST = PushTracesRequest(messages=[[{"role": "user", "content": "one"}]])
+
+
+def test_submitted_requests_run_concurrently():
+    """Test that pushes return futures at once and run on the pool in parallel."""
+    done = []
+    with StubServer(latency_ms=100) as server:
+        client = Client(api_url=server.url, api_key="test-key", max_workers=8)
+        start = time.perf_counter()
+        futures = [client.push_trace_async(PUSH_REQUEST) for _ in range(8)]
+        assert time.perf_counter() - start < 0.1
+        for future in futures:
+            future.add_done_callback(done.append)
+        responses = [future.result(timeout=5) for future in futures]
+        elapsed = time.perf_counter() - start
+        assert client.shutdown(timeout=5)
+
+    assert all(isinstance(response, PushTracesResponse) for response in responses)
+    assert elapsed < 0.5
+    assert len(done) == 8
+    assert server.stats.to_json()["requests"] == 8
+
+
+def test_append_and_metadata_variants():
+    """Test the append and metadata update variants, and errors reaching the future."""
+    with StubServer() as server:
+        client = Client(api_url=server.url, api_key="test-key")
+        trace_id = client.push_trace_async(PUSH_REQUEST).result(timeout=5).id[0]
+        appended = client.append_messages_async(
+            AppendMessagesRequest(
+                trace_id=trace_id, messages=[{"role": "assistant", "content": "two"}]
+            )
+        )
+        updated = client.update_dataset_metadata_async(
+            UpdateDatasetMetadataRequest(
+                dataset_name="example", metadata=MetadataUpdate(accuracy=0.5)
+            )
+        )
+        failed = client.submit(client.request, "POST", "/api/v1/unknown", {"json": {}})
+        assert appended.result(timeout=5) == {"success": True}
+        assert updated.result(timeout=5) == {"accuracy": 0.5}
+        assert isinstance(failed.exception(timeout=5), InvariantNotFoundError)
+        assert client.shutdown()
+
+
+def test_shutdown_drains_in_flight_work():
+    """Test that shutdown waits for queued work and then refuses new work."""
+    registry = MetricsRegistry()
+    with StubServer(latency_ms=50) as server:
+        client = Client(
+            api_url=server.url, api_key="test-key", max_workers=2, metrics=registry
+        )
+        futures = [client.push_trace_async(PUSH_REQUEST) for _ in range(6)]
+        assert registry.queue_depth.value(("submitted",)) > 0
+        assert client.shutdown(timeout=5)
+        assert all(future.done() and not future.cancelled() for future in futures)
+        with pytest.raises(InvariantUserError, match="after shutdown"):
+            client.push_trace_async(PUSH_REQUEST)
+    assert registry.queue_depth.value(("submitted",)) == 0
+
+
+def test_shutdown_timeout_cancels_queued_work():
+    """Test that shutdown is bounded: work that has not started is cancelled."""
+    release = threading.Event()
+    client = Client(api_url="http://127.0.0.1:1", api_key="test-key", max_workers=1)
+    blocking = client.submit(release.wait, 5)
+    queued = [client.submit(time.sleep, 0) for _ in range(3)]
+
+    timer = threading.Timer(0.2, release.set)
+    timer.start()
+    start = time.perf_counter()
+    assert not client.shutdown(timeout=0.05)
+    assert time.perf_counter() - start < 1
+    assert blocking.result() is True
+    assert all(future.cancelled() for future in queued)
+
+
+def test_shutdown_without_submissions():
+    """Test that shutting down a client that never submitted anything is a no-op."""
+    client = Client(api_url="http://127.0.0.1:1", api_key="test-key")
+    assert client.shutdown(timeout=0)
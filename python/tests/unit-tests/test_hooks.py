@@ -0,0 +1,111 @@
+"""Tests of the request lifecycle hooks."""
+
+import socket
+
+import pytest
+from invariant_sdk.client import Client
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.hooks import RequestHooks, RequestRecord
+from invariant_sdk.testing.stub_server import StubServer
+from invariant_sdk.types.exceptions import InvariantError, InvariantNotFoundError
+
+MESSAGES = [[{"role": "user", "content": "one"}]]
+
+
+def _recording_hooks(events):
+    return RequestHooks(
+        on_request_start=lambda record: events.append(("start", record.status)),
+        on_request_end=lambda record: events.append(("end", record)),
+        on_error=lambda record, error: events.append(("error", record, error)),
+    )
+
+
+@pytest.mark.parametrize("is_async", [True, False])
+async def test_hooks_report_successful_request(is_async, call):
+    """Test that start and end hooks see the request, its size and its timings."""
+    events = []
+    with StubServer(latency_ms=20) as server:
+        client_cls = AsyncClient if is_async else Client
+        client = client_cls(
+            api_url=server.url, api_key="test-key", hooks=_recording_hooks(events)
+        )
+        await call(client.create_request_and_push_trace(messages=MESSAGES))
+        bytes_received = server.stats.bytes_received
+
+    assert [event[0] for event in events] == ["start", "end"]
+    assert events[0][1] is None
+    record: RequestRecord = events[1][1]
+    assert (record.method, record.path, record.status) == (
+        "POST",
+        "/api/v1/push/trace",
+        200,
+    )
+    assert record.attempt == 1
+    assert record.body_bytes == bytes_received
+    timings = record.timings
+    assert timings.ttfb_ms >= 20
+    assert timings.total_ms >= timings.ttfb_ms
+    if is_async:
+        # A new connection was opened; plain HTTP, so no TLS handshake.
+        assert timings.queue_ms is not None
+        assert timings.connect_ms is not None
+        assert timings.tls_ms is None
+    else:
+        assert timings.queue_ms is None and timings.connect_ms is None
+
+
+@pytest.mark.parametrize("is_async", [True, False])
+async def test_hooks_report_http_error(is_async, call):
+    """Test that on_error receives the status of an HTTP error and the exception."""
+    events = []
+    with StubServer() as server:
+        client_cls = AsyncClient if is_async else Client
+        client = client_cls(
+            api_url=server.url, api_key="test-key", hooks=_recording_hooks(events)
+        )
+        with pytest.raises(InvariantNotFoundError) as exc_info:
+            await call(client.request("POST", "/api/v1/unknown", {"json": {}}))
+
+    assert [event[0] for event in events] == ["start", "error"]
+    _, record, error = events[1]
+    assert record.status == 404
+    assert record.body_bytes == 2
+    assert error is exc_info.value
+    assert record.timings.total_ms is not None
+
+
+@pytest.mark.parametrize("is_async", [True, False])
+async def test_hooks_report_connection_error(is_async, call):
+    """Test that on_error is called when no response is received at all."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    events = []
+    client_cls = AsyncClient if is_async else Client
+    client = client_cls(
+        api_url=f"http://127.0.0.1:{port}",
+        api_key="test-key",
+        hooks=_recording_hooks(events),
+    )
+    with pytest.raises(InvariantError, match="Connection error"):
+        await call(client.create_request_and_push_trace(messages=MESSAGES))
+
+    assert [event[0] for event in events] == ["start", "error"]
+    record = events[1][1]
+    assert record.status is None
+    assert record.body_bytes > 0
+
+
+def test_combined_hooks_call_each_in_order():
+    """Test that combined hooks call every callback and skip missing ones."""
+    calls = []
+    hooks = RequestHooks.combine(
+        RequestHooks(on_request_end=lambda record: calls.append("first")),
+        RequestHooks(on_error=lambda record, error: calls.append("error")),
+        RequestHooks(on_request_end=lambda record: calls.append("second")),
+    )
+    assert hooks.on_request_start is None
+    record = hooks.start("GET", "/")
+    hooks.end(record)
+    hooks.error(record, InvariantError("failed"))
+    assert calls == ["first", "second", "error"]
@@ -0,0 +1,252 @@
+"""Tests of recording the chat completions of OpenAI-compatible clients."""
+
+import asyncio
+from types import SimpleNamespace
+from typing import Any, List, Optional
+
+import pytest
+from invariant_sdk.client import Client
+from invariant_sdk.exporter import BufferedExporter
+from invariant_sdk.instrumentation import ChatTracer
+from invariant_sdk.metrics import MetricsRegistry
+from invariant_sdk.testing.stub_server import StubServer
+from pydantic import BaseModel
+
+TOOL_CALL = {
+    "id": "call_1",
+    "type": "function",
+    "function": {"name": "get_weather", "arguments": '{"city": "Zurich"}'},
+}
+
+
+class Message(BaseModel):
+    """A message of a response, with the unset fields of the OpenAI models."""
+
+    role: str = "assistant"
+    content: Optional[str] = None
+    refusal: Optional[str] = None
+    tool_calls: Optional[List[Any]] = None
+
+
+def _response(message, model="fake-model"):
+    return SimpleNamespace(
+        model=model, choices=[SimpleNamespace(index=0, message=message)]
+    )
+
+
+def _chunks():
+    """The chunks of a streamed reply with text and a tool call in pieces."""
+    deltas = [
+        {"role": "assistant", "content": "Let me "},
+        {"content": "check."},
+        {"tool_calls": [{"index": 0, "id": "call_1", "function": {"name": "get_"}}]},
+        {"tool_calls": [{"index": 0, "function": {"name": "weather"}}]},
+        {"tool_calls": [{"index": 0, "function": {"arguments": '{"city": '}}]},
+        {"tool_calls": [{"index": 0, "function": {"arguments": '"Zurich"}'}}]},
+    ]
+    return [
+        {"model": "fake-model", "choices": [{"index": 0, "delta": delta}]}
+        for delta in deltas
+    ]
+
+
+class FakeCompletions:
+    """Replies with the queued responses, or chunks if streamed."""
+
+    def __init__(self):
+        self.replies = []
+        self.closed = False
+
+    def create(self, *, model, messages, stream=False):
+        if model == "missing":
+            raise ValueError("The model does not exist")
+        if stream:
+            return iter(_chunks())
+        return self.replies.pop(0)
+
+
+class FakeAsyncStream:
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration  # pylint: disable=raise-missing-from
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeAsyncCompletions(FakeCompletions):
+    def create(self, *, model, messages, stream=False):
+        async def reply():
+            if stream:
+                return FakeAsyncStream(_chunks())
+            return self.replies.pop(0)
+
+        return reply()
+
+
+def _fake_client(completions):
+    return SimpleNamespace(
+        chat=SimpleNamespace(completions=completions), api_key="fake-key"
+    )
+
+
+@pytest.fixture(name="setup")
+def fixture_setup():
+    with StubServer(store_traces=True) as server:
+        registry = MetricsRegistry()
+        client = Client(api_url=server.url, api_key="test-key", metrics=registry)
+        with BufferedExporter(client) as exporter:
+            yield client, exporter, registry
+
+
+def test_records_completions_with_tool_calls(setup):
+    """Test that a trace holds the request's messages as they were, and the reply."""
+    client, exporter, _ = setup
+    completions = FakeCompletions()
+    completions.replies = [
+        _response(Message(tool_calls=[TOOL_CALL])),
+        _response({"role": "assistant", "content": "It is sunny."}, model="other"),
+    ]
+    tracer = ChatTracer(exporter, dataset="agent", metadata={"agent": "weather"})
+    llm = tracer.wrap(_fake_client(completions))
+
+    messages = [{"role": "user", "content": "Weather in Zurich?"}]
+    reply = llm.chat.completions.create(model="fake-model", messages=messages)
+    assert reply.choices[0].message.tool_calls == [TOOL_CALL]
+    # The agent loop appends to the same list before the next call.
+    messages.append(reply.choices[0].message)
+    messages.append({"role": "tool", "tool_call_id": "call_1", "content": "sunny"})
+    llm.chat.completions.create(model="fake-model", messages=messages)
+    assert llm.api_key == "fake-key"
+    assert tracer.flush(timeout=5)
+    traces = list(client.iter_dataset_traces("agent"))
+
+    assert [trace["messages"] for trace in traces] == [
+        [
+            {"role": "user", "content": "Weather in Zurich?"},
+            {"role": "assistant", "tool_calls": [TOOL_CALL]},
+        ],
+        [
+            {"role": "user", "content": "Weather in Zurich?"},
+            {"role": "assistant", "tool_calls": [TOOL_CALL]},
+            {"role": "tool", "tool_call_id": "call_1", "content": "sunny"},
+            {"role": "assistant", "content": "It is sunny."},
+        ],
+    ]
+    assert [trace["metadata"] for trace in traces] == [
+        {"agent": "weather", "model": "fake-model"},
+        {"agent": "weather", "model": "other"},
+    ]
+
+
+def test_streamed_completions_are_merged(setup):
+    """Test that the deltas of chunks are recorded as one message."""
+    client, exporter, _ = setup
+    tracer = ChatTracer(exporter, dataset="stream")
+    llm = tracer.wrap(_fake_client(FakeCompletions()))
+    messages = [{"role": "user", "content": "Weather in Zurich?"}]
+
+    chunks = list(
+        llm.chat.completions.create(model="fake-model", messages=messages, stream=True)
+    )
+    assert chunks == _chunks()
+    # Closed after the first chunk, the stream is recorded as far as it went.
+    with llm.chat.completions.create(
+        model="fake-model", messages=messages, stream=True
+    ) as stream:
+        next(stream)
+    assert tracer.flush(timeout=5)
+    traces = list(client.iter_dataset_traces("stream"))
+
+    assert [trace["messages"][-1] for trace in traces] == [
+        {"role": "assistant", "content": "Let me check.", "tool_calls": [TOOL_CALL]},
+        {"role": "assistant", "content": "Let me "},
+    ]
+
+
+def test_async_clients_are_recorded(setup):
+    """Test awaited and streamed completions of an async client."""
+    client, exporter, _ = setup
+    completions = FakeAsyncCompletions()
+    completions.replies = [_response(Message(content="Hello!"))]
+    tracer = ChatTracer(exporter, dataset="async")
+    llm = tracer.wrap(_fake_client(completions))
+    messages = [{"role": "user", "content": "Hi"}]
+
+    async def main():
+        reply = await llm.chat.completions.create(model="fake-model", messages=messages)
+        stream = await llm.chat.completions.create(
+            model="fake-model", messages=messages, stream=True
+        )
+        async with stream:
+            chunks = [chunk async for chunk in stream]
+        return reply, chunks, stream
+
+    reply, chunks, stream = asyncio.run(main())
+    assert reply.choices[0].message.content == "Hello!"
+    assert len(chunks) == len(_chunks())
+    assert stream.closed
+    assert tracer.flush(timeout=5)
+    traces = list(client.iter_dataset_traces("async"))
+
+    assert [trace["messages"][-1]["content"] for trace in traces] == [
+        "Hello!",
+        "Let me check.",
+    ]
+
+
+def test_failed_and_unconvertible_completions(setup):
+    """Test that errors reach the caller and bad responses do not stop the others."""
+    client, exporter, registry = setup
+    completions = FakeCompletions()
+    completions.replies = [object(), _response(Message(content="fine"))]
+    tracer = ChatTracer(exporter, dataset="errors")
+    llm = tracer.wrap(_fake_client(completions))
+    messages = [{"role": "user", "content": "Hi"}]
+
+    with pytest.raises(ValueError):
+        llm.chat.completions.create(model="missing", messages=messages)
+    llm.chat.completions.create(model="fake-model", messages=messages)
+    llm.chat.completions.create(model="fake-model", messages=messages)
+    assert tracer.flush(timeout=5)
+    traces = list(client.iter_dataset_traces("errors"))
+
+    # A response without choices is recorded without a reply.
+    assert [len(trace["messages"]) for trace in traces] == [1, 2]
+
+    completions.replies = [SimpleNamespace(choices=[object()])]
+    llm.chat.completions.create(model="fake-model", messages=messages)
+    tracer.flush(timeout=5)
+    assert registry.dropped_traces.value(("invalid",)) == 1
+
+
+def test_pending_completions_are_bounded(setup):
+    """Test dropping completions beyond `max_pending` and after shutdown."""
+    client, exporter, registry = setup
+    completions = FakeCompletions()
+    completions.replies = [_response(Message(content=str(i))) for i in range(8)]
+    tracer = ChatTracer(exporter, dataset="bounded", max_pending=5, flush_interval_s=60)
+    llm = tracer.wrap(_fake_client(completions))
+    messages = [{"role": "user", "content": "Count"}]
+
+    for _ in range(7):
+        llm.chat.completions.create(model="fake-model", messages=messages)
+    tracer.shutdown()
+    llm.chat.completions.create(model="fake-model", messages=messages)
+    assert exporter.flush(timeout=5)
+    traces = list(client.iter_dataset_traces("bounded"))
+
+    assert [trace["messages"][-1]["content"] for trace in traces] == list("01234")
+    assert registry.dropped_traces.value(("tracer_full",)) == 2
+    assert registry.dropped_traces.value(("shutdown",)) == 1
+    with pytest.raises(ValueError):
+        ChatTracer(exporter, max_pending=0)
@@ -0,0 +1,110 @@
+"""Tests of uploading JSONL files without parsing them."""
+
+import json
+
+import pytest
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.client import Client
+from invariant_sdk.jsonl_upload import JsonlFile, MultipartBody
+from invariant_sdk.testing.stub_server import StubServer
+
+LINES = [
+    {"metadata": {"benchmark": "example"}},
+    {
+        "messages": [
+            {"role": "user", "content": "Hello, world!"},
+            {"role": "assistant", "content": "Hi!"},
+        ],
+        "annotations": [{"content": "greeting", "address": "messages.0.content:0-5"}],
+        "metadata": {"key": "value"},
+    },
+    [{"metadata": {"raw": True}}, {"role": "user", "content": "How are you?"}],
+]
+
+
+def _write(path, lines):
+    path.write_text("".join(f"{line}\n" for line in lines))
+    return str(path)
+
+
+@pytest.fixture(name="traces_file")
+def fixture_traces_file(tmp_path):
+    """A file with dataset metadata, an annotated and a raw event list."""
+    lines = [json.dumps(line) for line in LINES]
+    return _write(tmp_path / "traces.jsonl", [lines[0], lines[1], "", lines[2]])
+
+
+def test_check_counts_traces_and_rejects_lines_that_are_not_traces(
+    tmp_path, traces_file
+):
+    """Test the structural check of each line."""
+    with JsonlFile(traces_file) as file:
+        assert file.check() == 2
+
+    with JsonlFile(_write(tmp_path / "empty.jsonl", [])) as file:
+        assert file.check() == 0
+
+    path = _write(tmp_path / "bad.jsonl", [json.dumps(LINES[1]), '"a string"'])
+    with JsonlFile(path) as file, pytest.raises(ValueError, match="line 2"):
+        file.check()
+
+    path = _write(tmp_path / "bad.jsonl", [json.dumps(LINES[1]), '{"metadata": {}}'])
+    with JsonlFile(path) as file, pytest.raises(ValueError, match="no messages"):
+        file.check()
+
+
+def test_multipart_body_splices_the_file_in():
+    """Test that the body reads as the fields, the file bytes and the boundary."""
+    data = b'{"messages": []}\n' * 1000
+    body = MultipartBody({"name": "example"}, "file", "traces.jsonl", data)
+    boundary = body.content_type.rpartition("=")[2]
+
+    chunks = []
+    while chunk := body.read(1000):
+        chunks.append(chunk)
+    read = b"".join(chunks)
+
+    assert len(read) == len(body)
+    assert max(len(chunk) for chunk in chunks) == 1000
+    assert read.startswith(f"--{boundary}\r\n".encode())
+    assert b'name="name"\r\n\r\nexample\r\n' in read
+    assert read.endswith(b"\r\n\r\n" + data + f"\r\n--{boundary}--\r\n".encode())
+
+
+@pytest.mark.parametrize("engine", ["requests", "asyncio"])
+def test_uploaded_traces_are_read_back(traces_file, engine):
+    """Test uploading a file and reading its traces back from the dataset."""
+    with StubServer(store_traces=True) as server:
+        client = Client(api_url=server.url, api_key="test-key", engine=engine)
+        dataset = client.upload_jsonl_file(traces_file, "example")
+        traces = list(client.iter_dataset_traces("example"))
+        metadata, _ = server.get_metadata("example")
+        stats = server.stats.to_json()
+
+    assert dataset["name"] == "example"
+    assert [trace["messages"] for trace in traces] == [
+        LINES[1]["messages"],
+        LINES[2][1:],
+    ]
+    assert traces[0]["annotations"] == LINES[1]["annotations"]
+    assert [trace["metadata"] for trace in traces] == [{"key": "value"}, {"raw": True}]
+    assert metadata == {"benchmark": "example"}
+    assert stats["traces"] == 2
+
+    with pytest.raises(ValueError, match="dataset name"):
+        client.upload_jsonl_file(traces_file, "not a name")
+
+
+async def test_async_client_uploads_the_file_as_it_is(traces_file):
+    """Test that the async client sends the bytes of the file unchanged."""
+    with StubServer() as server:
+        client = AsyncClient(api_url=server.url, api_key="test-key")
+        dataset = await client.upload_jsonl_file(traces_file, "example")
+        stats = server.stats.to_json()
+
+    with open(traces_file, "rb") as f:
+        size = len(f.read())
+    assert dataset["name"] == "example"
+    # Without store_traces, the stub counts the lines of the file.
+    assert stats["traces"] == 4
+    assert size < stats["bytes_received"] < size + 400
@@ -0,0 +1,122 @@
+"""Tests of shedding traces while the clients fall behind."""
+
+import time
+
+import pytest
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.client import Client
+from invariant_sdk.metrics import MetricsRegistry
+from invariant_sdk.sampling import KeepAnnotated, LoadShedder, SamplingPolicy
+from invariant_sdk.testing.stub_server import StubServer
+from invariant_sdk.types.annotations import AnnotationCreate
+from invariant_sdk.types.push_traces import PushTracesRequest
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+ANNOTATION = {"content": "important", "address": "messages.0"}
+
+
+def test_rate_falls_with_the_backlog_and_recovers_once_it_clears():
+    """Test the decrease while overloaded, the hold in between and the recovery."""
+    shedder = LoadShedder(
+        max_backlog=10, min_rate=0.1, decrease=0.5, increase=0.25, interval_s=0
+    )
+    assert shedder.observe_backlog(10) == 0 and shedder.rate == 1
+    assert shedder.observe_backlog(1) == -0.5 and shedder.rate == 0.5
+    for _ in range(5):
+        shedder.observe_backlog(0)
+    assert shedder.rate == 0.1
+
+    # Between half of max_backlog and max_backlog, the rate holds.
+    shedder.observe_backlog(-3)
+    assert shedder.rate == 0.1 and shedder.backlog == 8
+    shedder.observe_backlog(-3)
+    assert shedder.rate == pytest.approx(0.35)
+    for _ in range(5):
+        shedder.observe_backlog(0)
+    assert shedder.rate == 1
+
+    with pytest.raises(ValueError):
+        LoadShedder(decrease=1)
+
+
+def test_rate_falls_while_pushes_are_slow():
+    """Test shedding on the moving average of the latency, and the interval."""
+    shedder = LoadShedder(max_latency_ms=100, decrease=0.5, interval_s=0)
+    shedder.observe_latency(50)
+    assert shedder.rate == 1
+    shedder.observe_latency(1_000)
+    assert shedder.rate == 0.5
+
+    shedder = LoadShedder(max_latency_ms=100, interval_s=60)
+    assert shedder.observe_latency(1_000) == 0 and shedder.rate == 1
+
+
+def test_always_kept_traces_are_never_shed():
+    """Test that the shedder only drops the traces without priority."""
+    shedder = LoadShedder(max_backlog=1, min_rate=0.01, interval_s=0, seed=1)
+    policy = SamplingPolicy(always_keep=[KeepAnnotated()], load_shedder=shedder)
+    for _ in range(30):
+        shedder.observe_backlog(2)
+    reasons = policy.sample([MESSAGES] * 1_000, annotations=[[ANNOTATION]] + [[]] * 999)
+    assert reasons[0] is None
+    assert reasons.count("shed") > 980
+
+
+def test_client_sheds_queued_traces_under_backlog_and_counts_decisions():
+    """Test shedding at submit time against a slow server, and the recovery."""
+    registry = MetricsRegistry()
+    shedder = LoadShedder(
+        max_backlog=10, min_rate=0.05, decrease=0.5, increase=0.5, interval_s=0.01
+    )
+    policy = SamplingPolicy(always_keep=[KeepAnnotated()], load_shedder=shedder)
+    with StubServer(latency_ms=20) as server:
+        client = Client(
+            api_url=server.url,
+            api_key="test-key",
+            max_workers=2,
+            sampling_policy=policy,
+            metrics=registry,
+        )
+        futures = []
+        for i in range(300):
+            annotations = (
+                [AnnotationCreate.from_dicts([ANNOTATION])] if i % 10 == 0 else None
+            )
+            futures.append(
+                client.push_trace_async(
+                    PushTracesRequest(messages=[MESSAGES], annotations=annotations)
+                )
+            )
+            time.sleep(0.001)
+        responses = [future.result() for future in futures]
+        assert shedder.backlog == 0
+
+        for _ in range(5):
+            time.sleep(0.02)
+            client.push_trace(PushTracesRequest(messages=[MESSAGES]))
+        client.shutdown()
+        stats = server.stats.to_json()
+
+    assert shedder.rate == 1
+    assert all(responses[i].id[0] is not None for i in range(0, 300, 10))
+    shed = sum(response.id[0] is None for response in responses)
+    assert shed > 100 and stats["traces"] == 300 - shed + 5
+    text = registry.metrics_text()
+    assert f'invariant_sdk_dropped_traces_total{{reason="shed"}} {shed}' in text
+    assert 'invariant_sdk_load_shedding_adjustments_total{direction="decrease"}' in text
+    assert 'invariant_sdk_load_shedding_adjustments_total{direction="increase"}' in text
+    assert 'invariant_sdk_queue_depth{queue="traces"} 0' in text
+
+
+async def test_async_client_reports_backlog_and_latency():
+    """Test that the async client feeds the shedder on every push."""
+    shedder = LoadShedder(max_latency_ms=5, decrease=0.5, interval_s=0)
+    with StubServer(latency_ms=20) as server:
+        client = AsyncClient(
+            api_url=server.url,
+            api_key="test-key",
+            sampling_policy=SamplingPolicy(load_shedder=shedder),
+        )
+        await client.push_trace(PushTracesRequest(messages=[MESSAGES] * 3))
+    # Halved once after the push, and once more as it leaves the backlog.
+    assert shedder.rate == 0.25 and shedder.backlog == 0
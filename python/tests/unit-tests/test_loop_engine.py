@@ -0,0 +1,124 @@
+"""Tests of the background event loop engine and the sync client running on it."""
+
+import asyncio
+import contextvars
+import threading
+
+import httpx
+import pytest
+import requests
+from invariant_sdk.client import Client
+from invariant_sdk.hooks import RequestHooks
+from invariant_sdk.loop_engine import LoopEngine
+from invariant_sdk.testing.stub_server import StubServer
+from invariant_sdk.types.exceptions import InvariantNotFoundError
+
+MESSAGES = [[{"role": "user", "content": "one"}]]
+REQUEST_ID = contextvars.ContextVar("request_id", default=None)
+
+
+@pytest.fixture(name="engine")
+def fixture_engine():
+    """Fixture for a running engine."""
+    engine = LoopEngine()
+    yield engine
+    engine.close()
+
+
+def test_engine_runs_coroutines_from_many_threads(engine):
+    """Test that concurrent callers share the loop and get their own results."""
+
+    async def echo(value):
+        await asyncio.sleep(0.05)
+        return value, threading.current_thread().name, REQUEST_ID.get()
+
+    results = {}
+
+    def call(index):
+        REQUEST_ID.set(index)
+        results[index] = engine.run(echo(index))
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {i: (i, "invariant-sdk-loop", i) for i in range(50)}
+
+
+def test_engine_errors(engine):
+    """Test that exceptions propagate and that misuse is rejected."""
+
+    async def fail():
+        raise KeyError("missing")
+
+    async def run_nested():
+        return engine.run(asyncio.sleep(0))
+
+    with pytest.raises(KeyError):
+        engine.run(fail())
+    with pytest.raises(RuntimeError, match="deadlock"):
+        engine.run(run_nested())
+    future = engine.submit(asyncio.sleep(10))
+    engine.loop.call_soon_threadsafe(
+        lambda: [t.cancel() for t in asyncio.all_tasks(engine.loop)]
+    )
+    with pytest.raises(Exception) as exc_info:
+        future.result(timeout=5)
+    assert exc_info.type.__name__ == "CancelledError"
+    engine.close()
+    with pytest.raises(RuntimeError, match="closed"):
+        engine.run(asyncio.sleep(0))
+
+
+def test_client_on_asyncio_engine():
+    """Test the sync client API end to end with requests sent by the engine."""
+    records = []
+    with StubServer(latency_ms=50) as server:
+        client = Client(
+            api_url=server.url,
+            api_key="test-key",
+            engine="asyncio",
+            hooks=RequestHooks(on_request_end=records.append),
+        )
+        responses = []
+
+        def push():
+            responses.append(client.create_request_and_push_trace(messages=MESSAGES))
+
+        threads = [threading.Thread(target=push) for _ in range(32)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(responses) == 32
+
+        client.create_request_and_update_dataset_metadata(
+            dataset_name="example", metadata={"accuracy": 0.5}
+        )
+        assert client.get_dataset_metadata("example") == {"accuracy": 0.5}
+        assert client.create_request_and_append_messages(
+            messages=MESSAGES[0], trace_id=responses[0].id[0]
+        ) == {"success": True}
+        with pytest.raises(InvariantNotFoundError):
+            client.request("POST", "/api/v1/unknown", {"json": {}})
+        assert isinstance(
+            client.request("GET", "/api/v1/dataset/metadata/x"), httpx.Response
+        )
+
+    assert len(records) == 32 + 4
+    # The async client reports connection phases; the requests path cannot.
+    assert records[0].timings.queue_ms is not None
+
+
+def test_client_engine_validation():
+    """Test that invalid engine configurations are rejected."""
+    with pytest.raises(ValueError, match="Unknown engine"):
+        Client(api_url="http://localhost", api_key="test-key", engine="trio")
+    with pytest.raises(ValueError, match="httpx.AsyncClient"):
+        Client(
+            api_url="http://localhost",
+            api_key="test-key",
+            engine="asyncio",
+            session=requests.Session(),
+        )
@@ -0,0 +1,204 @@
+"""Unit tests for the dataset metadata cache."""
+
+from unittest import mock
+
+import pytest
+from invariant_sdk.client import Client
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.metadata_cache import MetadataCache, MetadataCacheEntry
+from invariant_sdk.types.update_dataset_metadata import (
+    MetadataUpdate,
+    UpdateDatasetMetadataRequest,
+)
+
+
+def _response(status_code=200, json_value=None, etag=None):
+    response = mock.Mock()
+    response.status_code = status_code
+    response.json.return_value = json_value
+    response.headers = {"ETag": etag} if etag else {}
+    return response
+
+
+def _make_client(is_async, responses, cache):
+    if is_async:
+        session = mock.AsyncMock()
+        session.request = mock.AsyncMock(side_effect=responses)
+        client_cls = AsyncClient
+    else:
+        session = mock.Mock()
+        session.request.side_effect = responses
+        client_cls = Client
+    client = client_cls(
+        api_url="https://default.api.url",
+        api_key="test-key",
+        session=session,
+        metadata_cache=cache,
+    )
+    return client, session
+
+
+def test_cache_lru_eviction():
+    """Test that the least recently used entry is evicted first."""
+    cache = MetadataCache(ttl_s=60, max_entries=2)
+    cache.store(("a", None), {"v": 1}, None)
+    cache.store(("b", None), {"v": 2}, None)
+    assert cache.lookup(("a", None))[0] == {"v": 1}
+    cache.store(("c", None), {"v": 3}, None)
+
+    assert cache.lookup(("b", None)) == (None, None)
+    assert cache.lookup(("a", None))[0] == {"v": 1}
+    assert cache.stats == {"hits": 2, "misses": 1, "revalidations": 0, "size": 2}
+
+
+def test_cache_returns_copies():
+    """Test that mutating a returned value does not corrupt the cache."""
+    cache = MetadataCache()
+    value = {"nested": {"accuracy": 1}}
+    cache.store(("a", None), value, None)
+    value["nested"]["accuracy"] = 2
+    cached, _ = cache.lookup(("a", None))
+    cached["nested"]["accuracy"] = 3
+    assert cache.lookup(("a", None))[0] == {"nested": {"accuracy": 1}}
+
+
+def test_cache_expired_entry_is_returned_for_revalidation_only_with_etag():
+    """Test that stale entries are handed back only when they can be revalidated."""
+    cache = MetadataCache(ttl_s=60)
+    with mock.patch("invariant_sdk.metadata_cache.time.monotonic", return_value=0):
+        cache.store(("a", None), {"v": 1}, '"etag-a"')
+        cache.store(("b", None), {"v": 2}, None)
+    with mock.patch("invariant_sdk.metadata_cache.time.monotonic", return_value=61):
+        value, stale = cache.lookup(("a", None))
+        assert value is None
+        assert stale.etag == '"etag-a"'
+        assert cache.lookup(("b", None)) == (None, None)
+
+
+def test_cache_invalidate_all_owners():
+    """Test that invalidation drops a dataset for every owner."""
+    cache = MetadataCache()
+    cache.store(("a", None), {}, None)
+    cache.store(("a", "someone"), {}, None)
+    cache.store(("b", None), {}, None)
+    cache.invalidate("a")
+    assert cache.stats["size"] == 1
+
+
+def test_cache_skips_values_fetched_before_an_invalidation():
+    """Test that `store` and `revalidated` drop values of an older generation."""
+    cache = MetadataCache()
+    cache.store(("a", None), {"v": 1}, '"v1"')
+    entry = MetadataCacheEntry({"v": 1}, '"v1"', expires_at=0)
+    generations = [cache.generation(("a", None)), cache.generation(("b", None))]
+    cache.invalidate("a")
+    cache.store(("a", None), {"v": 1}, None, generations[0])
+    assert cache.revalidated(("a", None), entry, generations[0]) == {"v": 1}
+    cache.store(("b", None), {"v": 2}, None, generations[1])
+    assert cache.lookup(("a", None)) == (None, None)
+    assert cache.lookup(("b", None))[0] == {"v": 2}
+
+    generation = cache.generation(("b", None))
+    cache.clear()
+    cache.store(("b", None), {"v": 2}, None, generation)
+    assert cache.stats["size"] == 0
+
+
+@pytest.mark.parametrize("is_async", [True, False])
+async def test_client_serves_fresh_entries_from_cache(is_async, call):
+    """Test that a second call within the TTL does not hit the server."""
+    cache = MetadataCache(ttl_s=60)
+    client, session = _make_client(
+        is_async, [_response(json_value={"accuracy": 1})], cache
+    )
+    for _ in range(3):
+        metadata = await call(client.get_dataset_metadata("example"))
+        assert metadata == {"accuracy": 1}
+    assert session.request.call_count == 1
+    assert cache.stats["hits"] == 2
+    assert cache.stats["misses"] == 1
+
+
+@pytest.mark.parametrize("is_async", [True, False])
+async def test_client_revalidates_with_etag(is_async, call):
+    """Test that a stale entry is revalidated with If-None-Match."""
+    cache = MetadataCache(ttl_s=60)
+    client, session = _make_client(
+        is_async,
+        [
+            _response(json_value={"accuracy": 1}, etag='"v1"'),
+            _response(status_code=304),
+        ],
+        cache,
+    )
+    with mock.patch("invariant_sdk.metadata_cache.time.monotonic", return_value=0):
+        await call(client.get_dataset_metadata("example"))
+    with mock.patch("invariant_sdk.metadata_cache.time.monotonic", return_value=100):
+        metadata = await call(client.get_dataset_metadata("example"))
+
+    assert metadata == {"accuracy": 1}
+    headers = session.request.call_args.kwargs["headers"]
+    assert headers["If-None-Match"] == '"v1"'
+    assert cache.stats["revalidations"] == 1
+
+
+@pytest.mark.parametrize("is_async", [True, False])
+async def test_client_update_invalidates_cache(is_async, call):
+    """Test that a local metadata update drops the cached entry."""
+    cache = MetadataCache(ttl_s=60)
+    client, session = _make_client(
+        is_async,
+        [
+            _response(json_value={"accuracy": 1}),
+            _response(json_value={"accuracy": 2}),
+            _response(json_value={"accuracy": 2}),
+        ],
+        cache,
+    )
+    await call(client.get_dataset_metadata("example"))
+    await call(
+        client.update_dataset_metadata(
+            UpdateDatasetMetadataRequest(
+                dataset_name="example", metadata=MetadataUpdate(accuracy=2)
+            )
+        ),
+    )
+    metadata = await call(client.get_dataset_metadata("example"))
+    assert metadata == {"accuracy": 2}
+    assert session.request.call_count == 3
+
+
+@pytest.mark.parametrize("is_async", [True, False])
+async def test_get_in_flight_during_an_update_is_not_cached(is_async, call):
+    """Test that a response fetched before an update does not outlive it."""
+    update = UpdateDatasetMetadataRequest(
+        dataset_name="example", metadata=MetadataUpdate(accuracy=2)
+    )
+    methods = []
+
+    def respond(method, **_):
+        methods.append(method)
+        return _response(json_value={"accuracy": 2})
+
+    def slow_get(method, **kwargs):
+        if not methods:
+            # The update is sent while the first GET waits for its response.
+            methods.append(method)
+            client.update_dataset_metadata(update)
+            return _response(json_value={"accuracy": 1})
+        return respond(method, **kwargs)
+
+    async def slow_get_async(method, **kwargs):
+        if not methods:
+            methods.append(method)
+            await client.update_dataset_metadata(update)
+            return _response(json_value={"accuracy": 1})
+        return respond(method, **kwargs)
+
+    client, session = _make_client(is_async, [], MetadataCache(ttl_s=60))
+    session.request.side_effect = slow_get_async if is_async else slow_get
+    before = await call(client.get_dataset_metadata("example"))
+    after = await call(client.get_dataset_metadata("example"))
+
+    assert methods == ["GET", "PUT", "GET"]
+    assert (before, after) == ({"accuracy": 1}, {"accuracy": 2})
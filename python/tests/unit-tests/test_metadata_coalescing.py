@@ -0,0 +1,371 @@
+"""Unit tests for coalescing dataset metadata updates."""
+
+import asyncio
+import gc
+import threading
+import time
+import weakref
+from unittest import mock
+
+import httpx
+import pytest
+import requests
+from invariant_sdk.client import Client
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.metadata_coalescing import MetadataUpdateCoalescer
+from invariant_sdk.metrics import MetricsRegistry
+from invariant_sdk.types.exceptions import InvariantError
+from invariant_sdk.types.update_dataset_metadata import (
+    InvariantTestResults,
+    MetadataUpdate,
+    UpdateDatasetMetadataRequest,
+)
+
+
+def _update(dataset_name="example_dataset", replace_all=False, **metadata):
+    return UpdateDatasetMetadataRequest(
+        dataset_name=dataset_name,
+        replace_all=replace_all,
+        metadata=MetadataUpdate(**metadata),
+    )
+
+
+def test_coalescer_last_write_wins_per_field():
+    """Test that later updates overwrite earlier ones field by field."""
+    coalescer = MetadataUpdateCoalescer(window_ms=1000)
+    assert coalescer.add(_update(accuracy=0.5, benchmark="bench"))
+    assert not coalescer.add(_update(accuracy=0.7))
+    assert not coalescer.add(
+        _update(invariant_test_results=InvariantTestResults(num_tests=2))
+    )
+
+    request, request_kwargs = coalescer.pop("example_dataset")
+    assert request_kwargs is None
+    assert request.replace_all is False
+    assert request.metadata.to_json() == {
+        "accuracy": 0.7,
+        "benchmark": "bench",
+        "invariant.test_results": {"num_tests": 2, "num_passed": None},
+    }
+    assert coalescer.pop("example_dataset") is None
+
+
+def test_coalescer_replace_all_is_a_barrier():
+    """Test that replace_all discards the fields buffered before it."""
+    coalescer = MetadataUpdateCoalescer(window_ms=1000)
+    coalescer.add(_update(accuracy=0.5, benchmark="bench"))
+    coalescer.add(_update(replace_all=True, name="fresh"))
+    coalescer.add(_update(accuracy=0.9))
+
+    request, _ = coalescer.pop("example_dataset")
+    assert request.replace_all is True
+    assert request.metadata.to_json() == {"name": "fresh", "accuracy": 0.9}
+
+
+def test_coalescer_keeps_datasets_apart():
+    """Test that updates are merged per dataset."""
+    coalescer = MetadataUpdateCoalescer(window_ms=1000)
+    coalescer.add(_update(dataset_name="a", accuracy=0.1))
+    coalescer.add(_update(dataset_name="b", accuracy=0.2), {"headers": {"X": "1"}})
+
+    assert sorted(coalescer.pending_datasets()) == ["a", "b"]
+    request, request_kwargs = coalescer.pop("b")
+    assert request.metadata.to_json() == {"accuracy": 0.2}
+    assert request_kwargs == {"headers": {"X": "1"}}
+    assert coalescer.pending_datasets() == ["a"]
+
+
+def test_coalescer_pops_all_datasets_at_once():
+    """Test that pop_all takes every dataset and cancels their flush handles."""
+    coalescer = MetadataUpdateCoalescer(window_ms=1000)
+    coalescer.add(_update(dataset_name="a", accuracy=0.1))
+    coalescer.add(_update(dataset_name="b", accuracy=0.2))
+    handle = mock.Mock()
+    coalescer.set_handle("a", handle)
+
+    updates = coalescer.pop_all()
+    assert [request.dataset_name for request, _ in updates] == ["a", "b"]
+    handle.cancel.assert_called_once()
+    assert coalescer.pending_datasets() == []
+    assert coalescer.add(_update(dataset_name="a", accuracy=0.3))
+
+
+def test_coalescer_invalid_window():
+    """Test that the window must be positive."""
+    with pytest.raises(ValueError, match="window_ms must be a positive integer"):
+        MetadataUpdateCoalescer(window_ms=0)
+
+
+def test_coalescer_requeues_under_newer_updates():
+    """Test that a failed update is merged under the ones added after it."""
+    coalescer = MetadataUpdateCoalescer(window_ms=1000)
+    coalescer.add(_update(accuracy=0.1, name="old"))
+    failed, _ = coalescer.pop("example_dataset")
+    assert coalescer.requeue(failed)
+    assert coalescer.pop("example_dataset")[0] == failed
+
+    coalescer.add(_update(name="new"))
+    assert not coalescer.requeue(failed)
+    request, _ = coalescer.pop("example_dataset")
+    assert request.metadata == MetadataUpdate(accuracy=0.1, name="new")
+    assert not request.replace_all
+
+    coalescer.add(_update(replace_all=True, name="newest"))
+    assert not coalescer.requeue(failed)
+    request, _ = coalescer.pop("example_dataset")
+    assert request.metadata == MetadataUpdate(name="newest")
+
+
+def test_client_coalesces_until_flush():
+    """Test that the sync client sends one PUT per dataset on flush."""
+    mock_response = mock.Mock()
+    mock_response.json.return_value = {"accuracy": 0.9}
+    mock_session = mock.Mock()
+    mock_session.request.return_value = mock_response
+    client = Client(
+        api_url="https://default.api.url",
+        api_key="test-key",
+        session=mock_session,
+        metadata_coalesce_window_ms=60_000,
+    )
+
+    for accuracy in (0.1, 0.5, 0.9):
+        assert (
+            client.create_request_and_update_dataset_metadata(
+                dataset_name="example_dataset", metadata={"accuracy": accuracy}
+            )
+            is None
+        )
+    mock_session.request.assert_not_called()
+
+    assert client.flush_dataset_metadata() == {"example_dataset": {"accuracy": 0.9}}
+    mock_session.request.assert_called_once()
+    assert mock_session.request.call_args.kwargs["json"] == {
+        "metadata": {"accuracy": 0.9},
+        "replace_all": False,
+    }
+    assert client.flush_dataset_metadata() == {}
+
+
+def test_client_flushes_at_end_of_window():
+    """Test that the sync client flushes on its own when the window closes."""
+    mock_session = mock.Mock()
+    mock_session.request.return_value.json.return_value = {}
+    client = Client(
+        api_url="https://default.api.url",
+        api_key="test-key",
+        session=mock_session,
+        metadata_coalesce_window_ms=20,
+    )
+    client.update_dataset_metadata(_update(accuracy=0.1))
+    client.update_dataset_metadata(_update(accuracy=0.2))
+
+    deadline = time.monotonic() + 5
+    while not mock_session.request.called and time.monotonic() < deadline:
+        time.sleep(0.01)
+    mock_session.request.assert_called_once()
+    assert mock_session.request.call_args.kwargs["json"]["metadata"] == {
+        "accuracy": 0.2
+    }
+
+
+def test_client_requeues_updates_that_fail_to_send():
+    """Test that a transient failure is retried at the end of a new window."""
+    mock_session = mock.Mock()
+    mock_session.request.side_effect = [
+        requests.ConnectionError("connection refused"),
+        mock.DEFAULT,
+    ]
+    mock_session.request.return_value.json.return_value = {"ok": True}
+    registry = MetricsRegistry()
+    client = Client(
+        api_url="https://default.api.url",
+        api_key="test-key",
+        session=mock_session,
+        metrics=registry,
+        metadata_coalesce_window_ms=50,
+    )
+    client.update_dataset_metadata(_update(accuracy=0.1, name="first"))
+    with pytest.raises(InvariantError):
+        client.flush_dataset_metadata()
+    # Newer than the failed update, so it wins over it.
+    client.update_dataset_metadata(_update(name="second"))
+
+    deadline = time.monotonic() + 5
+    while mock_session.request.call_count < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert mock_session.request.call_count == 2
+    assert mock_session.request.call_args.kwargs["json"]["metadata"] == {
+        "accuracy": 0.1,
+        "name": "second",
+    }
+    text = registry.metrics_text()
+    assert 'invariant_sdk_metadata_update_failures_total{outcome="requeued"} 1' in text
+    assert 'invariant_sdk_queue_depth{queue="metadata_updates"} 0' in text
+
+
+def test_client_puts_back_the_updates_a_failed_flush_did_not_send():
+    """Test that the updates after a failed one are kept for the next flush."""
+    rejected = mock.Mock(status_code=400, headers={})
+    rejected.raise_for_status.side_effect = requests.HTTPError(
+        request=mock.Mock(), response=rejected
+    )
+    mock_session = mock.Mock()
+    mock_session.request.side_effect = [rejected, mock.DEFAULT]
+    mock_session.request.return_value.json.return_value = {"ok": True}
+    client = Client(
+        api_url="https://default.api.url",
+        api_key="test-key",
+        session=mock_session,
+        metadata_coalesce_window_ms=60_000,
+    )
+    client.update_dataset_metadata(_update("first", accuracy=0.1))
+    client.update_dataset_metadata(_update("second", accuracy=0.2))
+    with pytest.raises(InvariantError):
+        client.flush_dataset_metadata()
+
+    assert client.flush_dataset_metadata() == {"second": {"ok": True}}
+    assert mock_session.request.call_count == 2
+
+
+def test_client_sends_updates_outside_the_flush_of_others():
+    """Test that a slow update does not hold up the flush of another dataset."""
+    sending = threading.Event()
+    release = threading.Event()
+
+    def request(method, url, **kwargs):
+        if url.endswith("/slow"):
+            sending.set()
+            release.wait(5)
+        return mock.DEFAULT
+
+    mock_session = mock.Mock()
+    mock_session.request.side_effect = request
+    mock_session.request.return_value.json.return_value = {}
+    client = Client(
+        api_url="https://default.api.url",
+        api_key="test-key",
+        session=mock_session,
+        metadata_coalesce_window_ms=60_000,
+    )
+    client.update_dataset_metadata(_update("slow", accuracy=0.1))
+    slow = threading.Thread(target=client.flush_dataset_metadata)
+    slow.start()
+    try:
+        assert sending.wait(5)
+        client.update_dataset_metadata(_update("fast", accuracy=0.2))
+        started = time.monotonic()
+        assert client.flush_dataset_metadata() == {"fast": {}}
+        assert time.monotonic() - started < 1
+    finally:
+        release.set()
+        slow.join()
+
+
+def test_client_shutdown_sends_the_buffered_updates():
+    """Test that shutdown flushes, unregisters the exit hook and closes the session."""
+    mock_session = mock.Mock()
+    mock_session.request.return_value.json.return_value = {}
+    client = Client(
+        api_url="https://default.api.url",
+        api_key="test-key",
+        session=mock_session,
+        metadata_coalesce_window_ms=60_000,
+    )
+    client.update_dataset_metadata(_update(accuracy=0.1))
+    with mock.patch("atexit.unregister") as unregister:
+        assert client.shutdown()
+    mock_session.request.assert_called_once()
+    mock_session.close.assert_called_once()
+    unregister.assert_called_once()
+
+
+def test_exit_hook_does_not_keep_the_client_alive():
+    """Test that a client with buffered updates can be garbage collected."""
+    client = Client(
+        api_url="https://default.api.url",
+        api_key="test-key",
+        session=mock.Mock(),
+        metadata_coalesce_window_ms=60_000,
+    )
+    reference = weakref.ref(client)
+    del client
+    gc.collect()
+    assert reference() is None
+
+
+async def test_async_client_drops_rejected_updates_in_the_background():
+    """Test that a window's flush failing for good is counted, not raised."""
+    rejected = mock.Mock(status_code=400, headers={})
+    rejected.raise_for_status.side_effect = httpx.HTTPStatusError(
+        "bad request", request=mock.Mock(), response=rejected
+    )
+    mock_session = mock.AsyncMock()
+    mock_session.request = mock.AsyncMock(return_value=rejected)
+    registry = MetricsRegistry()
+    client = AsyncClient(
+        api_url="https://default.api.url",
+        api_key="test-key",
+        session=mock_session,
+        metrics=registry,
+        metadata_coalesce_window_ms=20,
+    )
+    await client.update_dataset_metadata(_update(accuracy=0.1))
+
+    dropped = 'invariant_sdk_metadata_update_failures_total{outcome="dropped"} 1'
+    for _ in range(500):
+        if dropped in registry.metrics_text():
+            break
+        await asyncio.sleep(0.01)
+    mock_session.request.assert_called_once()
+    assert dropped in registry.metrics_text()
+    assert await client.flush_dataset_metadata() == {}
+
+
+async def test_async_client_coalesces_until_window_closes():
+    """Test that the async client sends one PUT per window."""
+    mock_response = mock.Mock()
+    mock_response.json.return_value = {}
+    mock_session = mock.AsyncMock()
+    mock_session.request = mock.AsyncMock(return_value=mock_response)
+    client = AsyncClient(
+        api_url="https://default.api.url",
+        api_key="test-key",
+        session=mock_session,
+        metadata_coalesce_window_ms=20,
+    )
+    await client.update_dataset_metadata(_update(accuracy=0.1, name="first"))
+    await client.update_dataset_metadata(_update(accuracy=0.2))
+    mock_session.request.assert_not_called()
+
+    for _ in range(500):
+        if mock_session.request.called:
+            break
+        await asyncio.sleep(0.01)
+    mock_session.request.assert_called_once()
+    assert mock_session.request.call_args.kwargs["json"]["metadata"] == {
+        "accuracy": 0.2,
+        "name": "first",
+    }
+    assert await client.flush_dataset_metadata() == {}
+
+
+async def test_async_client_explicit_flush_cancels_window():
+    """Test that an explicit flush sends immediately and cancels the scheduled one."""
+    mock_response = mock.Mock()
+    mock_response.json.return_value = {"ok": True}
+    mock_session = mock.AsyncMock()
+    mock_session.request = mock.AsyncMock(return_value=mock_response)
+    client = AsyncClient(
+        api_url="https://default.api.url",
+        api_key="test-key",
+        session=mock_session,
+        metadata_coalesce_window_ms=20,
+    )
+    await client.update_dataset_metadata(_update(accuracy=0.1))
+
+    assert await client.flush_dataset_metadata("example_dataset") == {
+        "example_dataset": {"ok": True}
+    }
+    await asyncio.sleep(0.05)
+    mock_session.request.assert_called_once()
@@ -0,0 +1,173 @@
+"""Tests of the in-process metrics registry."""
+
+import threading
+
+import pytest
+import requests
+from invariant_sdk.client import Client
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.hooks import RequestHooks, RequestRecord
+from invariant_sdk.metrics import MetricsRegistry, MetricsServer, endpoint
+from invariant_sdk.testing.stub_server import StubServer
+from invariant_sdk.types.exceptions import InvariantNotFoundError
+
+MESSAGES = [[{"role": "user", "content": "one"}]]
+
+
+def _samples(text):
+    return dict(
+        line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#")
+    )
+
+
+@pytest.mark.parametrize("is_async", [True, False])
+async def test_client_records_requests_and_errors(is_async, call):
+    """Test that a client with a registry records counts, bytes, latency and errors."""
+    registry = MetricsRegistry()
+    seen = []
+    with StubServer() as server:
+        client_cls = AsyncClient if is_async else Client
+        client = client_cls(
+            api_url=server.url,
+            api_key="test-key",
+            hooks=RequestHooks(on_request_end=seen.append),
+            metrics=registry,
+        )
+        for _ in range(2):
+            await call(client.create_request_and_push_trace(messages=MESSAGES))
+        with pytest.raises(InvariantNotFoundError):
+            await call(client.request("POST", "/api/v1/unknown", {"json": {}}))
+        stats = server.stats.to_json()
+
+    assert len(seen) == 2
+    samples = _samples(registry.metrics_text())
+    push = 'method="POST",endpoint="/api/v1/push/trace"'
+    assert samples[f'invariant_sdk_requests_total{{{push},status="200"}}'] == "2"
+    assert samples[f"invariant_sdk_request_duration_seconds_count{{{push}}}"] == "2"
+    assert (
+        samples[f'invariant_sdk_request_duration_seconds_bucket{{{push},le="+Inf"}}']
+        == "2"
+    )
+    assert int(samples[f'invariant_sdk_sent_bytes_total{{{push},status="200"}}']) == (
+        stats["bytes_received"] - 2
+    )
+    assert (
+        int(samples[f'invariant_sdk_received_bytes_total{{{push},status="200"}}']) > 0
+    )
+    assert (
+        samples[
+            'invariant_sdk_errors_total{method="POST",endpoint="/api/v1/unknown",'
+            'exception="InvariantNotFoundError"}'
+        ]
+        == "1"
+    )
+
+
+def test_counts_from_all_threads_are_kept():
+    """Test that counts recorded by many threads, including exited ones, add up."""
+    registry = MetricsRegistry()
+    record = RequestRecord("GET", "/api/v1/dataset/metadata/example?owner=me")
+    record.status = 200
+    record.timings.total_ms = 30.0
+    counter = registry.counter("test_events_total", "Events.", ("kind",))
+
+    def work():
+        for _ in range(1_000):
+            registry.hooks.on_request_end(record)
+            counter.inc(1, ("a",))
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    work()
+
+    samples = _samples(registry.metrics_text())
+    labels = 'method="GET",endpoint="/api/v1/dataset/metadata/{dataset}"'
+    assert samples[f'invariant_sdk_requests_total{{{labels},status="200"}}'] == "9000"
+    assert (
+        samples[f'invariant_sdk_request_duration_seconds_bucket{{{labels},le="0.025"}}']
+        == "0"
+    )
+    assert (
+        samples[f'invariant_sdk_request_duration_seconds_bucket{{{labels},le="0.05"}}']
+        == "9000"
+    )
+    assert counter.value(("a",)) == 9_000
+
+
+def test_metadata_queue_depth():
+    """Test that buffered metadata updates show up as queue depth."""
+    registry = MetricsRegistry()
+    with StubServer() as server:
+        client = Client(
+            api_url=server.url,
+            api_key="test-key",
+            metadata_coalesce_window_ms=60_000,
+            metrics=registry,
+        )
+        for dataset_name in ("a", "b", "a"):
+            client.create_request_and_update_dataset_metadata(
+                dataset_name=dataset_name, metadata={"accuracy": 0.5}
+            )
+        assert registry.queue_depth.value(("metadata_updates",)) == 2
+        client.flush_dataset_metadata()
+    assert registry.queue_depth.value(("metadata_updates",)) == 0
+
+
+def test_metrics_server():
+    """Test that the HTTP endpoint serves the exposition."""
+    registry = MetricsRegistry()
+    registry.gauge("test_depth", "Depth.").inc(3)
+    with registry.serve() as server:
+        response = requests.get(server.url, timeout=5)
+        assert requests.get(server.url + "x", timeout=5).status_code == 404
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE test_depth gauge\ntest_depth 3\n" in response.text
+    with MetricsServer(registry) as server:
+        assert "test_depth 3\n" in requests.get(server.url, timeout=5).text
+
+
+def test_stopping_a_server_that_was_not_started():
+    """Test that stop returns at once and closes the socket of an idle server."""
+    server = MetricsServer(MetricsRegistry())
+    stopping = threading.Thread(target=server.stop, daemon=True)
+    stopping.start()
+    stopping.join(timeout=5)
+    assert not stopping.is_alive()
+    # pylint: disable-next=protected-access
+    assert server._httpd.socket.fileno() == -1
+
+
+def test_registration_errors():
+    """Test that labels must match and names cannot be reused for another type."""
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "Test.", ("kind",))
+    assert registry.counter("test_total", "Test.", ("kind",)) is counter
+    with pytest.raises(ValueError, match="expects labels"):
+        counter.inc(1, ())
+    with pytest.raises(ValueError, match="already registered"):
+        registry.gauge("test_total", "Test.", ("kind",))
+
+
+@pytest.mark.parametrize(
+    "path, expected",
+    [
+        ("/api/v1/push/trace", "/api/v1/push/trace"),
+        ("/api/v1/dataset/metadata/example", "/api/v1/dataset/metadata/{dataset}"),
+        (
+            "/api/v1/dataset/metadata/example?owner_username=me",
+            "/api/v1/dataset/metadata/{dataset}",
+        ),
+        (
+            "/api/v1/dataset/export/example?offset=1000&limit=1000",
+            "/api/v1/dataset/export/{dataset}",
+        ),
+        ("/api/v1/trace/1234/messages", "/api/v1/trace/{trace_id}/messages"),
+    ],
+)
+def test_endpoint(path, expected):
+    """Test that ids are replaced so that label cardinality stays bounded."""
+    assert endpoint(path) == expected
@@ -0,0 +1,225 @@
+"""Tests of the payload policy for huge strings and base64 images."""
+
+import base64
+import copy
+import os
+
+import pytest
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.client import Client
+from invariant_sdk.metrics import MetricsRegistry
+from invariant_sdk.payload_policy import DirectoryBlobStore, PayloadPolicy
+from invariant_sdk.testing.stub_server import StubServer
+from invariant_sdk.types.append_messages import AppendMessagesRequest
+from invariant_sdk.types.push_traces import PushTracesRequest
+
+PNG = b"\x89PNG\r\n\x1a\n" + os.urandom(3000)
+PNG_BASE64 = base64.b64encode(PNG).decode()
+
+
+def _request(messages):
+    return PushTracesRequest(messages=messages, metadata=[{} for _ in messages])
+
+
+def test_truncates_to_the_message_and_trace_budgets():
+    """Test that strings are cut where the budgets run out, in order."""
+    messages = [
+        [
+            {"role": "user", "content": "a" * 300},
+            {"role": "tool", "content": "b" * 100},
+            {"role": "tool", "content": "c" * 300},
+        ]
+    ]
+    request = _request(messages)
+    original = copy.deepcopy(messages)
+    trimmed, report = PayloadPolicy(max_message_bytes=200, max_trace_bytes=500).apply(
+        request
+    )
+
+    first, second, third = trimmed.messages[0]
+    assert first["content"] == "a" * 196 + "...[truncated 104 bytes]"
+    assert second["content"] == "b" * 100
+    # 200 + 4 ("tool") + 100 + 4 ("tool") bytes are spent, so 192 are left.
+    assert third["content"] == "c" * 192 + "...[truncated 108 bytes]"
+    assert [(item.path, item.action) for item in report.trimmed] == [
+        ("0.content", "truncated"),
+        ("2.content", "truncated"),
+    ]
+    assert report.trimmed_bytes == 104 + 108
+    # The caller's request is left as it was, and unchanged messages are shared.
+    assert request.messages == original
+    assert second is request.messages[0][1]
+
+
+def test_untrimmed_request_is_returned_as_is():
+    """Test that a request within the budgets is not copied."""
+    request = _request([[{"role": "user", "content": "hello"}]])
+    trimmed, report = PayloadPolicy(max_message_bytes=100).apply(request)
+    assert trimmed is request
+    assert not report
+
+
+def test_non_ascii_content_is_cut_on_a_character_boundary():
+    """Test that multi-byte characters are counted in UTF-8 bytes and not split."""
+    request = _request([[{"role": "user", "content": "é" * 100}]])
+    trimmed, report = PayloadPolicy(max_message_bytes=75).apply(request)
+    assert trimmed.messages[0][0]["content"] == "é" * 35 + "...[truncated 130 bytes]"
+    assert report.trimmed[0].original_bytes == 200
+
+
+def test_images_are_extracted_to_the_blob_store(tmp_path):
+    """Test that data URLs and bare base64 images are saved and replaced."""
+    reports = []
+    policy = PayloadPolicy(
+        blob_store=DirectoryBlobStore(str(tmp_path)), on_trim=reports.append
+    )
+    request = _request(
+        [
+            [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": "what is this?"},
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": f"data:image/png;base64,{PNG_BASE64}"},
+                        },
+                    ],
+                },
+                {"role": "tool", "content": PNG_BASE64},
+                {"role": "tool", "content": "/9j/ is not an image " * 100},
+            ]
+        ]
+    )
+    trimmed, report = policy.apply(request)
+
+    assert reports == [report]
+    assert [(item.path, item.action) for item in report.trimmed] == [
+        ("0.content.1.image_url.url", "extracted"),
+        ("1.content", "extracted"),
+    ]
+    reference = report.trimmed[0].reference
+    assert report.trimmed[1].reference == reference
+    with open(reference, "rb") as f:
+        assert f.read() == PNG
+    url = trimmed.messages[0][0]["content"][1]["image_url"]["url"]
+    assert url == f"[image/png image extracted to {reference}]"
+    assert trimmed.messages[0][2] is request.messages[0][2]
+
+    trimmed, report = PayloadPolicy().apply(request)
+    assert trimmed.messages[0][1]["content"].endswith("base64 bytes removed]")
+    assert report.trimmed[0].action == "removed"
+    with pytest.raises(ValueError):
+        PayloadPolicy(max_trace_bytes=-1)
+
+
+def test_invalid_base64_images_are_truncated(tmp_path):
+    """Test that an image that cannot be decoded counts against the budgets."""
+    policy = PayloadPolicy(
+        max_message_bytes=500, blob_store=DirectoryBlobStore(str(tmp_path))
+    )
+    url = "data:image/png;base64," + "!" * 3000 + "A"
+    request = _request([[{"role": "user", "content": url}]])
+    trimmed, report = policy.apply(request)
+
+    assert trimmed.messages[0][0]["content"].startswith("data:image/png;base64,!!!")
+    assert trimmed.messages[0][0]["content"].endswith("...[truncated 2527 bytes]")
+    assert [(item.path, item.action) for item in report.trimmed] == [
+        ("0.content", "truncated")
+    ]
+    assert not os.listdir(tmp_path)
+
+
+def test_client_pushes_the_trimmed_request():
+    """Test that the clients apply the policy and count what was trimmed."""
+    registry = MetricsRegistry()
+    with StubServer() as server:
+        client = Client(
+            api_url=server.url,
+            api_key="test-key",
+            payload_policy=PayloadPolicy(max_trace_bytes=1_000),
+            metrics=registry,
+        )
+        client.create_request_and_push_trace(
+            messages=[[{"role": "user", "content": "x" * 100_000}]]
+        )
+        stats = server.stats.to_json()
+    assert stats["bytes_received"] < 2_000
+    assert (
+        'invariant_sdk_trimmed_payload_bytes_total{action="truncated"} 99004\n'
+        in registry.metrics_text()
+    )
+
+
+async def test_async_client_pushes_the_trimmed_request():
+    """Test the payload policy in the async client."""
+    with StubServer() as server:
+        client = AsyncClient(
+            api_url=server.url,
+            api_key="test-key",
+            payload_policy=PayloadPolicy(max_message_bytes=1_000),
+        )
+        await client.create_request_and_push_trace(
+            messages=[[{"role": "user", "content": "x" * 100_000}]]
+        )
+        stats = server.stats.to_json()
+    assert stats["bytes_received"] < 2_000
+
+
+def test_trims_appended_messages():
+    """Test that the appended messages of a request share the trace budget."""
+    request = AppendMessagesRequest(
+        trace_id="trace-id",
+        messages=[
+            {"role": "tool", "content": "a" * 300},
+            {"role": "tool", "content": "b" * 300},
+        ],
+    )
+    original = copy.deepcopy(request.messages)
+    trimmed, report = PayloadPolicy(max_trace_bytes=500).apply(request)
+
+    assert isinstance(trimmed, AppendMessagesRequest)
+    assert trimmed.trace_id == "trace-id"
+    assert trimmed.messages[0] is request.messages[0]
+    # 300 + 4 ("tool") + 32 (the timestamp) + 4 ("tool") bytes are spent.
+    assert trimmed.messages[1]["content"] == "b" * 160 + "...[truncated 140 bytes]"
+    assert [(item.trace, item.path) for item in report.trimmed] == [(0, "1.content")]
+    assert request.messages == original
+
+
+def test_client_appends_the_trimmed_messages():
+    """Test that the clients apply the policy when appending messages."""
+    registry = MetricsRegistry()
+    with StubServer() as server:
+        client = Client(
+            api_url=server.url,
+            api_key="test-key",
+            payload_policy=PayloadPolicy(max_message_bytes=1_000),
+            metrics=registry,
+        )
+        client.create_request_and_append_messages(
+            messages=[{"role": "tool", "content": "x" * 100_000}],
+            trace_id="trace-id",
+        )
+        stats = server.stats.to_json()
+    assert stats["bytes_received"] < 2_000
+    assert (
+        'invariant_sdk_trimmed_payload_bytes_total{action="truncated"} 99004\n'
+        in registry.metrics_text()
+    )
+
+
+async def test_async_client_appends_the_trimmed_messages():
+    """Test the payload policy when the async client appends messages."""
+    with StubServer() as server:
+        client = AsyncClient(
+            api_url=server.url,
+            api_key="test-key",
+            payload_policy=PayloadPolicy(max_message_bytes=1_000),
+        )
+        await client.create_request_and_append_messages(
+            messages=[{"role": "tool", "content": "x" * 100_000}],
+            trace_id="trace-id",
+        )
+        stats = server.stats.to_json()
+    assert stats["bytes_received"] < 2_000
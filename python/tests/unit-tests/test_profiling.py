@@ -0,0 +1,132 @@
+"""Tests of the profiling mode."""
+
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+from invariant_sdk import profiling
+from invariant_sdk.client import Client
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.testing.stub_server import StubRequestHandler, StubServer
+
+MESSAGES = [[{"role": "user", "content": "one"}]]
+ANNOTATIONS = [[{"content": "note", "address": "messages.0.content:0-3"}]]
+PHASES = {"validation", "serialization", "encode", "network", "deserialization"}
+
+
+@pytest.fixture(name="profiler")
+def fixture_profiler():
+    """Fixture enabling profiling for one test."""
+    yield profiling.enable(window=2)
+    profiling.disable()
+
+
+@pytest.mark.parametrize("is_async", [True, False])
+async def test_push_is_split_into_phases(profiler, is_async, call):
+    """Test that a push records every phase, attributed to the outermost call."""
+    with StubServer(latency_ms=20) as server:
+        client_cls = AsyncClient if is_async else Client
+        client = client_cls(api_url=server.url, api_key="test-key")
+        for _ in range(3):
+            response = await call(
+                client.create_request_and_push_trace(
+                    messages=MESSAGES, annotations=ANNOTATIONS
+                ),
+            )
+            assert len(response.id) == 1
+        await call(
+            client.create_request_and_append_messages(
+                messages=MESSAGES[0], trace_id=response.id[0]
+            ),
+        )
+
+    summary = profiler.summary()
+    assert set(summary) == {
+        "create_request_and_push_trace",
+        "create_request_and_append_messages",
+    }
+    push = summary["create_request_and_push_trace"]
+    assert push["calls"] == 2
+    assert set(push["phases"]) == PHASES | {profiling.TOTAL}
+    network = push["phases"]["network"]
+    assert network["wall_ms_p50"] >= 20
+    assert push["phases"]["total"]["wall_ms_max"] >= network["wall_ms_max"]
+    assert push["phases"]["total"]["peak_kib_max"] > 0
+    assert json.loads(profiler.dump()) == summary
+
+
+class ContentTypeRecordingHandler(StubRequestHandler):
+    """Records the content type of every request."""
+
+    content_types = []
+
+    def _handle(self, handler) -> None:
+        self.content_types.append(self.headers.get("Content-Type"))
+        super()._handle(handler)
+
+
+@pytest.mark.usefixtures("profiler")
+@pytest.mark.parametrize("is_async", [True, False])
+async def test_encoded_bodies_keep_the_json_content_type(is_async, call):
+    """Test that encoding a `json` body for the profiler still declares it JSON."""
+    ContentTypeRecordingHandler.content_types = []
+    with StubServer(handler_class=ContentTypeRecordingHandler) as server:
+        client_cls = AsyncClient if is_async else Client
+        client = client_cls(api_url=server.url, api_key="test-key")
+        body = {"messages": MESSAGES, "annotations": None, "metadata": None}
+        for headers in ({}, {"content-type": "application/json; charset=utf-8"}):
+            await call(
+                client.request(
+                    "POST",
+                    "/api/v1/push/trace",
+                    {"json": body, "headers": headers},
+                ),
+            )
+
+    assert ContentTypeRecordingHandler.content_types == [
+        "application/json",
+        "application/json; charset=utf-8",
+    ]
+
+
+def test_disabled_profiling_records_nothing():
+    """Test that phases and calls are no-ops without a profiler."""
+    assert profiling.get_profiler() is None
+    with profiling.phase("validation"):
+        pass
+    profiler = profiling.Profiler(trace_memory=False)
+    with profiler.phase("validation"):
+        pass
+    assert not profiler.summary()
+    with profiler.call("example"):
+        with profiler.phase("network"):
+            pass
+    assert profiler.summary()["example"]["phases"]["network"]["peak_kib_max"] == 0
+    profiler.reset()
+    assert not profiler.summary()
+
+
+def test_summary_is_dumped_at_exit(tmp_path):
+    """Test that INVARIANT_SDK_PROFILE enables profiling and dumps a summary at exit."""
+    path = tmp_path / "profile.json"
+    script = textwrap.dedent("""
+        from invariant_sdk.client import Client
+        from invariant_sdk.testing.stub_server import StubRequestHandler, StubServer
+
+        with StubServer() as server:
+            client = Client(api_url=server.url, api_key="test-key")
+            client.create_request_and_push_trace(
+                messages=[[{"role": "user", "content": "x"}]]
+            )
+        """)
+    env = {
+        **os.environ,
+        profiling.PROFILE_ENV_VAR: "1",
+        profiling.PROFILE_PATH_ENV_VAR: str(path),
+    }
+    subprocess.run([sys.executable, "-c", script], env=env, check=True, timeout=60)
+    summary = json.loads(path.read_text())
+    assert summary["create_request_and_push_trace"]["calls"] == 1
@@ -0,0 +1,205 @@
+"""Tests of the AIMD rate controller and the clients using it."""
+
+import asyncio
+import threading
+import time
+from collections import deque
+
+import pytest
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.client import Client
+from invariant_sdk.rate_control import RateController
+from invariant_sdk.testing.fault_server import FaultInjectingServer
+from invariant_sdk.types.exceptions import (
+    InvariantAPITimeoutError,
+    InvariantNotFoundError,
+    InvariantRateLimitError,
+    InvariantServiceUnavailableError,
+)
+
+MESSAGES = [[{"role": "user", "content": "one"}]]
+
+
+def _hold(controller, seconds, peak, lock):
+    with controller.admit():
+        with lock:
+            peak.append(controller.in_flight)
+        time.sleep(seconds)
+
+
+def test_limits_requests_in_flight():
+    """Test that no more requests than the limit run at the same time."""
+    controller = RateController(initial_limit=3, max_limit=3)
+    peak, lock = [], threading.Lock()
+    threads = [
+        threading.Thread(target=_hold, args=(controller, 0.02, peak, lock))
+        for _ in range(12)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 3
+    assert controller.in_flight == 0
+
+
+def test_token_bucket_limits_rate():
+    """Test that requests beyond the burst are spread out at `max_rps`."""
+    controller = RateController(max_rps=50, burst=1)
+    start = time.monotonic()
+    for _ in range(6):
+        with controller.admit():
+            pass
+    assert time.monotonic() - start >= 5 / 50 * 0.9
+
+
+def test_backs_off_once_per_burst_of_congestion():
+    """Test the multiplicative decrease, and that it applies once per burst."""
+    controller = RateController(initial_limit=16)
+    errors = [
+        InvariantRateLimitError("busy"),
+        InvariantServiceUnavailableError("busy"),
+        InvariantAPITimeoutError("slow"),
+    ]
+    admitted = [controller.admit() for _ in errors]
+    for context in admitted:
+        context.__enter__()
+    for context, error in zip(admitted, errors):
+        # False: the exception is not suppressed.
+        assert not context.__exit__(type(error), error, None)
+    assert controller.limit == 8
+
+    # Requests sent after the decrease count again, other errors do not.
+    for error in (InvariantNotFoundError("missing"), InvariantRateLimitError("busy")):
+        with pytest.raises(type(error)):
+            with controller.admit():
+                raise error
+    assert controller.limit == 4
+
+
+def test_grows_additively_while_saturated():
+    """Test that the limit grows by about one per limit's worth of successes."""
+    controller = RateController(initial_limit=4, latency_target_ms=1_000)
+    in_flight = deque()
+    for _ in range(4):
+        in_flight.append(controller.admit())
+        in_flight[-1].__enter__()
+    # Keep four requests in flight: L grows by 1/L per response (L^2 by ~2),
+    # until four requests are less than half of the limit.
+    for _ in range(40):
+        in_flight.popleft().__exit__(None, None, None)
+        in_flight.append(controller.admit())
+        in_flight[-1].__enter__()
+    assert controller.limit == 8
+    while in_flight:
+        in_flight.popleft().__exit__(None, None, None)
+    for _ in range(50):
+        with controller.admit():
+            pass
+    assert controller.limit == 8
+
+
+def test_slow_responses_count_as_congestion():
+    """Test that responses slower than the tolerated latency decrease the limit."""
+    controller = RateController(initial_limit=8, latency_target_ms=10)
+    with controller.admit():
+        time.sleep(0.03)
+    assert controller.limit == 4
+
+    controller = RateController(initial_limit=8)
+    with controller.admit():
+        time.sleep(0.01)
+    assert controller.baseline_ms >= 10
+    with controller.admit():
+        time.sleep(0.05)
+    assert controller.limit == 4
+
+
+def test_retry_after_pauses_all_requests():
+    """Test that a Retry-After holds back the following requests."""
+    controller = RateController()
+    with pytest.raises(InvariantRateLimitError):
+        with controller.admit():
+            raise InvariantRateLimitError("busy", retry_after_s=0.1)
+    start = time.monotonic()
+    with controller.admit():
+        pass
+    assert time.monotonic() - start >= 0.09
+
+
+async def test_async_admission_waits_for_a_free_slot():
+    """Test that async callers are limited and woken, also by sync callers."""
+    controller = RateController(initial_limit=2, max_limit=2)
+    running, peak = 0, 0
+
+    async def hold():
+        nonlocal running, peak
+        async with controller.admit_async():
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.02)
+            running -= 1
+
+    blocker = threading.Thread(
+        target=_hold, args=(controller, 0.1, [], threading.Lock())
+    )
+    blocker.start()
+    start = time.monotonic()
+    await asyncio.gather(*(hold() for _ in range(6)))
+    blocker.join()
+    assert peak == 1
+    assert time.monotonic() - start >= 6 * 0.02
+    assert controller.in_flight == 0
+
+    waiter = asyncio.ensure_future(hold())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    await asyncio.wait_for(hold(), timeout=1)
+
+
+@pytest.mark.parametrize("is_async", [False, True])
+async def test_clients_converge_below_server_capacity(is_async):
+    """Test that clients over a server's capacity back off and stop getting 429s."""
+    controller = RateController(initial_limit=32, latency_target_ms=1_000)
+    with FaultInjectingServer(
+        latency_ms=20, retry_after_s=0, max_in_flight=8
+    ) as server:
+        if is_async:
+            client = AsyncClient(
+                api_url=server.url, api_key="test-key", rate_controller=controller
+            )
+        else:
+            client = Client(
+                api_url=server.url, api_key="test-key", rate_controller=controller
+            )
+        rejected = []
+
+        def push():
+            for _ in range(10):
+                try:
+                    client.create_request_and_push_trace(messages=MESSAGES)
+                except InvariantRateLimitError:
+                    rejected.append(1)
+
+        async def push_async():
+            for _ in range(10):
+                try:
+                    await client.create_request_and_push_trace(messages=MESSAGES)
+                except InvariantRateLimitError:
+                    rejected.append(1)
+
+        if is_async:
+            await asyncio.gather(*(push_async() for _ in range(32)))
+        else:
+            threads = [threading.Thread(target=push) for _ in range(32)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    assert server.overloaded == len(rejected) > 0
+    assert controller.limit < 32
+    # Most rejections happen before the first back-off.
+    assert len(rejected) < 32 * 10 / 4
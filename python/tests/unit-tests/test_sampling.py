@@ -0,0 +1,145 @@
+"""Tests of client-side trace sampling."""
+
+import time
+
+import pytest
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.client import Client
+from invariant_sdk.metrics import MetricsRegistry
+from invariant_sdk.sampling import (
+    HashSampler,
+    KeepAnnotated,
+    KeepErrors,
+    ProbabilisticSampler,
+    RateCapSampler,
+    SamplingPolicy,
+)
+from invariant_sdk.testing.stub_server import StubServer
+from invariant_sdk.types.push_traces import PushTracesRequest
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def _keeps(sampler, metadata=None, dataset=None):
+    return sampler.keep(MESSAGES, None, metadata, dataset)
+
+
+def test_probabilistic_and_hash_samplers_keep_the_rate():
+    """Test the fraction kept, and that hashing decides by the value only."""
+    sampler = ProbabilisticSampler(0.25, seed=1)
+    kept = sum(_keeps(sampler) for _ in range(10_000))
+    assert 2_250 < kept < 2_750
+
+    sampler = HashSampler("session_id", 0.25)
+    decisions = [_keeps(sampler, {"session_id": i}) for i in range(10_000)]
+    assert 2_250 < sum(decisions) < 2_750
+    again = HashSampler("session_id", 0.25)
+    assert decisions == [_keeps(again, {"session_id": i}) for i in range(10_000)]
+    # The decision is the same whether the value is given as a number or a string.
+    assert decisions[7] == _keeps(again, {"session_id": "7"})
+    assert _keeps(sampler, {}) and not _keeps(HashSampler("id", 0.5, False), {})
+
+    with pytest.raises(ValueError):
+        ProbabilisticSampler(1.5)
+
+
+def test_rate_cap_sampler_caps_each_dataset():
+    """Test that every dataset has its own bucket, refilled over time."""
+    sampler = RateCapSampler(max_tps=20, per_dataset={"slow": 1}, burst=5)
+    assert [_keeps(sampler, dataset="a") for _ in range(6)] == [True] * 5 + [False]
+    assert sum(_keeps(sampler, dataset="b") for _ in range(10)) == 5
+    assert sum(_keeps(sampler, dataset="slow") for _ in range(10)) == 5
+    time.sleep(0.1)
+    assert sum(_keeps(sampler, dataset="a") for _ in range(10)) == 2
+    assert _keeps(RateCapSampler(per_dataset={"slow": 1}), dataset="other")
+
+
+def test_always_keep_rules_take_precedence():
+    """Test that annotated and error-like traces pass any sampler."""
+    policy = SamplingPolicy(
+        samplers=[ProbabilisticSampler(0)],
+        always_keep=[KeepAnnotated(), KeepErrors(roles=["tool"])],
+    )
+    error = [{"role": "tool", "content": "Traceback (most recent call last): ..."}]
+    assert policy.sample(
+        [MESSAGES, MESSAGES, error, [{"role": "tool", "error": "timed out"}]],
+        annotations=[[], [{"content": "bad"}], [], []],
+    ) == ["sampled", None, None, None]
+    assert policy.drop_reason([{"role": "user", "content": "an error"}]) == "sampled"
+
+
+def test_client_drops_sampled_traces():
+    """Test that dropped traces get no id, are not sent and are counted."""
+    registry = MetricsRegistry()
+    policy = SamplingPolicy(
+        samplers=[HashSampler("user", 0.5, keep_missing=False)],
+        always_keep=[KeepAnnotated()],
+    )
+    with StubServer() as server:
+        client = Client(
+            api_url=server.url,
+            api_key="test-key",
+            sampling_policy=policy,
+            metrics=registry,
+        )
+        sampler = policy.samplers[0]
+        kept_user = next(i for i in range(100) if _keeps(sampler, {"user": i}))
+        response = client.create_request_and_push_trace(
+            messages=[MESSAGES] * 4,
+            annotations=[[], [{"content": "good", "address": "messages.0"}], [], []],
+            metadata=[{"user": kept_user}, {}, {}, {}],
+            dataset="example",
+        )
+        requests_sent = server.stats.to_json()["requests"]
+        dropped = client.push_trace(
+            PushTracesRequest(messages=[MESSAGES], metadata=[{}], dataset="example")
+        )
+        stats = server.stats.to_json()
+
+    assert None not in response.id[:2] and response.id[2:] == [None, None]
+    assert response.dataset == "example"
+    assert dropped.id == [None] and stats["requests"] == requests_sent
+    assert stats["traces"] == 2
+    assert (
+        'invariant_sdk_dropped_traces_total{reason="sampled"} 3'
+        in registry.metrics_text()
+    )
+
+
+@pytest.mark.parametrize("is_async", [True, False])
+async def test_invalid_traces_raise_even_if_dropped(is_async):
+    """Test that sampling does not hide or change the errors of invalid input."""
+    policy = SamplingPolicy(
+        samplers=[ProbabilisticSampler(0.0)], always_keep=[KeepErrors()]
+    )
+    client_cls = AsyncClient if is_async else Client
+    client = client_cls(
+        api_url="http://127.0.0.1:1", api_key="test-key", sampling_policy=policy
+    )
+    invalid = [
+        {"messages": [MESSAGES, ["not a message"]]},
+        {"messages": [MESSAGES], "metadata": [{}, {}]},
+        {"messages": [MESSAGES], "annotations": [{"content": "not nested"}]},
+        {"messages": [MESSAGES], "dataset": "not a name"},
+    ]
+    for kwargs in invalid:
+        with pytest.raises(ValueError):
+            response = client.create_request_and_push_trace(**kwargs)
+            if is_async:
+                await response
+
+
+async def test_async_client_samples_batched_pushes():
+    """Test sampling in the async client, before the traces are batched."""
+    with StubServer() as server:
+        client = AsyncClient(
+            api_url=server.url,
+            api_key="test-key",
+            sampling_policy=SamplingPolicy([RateCapSampler(max_tps=1, burst=3)]),
+        )
+        response = await client.push_trace_batched(
+            PushTracesRequest(messages=[MESSAGES] * 10, dataset="example")
+        )
+        stats = server.stats.to_json()
+    assert [trace_id is None for trace_id in response.id] == [False] * 3 + [True] * 7
+    assert stats["traces"] == 3
@@ -0,0 +1,154 @@
+"""Unit tests for single-flight deduplication of concurrent calls."""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+from invariant_sdk.client import Client
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.single_flight import AsyncSingleFlight, SingleFlight
+
+
+def test_single_flight_shares_one_call_between_threads():
+    """Test that concurrent callers for a key share one call."""
+    flights = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {"value": 1}
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(flights.do, "key", fetch) for _ in range(8)]
+        deadline = time.monotonic() + 5
+        while flights.in_flight() == 0 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        time.sleep(0.05)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert results == [{"value": 1}] * 8
+    # Every caller gets its own copy of the result.
+    assert len({id(result) for result in results}) == 8
+    assert flights.in_flight() == 0
+
+
+def test_single_flight_propagates_errors_and_forgets_the_call():
+    """Test that the error of the shared call reaches the caller and is not cached."""
+    flights = SingleFlight()
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError, match="boom"):
+        flights.do("key", fail)
+    assert flights.do("key", lambda: 2) == 2
+
+
+async def test_async_single_flight_shares_one_call_between_tasks():
+    """Test that concurrent tasks for a key share one call."""
+    flights = AsyncSingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"value": 1}
+
+    results = await asyncio.gather(*(flights.do("key", fetch) for _ in range(200)))
+    assert len(calls) == 1
+    assert all(result == {"value": 1} for result in results)
+    assert flights.in_flight() == 0
+
+
+async def test_async_single_flight_survives_cancelled_leader():
+    """Test that cancelling the first caller does not cancel the shared call."""
+    flights = AsyncSingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return 1
+
+    leader = asyncio.ensure_future(flights.do("key", fetch))
+    await asyncio.sleep(0)
+    follower = asyncio.ensure_future(flights.do("key", fetch))
+    await asyncio.sleep(0)
+    leader.cancel()
+    assert await follower == 1
+
+
+async def test_async_client_coalesces_concurrent_get_dataset_metadata():
+    """Test that 200 concurrent identical GETs result in a single request."""
+
+    async def slow_request(**_):
+        await asyncio.sleep(0.01)
+        response = mock.Mock()
+        response.json.return_value = {"accuracy": 1}
+        return response
+
+    session = mock.AsyncMock()
+    session.request = mock.AsyncMock(side_effect=slow_request)
+    client = AsyncClient(
+        api_url="https://default.api.url", api_key="test-key", session=session
+    )
+
+    results = await asyncio.gather(
+        *(client.get_dataset_metadata("example") for _ in range(200))
+    )
+    assert all(result == {"accuracy": 1} for result in results)
+    session.request.assert_called_once()
+
+
+async def test_async_client_does_not_coalesce_custom_request_kwargs():
+    """Test that calls with custom request kwargs are not shared."""
+    response = mock.Mock()
+    response.json.return_value = {}
+    session = mock.AsyncMock()
+    session.request = mock.AsyncMock(return_value=response)
+    client = AsyncClient(
+        api_url="https://default.api.url", api_key="test-key", session=session
+    )
+
+    await asyncio.gather(
+        *(
+            client.get_dataset_metadata(
+                "example", request_kwargs={"headers": {"X-Caller": str(i)}}
+            )
+            for i in range(3)
+        )
+    )
+    assert session.request.call_count == 3
+
+
+def test_client_coalesces_concurrent_get_dataset_metadata():
+    """Test that concurrent identical GETs from threads result in a single request."""
+    release = threading.Event()
+
+    def slow_request(**_):
+        release.wait(5)
+        response = mock.Mock()
+        response.json.return_value = {"accuracy": 1}
+        return response
+
+    session = mock.Mock()
+    session.request.side_effect = slow_request
+    client = Client(
+        api_url="https://default.api.url", api_key="test-key", session=session
+    )
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        futures = [
+            pool.submit(client.get_dataset_metadata, "example") for _ in range(16)
+        ]
+        time.sleep(0.1)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert results == [{"accuracy": 1}] * 16
+    session.request.assert_called_once()
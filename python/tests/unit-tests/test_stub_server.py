@@ -0,0 +1,89 @@
+"""Unit tests for the local Explorer stub server."""
+
+import pytest
+import requests
+from invariant_sdk.client import Client
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.metadata_cache import MetadataCache
+from invariant_sdk.testing.stub_server import StubServer
+from invariant_sdk.types.exceptions import InvariantAuthError, InvariantNotFoundError
+
+
+@pytest.fixture(name="stub_server")
+def fixture_stub_server():
+    """Fixture for a running stub server."""
+    with StubServer() as server:
+        yield server
+
+
+@pytest.mark.parametrize("is_async", [True, False])
+async def test_stub_server_round_trip(stub_server, is_async, call):
+    """Test every endpoint the stub implements with both clients."""
+    client_cls = AsyncClient if is_async else Client
+    client = client_cls(api_url=stub_server.url, api_key="test-key")
+
+    response = await call(
+        client.create_request_and_push_trace(
+            messages=[
+                [{"role": "user", "content": "one"}],
+                [{"role": "user", "content": "two"}],
+            ],
+            dataset="example_dataset",
+        ),
+    )
+    assert len(response.id) == 2
+    assert response.dataset == "example_dataset"
+
+    await call(
+        client.create_request_and_update_dataset_metadata(
+            dataset_name="example_dataset", metadata={"accuracy": 0.5}
+        ),
+    )
+    updated = await call(
+        client.create_request_and_update_dataset_metadata(
+            dataset_name="example_dataset", metadata={"name": "example"}
+        ),
+    )
+    assert updated == {"accuracy": 0.5, "name": "example"}
+    assert await call(client.get_dataset_metadata("example_dataset")) == {
+        "accuracy": 0.5,
+        "name": "example",
+    }
+
+    appended = await call(
+        client.create_request_and_append_messages(
+            messages=[{"role": "assistant", "content": "three"}],
+            trace_id=response.id[0],
+        ),
+    )
+    assert appended == {"success": True}
+    assert stub_server.stats.to_json()["requests"] == 5
+    assert stub_server.stats.to_json()["traces"] == 2
+
+
+def test_stub_server_revalidates_with_etag(stub_server):
+    """Test that the stub answers 304 to a matching If-None-Match."""
+    cache = MetadataCache(ttl_s=60)
+    client = Client(api_url=stub_server.url, api_key="test-key", metadata_cache=cache)
+    client.create_request_and_update_dataset_metadata(
+        dataset_name="example_dataset", metadata={"accuracy": 0.5}
+    )
+    assert client.get_dataset_metadata("example_dataset") == {"accuracy": 0.5}
+    # pylint: disable-next=protected-access
+    cache._entries[("example_dataset", None)].expires_at = 0
+    assert client.get_dataset_metadata("example_dataset") == {"accuracy": 0.5}
+    assert cache.stats["revalidations"] == 1
+
+
+def test_stub_server_errors(stub_server):
+    """Test the error responses of the stub."""
+    assert (
+        requests.get(stub_server.url + "/api/v1/dataset/metadata/x").status_code == 401
+    )
+    client = Client(api_url=stub_server.url, api_key="test-key")
+    with pytest.raises(InvariantNotFoundError):
+        client.request("POST", "/api/v1/unknown", {"json": {}})
+    with pytest.raises(InvariantAuthError):
+        client.request(
+            "GET", "/api/v1/dataset/metadata/x", {"headers": {"Authorization": ""}}
+        )
@@ -0,0 +1,179 @@
+"""Tests of the local store of pushed traces."""
+
+import gc
+import subprocess
+import sys
+import textwrap
+import threading
+
+import pytest
+from invariant_sdk.async_client import AsyncClient
+from invariant_sdk.client import Client
+from invariant_sdk.dedup import DedupIndex
+from invariant_sdk.testing.fault_server import (
+    RATE_LIMITED,
+    FaultInjectingServer,
+    FaultSchedule,
+)
+from invariant_sdk.testing.stub_server import StubServer
+from invariant_sdk.trace_store import TraceStore
+from invariant_sdk.types.exceptions import InvariantRateLimitError
+from invariant_sdk.types.push_traces import PushTracesRequest
+
+
+class ThreadRecordingStore(TraceStore):
+    """Records the threads pushes are recorded on."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.threads = set()
+
+    def record(self, *args, **kwargs):
+        self.threads.add(threading.get_ident())
+        return super().record(*args, **kwargs)
+
+
+def _request(start, count, dataset="example"):
+    return PushTracesRequest(
+        messages=[
+            [{"role": "user", "content": f"trace {i}"}]
+            for i in range(start, start + count)
+        ],
+        metadata=[{"run": i % 2, "index": i} for i in range(start, start + count)],
+        dataset=dataset,
+    )
+
+
+def test_lookups_by_id_dataset_and_metadata(tmp_path):
+    """Test that recorded traces are found by id, dataset and metadata key."""
+    store = TraceStore(str(tmp_path / "traces.db"), batch_size=100)
+    store.record(_request(0, 4), trace_ids=["a", "b", "c", "d"], latency_ms=12.5)
+    store.record(_request(4, 2, dataset=None), trace_ids=["e", "f"])
+
+    trace = store.get("b")
+    assert trace.messages == [{"role": "user", "content": "trace 1"}]
+    assert trace.metadata == {"run": 1, "index": 1}
+    assert (trace.dataset, trace.status, trace.latency_ms) == (
+        "example",
+        "pushed",
+        12.5,
+    )
+    assert store.get("missing") is None
+
+    assert [t.trace_id for t in store.by_dataset("example")] == ["d", "c", "b", "a"]
+    assert [t.trace_id for t in store.by_dataset(None)] == ["f", "e"]
+    assert [t.trace_id for t in store.by_dataset("example", limit=2)] == ["d", "c"]
+    assert [t.trace_id for t in store.by_metadata("run", 0)] == ["e", "c", "a"]
+    assert len(store.by_metadata("index")) == 6
+    assert store.by_metadata("unknown") == []
+    store.close()
+
+    # Reopened, the traces are still there.
+    store = TraceStore(str(tmp_path / "traces.db"))
+    assert len(store) == 6
+    assert store.get("e").dataset is None
+    store.close()
+
+
+def test_writes_are_batched(tmp_path):
+    """Test that traces are buffered until a batch is full."""
+    path = str(tmp_path / "traces.db")
+    store = TraceStore(path, batch_size=5, flush_interval_s=60)
+    reader = TraceStore(path)
+    store.record(_request(0, 3), trace_ids=["a", "b", "c"])
+    assert len(reader) == 0
+    store.record(_request(3, 2), trace_ids=["d", "e"])
+    assert len(reader) == 5
+    store.record(_request(5, 1), trace_ids=["f"])
+    store.close()
+    assert len(reader) == 6
+    reader.close()
+
+
+def test_unclosed_stores_write_what_they_buffered(tmp_path):
+    """Test that traces are written when a store is dropped or the process exits."""
+    path = str(tmp_path / "traces.db")
+    store = TraceStore(path, flush_interval_s=60)
+    store.record(_request(0, 3), trace_ids=["a", "b", "c"])
+    del store
+    gc.collect()
+
+    script = textwrap.dedent(f"""
+        from invariant_sdk.trace_store import TraceStore
+        from invariant_sdk.types.push_traces import PushTracesRequest
+
+        store = TraceStore({path!r}, flush_interval_s=60)
+        request = PushTracesRequest(messages=[[{{"role": "user", "content": "x"}}]])
+        store.record(request, trace_ids=["d"])
+        """)
+    subprocess.run([sys.executable, "-c", script], check=True, timeout=60)
+    store = TraceStore(path)
+    assert [trace.trace_id for trace in store.by_dataset("example")] == ["c", "b", "a"]
+    assert store.get("d") is not None
+    store.close()
+
+
+def test_retention_deletes_the_oldest_traces():
+    """Test that the stored traces are kept under `max_bytes`."""
+    store = TraceStore(":memory:", batch_size=1)
+    store.record(_request(0, 1), trace_ids=["a"])
+    trace_bytes = store.stored_bytes
+    store.close()
+
+    store = TraceStore(":memory:", max_bytes=trace_bytes * 10, batch_size=1)
+    for i in range(25):
+        store.record(_request(i, 1), trace_ids=[f"id-{i}"])
+    assert 9 <= len(store) <= 10
+    assert store.stored_bytes <= trace_bytes * 10
+    assert store.get("id-0") is None
+    assert store.get("id-24") is not None
+    # The metadata of deleted traces is gone too.
+    assert len(store.by_metadata("index")) == len(store)
+    with pytest.raises(ValueError):
+        TraceStore(":memory:", max_bytes=0)
+    store.close()
+
+
+def test_client_records_pushes_and_failures():
+    """Test that pushes are recorded with their status, including failures."""
+    store = TraceStore(":memory:")
+    with StubServer() as server:
+        client = Client(
+            api_url=server.url,
+            api_key="test-key",
+            trace_store=store,
+            dedup_index=DedupIndex(":memory:"),
+        )
+        first = client.push_trace(_request(0, 2))
+        second = client.push_trace(_request(1, 2))
+
+    assert [t.status for t in store.by_dataset("example")] == [
+        "pushed",
+        "deduplicated",
+        "pushed",
+        "pushed",
+    ]
+    assert store.get(first.id[1]).status == "deduplicated"
+    assert store.get(second.id[1]).latency_ms > 0
+
+    schedule = FaultSchedule(sequence=[RATE_LIMITED])
+    with FaultInjectingServer(schedule) as server:
+        client = Client(api_url=server.url, api_key="test-key", trace_store=store)
+        with pytest.raises(InvariantRateLimitError):
+            client.push_trace(_request(5, 1, dataset="failing"))
+    (failed,) = store.by_dataset("failing")
+    assert failed.status == "failed"
+    assert failed.trace_id is None
+    assert failed.error.startswith("InvariantRateLimitError")
+    store.close()
+
+
+async def test_async_client_records_pushes():
+    """Test that the async client records its pushes, off the event loop's thread."""
+    store = ThreadRecordingStore(":memory:")
+    with StubServer() as server:
+        client = AsyncClient(api_url=server.url, api_key="test-key", trace_store=store)
+        response = await client.push_trace(_request(0, 3))
+    assert [store.get(trace_id).status for trace_id in response.id] == ["pushed"] * 3
+    assert store.threads and threading.get_ident() not in store.threads
+    store.close()
@@ -75,3 +75,56 @@ def test_annotation_create_from_dicts_invalid_input():
         )
     with pytest.raises(ValueError):
         AnnotationCreate.from_dicts({"content": "Content 1", "address": "Address 1"})
+
+
+@pytest.mark.parametrize("instantiate", [True, False])
+def test_annotation_create_bulk_from_nested_dicts(instantiate):
+    """Test the bulk_from_nested_dicts class method with valid input."""
+    data = [
+        [
+            {"content": "Content 1", "address": "Address 1"},
+            {
+                "content": "Content 2",
+                "address": "Address 2",
+                "extra_metadata": {"key": "value"},
+            },
+        ],
+        [],
+        [{"content": "Content 3", "address": "Address 3"}],
+    ]
+    annotations = AnnotationCreate.bulk_from_nested_dicts(data, instantiate=instantiate)
+    if instantiate:
+        assert annotations == AnnotationCreate.from_nested_dicts(data)
+    else:
+        assert annotations == data
+        assert isinstance(annotations[0][0], dict)
+
+
+@pytest.mark.parametrize("instantiate", [True, False])
+def test_annotation_create_bulk_from_dicts(instantiate):
+    """Test the bulk_from_dicts class method with valid input."""
+    data = [
+        {"content": "Content 1", "address": "Address 1"},
+        {"content": "Content 2", "address": "Address 2", "extra_metadata": None},
+    ]
+    annotations = AnnotationCreate.bulk_from_dicts(data, instantiate=instantiate)
+    if instantiate:
+        assert annotations == AnnotationCreate.from_dicts(data)
+    else:
+        assert annotations == data
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        [{"content": "Content 1", "address": "Address 1"}],
+        [[{"content": "Content 1"}]],
+        [[{"content": 1, "address": "Address 1"}]],
+        {"content": "Content 1", "address": "Address 1"},
+    ],
+)
+@pytest.mark.parametrize("instantiate", [True, False])
+def test_annotation_create_bulk_from_nested_dicts_invalid_input(data, instantiate):
+    """Test the bulk_from_nested_dicts class method with invalid input."""
+    with pytest.raises(ValueError):
+        AnnotationCreate.bulk_from_nested_dicts(data, instantiate=instantiate)